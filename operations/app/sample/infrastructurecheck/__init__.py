@@ -4,17 +4,21 @@ Function to exercise infrastructure from the inside.
 Query parameters:
 
 * `run_azure` (default: true) - if 'false' we won't try to interact with the storage account or key vault
+* `deadline` (default: 20, at most 120) - number of seconds to wait for all checks; checks still running after that are reported as timeouts
 
 Headers:
 
 * `Accept` if 'text/plain' we'll return a plaintext response, otherwise it'll be JSON
 """  # noqa: E501
+
 import collections
+import concurrent.futures
 import json
 import logging
 import os
 import re
 import socket
+import time
 
 import azure.functions as func
 import azure.identity
@@ -22,7 +26,6 @@ import azure.keyvault.secrets
 import requests
 from azure.storage.blob import BlobServiceClient
 
-
 logger = logging.getLogger(__name__)
 
 KEY_VAULT_NAME = "pitest-app-kv"
@@ -32,112 +35,126 @@ STORAGE_ACCOUNT_CONNECTION = os.environ.get("APPSETTING_AzureWebJobsStorage")
 STORAGE_FILENAME = "_test.txt"
 STORAGE_HOST = "pitestdatasa.privatelink.blob.core.windows.net"
 URL_IP_CHECK = "https://api.ipify.org/?format=json"
+DEFAULT_DEADLINE_SECONDS = 20
+# Well within the 230 second limit on HTTP requests to a function app
+MAX_DEADLINE_SECONDS = 120
+CONTAINERS = ["bronze", "silver", "gold"]
 
-Check = collections.namedtuple("Check", ["name", "status", "message"])
+Check = collections.namedtuple(
+    "Check", ["name", "status", "message", "latency_ms"], defaults=[None]
+)
 
 
 def is_blank(v):
     return v is None or v.strip() == ""
 
 
-def verify_blob_storage():
-    checks = []
+def elapsed_ms(start):
+    return round((time.monotonic() - start) * 1000, 1)
+
+
+def create_blob_service_client():
     try:
-        service_client = BlobServiceClient.from_connection_string(
-            STORAGE_ACCOUNT_CONNECTION
+        return (
+            BlobServiceClient.from_connection_string(STORAGE_ACCOUNT_CONNECTION),
+            Check("Storage client", "ok", "Created from connection string"),
         )
-        checks.append(Check("Storage client", "ok", "Created from connection string"))
     except Exception as e:
-        return [
-            Check("Storage client", "error", f"Failed to create BlobServiceClient: {e}")
-        ]
+        return (
+            None,
+            Check(
+                "Storage client", "error", f"Failed to create BlobServiceClient: {e}"
+            ),
+        )
 
-    containers = ["bronze", "silver", "gold"]
 
-    for container_name in containers:
-        try:
-            container_client = service_client.get_container_client(container_name)
-        except Exception as e:
-            checks.append(
-                Check(
-                    f"Container client: {container_name}",
-                    "error",
-                    f"Failed to create container client: {e}",
-                )
+def verify_blob_container(service_client, container_name):
+    checks = []
+    try:
+        container_client = service_client.get_container_client(container_name)
+    except Exception as e:
+        return [
+            Check(
+                f"Container client: {container_name}",
+                "error",
+                f"Failed to create container client: {e}",
             )
-            continue
+        ]
 
-        try:
-            blob_client = container_client.get_blob_client(STORAGE_FILENAME)
-        except Exception as e:
-            checks.append(
-                Check(
-                    f"Blob client: {container_name}",
-                    "error",
-                    f"Failed to create blob client: {e}",
-                )
+    try:
+        blob_client = container_client.get_blob_client(STORAGE_FILENAME)
+    except Exception as e:
+        return [
+            Check(
+                f"Blob client: {container_name}",
+                "error",
+                f"Failed to create blob client: {e}",
             )
-            continue
+        ]
 
-        try:
-            blob = blob_client.download_blob()
-            blob_value = blob.content_as_text()
-            checks.append(Check(f"Blob download: {container_name}", "ok", ""))
-        except Exception as e:
-            checks.append(
-                Check(
-                    f"Blob read: {container_name}", "error", f"Failed to get blob: {e}"
-                )
+    start = time.monotonic()
+    try:
+        blob = blob_client.download_blob()
+        blob_value = blob.content_as_text()
+        checks.append(
+            Check(f"Blob download: {container_name}", "ok", "", elapsed_ms(start))
+        )
+    except Exception as e:
+        return [
+            Check(
+                f"Blob read: {container_name}",
+                "error",
+                f"Failed to get blob: {e}",
+                elapsed_ms(start),
             )
-            continue
-
-        # Contents look like this -- we'll increment the number after 'Count: ':
-        # # This test is to ensure we can read/write to blob storage
-        # Count: 0
-        try:
-            lines = blob_value.split("\n")
-            _, count = lines[1].strip().split(" ")
-            new_count = int(count.strip()) + 1
-            new_value = "\n".join([lines[0], f"Count: {new_count}"])
-            blob_client.upload_blob(new_value, overwrite=True)
-            checks.append(Check(f"Blob upload: {container_name}", "ok", ""))
-        except Exception as e:
-            checks.append(
-                Check(
-                    f"Blob upload: {container_name}",
-                    "error",
-                    f"Failed to uploadblob: {e}",
-                )
+        ]
+
+    # Contents look like this -- we'll increment the number after 'Count: ':
+    # # This test is to ensure we can read/write to blob storage
+    # Count: 0
+    start = time.monotonic()
+    try:
+        lines = blob_value.split("\n")
+        _, count = lines[1].strip().split(" ")
+        new_count = int(count.strip()) + 1
+        new_value = "\n".join([lines[0], f"Count: {new_count}"])
+        blob_client.upload_blob(new_value, overwrite=True)
+        checks.append(
+            Check(f"Blob upload: {container_name}", "ok", "", elapsed_ms(start))
+        )
+    except Exception as e:
+        checks.append(
+            Check(
+                f"Blob upload: {container_name}",
+                "error",
+                f"Failed to uploadblob: {e}",
+                elapsed_ms(start),
             )
+        )
 
     return checks
 
 
-def verify_dns():
-    checks = []
+def verify_dns_external():
     try:
         google_ip = socket.gethostbyname("google.com")
-        checks.append(
-            Check(
-                "DNS lookup - external", "ok", f'Found IP "{google_ip}" for google.com'
-            )
+        return Check(
+            "DNS lookup - external", "ok", f'Found IP "{google_ip}" for google.com'
         )
     except Exception as e:
-        checks.append(Check("DNS lookup - external", "error", str(e)))
+        return Check("DNS lookup - external", "error", str(e))
+
 
+def verify_dns_internal():
     try:
         storage_ip = socket.gethostbyname(STORAGE_HOST)
-        checks.append(
-            Check(
-                "DNS lookup - internal",
-                "ok",
-                f'Found IP "{storage_ip}" for "{STORAGE_HOST}"',
-            )
+        return Check(
+            "DNS lookup - internal",
+            "ok",
+            f'Found IP "{storage_ip}" for "{STORAGE_HOST}"',
         )
     except Exception as e:
-        checks.append(Check("DNS lookup - internal", "error", str(e)))
-
-    return checks
+        return Check("DNS lookup - internal", "error", str(e))
 
 
 def verify_key_vault_read():
@@ -173,37 +190,111 @@ def verify_my_ip():
         return Check("IP Check", "error", str(e))
 
 
+def timed(name, check_fn, *args):
+    """
+    Wrap a check so it returns a list of checks, each carrying a latency.  Checks
+    that don't time their own steps are given the latency of the whole call.
+    """
+
+    def run():
+        start = time.monotonic()
+        result = check_fn(*args)
+        latency = elapsed_ms(start)
+        checks = result if isinstance(result, list) else [result]
+        return [
+            c if c.latency_ms is not None else c._replace(latency_ms=latency)
+            for c in checks
+        ]
+
+    return name, run
+
+
+def run_checks(tasks, deadline):
+    """
+    Run all checks concurrently and collect their results.  Anything that
+    hasn't finished by the deadline is reported as a timeout; its thread is
+    left to finish in the background rather than holding up the response.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(tasks))
+    futures = [(name, executor.submit(run)) for name, run in tasks]
+    concurrent.futures.wait([f for _, f in futures], timeout=deadline)
+    executor.shutdown(wait=False)
+
+    checks = []
+    for name, future in futures:
+        if not future.done():
+            checks.append(
+                Check(
+                    name,
+                    "timeout",
+                    f"Did not finish within {deadline} seconds",
+                    deadline * 1000,
+                )
+            )
+        elif future.exception() is not None:
+            checks.append(Check(name, "error", str(future.exception())))
+        else:
+            checks.extend(future.result())
+    return checks
+
+
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logger.info("APP: Python HTTP trigger function processing a request.")
+    try:
+        deadline = float(req.params.get("deadline", DEFAULT_DEADLINE_SECONDS))
+    except ValueError:
+        deadline = None
+    if deadline is None or not 0 < deadline <= MAX_DEADLINE_SECONDS:
+        return func.HttpResponse(
+            body=json.dumps(
+                {
+                    "error": "deadline must be more than 0 and at most "
+                    + f"{MAX_DEADLINE_SECONDS} seconds"
+                }
+            ),
+            headers={"Content-Type": "application/json"},
+            status_code=400,
+        )
     checks = []
 
-    logger.info("Task 1: Verifying DNS")
-    checks.extend(
-        verify_dns()
-    )  # task 1: can I lookup IPs? checks whether the DNS from CDC (or Azure) is working
-    logger.info("Task 2: Verifying my IP")
-    checks.append(
-        verify_my_ip()
-    )  # task 2: can I reach the internet? if so, what is my IP?
+    # task 1: can I lookup IPs? checks whether the DNS from CDC (or Azure) is working
+    # task 2: can I reach the internet? if so, what is my IP?
+    tasks = [
+        timed("DNS lookup - external", verify_dns_external),
+        timed("DNS lookup - internal", verify_dns_internal),
+        timed("IP Check", verify_my_ip),
+    ]
 
     # ?run_azure=false will skip the storage account and key vault actions
     run_azure = req.params.get("run_azure", "true").strip().lower() == "true"
 
     if run_azure:
-        logger.info("Task 3: Verifying blob storage")
+        # task 3: can I read/write to blob storage?
         if is_blank(STORAGE_ACCOUNT_CONNECTION):
             checks.append(Check("Blob *", "error", "No connection string defined"))
         else:
-            checks.extend(
-                verify_blob_storage()
-            )  # task 3: can I read/write to blob storage?
-        logger.info("Task 4: Verifying key vault")
-        checks.append(verify_key_vault_read())  # task 4: can I read from key vault?
+            service_client, client_check = create_blob_service_client()
+            checks.append(client_check)
+            if service_client is not None:
+                for container_name in CONTAINERS:
+                    tasks.append(
+                        timed(
+                            f"Blob *: {container_name}",
+                            verify_blob_container,
+                            service_client,
+                            container_name,
+                        )
+                    )
+        # task 4: can I read from key vault?
+        tasks.append(timed("Key vault", verify_key_vault_read))
     else:
         logger.info("Task 3+4: Skipping on request")
         checks.append(Check("Blob *", "skip", "Instructed to not run azure tasks"))
         checks.append(Check("Key vault", "skip", "Instructed to not run azure tasks"))
 
+    logger.info(f"Running {len(tasks)} checks with a deadline of {deadline} seconds")
+    checks = run_checks(tasks, deadline) + checks
+
     # just check the first one rather than dealing with q-weights
     accept_header = re.split(r"\s+,\s+", req.headers.get("Accept", ""))
     is_text = len(accept_header) > 0 and "text" in accept_header[0]
@@ -213,6 +304,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         body = "Checks:\n"
         for c in checks:
             body += f"* {c.name}: {c.status}"
+            if c.latency_ms is not None:
+                body += f" ({c.latency_ms} ms)"
             if c.message != "":
                 body += f" - {c.message}"
             body += "\n"
@@ -0,0 +1,73 @@
+import json
+import threading
+
+from unittest import mock
+
+from infrastructurecheck import Check, main, run_checks, timed
+
+
+def test_run_checks():
+    tasks = [
+        timed("DNS lookup", lambda: Check("DNS lookup", "success", "")),
+        timed(
+            "Blob *",
+            lambda: [
+                Check("Blob read", "success", ""),
+                Check("Blob write", "fail", ""),
+            ],
+        ),
+        timed("Key vault", lambda: 1 / 0),
+    ]
+
+    checks = run_checks(tasks, 5)
+
+    assert [(c.name, c.status) for c in checks] == [
+        ("DNS lookup", "success"),
+        ("Blob read", "success"),
+        ("Blob write", "fail"),
+        ("Key vault", "error"),
+    ]
+    assert all(c.latency_ms is not None for c in checks[:3])
+
+
+def test_run_checks_timeout():
+    release = threading.Event()
+    tasks = [
+        timed("DNS lookup", lambda: Check("DNS lookup", "success", "")),
+        timed("IP Check", release.wait),
+    ]
+
+    try:
+        checks = run_checks(tasks, 0.1)
+    finally:
+        release.set()
+
+    assert checks[0].status == "success"
+    assert checks[1] == Check(
+        "IP Check", "timeout", "Did not finish within 0.1 seconds", 100.0
+    )
+
+
+@mock.patch("infrastructurecheck.run_checks")
+def test_main_invalid_deadline(patched_run_checks):
+    for deadline in ["0", "-5", "121", "nan", "soon"]:
+        req = mock.Mock(params={"deadline": deadline, "run_azure": "false"})
+
+        response = main(req)
+
+        assert response.status_code == 400
+        assert "deadline" in json.loads(response.get_body())["error"]
+    patched_run_checks.assert_not_called()
+
+
+@mock.patch("infrastructurecheck.run_checks")
+def test_main(patched_run_checks):
+    patched_run_checks.return_value = [Check("DNS lookup", "success", "", 1.5)]
+    req = mock.Mock(params={"deadline": "30", "run_azure": "false"}, headers={})
+
+    response = main(req)
+
+    assert response.status_code == 200
+    assert patched_run_checks.call_args.args[1] == 30
+    checks = json.loads(response.get_body())["checks"]
+    assert [c["name"] for c in checks] == ["DNS lookup", "Blob *", "Key vault"]
@@ -51,12 +51,17 @@ module "pdi_function_app" {
     HASH_SALT                              = "@Microsoft.KeyVault(SecretUri=https://${var.resource_prefix}-app-kv.vault.azure.net/secrets/salt)"
     FHIR_URL                               = "https://${var.resource_prefix}-fhir.azurehealthcareapis.com"
     "AzureWebJobs.IntakePipeline.Disabled" = each.value.AzureWebJobs_IntakePipeline_Disabled
+    "AzureWebJobs.IntakeBatch.Disabled"    = each.value.AzureWebJobs_IntakeBatch_Disabled
     AzureWebJobsStorage__accountName       = each.value.AzureWebJobsStorage__accountName
     AzureWebJobsStorage__blobServiceUri    = each.value.AzureWebJobsStorage__blobServiceUri
     AzureWebJobsStorage__queueServiceUri   = each.value.AzureWebJobsStorage__queueServiceUri
     AzureWebJobsStorage__tableServiceUri   = each.value.AzureWebJobsStorage__tableServiceUri
     INVALID_OUTPUT_CONTAINER_PATH          = each.value.INVALID_OUTPUT_CONTAINER_PATH
     VALID_OUTPUT_CONTAINER_PATH            = each.value.VALID_OUTPUT_CONTAINER_PATH
+    DIAGNOSTICS_OUTPUT_CONTAINER_PATH      = each.value.DIAGNOSTICS_OUTPUT_CONTAINER_PATH
+    INTAKE_PREVALIDATION                   = each.value.INTAKE_PREVALIDATION
+    INTAKE_TIME_BUDGET_SECONDS             = each.value.INTAKE_TIME_BUDGET_SECONDS
+    PARQUET_OUTPUT_CONTAINER_PATH          = each.value.PARQUET_OUTPUT_CONTAINER_PATH
 
   }
 }
@@ -16,12 +16,17 @@ locals {
       always_on                            = true,
       WEBSITE_RUN_FROM_PACKAGE             = 1,
       AzureWebJobs_IntakePipeline_Disabled = 0,
+      AzureWebJobs_IntakeBatch_Disabled    = 1,
       AzureWebJobsStorage__accountName     = "${var.resource_prefix}datasa${var.environment == "skylight" ? "1" : ""}",
       AzureWebJobsStorage__blobServiceUri  = "https://${var.resource_prefix}datasa${var.environment == "skylight" ? "1" : ""}.blob.core.windows.net",
       AzureWebJobsStorage__queueServiceUri = "https://${var.resource_prefix}datasa${var.environment == "skylight" ? "1" : ""}.queue.core.windows.net",
       AzureWebJobsStorage__tableServiceUri = "https://${var.resource_prefix}datasa${var.environment == "skylight" ? "1" : ""}.table.core.windows.net",
       INVALID_OUTPUT_CONTAINER_PATH        = "blob-trigger-out/invalid-messages",
       VALID_OUTPUT_CONTAINER_PATH          = "blob-trigger-out/valid-messages",
+      DIAGNOSTICS_OUTPUT_CONTAINER_PATH    = "",
+      INTAKE_PREVALIDATION                 = "false",
+      INTAKE_TIME_BUDGET_SECONDS           = "1500",
+      PARQUET_OUTPUT_CONTAINER_PATH        = "blob-trigger-out/silver",
       CSV_INPUT_PREFIX                     = "blob-trigger-out/valid-messages/",
       CSV_OUTPUT_PREFIX                    = "csvs"
       functions_path                       = "../../../../../src/FunctionApps/python"
@@ -1,6 +1,160 @@
+from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob import ContainerClient
 from azure.identity import DefaultAzureCredential
 import azure.functions as func
+import json
+import os
+import statistics
+import time
+import uuid
+
+MB = 1024 * 1024
+MAX_SIZE_MB = 256
+MAX_COUNT = 10
+MAX_CONCURRENCY = 32
+MAX_BLOCK_SIZE_MB = 100
+PROBE_PREFIX = "_throughput_probe"
+
+_credential = None
+
+
+def get_credential() -> DefaultAzureCredential:
+    """
+    Create the credential once per worker, so its token is reused across
+    requests rather than fetched every time.
+    """
+    global _credential
+    if _credential is None:
+        _credential = DefaultAzureCredential()
+    return _credential
+
+
+def get_container_client(
+    account: str, container: str, block_size: int = 4 * MB
+) -> ContainerClient:
+    storage_url = f"https://{account}.blob.core.windows.net"
+    return ContainerClient.from_container_url(
+        container_url=f"{storage_url}/{container}",
+        credential=get_credential(),
+        max_block_size=block_size,
+        max_single_put_size=block_size,
+        max_chunk_get_size=block_size,
+        max_single_get_size=block_size,
+    )
+
+
+def check_access(container_client: ContainerClient) -> int:
+    try:
+        # Fetch a single page holding at most one blob, which needs the same
+        # permission as reading the container without listing all of it
+        next(container_client.list_blobs(results_per_page=1).by_page(), None)
+        return 1
+    except Exception:
+        return 0
+
+
+def summarize_latencies(latencies_ms: list) -> dict:
+    return {
+        "min": round(min(latencies_ms), 1),
+        "mean": round(statistics.mean(latencies_ms), 1),
+        "max": round(max(latencies_ms), 1),
+    }
+
+
+def measure_throughput(
+    container_client: ContainerClient, size: int, count: int, max_concurrency: int
+) -> dict:
+    """
+    Upload and then download `count` test blobs of `size` bytes, transferring
+    blocks in parallel, and report the throughput and per-operation latency.
+    Test blobs are deleted afterwards.
+    """
+    data = os.urandom(size)
+    upload_ms = []
+    download_ms = []
+
+    for _ in range(count):
+        blob_client = container_client.get_blob_client(
+            f"{PROBE_PREFIX}/{uuid.uuid4()}.bin"
+        )
+        try:
+            start = time.perf_counter()
+            blob_client.upload_blob(
+                data, overwrite=True, max_concurrency=max_concurrency
+            )
+            upload_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            downloaded = blob_client.download_blob(
+                max_concurrency=max_concurrency
+            ).readall()
+            download_ms.append((time.perf_counter() - start) * 1000)
+
+            if len(downloaded) != size:
+                raise ValueError(
+                    f"Downloaded {len(downloaded)} bytes but uploaded {size}"
+                )
+        finally:
+            try:
+                blob_client.delete_blob()
+            except ResourceNotFoundError:
+                # The upload never completed
+                pass
+
+    total_mb = size * count / MB
+    return {
+        "size_mb": round(size / MB, 3),
+        "count": count,
+        "max_concurrency": max_concurrency,
+        "upload_mbps": round(total_mb / (sum(upload_ms) / 1000), 2),
+        "download_mbps": round(total_mb / (sum(download_ms) / 1000), 2),
+        "upload_latency_ms": summarize_latencies(upload_ms),
+        "download_latency_ms": summarize_latencies(download_ms),
+    }
+
+
+def throughput(req: func.HttpRequest, account: str, container: str):
+    try:
+        size = int(float(req.params.get("size_mb", 8)) * MB)
+        count = int(req.params.get("count", 3))
+        max_concurrency = int(req.params.get("max_concurrency", 4))
+        block_size = int(float(req.params.get("block_size_mb", 4)) * MB)
+    except ValueError:
+        return func.HttpResponse(
+            body='{"error":"size_mb, count, max_concurrency and block_size_mb '
+            + 'must be numbers"}',
+            status_code=400,
+        )
+
+    if not (
+        0 < size <= MAX_SIZE_MB * MB
+        and 0 < count <= MAX_COUNT
+        and 0 < max_concurrency <= MAX_CONCURRENCY
+        and 0 < block_size <= MAX_BLOCK_SIZE_MB * MB
+    ):
+        return func.HttpResponse(
+            body=f'{{"error":"size_mb must be at most {MAX_SIZE_MB}, count at most '
+            + f"{MAX_COUNT}, max_concurrency at most {MAX_CONCURRENCY}, "
+            + f"block_size_mb at most {MAX_BLOCK_SIZE_MB}, and all values "
+            + 'positive"}',
+            status_code=400,
+        )
+
+    container_client = get_container_client(account, container, block_size)
+    try:
+        result = measure_throughput(container_client, size, count, max_concurrency)
+    except Exception as e:
+        return func.HttpResponse(
+            body=json.dumps({"error": f"Throughput probe failed: {e}"}),
+            status_code=500,
+            headers={"Content-Type": "application/json"},
+        )
+
+    return func.HttpResponse(
+        body=json.dumps(result),
+        status_code=200,
+        headers={"Content-Type": "application/json"},
+    )
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
@@ -9,20 +163,10 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     container = req.params.get("container")
 
     if account and container:
-        creds = DefaultAzureCredential()
-
-        storage_url = f"https://{account}.blob.core.windows.net"
-        container_service_client = ContainerClient.from_container_url(
-            container_url=f"{storage_url}/{container}",
-            credential=creds,
-        )
+        if req.params.get("mode") == "throughput":
+            return throughput(req, account, container)
 
-        try:
-            # Read root of container to validate access
-            list(container_service_client.walk_blobs(delimiter="/"))
-            access = 1
-        except Exception:
-            access = 0
+        access = check_access(get_container_client(account, container))
 
         return func.HttpResponse(
             body=f'{{"access":{access}}}',
@@ -0,0 +1,168 @@
+import concurrent.futures
+import math
+import socket
+import ssl
+import statistics
+import time
+import urllib.parse
+
+from ping3 import ping
+from typing import Callable, Dict, List, Optional, Tuple
+
+MAX_TARGETS = 20
+MAX_SAMPLES = 100
+MAX_TIMEOUT_SECONDS = 10
+# The longest a probe may take if every sample times out, well within the
+# 230 second limit on HTTP requests to a function app
+MAX_PROBE_SECONDS = 120
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Compute a percentile of a list of values, interpolating linearly between
+    the closest ranks.
+
+    :param values: The values to summarize; must not be empty
+    :param pct: The percentile to compute, between 0 and 100
+    """
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(samples: List[Optional[float]]) -> Dict[str, Optional[float]]:
+    """
+    Summarize latency samples.  Jitter is the mean absolute difference between
+    consecutive successful samples, and loss is the fraction of samples that
+    failed.
+
+    :param samples: Latencies in milliseconds, with None for each failed sample
+    """
+    latencies = [s for s in samples if s is not None]
+    summary = {
+        "samples": len(samples),
+        "loss": round(1 - len(latencies) / len(samples), 3) if samples else None,
+        "min": None,
+        "mean": None,
+        "p50": None,
+        "p99": None,
+        "jitter": None,
+    }
+    if latencies:
+        summary["min"] = round(min(latencies), 3)
+        summary["mean"] = round(statistics.mean(latencies), 3)
+        summary["p50"] = round(percentile(latencies, 50), 3)
+        summary["p99"] = round(percentile(latencies, 99), 3)
+        deltas = [abs(b - a) for a, b in zip(latencies, latencies[1:])]
+        summary["jitter"] = round(statistics.mean(deltas), 3) if deltas else 0.0
+    return summary
+
+
+def icmp_sample(host: str, port: int, timeout: float) -> Optional[float]:
+    """Time a single ICMP echo request, in milliseconds."""
+    try:
+        result = ping(host, timeout=timeout, unit="ms")
+    except OSError:
+        # Raw sockets may not be permitted in the sandbox
+        return None
+    return result if result else None
+
+
+def tcp_connect_sample(host: str, port: int, timeout: float) -> Optional[float]:
+    """Time establishing a TCP connection, in milliseconds."""
+    start = time.perf_counter()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return (time.perf_counter() - start) * 1000
+    except OSError:
+        return None
+
+
+def tls_handshake_sample(host: str, port: int, timeout: float) -> Optional[float]:
+    """Time a TLS handshake over an established connection, in milliseconds."""
+    context = ssl.create_default_context()
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            start = time.perf_counter()
+            with context.wrap_socket(sock, server_hostname=host):
+                return (time.perf_counter() - start) * 1000
+    except (OSError, ssl.SSLError):
+        return None
+
+
+def collect(
+    sample_fn: Callable[[str, int, float], Optional[float]],
+    host: str,
+    port: int,
+    samples: int,
+    timeout: float,
+) -> Dict[str, Optional[float]]:
+    """Take a number of samples with one method and summarize them."""
+    return summarize([sample_fn(host, port, timeout) for _ in range(samples)])
+
+
+def get_max_duration(samples: int, tls: bool, timeout: float) -> float:
+    """
+    Compute the longest a probe can take, when every sample times out.  Targets
+    are probed at the same time, so this is the time taken by a single target.
+    A TLS sample can wait for both its connection and its handshake to time out.
+    """
+    timeouts = 4 if tls else 2
+    return samples * timeouts * timeout
+
+
+def parse_target(target: str, default_port: int) -> Tuple[str, int]:
+    """
+    Split a `host`, `host:port`, `[address]` or `[address]:port` target into its
+    host and port.  A bare IPv6 address (eg: `2001:db8::1`) has no port.
+    """
+    target = target.strip()
+    if target.count(":") > 1 and not target.startswith("["):
+        return target, default_port
+    parts = urllib.parse.urlsplit(f"//{target}")
+    port = parts.port
+    return parts.hostname or "", default_port if port is None else port
+
+
+def probe_target(
+    target: str, samples: int, port: int, tls: bool, timeout: float
+) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Measure the latency to a single target with ICMP echo, TCP connect and
+    (optionally) TLS handshake samples.
+
+    :param target: A `host` or `host:port` to probe
+    :param samples: Number of samples to take with each method
+    :param port: Port to connect to when the target doesn't specify one
+    :param tls: Whether to time TLS handshakes
+    :param timeout: Number of seconds to wait for each sample
+    """
+    host, port = parse_target(target, port)
+    result = {
+        "icmp": collect(icmp_sample, host, port, samples, timeout),
+        "tcp_connect": collect(tcp_connect_sample, host, port, samples, timeout),
+    }
+    if tls:
+        result["tls_handshake"] = collect(
+            tls_handshake_sample, host, port, samples, timeout
+        )
+    return result
+
+
+def probe_targets(
+    targets: List[str], samples: int, port: int, tls: bool, timeout: float
+) -> Dict[str, Dict[str, Dict[str, Optional[float]]]]:
+    """
+    Probe several targets at the same time.  Samples for any one target are
+    taken one after another so they don't compete with each other.
+
+    :return: Dictionary mapping each target to its latency summaries
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {
+            target: executor.submit(probe_target, target, samples, port, tls, timeout)
+            for target in targets
+        }
+    return {target: future.result() for target, future in futures.items()}
@@ -1,18 +1,32 @@
 import azure.functions as func
+import json
 from ping3 import ping
 
+from .latency_probe import (
+    MAX_PROBE_SECONDS,
+    MAX_SAMPLES,
+    MAX_TARGETS,
+    MAX_TIMEOUT_SECONDS,
+    get_max_duration,
+    parse_target,
+    probe_targets,
+)
+
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
 
+    if req.params.get("mode") == "probe":
+        return probe(req)
+
     address = req.params.get("address")
 
     if address:
 
         r = ping(address, timeout=10)
 
-        if r == "None":
+        if r is None:
             result = "Timeout"
-        elif r == "False":
+        elif r is False:
             result = "Cannot resolve"
         else:
             result = "Success"
@@ -27,3 +41,67 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             body='{"error":"Please pass an address on the query string"}',
             status_code=400,
         )
+
+
+def probe(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Measure latency statistics to one or more targets, probed concurrently.
+
+    Query parameters:
+
+    * `targets` - comma-separated list of `host`, `host:port` or
+      `[address]:port` to probe
+    * `samples` (default: 10) - number of samples per target and method
+    * `port` (default: 443) - port for TCP and TLS samples, unless the target
+      specifies one
+    * `tls` (default: true) - if 'false' TLS handshakes won't be timed
+    * `timeout` (default: 2) - number of seconds to wait for each sample, at
+      most 10.  The samples of a target, times the timeout (twice for TLS
+      samples), may add up to at most 120 seconds.
+    """
+    targets = [t for t in req.params.get("targets", "").split(",") if t.strip()]
+
+    try:
+        samples = int(req.params.get("samples", 10))
+        port = int(req.params.get("port", 443))
+        timeout = float(req.params.get("timeout", 2))
+        for target in targets:
+            parse_target(target, port)
+    except ValueError:
+        return func.HttpResponse(
+            body='{"error":"samples, port, timeout and target ports must be numbers"}',
+            status_code=400,
+        )
+    tls = req.params.get("tls", "true").strip().lower() == "true"
+
+    if not targets or len(targets) > MAX_TARGETS:
+        return func.HttpResponse(
+            body=f'{{"error":"Please pass 1 to {MAX_TARGETS} targets on the query '
+            + 'string"}',
+            status_code=400,
+        )
+    if not 1 <= samples <= MAX_SAMPLES:
+        return func.HttpResponse(
+            body=f'{{"error":"samples must be between 1 and {MAX_SAMPLES}"}}',
+            status_code=400,
+        )
+    if not 0 < timeout <= MAX_TIMEOUT_SECONDS:
+        return func.HttpResponse(
+            body='{"error":"timeout must be more than 0 and at most '
+            + f'{MAX_TIMEOUT_SECONDS} seconds"}}',
+            status_code=400,
+        )
+    if get_max_duration(samples, tls, timeout) > MAX_PROBE_SECONDS:
+        return func.HttpResponse(
+            body='{"error":"samples times timeout, for each method and twice for '
+            + f'TLS, must be at most {MAX_PROBE_SECONDS} seconds"}}',
+            status_code=400,
+        )
+
+    results = probe_targets(targets, samples, port, tls, timeout)
+
+    return func.HttpResponse(
+        body=json.dumps({"results": results}),
+        status_code=200,
+        headers={"Content-Type": "application/json"},
+    )
@@ -1,3 +1,118 @@
-def test_confirm_storage_access_placeholder():
-    """placeholder so pytest does not fail"""
-    pass
+import json
+
+from unittest import mock
+
+from ConfirmStorageAccess import confirm_storage_access
+from ConfirmStorageAccess.confirm_storage_access import (
+    MB,
+    check_access,
+    get_credential,
+    main,
+    measure_throughput,
+)
+
+
+@mock.patch("ConfirmStorageAccess.confirm_storage_access.DefaultAzureCredential")
+def test_get_credential_is_cached(patched_credential):
+    confirm_storage_access._credential = None
+
+    assert get_credential() is get_credential()
+    patched_credential.assert_called_once()
+    confirm_storage_access._credential = None
+
+
+def test_check_access():
+    container_client = mock.Mock()
+    container_client.list_blobs.return_value.by_page.return_value = iter([[]])
+
+    assert check_access(container_client) == 1
+    container_client.list_blobs.assert_called_with(results_per_page=1)
+
+    container_client.list_blobs.side_effect = Exception("403 Forbidden")
+    assert check_access(container_client) == 0
+
+
+def test_measure_throughput():
+    container_client = mock.Mock()
+    blob_client = container_client.get_blob_client.return_value
+    blob_client.download_blob.return_value.readall.return_value = b"x" * MB
+
+    result = measure_throughput(container_client, MB, 2, 4)
+
+    assert result["size_mb"] == 1
+    assert result["count"] == 2
+    assert result["upload_mbps"] > 0
+    assert result["download_mbps"] > 0
+    assert set(result["upload_latency_ms"]) == {"min", "mean", "max"}
+    assert blob_client.upload_blob.call_count == 2
+    blob_client.upload_blob.assert_called_with(
+        mock.ANY, overwrite=True, max_concurrency=4
+    )
+    blob_client.download_blob.assert_called_with(max_concurrency=4)
+    # Test blobs are always cleaned up
+    assert blob_client.delete_blob.call_count == 2
+
+
+@mock.patch("ConfirmStorageAccess.confirm_storage_access.check_access")
+@mock.patch("ConfirmStorageAccess.confirm_storage_access.get_container_client")
+def test_main_access(patched_get_container_client, patched_check_access):
+    patched_check_access.return_value = 1
+    req = mock.Mock()
+    req.params = {"account": "someaccount", "container": "bronze"}
+
+    response = main(req)
+
+    assert json.loads(response.get_body()) == {"access": 1}
+    patched_get_container_client.assert_called_with("someaccount", "bronze")
+
+
+@mock.patch("ConfirmStorageAccess.confirm_storage_access.measure_throughput")
+@mock.patch("ConfirmStorageAccess.confirm_storage_access.get_container_client")
+def test_main_throughput(patched_get_container_client, patched_measure_throughput):
+    patched_measure_throughput.return_value = {"upload_mbps": 50.0}
+    req = mock.Mock()
+    req.params = {
+        "account": "someaccount",
+        "container": "bronze",
+        "mode": "throughput",
+        "size_mb": "16",
+        "count": "2",
+        "max_concurrency": "8",
+        "block_size_mb": "2",
+    }
+
+    response = main(req)
+
+    assert response.status_code == 200
+    assert json.loads(response.get_body()) == {"upload_mbps": 50.0}
+    patched_get_container_client.assert_called_with("someaccount", "bronze", 2 * MB)
+    patched_measure_throughput.assert_called_with(
+        patched_get_container_client.return_value, 16 * MB, 2, 8
+    )
+
+
+def test_main_throughput_invalid():
+    req = mock.Mock()
+    req.params = {
+        "account": "someaccount",
+        "container": "bronze",
+        "mode": "throughput",
+        "size_mb": "1024",
+    }
+    assert main(req).status_code == 400
+
+    req.params = {**req.params, "size_mb": "8", "max_concurrency": "1000"}
+    response = main(req)
+    assert response.status_code == 400
+    assert "max_concurrency at most 32" in json.loads(response.get_body())["error"]
+
+    req.params = {**req.params, "max_concurrency": "4", "block_size_mb": "4000"}
+    response = main(req)
+    assert response.status_code == 400
+    assert "block_size_mb at most 100" in json.loads(response.get_body())["error"]
+
+
+def test_main_missing_params():
+    req = mock.Mock()
+    req.params = {"account": "someaccount"}
+    assert main(req).status_code == 400
@@ -0,0 +1,123 @@
+import json
+import pytest
+
+from unittest import mock
+
+from PingAddress.latency_probe import (
+    get_max_duration,
+    parse_target,
+    percentile,
+    summarize,
+)
+from PingAddress.ping_address import main
+
+
+def test_percentile():
+    values = [5.0, 1.0, 3.0, 2.0, 4.0]
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 50) == 3.0
+    assert percentile(values, 100) == 5.0
+    assert percentile(values, 90) == 4.6
+
+
+def test_summarize():
+    summary = summarize([10.0, None, 14.0, 12.0])
+
+    assert summary == {
+        "samples": 4,
+        "loss": 0.25,
+        "min": 10.0,
+        "mean": 12.0,
+        "p50": 12.0,
+        "p99": 13.96,
+        "jitter": 3.0,
+    }
+
+
+def test_summarize_all_lost():
+    summary = summarize([None, None])
+
+    assert summary["loss"] == 1.0
+    assert summary["mean"] is None
+    assert summary["jitter"] is None
+
+
+def test_parse_target():
+    assert parse_target("example.com", 443) == ("example.com", 443)
+    assert parse_target(" example.com:8443 ", 443) == ("example.com", 8443)
+    assert parse_target("2001:db8::1", 443) == ("2001:db8::1", 443)
+    assert parse_target("[2001:db8::1]", 443) == ("2001:db8::1", 443)
+    assert parse_target("[2001:db8::1]:8443", 443) == ("2001:db8::1", 8443)
+    with pytest.raises(ValueError):
+        parse_target("example.com:port", 443)
+
+
+@mock.patch("PingAddress.ping_address.probe_targets")
+def test_main_probe(patched_probe_targets):
+    patched_probe_targets.return_value = {"example.com": {"icmp": {"samples": 3}}}
+    req = mock.Mock()
+    req.params = {
+        "mode": "probe",
+        "targets": "example.com,storage.example.com:8443",
+        "samples": "3",
+        "tls": "false",
+    }
+
+    response = main(req)
+
+    assert response.status_code == 200
+    assert json.loads(response.get_body()) == {
+        "results": patched_probe_targets.return_value
+    }
+    patched_probe_targets.assert_called_with(
+        ["example.com", "storage.example.com:8443"], 3, 443, False, 2.0
+    )
+
+
+def test_main_probe_invalid():
+    req = mock.Mock()
+    req.params = {"mode": "probe", "targets": "example.com", "samples": "1000"}
+    assert main(req).status_code == 400
+
+    req.params = {"mode": "probe"}
+    assert main(req).status_code == 400
+
+    req.params = {"mode": "probe", "targets": "example.com:https"}
+    assert main(req).status_code == 400
+
+    for timeout in ["0", "-1", "11", "nan", "inf"]:
+        req.params = {"mode": "probe", "targets": "example.com", "timeout": timeout}
+        response = main(req)
+        assert response.status_code == 400
+        assert "timeout" in json.loads(response.get_body())["error"]
+
+    # Every sample timing out would take 100 * 4 * 1 seconds
+    req.params = {
+        "mode": "probe",
+        "targets": "example.com",
+        "samples": "100",
+        "timeout": "1",
+    }
+    response = main(req)
+    assert response.status_code == 400
+    assert "120 seconds" in json.loads(response.get_body())["error"]
+
+
+def test_get_max_duration():
+    assert get_max_duration(10, True, 2) == 80
+    assert get_max_duration(10, False, 2) == 40
+
+
+@mock.patch("PingAddress.ping_address.ping")
+def test_main_single_ping(patched_ping):
+    req = mock.Mock()
+    req.params = {"address": "example.com"}
+
+    patched_ping.return_value = None
+    assert json.loads(main(req).get_body()) == {"result": "Timeout"}
+
+    patched_ping.return_value = False
+    assert json.loads(main(req).get_body()) == {"result": "Cannot resolve"}
+
+    patched_ping.return_value = 0.012
+    assert json.loads(main(req).get_body()) == {"result": "Success"}
@@ -0,0 +1,212 @@
+import azure.functions as func
+import json
+import logging
+import re
+import requests
+import threading
+import urllib.parse
+
+from clients import get_cred_manager
+from config import get_required_config
+from FhirLookup.cache import CachedResponse, ResponseCache
+from typing import Collection, Dict, Optional
+
+# The seconds to wait for the FHIR server to answer a request
+REQUEST_TIMEOUT = 30
+
+# The path that reports the cache's metrics instead of proxying a request
+METRICS_PATH = "_metrics"
+
+RESOURCE_ID_PATTERN = re.compile(r"^[A-Za-z0-9\-\.]{1,64}$")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Main function for the FhirLookup HTTP trigger, which proxies reads and
+    searches of common resource types to the FHIR server, answering repeated
+    requests from an in-memory cache.  For more information, see the README
+    file accompanying the FhirLookup function.
+
+    :param req: The read or search request, with its FHIR path (eg:
+        `Patient/<id>` or `Immunization`) in the route
+    :return: The FHIR server's response, or the cached copy of it
+    """
+    path = req.route_params.get("path", "").strip("/")
+    if path == METRICS_PATH:
+        return func.HttpResponse(
+            json.dumps(get_cache().get_metrics()), mimetype="application/json"
+        )
+
+    fhir_url = get_required_config("FHIR_URL")
+    resource_types = get_required_config(
+        "FHIR_LOOKUP_RESOURCE_TYPES", "Patient,Immunization"
+    ).split(",")
+    try:
+        url = compose_lookup_url(
+            fhir_url, path, urllib.parse.urlparse(req.url).query, resource_types
+        )
+    except ValueError as error:
+        return func.HttpResponse(str(error), status_code=400)
+
+    try:
+        return lookup(url, fhir_url)
+    except requests.RequestException:
+        logging.exception(f"Error occurred while looking up {path}")
+        return func.HttpResponse(
+            "The FHIR server could not be reached", status_code=502
+        )
+
+
+def compose_lookup_url(
+    fhir_url: str,
+    path: str,
+    query: str,
+    resource_types: Collection[str],
+) -> str:
+    """
+    Build the FHIR server URL of a read (`<type>/<id>`), version read
+    (`<type>/<id>/_history/<version>`) or search (`<type>?<parameters>`).  The
+    search parameters are sorted, so the same search is always cached once.
+    Repeated parameters (eg: `date=ge2022-01-01&date=lt2023-01-01`) are all kept.
+
+    :param fhir_url: The base URL of the FHIR server
+    :param path: The FHIR path of the request
+    :param query: The query string of the request
+    :param resource_types: The resource types that may be looked up
+    :raises ValueError: If the request isn't a read or search of one of
+        `resource_types`
+    """
+    segments = path.split("/") if path else []
+    if not segments or segments[0] not in resource_types:
+        raise ValueError(
+            f"Only {', '.join(resource_types)} resources can be looked up."
+        )
+
+    if len(segments) in (1, 2):
+        ids = segments[1:]
+    elif len(segments) == 4 and segments[2] == "_history":
+        ids = [segments[1], segments[3]]
+    else:
+        ids = None
+    if ids is None or not all(RESOURCE_ID_PATTERN.match(id) for id in ids):
+        raise ValueError(
+            f"Invalid path {path}.  Expected '<type>', '<type>/<id>' or "
+            + "'<type>/<id>/_history/<version>'."
+        )
+
+    query = urllib.parse.urlencode(
+        sorted(urllib.parse.parse_qsl(query, keep_blank_values=True))
+    )
+    return f"{fhir_url.rstrip('/')}/{path}" + (f"?{query}" if query else "")
+
+
+def lookup(url: str, fhir_url: str) -> func.HttpResponse:
+    """
+    Answer a request from the cache while the cached response is fresh.
+    Otherwise, ask the FHIR server, revalidating a stale cached response with
+    `If-None-Match` when it has an `ETag`, and cache successful responses.
+    Failed responses (eg: 404 for a deleted resource) aren't cached, and replace
+    any cached response.  When the FHIR server can't answer for the moment (a
+    429, a 5xx or no response at all), a stale cached response is served
+    instead, and kept.
+
+    :param url: The FHIR server URL of the request
+    :param fhir_url: The base URL of the FHIR server, for authentication
+    :return: The response, with an `X-Cache` header of `HIT`, `REVALIDATED`,
+        `STALE` or `MISS`
+    :raises requests.RequestException: If the FHIR server can't be reached and
+        nothing is cached
+    """
+    cache = get_cache()
+    cached = cache.get(url)
+    if cached is not None and cache.is_fresh(cached):
+        cache.record("hit")
+        return _respond(cached.body, cached.content_type, cached.etag, "HIT")
+
+    access_token = get_cred_manager(fhir_url).get_access_token()
+    headers = {
+        "Authorization": f"Bearer {access_token.token}",
+        "Accept": "application/fhir+json",
+    }
+    if cached is not None and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    try:
+        response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        if cached is None:
+            raise
+        logging.exception(f"Serving a stale response to {url}")
+        return _respond_stale(cache, cached)
+
+    if response.status_code == 304 and cached is not None:
+        cache.touch(cached)
+        cache.record("revalidated")
+        return _respond(cached.body, cached.content_type, cached.etag, "REVALIDATED")
+
+    content_type = response.headers.get("Content-Type", "application/fhir+json")
+    etag = response.headers.get("ETag")
+    if response.status_code == 200:
+        cache.put(url, response.content, content_type, etag)
+        cache.record("miss" if cached is None else "refreshed")
+        return _respond(response.content, content_type, etag, "MISS")
+
+    if cached is not None and _is_transient(response.status_code):
+        logging.warning(
+            f"Serving a stale response to {url} after a {response.status_code}"
+        )
+        return _respond_stale(cache, cached)
+
+    cache.discard(url)
+    cache.record("uncached")
+    return _respond(response.content, content_type, None, "MISS", response.status_code)
+
+
+def get_cache() -> ResponseCache:
+    """
+    Get the response cache, creating it on first use.  The cache is shared by
+    every invocation in the worker process.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                max_bytes=int(
+                    get_required_config("FHIR_LOOKUP_CACHE_MAX_BYTES", "33554432")
+                ),
+                ttl_seconds=float(
+                    get_required_config("FHIR_LOOKUP_CACHE_TTL_SECONDS", "60")
+                ),
+            )
+        return _cache
+
+
+def reset_cache() -> None:
+    """Forget the response cache, so it is created afresh."""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def _is_transient(status_code: int) -> bool:
+    return status_code == 429 or 500 <= status_code < 600
+
+
+def _respond_stale(cache: ResponseCache, cached: CachedResponse) -> func.HttpResponse:
+    cache.record("stale")
+    return _respond(cached.body, cached.content_type, cached.etag, "STALE")
+
+
+def _respond(
+    body: bytes,
+    content_type: str,
+    etag: Optional[str],
+    cache_status: str,
+    status_code: int = 200,
+) -> func.HttpResponse:
+    headers: Dict[str, str] = {"Content-Type": content_type, "X-Cache": cache_status}
+    if etag:
+        headers["ETag"] = etag
+    return func.HttpResponse(body, status_code=status_code, headers=headers)
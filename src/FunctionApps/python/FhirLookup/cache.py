@@ -0,0 +1,149 @@
+import collections
+import threading
+import time
+
+from typing import Callable, Dict, Optional
+
+
+class CachedResponse:
+    """
+    A response from the FHIR server, as held in the cache.
+
+    :param body: The body of the response
+    :param content_type: The content type of the body
+    :param etag: The `ETag` header of the response, if it had one
+    :param stored_at: When the response was received or last revalidated
+    """
+
+    def __init__(
+        self, body: bytes, content_type: str, etag: Optional[str], stored_at: float
+    ):
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.stored_at = stored_at
+
+
+class ResponseCache:
+    """
+    A thread-safe cache of FHIR server responses, keyed on the request URL.
+
+    Responses are fresh for `ttl_seconds` after they are stored, and are served
+    without asking the server.  Stale responses are kept, so they can be
+    revalidated with `If-None-Match` when they have an `ETag`.  Once the bodies
+    held exceed `max_bytes`, the least recently used responses are evicted.
+
+    :param max_bytes: The most bytes of response bodies held
+    :param ttl_seconds: How long a response is served without asking the server
+    :param clock: A function returning the current time, in seconds
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.size_bytes = 0
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        Get the response held for a URL, fresh or stale.
+
+        :param key: The request URL
+        """
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+            return response
+
+    def is_fresh(self, response: CachedResponse) -> bool:
+        """Determine whether a response can be served without asking the server."""
+        return self._clock() - response.stored_at < self.ttl_seconds
+
+    def put(
+        self, key: str, body: bytes, content_type: str, etag: Optional[str]
+    ) -> None:
+        """
+        Hold the response for a URL, replacing any older response.  Responses
+        larger than the whole cache aren't held.
+
+        :param key: The request URL
+        :param body: The body of the response
+        :param content_type: The content type of the body
+        :param etag: The `ETag` header of the response, if it had one
+        """
+        with self._lock:
+            self._remove(key)
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = CachedResponse(body, content_type, etag, self._clock())
+            self.size_bytes += len(body)
+            while self.size_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counts["evictions"] += 1
+
+    def touch(self, response: CachedResponse) -> None:
+        """
+        Record that the server confirmed a stale response is unchanged, making
+        it fresh again.
+        """
+        with self._lock:
+            response.stored_at = self._clock()
+
+    def discard(self, key: str) -> None:
+        """Forget the response held for a URL, if there is one."""
+        with self._lock:
+            self._remove(key)
+
+    def record(self, outcome: str) -> None:
+        """
+        Count how a request was answered, eg: `hit`, `miss` or `revalidated`.
+
+        :param outcome: The name of the outcome
+        """
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def get_metrics(self) -> Dict:
+        """
+        Report how effective the cache has been: how requests were answered,
+        the fraction answered without the server sending a body, and the
+        responses held.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            entries = len(self._entries)
+            size_bytes = self.size_bytes
+        requests = sum(
+            counts.get(outcome, 0)
+            for outcome in (
+                "hit",
+                "revalidated",
+                "miss",
+                "refreshed",
+                "stale",
+                "uncached",
+            )
+        )
+        saved = counts.get("hit", 0) + counts.get("revalidated", 0)
+        return {
+            **counts,
+            "requests": requests,
+            "hit_rate": round(saved / requests, 4) if requests else 0,
+            "entries": entries,
+            "size_bytes": size_bytes,
+        }
+
+    def _remove(self, key: str) -> None:
+        response = self._entries.pop(key, None)
+        if response is not None:
+            self.size_bytes -= len(response.body)
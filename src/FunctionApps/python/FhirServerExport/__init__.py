@@ -3,9 +3,19 @@ import config
 import json
 import logging
 import requests
+import time
 
+from FhirServerExport.filters import (
+    ExportParameterError,
+    compose_export_url,
+    get_export_parameters,
+)
 from phdi import fhir
 from phdi.azure import AzureFhirServerCredentialManager
+from typing import Dict
+
+# The seconds to wait for the FHIR server to answer a single request
+REQUEST_TIMEOUT = 30
 
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
@@ -26,20 +36,36 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     if container == "<none>":
         container = ""
 
+    export_scope = req.params.get("export_scope", "")
+    try:
+        parameters = get_export_parameters(req.params, container)
+        export_url = compose_export_url(fhir_url, export_scope, parameters)
+    except ExportParameterError as error:
+        logging.warning(f"Rejected export request: {error}")
+        return func.HttpResponse(str(error), status_code=400)
+
     cred_manager = AzureFhirServerCredentialManager(fhir_url=fhir_url)
 
     # Properly configured, kickoff the export procedure
     try:
-        export_response = fhir.export_from_fhir_server(
-            cred_manager=cred_manager,
-            fhir_url=fhir_url,
-            export_scope=req.params.get("export_scope", ""),
-            since=req.params.get("since", ""),
-            resource_type=req.params.get("type", ""),
-            container=container,
-            poll_step=poll_step,
-            poll_timeout=poll_timeout,
-        )
+        if "_typeFilter" in parameters or "_elements" in parameters:
+            export_response = export_with_filters(
+                cred_manager=cred_manager,
+                export_url=export_url,
+                poll_step=poll_step,
+                poll_timeout=poll_timeout,
+            )
+        else:
+            export_response = fhir.export_from_fhir_server(
+                cred_manager=cred_manager,
+                fhir_url=fhir_url,
+                export_scope=export_scope,
+                since=parameters.get("_since", ""),
+                resource_type=parameters.get("_type", ""),
+                container=parameters.get("_container", ""),
+                poll_step=poll_step,
+                poll_timeout=poll_timeout,
+            )
         logging.debug(f"Export response received: {json.dumps(export_response)}")
 
     except requests.HTTPError as exception:
@@ -54,3 +80,58 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         raise exception
 
     return func.HttpResponse(status_code=202)
+
+
+def export_with_filters(
+    cred_manager: AzureFhirServerCredentialManager,
+    export_url: str,
+    poll_step: float,
+    poll_timeout: float,
+) -> Dict:
+    """
+    Kick off an export with filtering (`_typeFilter`) or projection (`_elements`)
+    parameters, which `fhir.export_from_fhir_server` doesn't send, and poll
+    until it completes.
+
+    :param cred_manager: The credential manager used to authenticate to the FHIR
+        server
+    :param export_url: The URL of the kick-off request, with its parameters
+    :param poll_step: The seconds to wait between checks for the completion of
+        the export
+    :param poll_timeout: The seconds to wait for the completion of the export
+    :raises requests.HTTPError: If the FHIR server returns an unexpected status
+    :raises TimeoutError: If the export doesn't complete within `poll_timeout`
+    :return: The completed export's list of exported files
+    """
+    kickoff_response = requests.get(
+        export_url,
+        headers={
+            "Authorization": f"Bearer {cred_manager.get_access_token().token}",
+            "Accept": "application/fhir+json",
+            "Prefer": "respond-async",
+        },
+        timeout=REQUEST_TIMEOUT,
+    )
+    if kickoff_response.status_code != 202:
+        raise requests.HTTPError(response=kickoff_response)
+
+    poll_url = kickoff_response.headers["Content-Location"]
+    deadline = time.monotonic() + poll_timeout
+    while True:
+        poll_response = requests.get(
+            poll_url,
+            headers={
+                "Authorization": f"Bearer {cred_manager.get_access_token().token}",
+                "Accept": "application/json",
+            },
+            timeout=REQUEST_TIMEOUT,
+        )
+        if poll_response.status_code == 200:
+            return poll_response.json()
+        if poll_response.status_code != 202:
+            raise requests.HTTPError(response=poll_response)
+        if time.monotonic() + poll_step > deadline:
+            raise TimeoutError(
+                f"Export did not complete within {poll_timeout} seconds: {poll_url}"
+            )
+        time.sleep(poll_step)
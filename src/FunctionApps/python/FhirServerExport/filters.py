@@ -0,0 +1,139 @@
+import re
+import urllib.parse
+
+from typing import Dict, List, Mapping
+
+RESOURCE_TYPE = r"[A-Z][A-Za-z]+"
+
+# A search query restricting the resources of a type, eg:
+# `Immunization?date=ge2022-01-01&vaccine-code=207`
+TYPE_FILTER_PATTERN = re.compile(rf"^({RESOURCE_TYPE})\?[^?]*=[^?]*$")
+
+# An element of every exported type (eg: `id`), or of one type (eg:
+# `Immunization.vaccineCode`)
+ELEMENT_PATTERN = re.compile(rf"^({RESOURCE_TYPE}\.)?[a-z][A-Za-z0-9]*$")
+
+# The naming rules of Azure blob containers
+CONTAINER_PATTERN = re.compile(r"^(?=.{3,63}$)[a-z0-9]+(-[a-z0-9]+)*$")
+
+# The parameters of the kick-off request, in the order they are sent
+PARAMETERS = ("_since", "_type", "_typeFilter", "_elements", "_container")
+
+
+class ExportParameterError(ValueError):
+    """Raised when a parameter of an export request is malformed."""
+
+
+def get_export_parameters(
+    params: Mapping[str, str], default_container: str = ""
+) -> Dict[str, str]:
+    """
+    Validate the query parameters of an export request, and collect the ones
+    sent with the kick-off request, with their names in the Bulk Data Export
+    specification.
+
+    * `since` and `type` are passed as `_since` and `_type`.
+    * `_typeFilter` is a comma-separated list of FHIR search queries, each of the
+      form `<resource type>?<search parameters>`.  When `type` is given, every
+      filter must be for one of its types.
+    * `_elements` is a comma-separated list of the elements exported, either for
+      every type (eg: `id`) or for one type (eg: `Immunization.vaccineCode`).
+      Mandatory elements are always exported.
+    * `_container` is the storage container the files are exported to,
+      overriding `default_container`.
+
+    :param params: The query parameters of the HTTP request
+    :param default_container: The container exported to when `_container` isn't
+        given; empty to export to a new container
+    :raises ExportParameterError: If a parameter is malformed
+    :return: Dictionary mapping kick-off parameter names to their values, with
+        empty parameters left out
+    """
+    parameters = {
+        "_since": params.get("since", ""),
+        "_type": params.get("type", ""),
+        "_typeFilter": ",".join(
+            _validate_type_filters(
+                params.get("_typeFilter", ""), _split(params.get("type", ""))
+            )
+        ),
+        "_elements": ",".join(_validate_elements(params.get("_elements", ""))),
+        "_container": _validate_container(params.get("_container", ""))
+        or default_container,
+    }
+    return {name: value for name, value in parameters.items() if value}
+
+
+def compose_export_url(
+    fhir_url: str, export_scope: str, parameters: Dict[str, str]
+) -> str:
+    """
+    Build the URL of the kick-off request, with its parameters URL-encoded.
+
+    :param fhir_url: The base URL of the FHIR server
+    :param export_scope: Empty for a system level export, `Patient`, or
+        `Group/<id>`
+    :param parameters: The kick-off parameters, from `get_export_parameters`
+    :raises ExportParameterError: If the scope isn't supported
+    """
+    if export_scope == "":
+        path = "$export"
+    elif export_scope == "Patient" or export_scope.startswith("Group/"):
+        path = f"{export_scope}/$export"
+    else:
+        raise ExportParameterError(
+            f"Invalid export scope {export_scope}.  Expected 'Patient' or "
+            + "'Group/[ID]'."
+        )
+
+    query = urllib.parse.urlencode(
+        [(name, parameters[name]) for name in PARAMETERS if name in parameters],
+        safe=",",
+    )
+    return f"{fhir_url.rstrip('/')}/{path}" + (f"?{query}" if query else "")
+
+
+def _validate_type_filters(value: str, resource_types: List[str]) -> List[str]:
+    # Search queries may themselves contain commas (eg: `code=207,208`), so the
+    # list is only split before the start of the next query
+    type_filters = [
+        type_filter.strip()
+        for type_filter in re.split(rf",(?={RESOURCE_TYPE}\?)", value)
+        if type_filter.strip()
+    ]
+    for type_filter in type_filters:
+        match = TYPE_FILTER_PATTERN.match(type_filter)
+        if match is None:
+            raise ExportParameterError(
+                f"Invalid _typeFilter {type_filter}.  Expected "
+                + "'<resource type>?<search parameters>'."
+            )
+        if resource_types and match.group(1) not in resource_types:
+            raise ExportParameterError(
+                f"_typeFilter {type_filter} is for a type not listed in type."
+            )
+    return type_filters
+
+
+def _validate_elements(value: str) -> List[str]:
+    elements = _split(value)
+    for element in elements:
+        if ELEMENT_PATTERN.match(element) is None:
+            raise ExportParameterError(
+                f"Invalid _elements entry {element}.  Expected '<element>' or "
+                + "'<resource type>.<element>'."
+            )
+    return elements
+
+
+def _validate_container(value: str) -> str:
+    if value and CONTAINER_PATTERN.match(value) is None:
+        raise ExportParameterError(
+            f"Invalid _container {value}.  Container names have 3 to 63 lowercase "
+            + "letters, numbers and single hyphens."
+        )
+    return value
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
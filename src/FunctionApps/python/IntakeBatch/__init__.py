@@ -0,0 +1,107 @@
+import azure.functions as func
+import concurrent.futures
+import logging
+
+from config import get_required_config
+from typing import Optional
+
+from IntakePipeline import process_blobs
+from IntakePipeline.blob_events import (
+    delete_event,
+    parse_event,
+    receive_events,
+    release_event,
+)
+from IntakePipeline.continuation import (
+    BlobStream,
+    get_deadline,
+    open_blob,
+    schedule_continuation,
+)
+from IntakePipeline.profiling import profile_invocation
+
+# The most blobs downloaded at the same time
+MAX_DOWNLOADS = 8
+
+
+def main(msg: func.QueueMessage) -> None:
+    """
+    This is the main entry point for the IntakeBatch function.  It receives
+    Event Grid notifications of blobs created in the intake container, and
+    along with the notification that triggered it, takes up to
+    `INTAKE_BATCH_MAX_BLOBS` notifications waiting on the queue, so that many
+    small blobs (eg: files holding a single message) are processed together in
+    one invocation by `process_blobs`, rather than each paying for its own
+    invocation.
+
+    Blobs larger than `INTAKE_BATCH_MAX_BLOB_BYTES` are handed to the
+    IntakeContinuation function to be processed on their own.  Notifications
+    are removed from the queue once their blobs are processed, and returned to
+    it otherwise, so each blob succeeds or fails on its own.  The notifications
+    of blobs that weren't reached before the time budget ran out are returned
+    to the queue straight away, for another invocation to pick up.
+
+    :param msg: The notification that triggered the invocation
+    """
+    logging.debug("Entering intake batch")
+    deadline = get_deadline()
+    trigger = parse_event(msg.get_body().decode("utf-8"))
+    if trigger is None:
+        logging.info("Ignoring an event that isn't the creation of an intake blob")
+        return
+
+    events = [trigger] + receive_events(
+        int(get_required_config("INTAKE_BATCH_MAX_BLOBS", "32")) - 1,
+        _get_visibility_timeout(),
+    )
+    max_blob_bytes = int(get_required_config("INTAKE_BATCH_MAX_BLOB_BYTES", "1048576"))
+
+    failed = []
+    small_events = []
+    for event in events:
+        if event.length <= max_blob_bytes:
+            small_events.append(event)
+        elif schedule_continuation(event.blob_name, 0):
+            delete_event(event)
+        else:
+            failed.append(event)
+
+    # A blob may be created more than once before its notifications are read
+    blob_names = list(dict.fromkeys(event.blob_name for event in small_events))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_DOWNLOADS) as executor:
+        blobs = [blob for blob in executor.map(_open, blob_names) if blob is not None]
+
+    results = {}
+    if blobs:
+        logging.info(f"Processing {len(blobs)} blobs together")
+        with profile_invocation(trigger.blob_name):
+            results = process_blobs(blobs, deadline)
+
+    for event in small_events:
+        if results.get(event.blob_name):
+            delete_event(event)
+        else:
+            failed.append(event)
+    for event in failed:
+        release_event(event)
+
+    if trigger in failed:
+        # Fail the invocation so the runtime delivers the notification again
+        raise RuntimeError(f"Failed to process {trigger.blob_name}")
+
+
+def _open(blob_name: str) -> Optional[BlobStream]:
+    try:
+        return open_blob(blob_name)
+    except Exception:
+        logging.exception(f"Failed to open {blob_name}")
+        return None
+
+
+def _get_visibility_timeout() -> int:
+    """
+    Keep the notifications taken with the trigger hidden from other invocations
+    until this invocation's time budget has run out, with a minute to spare.
+    """
+    budget = float(get_required_config("INTAKE_TIME_BUDGET_SECONDS", "240"))
+    return int(budget or 600) + 60
@@ -0,0 +1,23 @@
+import azure.functions as func
+import json
+import logging
+
+from IntakePipeline import process_blob
+from IntakePipeline.continuation import open_blob
+from IntakePipeline.profiling import profile_invocation
+
+
+def main(msg: func.QueueMessage) -> None:
+    """
+    This is the main entry point for the IntakeContinuation function.  It
+    receives blobs the IntakePipeline function stopped processing part way
+    through because its time budget ran out, and processes the rest of their
+    messages.  If the budget runs out again, the blob is continued once more.
+
+    :param msg: The queued blob name, along with the position of the first
+        message left to process
+    """
+    logging.debug("Entering intake continuation")
+    payload = json.loads(msg.get_body().decode("utf-8"))
+    with profile_invocation(payload["blob_name"]):
+        process_blob(open_blob(payload["blob_name"]), start=payload["offset"])
@@ -1,10 +1,50 @@
 import azure.functions as func
+import concurrent.futures
+import contextlib
+import itertools
+import json
 import logging
+import math
+import random
+import requests
+import threading
 
 from azure.core.exceptions import ResourceExistsError
+from clients import get_cred_manager, get_geocoder
 from config import get_required_config
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from IntakePipeline.breakers import CircuitBreaker, get_breaker, get_breaker_metrics
+from IntakePipeline.continuation import (
+    BlobProgress,
+    Deadline,
+    clear_checkpoint,
+    get_checkpoint,
+    get_deadline,
+    get_etag,
+    schedule_continuation,
+    store_checkpoint,
+)
+from IntakePipeline.delta import DeltaUpload, is_delta_upload_enabled
+from IntakePipeline.engine import Stage, StagedEngine
+from IntakePipeline.lanes import Lane, LaneScheduler, get_scheduler
+from IntakePipeline.memoize import get_cache_metrics
+from IntakePipeline.memory import (
+    MemoryTracker,
+    iter_batch_messages,
+    use_low_memory_mode,
+)
+from IntakePipeline.parquet_sink import ParquetSink, get_sink, is_json_output_enabled
+from IntakePipeline.profiling import profile_invocation
+from IntakePipeline.retry import (
+    is_transient_failure,
+    park_message,
+    resubmit_failed_entries,
+    schedule_retry,
+)
+from IntakePipeline.slow_messages import StageTimer, capture_slow_message
+from IntakePipeline.standardization import standardize_patients
+from IntakePipeline.validation import is_prevalidation_enabled, validate_message
 
 from phdi.azure import (
     store_data,
@@ -22,15 +62,61 @@ from phdi.conversion import (
     default_hl7_value,
 )
 
-from phdi.geo import (
-    get_smartystreets_client,
-    geocode_patients,
-)
-from phdi.standardize import (
-    standardize_patient_names,
-    standardize_all_phones,
-)
-from phdi.linkage import add_patient_identifier
+
+class MessageContext:
+    """
+    A class holding everything known about a single message as it passes
+    through the stages of the pipeline: the message itself, the settings and
+    clients used to process it, and the results of earlier stages.
+
+    :param message: The raw message to attempt conversion on
+    :param message_mappings: Dictionary having the appropriate
+        template mapping for the type of file being processed
+    :param fhir_url: The url of the FHIR server to interact with
+    :param cred_manager: The credential manager that allows us to authenticate
+        with blob storage and the FHIR server
+    :param attempt: The number of times this message has been attempted,
+        including this one
+    :param timer: A timer to record the time taken by each stage in
+    :param sink: The Parquet sink to collect the standardized bundle in, if
+        Parquet output is enabled
+    :param deadline: The time budget of the invocation, if any
+    """
+
+    def __init__(
+        self,
+        message: str,
+        message_mappings: Dict[str, str],
+        fhir_url: str,
+        cred_manager: AzureFhirServerCredentialManager,
+        attempt: int = 1,
+        timer: Optional[StageTimer] = None,
+        sink: Optional[ParquetSink] = None,
+        deadline: Optional[Deadline] = None,
+    ):
+        self.raw_message = message
+        self.message = message
+        self.message_mappings = message_mappings
+        self.fhir_url = fhir_url
+        self.cred_manager = cred_manager
+        self.attempt = attempt
+        self.timer = timer or StageTimer()
+        self.sink = sink
+        self.deadline = deadline
+
+        self.salt = get_required_config("HASH_SALT")
+        self.geocoder = get_geocoder(
+            get_required_config("SMARTYSTREETS_AUTH_ID"),
+            get_required_config("SMARTYSTREETS_AUTH_TOKEN"),
+        )
+        self.container_url = get_required_config("INTAKE_CONTAINER_URL")
+        self.valid_output_path = get_required_config("VALID_OUTPUT_CONTAINER_PATH")
+        self.invalid_output_path = get_required_config("INVALID_OUTPUT_CONTAINER_PATH")
+
+        # The converted bundle, once conversion succeeds
+        self.bundle = None
+        # The position of the message in its blob, when processed from one
+        self.index = None
 
 
 def run_pipeline(
@@ -38,14 +124,24 @@ def run_pipeline(
     message_mappings: Dict[str, str],
     fhir_url: str,
     cred_manager: AzureFhirServerCredentialManager,
+    attempt: int = 1,
+    timer: Optional[StageTimer] = None,
+    sink: Optional[ParquetSink] = None,
+    deadline: Optional[Deadline] = None,
 ) -> None:
     """
     This function takes in a single message and attempts to convert it
     to FHIR, transform and standardize it, and finally store the result
     in a given blob storage container. The function also makes an
     import upload to the FHIR server with the finalized bundle. If the
-    incoming message cannot be converted, it is stored to the configured
-    invalid blob container and no further processing is done.
+    incoming message cannot be converted or uploaded because of a transient
+    problem (eg: a timeout or a brief FHIR server outage), it is placed on
+    the retry queue for another attempt.  Otherwise, or once it has used up
+    its attempts, it is stored to the configured invalid blob container and
+    no further processing is done.
+
+    The time taken by each stage is recorded, and unusually slow messages are
+    captured to the diagnostics path so they can be replayed offline.
 
     :param message: The raw message to attempt conversion on
     :param message_mappings: Dictionary having the appropriate
@@ -53,109 +149,380 @@ def run_pipeline(
     :param fhir_url: The url of the FHIR server to interact with
     :param access_token: The token that allows us to authenticate
         with blob storage and the FHIR server
+    :param attempt: The number of times this message has been attempted,
+        including this one
+    :param timer: A timer to record the time taken by each stage in, if the
+        caller wants to inspect it
+    :param sink: The Parquet sink to collect the standardized bundle in, if
+        Parquet output is enabled
+    :param deadline: The time budget of the invocation, which bounds how long
+        failed entries of the upload are resubmitted for
     """
-    salt = get_required_config("HASH_SALT")
-    geocoder = get_smartystreets_client(
-        get_required_config("SMARTYSTREETS_AUTH_ID"),
-        get_required_config("SMARTYSTREETS_AUTH_TOKEN"),
+    context = MessageContext(
+        message,
+        message_mappings,
+        fhir_url,
+        cred_manager,
+        attempt,
+        timer,
+        sink,
+        deadline,
     )
-    container_url = get_required_config("INTAKE_CONTAINER_URL")
-    valid_output_path = get_required_config("VALID_OUTPUT_CONTAINER_PATH")
-    invalid_output_path = get_required_config("INVALID_OUTPUT_CONTAINER_PATH")
+    try:
+        for stage in (_convert, _standardize, _store, _upload):
+            if not stage(context):
+                break
+    finally:
+        _finish(context)
 
-    # Attempt conversion to FHIR
-    message = _default_fields(message=message, message_mappings=message_mappings)
 
-    convert_response = convert_message_to_fhir(
-        message=message,
-        filename=message_mappings["filename"],
-        input_data_type=message_mappings["input_data_type"],
-        root_template=message_mappings["root_template"],
-        template_collection=message_mappings["template_collection"],
-        cred_manager=cred_manager,
-        fhir_url=fhir_url,
+def _convert(context: MessageContext) -> bool:
+    """
+    Convert the message to FHIR.  If the conversion fails, the message is
+    retried or recorded as invalid, and processing stops.
+    """
+    message_mappings = context.message_mappings
+    context.message = _default_fields(
+        message=context.message, message_mappings=message_mappings
     )
 
+    # Reject structurally broken messages without a round trip to the converter
+    if is_prevalidation_enabled():
+        with context.timer.stage("validate"):
+            errors = validate_message(context.message, message_mappings)
+        if errors:
+            _store_validation_errors(context, errors)
+            return False
+
+    # Don't wait on a converter that is known to be failing
+    breaker = get_breaker("convert")
+    if not breaker.allow() and _park(context, breaker):
+        return False
+
+    try:
+        with context.timer.stage("convert"):
+            convert_response = convert_message_to_fhir(
+                message=context.message,
+                filename=message_mappings["filename"],
+                input_data_type=message_mappings["input_data_type"],
+                root_template=message_mappings["root_template"],
+                template_collection=message_mappings["template_collection"],
+                cred_manager=context.cred_manager,
+                fhir_url=context.fhir_url,
+            )
+    except requests.exceptions.RequestException:
+        logging.exception(
+            f"Conversion request failed for {message_mappings['filename']}"
+        )
+        convert_response = None
+    _record_outcome(breaker, convert_response)
+
     # TODO: Determine if we still need this code. At the moment, I believe it's
     # duplicating storage with no benefit.
 
-    # We got a valid conversion so apply desired standardizations
-    # sequentially and then add the linking identifier
     if convert_response and convert_response.status_code == 200:
-        bundle = convert_response.json()
-        standardized_bundle = standardize_patient_names(bundle)
-        standardized_bundle = standardize_all_phones(standardized_bundle)
-        standardized_bundle = geocode_patients(standardized_bundle, geocoder)
-        standardized_bundle = add_patient_identifier(standardized_bundle, salt)
+        context.bundle = convert_response.json()
+        return True
 
-        # Now store the data in the desired container
-        try:
+    # For some reason, the HL7/CCDA message failed to convert.
+    # This might be failure to communicate with the FHIR server due to
+    # access/authentication reasons, or potentially malformed timestamps
+    # in the data
+    _handle_failure(
+        message=context.message,
+        message_mappings=message_mappings,
+        response=convert_response,
+        response_suffix="convert-resp",
+        attempt=context.attempt,
+        container_url=context.container_url,
+        invalid_output_path=context.invalid_output_path,
+    )
+    return False
+
+
+def _store_validation_errors(context: MessageContext, errors: List[Dict]) -> None:
+    """
+    Record a message that failed validation in the invalid output container,
+    along with a report of the errors found.  Validation failures are never
+    transient, so the message isn't retried.
+    """
+    message_mappings = context.message_mappings
+    message_filename = (
+        f"{message_mappings['filename']}.{message_mappings['file_suffix']}"
+    )
+    logging.warning(
+        f"{message_filename} failed validation with {len(errors)} errors, "
+        + f"the first being {errors[0]}"
+    )
+    store_data(
+        container_url=context.container_url,
+        prefix=context.invalid_output_path,
+        filename=message_filename,
+        bundle_type=message_mappings["bundle_type"],
+        message=context.message,
+    )
+    store_data(
+        container_url=context.container_url,
+        prefix=context.invalid_output_path,
+        filename=f"{message_filename}.validation-resp",
+        bundle_type=message_mappings["bundle_type"],
+        message_json={"errors": errors},
+    )
+
+
+def _standardize(context: MessageContext) -> bool:
+    """
+    Apply desired standardizations to each patient in a single pass, and then
+    add the linking identifier.
+    """
+    context.bundle = standardize_patients(
+        context.bundle, context.geocoder, context.salt, context.timer
+    )
+    return True
+
+
+def _standardize_fields(context: MessageContext) -> bool:
+    """Standardize patient names and phone numbers (pipelined engine only)."""
+    context.bundle = standardize_patients(
+        context.bundle,
+        context.geocoder,
+        context.salt,
+        context.timer,
+        steps=("standardize_names", "standardize_phones"),
+    )
+    return True
+
+
+def _geocode(context: MessageContext) -> bool:
+    """Geocode patient addresses (pipelined engine only)."""
+    context.bundle = standardize_patients(
+        context.bundle,
+        context.geocoder,
+        context.salt,
+        context.timer,
+        steps=("geocode",),
+    )
+    return True
+
+
+def _link(context: MessageContext) -> bool:
+    """Add the linking identifier to patients (pipelined engine only)."""
+    context.bundle = standardize_patients(
+        context.bundle,
+        context.geocoder,
+        context.salt,
+        context.timer,
+        steps=("add_identifier",),
+    )
+    return True
+
+
+def _store(context: MessageContext) -> bool:
+    """
+    Store the standardized bundle in the valid output container, and collect
+    its resources in the Parquet sink if there is one.
+    """
+    if context.sink is not None:
+        with context.timer.stage("parquet"):
+            context.sink.add(context.bundle, context.message_mappings["filename"])
+    if not is_json_output_enabled():
+        return True
+
+    filename = f"{context.message_mappings['filename']}.fhir"
+    try:
+        with context.timer.stage("store"):
             store_data(
-                container_url,
-                valid_output_path,
-                f"{message_mappings['filename']}.fhir",
-                message_mappings["bundle_type"],
-                message_json=standardized_bundle,
+                context.container_url,
+                context.valid_output_path,
+                filename,
+                context.message_mappings["bundle_type"],
+                message_json=context.bundle,
             )
-        except ResourceExistsError:
-            logging.warning(
-                "Attempted to store preexisting resource: "
-                + f"{message_mappings['filename']}.fhir"
+    except ResourceExistsError:
+        logging.warning(f"Attempted to store preexisting resource: {filename}")
+    return True
+
+
+def _upload(context: MessageContext) -> bool:
+    """
+    Upload the standardized bundle to the FHIR server.  If the whole upload
+    fails, the message is retried or recorded as invalid.  Entries that fail
+    individually are resubmitted if they may succeed later, and recorded as
+    invalid otherwise.
+    """
+    message_mappings = context.message_mappings
+
+    # Don't wait on a FHIR server that is known to be failing
+    breaker = get_breaker("upload")
+    if not breaker.allow() and _park(context, breaker):
+        return False
+
+    upload_bundle, delta_upload = _prepare_upload(context)
+    if delta_upload and not upload_bundle.get("entry"):
+        return True
+
+    # Don't forget to import the bundle to the FHIR server as well
+    try:
+        with context.timer.stage("upload"):
+            upload_response = upload_bundle_to_fhir_server(
+                upload_bundle, context.cred_manager, context.fhir_url
             )
+    except requests.exceptions.RequestException:
+        logging.exception(f"Upload request failed for {message_mappings['filename']}")
+        upload_response = None
+    _record_outcome(breaker, upload_response)
+
+    if upload_response is None or upload_response.status_code != 200:
+        _handle_upload_failure(context, upload_response)
+        return True
+
+    # When individual transaction(s) fail in an upload batch, resubmit
+    # those that may succeed later and record error detail in the
+    # response for those that still fail
+    upload_response_json = upload_response.json()
+    with context.timer.stage("resubmit"):
+        upload_response_entries = resubmit_failed_entries(
+            upload_bundle,
+            upload_response_json.get("entry", []),
+            lambda bundle: upload_bundle_to_fhir_server(
+                bundle, context.cred_manager, context.fhir_url
+            ),
+            message_mappings["filename"],
+            context.deadline,
+        )
+    _record_entries(context, delta_upload, upload_response_entries)
+    return True
+
+
+def _prepare_upload(context: MessageContext) -> Tuple[Dict, Optional[DeltaUpload]]:
+    """
+    Build the bundle to upload for a message.  In delta upload mode, resources
+    that haven't changed since they were last uploaded are left out.
+
+    :return: The bundle to upload, and the delta upload it was built by, if any
+    """
+    if not is_delta_upload_enabled():
+        return context.bundle, None
 
-        # Don't forget to import the bundle to the FHIR server as well
-        upload_response = upload_bundle_to_fhir_server(
-            standardized_bundle, cred_manager, fhir_url
+    with context.timer.stage("delta"):
+        delta_upload = DeltaUpload(
+            context.bundle,
+            conditional=get_required_config(
+                "INTAKE_CONDITIONAL_UPLOAD", "false"
+            ).lower()
+            == "true",
         )
+    logging.info(
+        f"Skipping {delta_upload.skipped} unchanged entries of "
+        + f"{context.message_mappings['filename']}"
+    )
+    return delta_upload.upload_bundle, delta_upload
+
+
+def _handle_upload_failure(
+    context: MessageContext, upload_response: Optional[requests.Response]
+) -> None:
+    """Retry or record a message when the entire upload batch request fails."""
+    _handle_failure(
+        message=context.message,
+        message_mappings=context.message_mappings,
+        response=upload_response,
+        response_suffix="upload-resp",
+        attempt=context.attempt,
+        container_url=context.container_url,
+        invalid_output_path=context.invalid_output_path,
+    )
+
+
+def _record_entries(
+    context: MessageContext,
+    delta_upload: Optional[DeltaUpload],
+    upload_response_entries: List[Dict],
+) -> None:
+    """
+    Record the outcome of each uploaded entry of a message, storing the error
+    detail of entries that still failed after being resubmitted.
 
-        if upload_response.status_code != 200:
-            # Record when the entire upload batch request fails
-            store_message_and_response(
-                container_url=container_url,
-                prefix=invalid_output_path,
-                message_filename=f"{message_mappings['filename']}"
+    :param context: The message whose entries were uploaded
+    :param delta_upload: The delta upload the uploaded bundle was built by, if any
+    :param upload_response_entries: The final response for every uploaded entry
+    """
+    message_mappings = context.message_mappings
+    if delta_upload:
+        delta_upload.record({"entry": upload_response_entries})
+
+    for upload_index, entry in enumerate(upload_response_entries):
+        # Failures are recorded against their index in the full bundle
+        entry_index = (
+            delta_upload.indexes[upload_index] if delta_upload else upload_index
+        )
+        # FHIR bundle.entry.response.status is string type - integer status code
+        # plus may inlude a message
+        if not entry.get("response", {}).get("status", "").startswith("200"):
+            store_data(
+                container_url=context.container_url,
+                prefix=context.invalid_output_path,
+                filename=f"{message_mappings['filename']}.entry-{entry_index}"
                 + f".{message_mappings['file_suffix']}",
-                response_filename=f"{message_mappings['filename']}"
-                + f".{message_mappings['file_suffix']}.upload-resp",
                 bundle_type=message_mappings["bundle_type"],
-                message=message,
-                response=upload_response,
+                message_json={"entry_index": entry_index, "entry": entry},
             )
-        else:
-            # When individual transaction(s) fail in an upload batch,
-            # record error detail in the response
-            upload_response_json = upload_response.json()
-            upload_response_entries = upload_response_json.get("entry", [])
-
-            for entry_index, entry in enumerate(upload_response_entries):
-                # FHIR bundle.entry.response.status is string type - integer status code
-                # plus may inlude a message
-                if not entry.get("response", {}).get("status", "").startswith("200"):
-                    store_data(
-                        container_url=container_url,
-                        prefix=invalid_output_path,
-                        filename=f"{message_mappings['filename']}.entry-{entry_index}"
-                        + f".{message_mappings['file_suffix']}",
-                        bundle_type=message_mappings["bundle_type"],
-                        message_json={"entry_index": entry_index, "entry": entry},
-                    )
 
-    # For some reason, the HL7/CCDA message failed to convert.
-    # This might be failure to communicate with the FHIR server due to
-    # access/authentication reasons, or potentially malformed timestamps
-    # in the data
+
+def _park(context: MessageContext, breaker: CircuitBreaker) -> bool:
+    """
+    Defer a message while the circuit breaker of a dependency it needs is open,
+    without using up one of its attempts.  Parked messages are spread over the
+    breaker's open period, so they don't all return the moment it closes.  If
+    the message can't be parked, it is processed anyway.
+    """
+    delay = math.ceil(breaker.retry_after()) + random.randint(
+        0, math.ceil(breaker.open_seconds)
+    )
+    return park_message(
+        context.message, context.message_mappings, context.attempt, delay
+    )
+
+
+def _record_outcome(
+    breaker: CircuitBreaker, response: Optional[requests.Response]
+) -> None:
+    """
+    Record the outcome of a call in the dependency's circuit breaker.  Only
+    failures that are the dependency's fault count against it.
+    """
+    if is_transient_failure(response):
+        breaker.record_failure()
     else:
-        store_message_and_response(
-            container_url=container_url,
-            prefix=invalid_output_path,
-            message_filename=f"{message_mappings['filename']}"
-            + f".{message_mappings['file_suffix']}",
-            response_filename=f"{message_mappings['filename']}"
-            + f".{message_mappings['file_suffix']}.convert-resp",
-            bundle_type=message_mappings["bundle_type"],
-            message=message,
-            response=convert_response,
-        )
+        breaker.record_success()
+
+
+def _finish(context: MessageContext) -> None:
+    """Capture the message for offline replay if it was unusually slow."""
+    capture_slow_message(
+        context.raw_message, context.message_mappings, context.timer, context.attempt
+    )
+
+
+# The stages of the pipelined engine, in order
+PIPELINED_STAGES = [
+    ("convert", _convert),
+    ("standardize", _standardize_fields),
+    ("geocode", _geocode),
+    ("link", _link),
+    ("store", _store),
+    ("upload", _upload),
+]
+
+# Stages that wait on a remote service get more workers by default
+DEFAULT_STAGE_CONCURRENCY = {
+    "convert": 4,
+    "standardize": 1,
+    "geocode": 4,
+    "link": 1,
+    "store": 2,
+    "upload": 4,
+}
 
 
 def main(blob: func.InputStream) -> None:
@@ -165,27 +532,665 @@ def main(blob: func.InputStream) -> None:
     into a list of individual messages.  Each individual message is passed to the
     processing pipeline.
 
+    The blob is assigned to a priority lane based on its file type, name and
+    size, and its messages are processed concurrently within that lane's share
+    of the worker's capacity, so bulk loads cannot starve real-time feeds.
+
+    Blobs larger than the low-memory threshold are instead split while they
+    are read and their messages processed one at a time, so that only a single
+    message and its bundle are held in memory.  The memory used for every blob
+    is reported along with its size and message count.
+
+    With `INTAKE_PIPELINED` enabled, messages are instead sent through a
+    pipelined engine in which every stage has its own workers, connected by
+    bounded queues, so each stage works on one message while the next stage
+    works on another.
+
+    Progress through the blob is checkpointed as messages finish.  Once the
+    invocation's time budget (`INTAKE_TIME_BUDGET_SECONDS`) runs out, no more
+    messages are started, and the rest of the blob is handed to the
+    IntakeContinuation function through the continuation queue, so a large blob
+    is never cut off by the function timeout part way through.
+
+    A fraction of invocations (`INTAKE_PROFILE_SAMPLE_RATE`) are profiled, and
+    their profiles stored to the diagnostics path.
+
     :param blob: The HL7 message to be processed
     """
+    with profile_invocation(blob.name):
+        process_blob(blob)
+
+
+def process_blob(
+    blob: func.InputStream, start: int = 0, deadline: Optional[Deadline] = None
+) -> bool:
+    """
+    Send the messages of a blob down the pipeline, as described for `main`,
+    skipping those before `start` and any an earlier invocation checkpointed.
+
+    :param blob: The blob to be processed
+    :param start: The position of the first message to process
+    :param deadline: The time budget of the blob (default = the invocation's
+        time budget).  A `Deadline(0)` never runs out, so the whole blob is
+        processed without handing any of it to the IntakeContinuation function.
+    :return: True if the blob was processed, False if an error stopped it
+    """
     # Set up logging, retrieve configuration variables
     logging.debug("Entering intake pipeline ")
     fhir_url = get_required_config("FHIR_URL")
-    cred_manager = AzureFhirServerCredentialManager(fhir_url)
+    cred_manager = get_cred_manager(fhir_url)
+    scheduler = get_scheduler()
+    memory_tracker = MemoryTracker(blob.name, blob.length)
+    if deadline is None:
+        deadline = get_deadline()
+    sink = get_sink()
+    processed = False
 
     try:
-        # VA sends \\u000b & \\u001c in real data, ignore for now
-        messages = convert_batch_messages_to_list(
-            blob.read().decode("utf-8", errors="ignore")
-        )
-
         # Once we have the file type mappings, run through all
         # messages in the blob and send them down the pipeline
         message_mappings = get_file_type_mappings(blob.name)
-        for i, message in enumerate(messages):
-            message_mappings["filename"] = generate_filename(blob.name, i)
-            run_pipeline(message, message_mappings, fhir_url, cred_manager)
+        lane = scheduler.classify(blob.name, blob.length, message_mappings)
+
+        etag = get_etag(blob)
+        start = max(start, get_checkpoint(blob.name, blob.length, etag))
+        if start:
+            logging.info(f"Resuming {blob.name} from message {start}")
+        progress = BlobProgress(
+            blob.name,
+            blob.length,
+            start,
+            int(get_required_config("INTAKE_CHECKPOINT_INTERVAL", "50")),
+            etag,
+        )
+
+        if use_low_memory_mode(blob.length):
+            logging.warning(
+                f"Processing {blob.name} ({blob.length} bytes) in low-memory mode "
+                + f"in the {lane.name} lane"
+            )
+            memory_tracker.low_memory_mode = True
+            with memory_tracker.stage("process"):
+                # VA sends \\u000b & \\u001c in real data, ignore for now
+                messages = itertools.islice(
+                    enumerate(iter_batch_messages(blob)), start, None
+                )
+                for i, message in progress.until(messages, deadline):
+                    _run_in_lane(
+                        scheduler,
+                        lane,
+                        message,
+                        {
+                            **message_mappings,
+                            "filename": generate_filename(blob.name, i),
+                        },
+                        fhir_url,
+                        cred_manager,
+                        sink,
+                        deadline,
+                    )
+                    progress.complete(i)
+                    memory_tracker.message_count += 1
+        else:
+            with memory_tracker.stage("split"):
+                # VA sends \\u000b & \\u001c in real data, ignore for now
+                messages = convert_batch_messages_to_list(
+                    blob.read().decode("utf-8", errors="ignore")
+                )
+            memory_tracker.message_count = len(messages)
+            logging.info(
+                f"Processing {len(messages)} messages from {blob.name} "
+                + f"in the {lane.name} lane"
+            )
+
+            with memory_tracker.stage("process"):
+                runner = _run_pipelined if is_pipelined() else _run_concurrently
+                runner(
+                    scheduler,
+                    lane,
+                    progress.until(
+                        itertools.islice(enumerate(messages), start, None), deadline
+                    ),
+                    progress,
+                    blob.name,
+                    message_mappings,
+                    fhir_url,
+                    cred_manager,
+                    sink,
+                    deadline,
+                )
+
+        processed = True
+
+        logging.info(f"Lane metrics: {json.dumps(scheduler.get_metrics())}")
+        logging.info(f"Circuit breakers: {json.dumps(get_breaker_metrics())}")
+        logging.info(f"Normalizer caches: {json.dumps(get_cache_metrics())}")
+    except MemoryError:
+        logging.exception(
+            f"Ran out of memory during IntakePipeline processing of {blob.name}: "
+            + json.dumps(memory_tracker.report())
+        )
+    except Exception:
+        logging.exception("Exception occurred during IntakePipeline processing.")
+    finally:
+        # Write the rest of the blob's resources before it counts as processed
+        if sink is not None:
+            sink.close()
+        memory_tracker.stop()
+        logging.info(f"Memory usage: {json.dumps(memory_tracker.report())}")
+
+    if processed and not _continue_or_clear(blob, progress):
+        # Fail the invocation so the rest of the blob is picked up from its
+        # checkpoint when the trigger retries
+        raise RuntimeError(f"Failed to continue processing {blob.name}")
+    return processed
+
+
+def _continue_or_clear(blob: func.InputStream, progress: BlobProgress) -> bool:
+    """
+    Once no more messages of a blob will be started, either hand the rest of
+    the blob to the IntakeContinuation function if the deadline stopped it
+    early, or remove its checkpoint if every message was processed.
+
+    :return: False if the rest of the blob couldn't be handed over
+    """
+    if progress.stopped_at is None:
+        if progress.checkpointed:
+            clear_checkpoint(blob.name)
+        return True
+
+    # Every message before the one it stopped at has finished by now
+    logging.warning(
+        f"Time budget ran out processing {blob.name}, continuing from message "
+        + f"{progress.stopped_at}"
+    )
+    store_checkpoint(blob.name, blob.length, progress.stopped_at, progress.etag)
+    return schedule_continuation(blob.name, progress.stopped_at)
+
+
+def is_pipelined() -> bool:
+    """Determine whether messages should be sent through the pipelined engine."""
+    return get_required_config("INTAKE_PIPELINED", "false").lower() == "true"
+
+
+def _run_concurrently(
+    scheduler: LaneScheduler,
+    lane: Lane,
+    messages: Iterable[Tuple[int, str]],
+    progress: BlobProgress,
+    blob_name: str,
+    message_mappings: Dict[str, str],
+    fhir_url: str,
+    cred_manager: AzureFhirServerCredentialManager,
+    sink: Optional[ParquetSink] = None,
+    deadline: Optional[Deadline] = None,
+) -> None:
+    """
+    Send each message down the pipeline in its own thread, up to the lane's
+    concurrency limit.  The next message isn't read until one of those in
+    flight finishes, so the deadline is checked as messages finish rather than
+    all at once before the first one does.
+    """
+    in_flight = threading.Semaphore(lane.max_concurrency)
+    messages = iter(messages)
+
+    def done(i: int) -> None:
+        in_flight.release()
+        progress.complete(i)
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=lane.max_concurrency
+    ) as executor:
+        while in_flight.acquire():
+            next_message = next(messages, None)
+            if next_message is None:
+                break
+            i, message = next_message
+            executor.submit(
+                _run_in_lane,
+                scheduler,
+                lane,
+                message,
+                {**message_mappings, "filename": generate_filename(blob_name, i)},
+                fhir_url,
+                cred_manager,
+                sink,
+                deadline,
+            ).add_done_callback(lambda _, i=i: done(i))
+
+
+def _run_pipelined(
+    scheduler: LaneScheduler,
+    lane: Lane,
+    messages: Iterable[Tuple[int, str]],
+    progress: BlobProgress,
+    blob_name: str,
+    message_mappings: Dict[str, str],
+    fhir_url: str,
+    cred_manager: AzureFhirServerCredentialManager,
+    sink: Optional[ParquetSink] = None,
+    deadline: Optional[Deadline] = None,
+) -> None:
+    """
+    Send messages through the pipelined engine.  Each stage has its own number
+    of workers (`INTAKE_STAGE_CONCURRENCY`) and at most
+    `INTAKE_STAGE_QUEUE_SIZE` messages wait in front of it.  A message holds a
+    slot in its lane from when it enters the engine until it leaves, so the
+    lane still limits the number of its messages in flight.
+    """
+    concurrency = {
+        **DEFAULT_STAGE_CONCURRENCY,
+        **json.loads(get_required_config("INTAKE_STAGE_CONCURRENCY", "{}")),
+    }
+    stages = [Stage(name, fn, int(concurrency[name])) for name, fn in PIPELINED_STAGES]
+
+    def complete(context: MessageContext) -> None:
+        scheduler.release(lane)
+        _finish(context)
+        progress.complete(context.index)
+
+    engine = StagedEngine(
+        stages,
+        queue_size=int(get_required_config("INTAKE_STAGE_QUEUE_SIZE", "16")),
+        on_complete=complete,
+    )
+    with engine:
+        for i, message in messages:
+            scheduler.acquire(lane)
+            try:
+                context = MessageContext(
+                    message,
+                    {**message_mappings, "filename": generate_filename(blob_name, i)},
+                    fhir_url,
+                    cred_manager,
+                    sink=sink,
+                    deadline=deadline,
+                )
+            except Exception:
+                scheduler.release(lane)
+                logging.exception(
+                    f"Exception occurred while preparing message {i} of {blob_name}."
+                )
+                progress.complete(i)
+                continue
+            context.index = i
+            engine.submit(context)
+
+    logging.info(f"Stage metrics: {json.dumps(engine.get_metrics())}")
+
+
+def _run_in_lane(
+    scheduler: LaneScheduler,
+    lane: Lane,
+    message: str,
+    message_mappings: Dict[str, str],
+    fhir_url: str,
+    cred_manager: AzureFhirServerCredentialManager,
+    sink: Optional[ParquetSink] = None,
+    deadline: Optional[Deadline] = None,
+) -> None:
+    """
+    Wait for a processing slot in the given lane, then send a single message
+    down the pipeline.  Failures are logged per message so one bad message
+    doesn't stop the rest of the blob.
+    """
+    try:
+        with scheduler.slot(lane) as wait_time:
+            logging.debug(
+                f"Waited {wait_time:.3f}s in the {lane.name} lane "
+                + f"for {message_mappings['filename']}"
+            )
+            run_pipeline(
+                message,
+                message_mappings,
+                fhir_url,
+                cred_manager,
+                sink=sink,
+                deadline=deadline,
+            )
+    except Exception:
+        logging.exception(
+            f"Exception occurred while processing {message_mappings['filename']}."
+        )
+
+
+def process_blobs(
+    blobs: Iterable[func.InputStream], deadline: Optional[Deadline] = None
+) -> Dict[str, bool]:
+    """
+    Send the messages of many small blobs down the pipeline together, in one
+    invocation.  The blobs share the settings, clients and Parquet sink of a
+    single blob, and their standardized bundles are uploaded to the FHIR server
+    in combined batches of up to `INTAKE_BATCH_MAX_ENTRIES` entries, rather than
+    one upload per message.  Each message is still converted, standardized and
+    stored on its own, and the response to each uploaded entry is recorded
+    against the message it came from, so messages fail, retry and are
+    dead-lettered individually, as they are for `process_blob`.
+
+    Blobs are read whole, so large blobs should go through `process_blob`, which
+    can continue them past the time budget.  Blobs are read as messages finish,
+    at most the scheduler's concurrency limit in flight, and once the time
+    budget runs out no more blobs are read.
+
+    :param blobs: The blobs to be processed
+    :param deadline: The time budget of the invocation (default = the
+        invocation's time budget)
+    :return: Dictionary mapping the name of each blob to whether its messages
+        were sent down the pipeline.  Blobs that couldn't be read or split are
+        False, and blobs missing from the result weren't reached.
+    """
+    logging.debug("Entering intake pipeline for a batch of blobs")
+    fhir_url = get_required_config("FHIR_URL")
+    cred_manager = get_cred_manager(fhir_url)
+    scheduler = get_scheduler()
+    sink = get_sink()
+    max_entries = int(get_required_config("INTAKE_BATCH_MAX_ENTRIES", "500"))
+    if deadline is None:
+        deadline = get_deadline()
+    in_flight = threading.Semaphore(scheduler.max_concurrency)
+    results = {}
+    prepared = []
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=scheduler.max_concurrency
+        ) as executor:
+            futures = []
+            for blob in blobs:
+                if deadline.expired():
+                    logging.warning(
+                        f"Time budget ran out after reading {len(results)} blobs"
+                    )
+                    break
+                try:
+                    message_mappings = get_file_type_mappings(blob.name)
+                    lane = scheduler.classify(blob.name, blob.length, message_mappings)
+                    # VA sends \\u000b & \\u001c in real data, ignore for now
+                    messages = convert_batch_messages_to_list(
+                        blob.read().decode("utf-8", errors="ignore")
+                    )
+                except Exception:
+                    logging.exception(f"Exception occurred while reading {blob.name}.")
+                    results[blob.name] = False
+                    continue
+
+                results[blob.name] = True
+                for i, message in enumerate(messages):
+                    in_flight.acquire()
+                    future = executor.submit(
+                        _prepare_in_lane,
+                        scheduler,
+                        lane,
+                        message,
+                        {
+                            **message_mappings,
+                            "filename": generate_filename(blob.name, i),
+                        },
+                        fhir_url,
+                        cred_manager,
+                        sink,
+                        deadline,
+                    )
+                    future.add_done_callback(lambda _: in_flight.release())
+                    futures.append(future)
+            prepared = [future.result() for future in futures]
+
+        logging.info(
+            f"Uploading {sum(ready for _, ready in prepared)} of {len(prepared)} "
+            + f"messages from {len(results)} blobs together"
+        )
+        _upload_together(
+            [context for context, ready in prepared if ready], max_entries, deadline
+        )
+
+        logging.info(f"Lane metrics: {json.dumps(scheduler.get_metrics())}")
+        logging.info(f"Circuit breakers: {json.dumps(get_breaker_metrics())}")
+        logging.info(f"Normalizer caches: {json.dumps(get_cache_metrics())}")
     except Exception:
         logging.exception("Exception occurred during IntakePipeline processing.")
+        results = {name: False for name in results}
+    finally:
+        for context, _ in prepared:
+            if context is not None:
+                _finish(context)
+        # Write the rest of the blobs' resources before they count as processed
+        if sink is not None:
+            sink.close()
+
+    return results
+
+
+def _prepare_in_lane(
+    scheduler: LaneScheduler,
+    lane: Lane,
+    message: str,
+    message_mappings: Dict[str, str],
+    fhir_url: str,
+    cred_manager: AzureFhirServerCredentialManager,
+    sink: Optional[ParquetSink] = None,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[Optional[MessageContext], bool]:
+    """
+    Wait for a processing slot in the given lane, then send a single message
+    through every stage of the pipeline but the upload, which is combined with
+    other messages' uploads.  Failures are logged per message so one bad message
+    doesn't stop the rest of the batch.
+
+    :return: The message's context, unless it couldn't be created, and whether
+        the message is ready to upload
+    """
+    context = None
+    try:
+        with scheduler.slot(lane):
+            context = MessageContext(
+                message,
+                message_mappings,
+                fhir_url,
+                cred_manager,
+                sink=sink,
+                deadline=deadline,
+            )
+            for stage in (_convert, _standardize, _store):
+                if not stage(context):
+                    return context, False
+            return context, True
+    except Exception:
+        logging.exception(
+            f"Exception occurred while processing {message_mappings['filename']}."
+        )
+        return context, False
+
+
+def _upload_together(
+    contexts: List[MessageContext],
+    max_entries: int,
+    deadline: Optional[Deadline] = None,
+) -> None:
+    """
+    Upload the standardized bundles of many messages in combined batch bundles
+    of at most `max_entries` entries.  Bundles that aren't of type `batch` (eg:
+    transactions, which must succeed or fail as a whole) and bundles with more
+    than `max_entries` entries are uploaded on their own.
+
+    :param contexts: The messages ready to upload
+    :param max_entries: The most entries in a combined upload
+    :param deadline: The time budget of the invocation, if any
+    """
+    batches = []
+    current = []
+    current_entries = 0
+    for context in contexts:
+        try:
+            upload_bundle, delta_upload = _prepare_upload(context)
+        except Exception:
+            logging.exception(
+                "Exception occurred while preparing the upload of "
+                + f"{context.message_mappings['filename']}."
+            )
+            continue
+        if delta_upload and not upload_bundle.get("entry"):
+            continue
+
+        entries = len(upload_bundle.get("entry", []))
+        combinable = upload_bundle.get("type") == "batch"
+        if current and (not combinable or current_entries + entries > max_entries):
+            batches.append(current)
+            current = []
+            current_entries = 0
+        current.append((context, upload_bundle, delta_upload))
+        current_entries += entries
+        if not combinable:
+            batches.append(current)
+            current = []
+            current_entries = 0
+    if current:
+        batches.append(current)
+
+    # Don't wait on a FHIR server that is known to be failing
+    breaker = get_breaker("upload")
+    for batch in batches:
+        if not breaker.allow():
+            batch = [item for item in batch if not _park(item[0], breaker)]
+        if batch:
+            _upload_batch(batch, breaker, deadline)
+
+
+def _upload_batch(
+    batch: List[Tuple[MessageContext, Dict, Optional[DeltaUpload]]],
+    breaker: CircuitBreaker,
+    deadline: Optional[Deadline] = None,
+) -> None:
+    """
+    Upload the bundles of several messages as a single batch bundle, then split
+    the response entries between the messages.  If the whole upload fails,
+    every message in it is retried or recorded as invalid.
+    """
+    contexts = [context for context, _, _ in batch]
+    upload_bundle = {
+        **batch[0][1],
+        "entry": [entry for _, bundle, _ in batch for entry in bundle.get("entry", [])],
+    }
+    description = (
+        contexts[0].message_mappings["filename"]
+        if len(contexts) == 1
+        else f"a batch of {len(contexts)} messages"
+    )
+
+    def upload(bundle: Dict) -> requests.Response:
+        return upload_bundle_to_fhir_server(
+            bundle, contexts[0].cred_manager, contexts[0].fhir_url
+        )
+
+    try:
+        with _stage_for_all(contexts, "upload"):
+            upload_response = upload(upload_bundle)
+    except requests.exceptions.RequestException:
+        logging.exception(f"Upload request failed for {description}")
+        upload_response = None
+    _record_outcome(breaker, upload_response)
+
+    if upload_response is None or upload_response.status_code != 200:
+        for context in contexts:
+            _handle_upload_failure(context, upload_response)
+        return
+
+    with _stage_for_all(contexts, "resubmit"):
+        upload_response_entries = resubmit_failed_entries(
+            upload_bundle,
+            upload_response.json().get("entry", []),
+            upload,
+            description,
+            deadline,
+        )
+
+    start = 0
+    for context, bundle, delta_upload in batch:
+        end = start + len(bundle.get("entry", []))
+        _record_entries(context, delta_upload, upload_response_entries[start:end])
+        start = end
+
+
+@contextlib.contextmanager
+def _stage_for_all(contexts: List[MessageContext], name: str) -> Iterator[None]:
+    """Time a stage shared by several messages in each message's timer."""
+    with contextlib.ExitStack() as stack:
+        for context in contexts:
+            stack.enter_context(context.timer.stage(name))
+        yield
+
+
+def warm_up() -> None:
+    """
+    Prepare a newly started worker to process messages: build the FHIR server
+    credential manager and the geocoding client, and obtain an access token,
+    so the first blob after a scale-out doesn't pay for that setup.
+    """
+    fhir_url = get_required_config("FHIR_URL")
+    get_cred_manager(fhir_url).get_access_token()
+    get_geocoder(
+        get_required_config("SMARTYSTREETS_AUTH_ID"),
+        get_required_config("SMARTYSTREETS_AUTH_TOKEN"),
+    )
+
+
+def _handle_failure(
+    message: str,
+    message_mappings: Dict[str, str],
+    response: Optional[requests.Response],
+    response_suffix: str,
+    attempt: int,
+    container_url: str,
+    invalid_output_path: str,
+) -> None:
+    """
+    Route a message that failed to convert or upload.  Transient failures are
+    placed on the retry queue.  Permanent failures, and messages that have used
+    up their attempts, are dead-lettered to the invalid output container along
+    with the response that explains the failure.
+
+    :param message: The raw message
+    :param message_mappings: Dictionary having the appropriate
+        template mapping for the type of file being processed
+    :param response: The failed response, or None if no response was received
+    :param response_suffix: Suffix for the stored response filename
+    :param attempt: The number of times this message has been attempted
+    :param container_url: The url of the container to store failures in
+    :param invalid_output_path: The prefix within the container for failures
+    """
+    if is_transient_failure(response) and schedule_retry(
+        message, message_mappings, attempt
+    ):
+        return
+
+    message_filename = (
+        f"{message_mappings['filename']}.{message_mappings['file_suffix']}"
+    )
+    if response is None:
+        # The request never completed, so there is no response to record
+        store_data(
+            container_url=container_url,
+            prefix=invalid_output_path,
+            filename=message_filename,
+            bundle_type=message_mappings["bundle_type"],
+            message=message,
+        )
+        store_data(
+            container_url=container_url,
+            prefix=invalid_output_path,
+            filename=f"{message_filename}.{response_suffix}",
+            bundle_type=message_mappings["bundle_type"],
+            message_json={"error": "No response received from the FHIR server"},
+        )
+    else:
+        store_message_and_response(
+            container_url=container_url,
+            prefix=invalid_output_path,
+            message_filename=message_filename,
+            response_filename=f"{message_filename}.{response_suffix}",
+            bundle_type=message_mappings["bundle_type"],
+            message=message,
+            response=response,
+        )
 
 
 def _default_fields(message: str, message_mappings: Dict[str, str]) -> str:
@@ -0,0 +1,172 @@
+import json
+import logging
+
+from azure.core.exceptions import ResourceExistsError
+from config import get_required_config
+from typing import List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient, QueueMessage
+
+BLOB_EVENTS_QUEUE_NAME = "intake-blob-events"
+POISON_QUEUE_NAME = f"{BLOB_EVENTS_QUEUE_NAME}-poison"
+BLOB_CREATED = "Microsoft.Storage.BlobCreated"
+
+# The blobs the IntakePipeline blob trigger processes
+INTAKE_BLOB_PREFIX = "bronze/decrypted/"
+
+# The number of times the Functions runtime delivers a queue message before
+# moving it to the poison queue, which events received alongside the trigger
+# follow too
+MAX_DEQUEUE_COUNT = 5
+
+_queue_clients = {}
+
+
+class BlobEvent:
+    """
+    A blob-created notification, as delivered by Event Grid.
+
+    :param blob_name: The name of the blob, including its container, as passed
+        to the blob trigger (eg: `bronze/decrypted/VXU/some-file.hl7`)
+    :param length: The size of the blob, in bytes
+    :param message: The queue message the event was received in, unless it was
+        the message that triggered the invocation
+    """
+
+    def __init__(
+        self, blob_name: str, length: int, message: Optional["QueueMessage"] = None
+    ):
+        self.blob_name = blob_name
+        self.length = length
+        self.message = message
+
+
+def parse_event(body: str) -> Optional[BlobEvent]:
+    """
+    Read the blob an Event Grid notification is about, if it is the creation of
+    a blob the intake pipeline processes.
+
+    :param body: The Event Grid event, as JSON
+    :return: The event, or None if it should be ignored
+    """
+    try:
+        event = json.loads(body)
+        if event.get("eventType") != BLOB_CREATED:
+            return None
+        # eg: /blobServices/default/containers/bronze/blobs/decrypted/VXU/a.hl7
+        container, name = (
+            event["subject"].split("/containers/", 1)[1].split("/blobs/", 1)
+        )
+    except (ValueError, KeyError, IndexError, AttributeError):
+        logging.warning(f"Ignoring malformed blob event: {body[:200]}")
+        return None
+
+    blob_name = f"{container}/{name}"
+    if not blob_name.startswith(INTAKE_BLOB_PREFIX):
+        return None
+    return BlobEvent(blob_name, int(event.get("data", {}).get("contentLength", 0)))
+
+
+def receive_events(max_events: int, visibility_timeout: int) -> List[BlobEvent]:
+    """
+    Receive more blob-created notifications waiting on the queue, to process
+    along with the one that triggered the invocation.  The notifications stay
+    invisible to other invocations for `visibility_timeout` seconds, and must be
+    deleted once their blobs are processed, or released.  Notifications that
+    aren't about intake blobs are deleted straight away.  Failures to receive
+    are logged, since the triggering notification can still be processed alone.
+
+    :param max_events: The most notifications to receive
+    :param visibility_timeout: The seconds the notifications stay invisible
+    """
+    if max_events <= 0:
+        return []
+
+    events = []
+    try:
+        queue_client = _get_queue_client(BLOB_EVENTS_QUEUE_NAME)
+        for message in queue_client.receive_messages(
+            messages_per_page=min(max_events, 32),
+            max_messages=max_events,
+            visibility_timeout=visibility_timeout,
+        ):
+            event = parse_event(message.content)
+            if event is None:
+                queue_client.delete_message(message)
+                continue
+            event.message = message
+            events.append(event)
+    except Exception:
+        logging.exception("Failed to receive blob events")
+    return events
+
+
+def delete_event(event: BlobEvent) -> None:
+    """
+    Remove a received notification from the queue, once its blob has been
+    processed.  The triggering notification is removed by the Functions
+    runtime instead.
+    """
+    if event.message is None:
+        return
+    try:
+        _get_queue_client(BLOB_EVENTS_QUEUE_NAME).delete_message(event.message)
+    except Exception:
+        # The blob may be processed again once the notification reappears
+        logging.exception(f"Failed to delete the blob event for {event.blob_name}")
+
+
+def release_event(event: BlobEvent) -> None:
+    """
+    Return a received notification whose blob wasn't processed to the queue,
+    so another invocation can process it.  After `MAX_DEQUEUE_COUNT` deliveries,
+    it is moved to the poison queue instead, as the Functions runtime does for
+    triggering notifications.
+    """
+    if event.message is None:
+        return
+    try:
+        queue_client = _get_queue_client(BLOB_EVENTS_QUEUE_NAME)
+        if event.message.dequeue_count >= MAX_DEQUEUE_COUNT:
+            logging.error(
+                f"Moving the blob event for {event.blob_name} to {POISON_QUEUE_NAME} "
+                + f"after {event.message.dequeue_count} attempts"
+            )
+            _get_queue_client(POISON_QUEUE_NAME).send_message(event.message.content)
+            queue_client.delete_message(event.message)
+        else:
+            queue_client.update_message(event.message, visibility_timeout=0)
+    except Exception:
+        # Left alone, the notification reappears once its visibility times out
+        logging.exception(f"Failed to release the blob event for {event.blob_name}")
+
+
+def _get_queue_client(queue_name: str) -> "QueueClient":
+    """
+    Lazily build the client for a queue in the storage account the function
+    app's triggers use, accessed using the function app's managed identity.
+    Event Grid and the Functions runtime encode messages as base64, so the
+    client does too.  The queue is created on first use.
+    """
+    if queue_name not in _queue_clients:
+        from azure.identity import DefaultAzureCredential
+        from azure.storage.queue import (
+            QueueClient,
+            TextBase64DecodePolicy,
+            TextBase64EncodePolicy,
+        )
+
+        queue_client = QueueClient(
+            account_url=get_required_config("AzureWebJobsStorage__queueServiceUri"),
+            queue_name=queue_name,
+            credential=DefaultAzureCredential(),
+            message_encode_policy=TextBase64EncodePolicy(),
+            message_decode_policy=TextBase64DecodePolicy(),
+        )
+        try:
+            queue_client.create_queue()
+        except ResourceExistsError:
+            pass
+        _queue_clients[queue_name] = queue_client
+    return _queue_clients[queue_name]
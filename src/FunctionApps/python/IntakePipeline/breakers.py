@@ -0,0 +1,174 @@
+import collections
+import logging
+import threading
+import time
+
+from config import get_required_config
+from typing import Callable, Dict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitBreaker:
+    """
+    A class tracking the recent outcomes of calls to a remote dependency, so
+    calls can fail fast while the dependency is down rather than each waiting
+    for its own timeout.
+
+    The breaker starts closed, letting every call through.  Once at least
+    `min_calls` of the last `window_size` calls have been recorded and the
+    fraction that failed reaches `error_rate`, it opens, and no calls are let
+    through for `open_seconds`.  After that it is half open: a single probe call
+    is let through, and the breaker closes if the probe succeeds or opens again
+    if it fails.
+
+    :param name: The name of the dependency, for logging
+    :param error_rate: The fraction of failed calls, between 0 and 1, at which
+        the breaker opens
+    :param min_calls: The fewest recorded calls the error rate is judged on
+    :param window_size: The number of most recent calls the error rate is
+        computed over
+    :param open_seconds: How long the breaker stays open before probing
+    :param clock: A function returning the current time, in seconds
+    """
+
+    def __init__(
+        self,
+        name: str,
+        error_rate: float = 0.5,
+        min_calls: int = 10,
+        window_size: int = 20,
+        open_seconds: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._clock = clock
+        self._outcomes = collections.deque(maxlen=window_size)
+        self._opened_at = None
+        # When the current half-open probe was let through, if there is one
+        self._probe_started = None
+        self._opened = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Determine whether a call may be made now."""
+        with self._lock:
+            now = self._clock()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    self._rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probe_started = None
+
+            # A probe whose outcome was never recorded doesn't block the breaker
+            # for good
+            if (
+                self._probe_started is not None
+                and now - self._probe_started < self.open_seconds
+            ):
+                self._rejected += 1
+                return False
+            self._probe_started = now
+            return True
+
+    def record_success(self) -> None:
+        """Record that a call succeeded."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                logging.info(f"Circuit breaker for {self.name} closed")
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._probe_started = None
+            self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        """Record that a call failed because of the dependency."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.error_rate:
+                    self._open()
+
+    def retry_after(self) -> float:
+        """The number of seconds until the breaker next lets a probe through."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0
+            return max(self.open_seconds - (self._clock() - self._opened_at), 0)
+
+    def get_metrics(self) -> Dict:
+        """Report the state of the breaker and how often it has tripped."""
+        with self._lock:
+            return {
+                "state": self.state,
+                "opened": self._opened,
+                "rejected": self._rejected,
+                "recent_failures": self._outcomes.count(False),
+                "recent_calls": len(self._outcomes),
+            }
+
+    def _open(self) -> None:
+        logging.warning(
+            f"Circuit breaker for {self.name} opened for {self.open_seconds} seconds"
+        )
+        self.state = OPEN
+        self._opened_at = self._clock()
+        self._probe_started = None
+        self._opened += 1
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker of a dependency, creating it on first use.  Breakers
+    are shared by every invocation in the worker process, so one blob's failures
+    protect the next.
+
+    :param name: The name of the dependency (eg: `convert`, `upload` or
+        `geocode`)
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                error_rate=float(
+                    get_required_config("CIRCUIT_BREAKER_ERROR_RATE", "0.5")
+                ),
+                min_calls=int(get_required_config("CIRCUIT_BREAKER_MIN_CALLS", "10")),
+                window_size=int(
+                    get_required_config("CIRCUIT_BREAKER_WINDOW_SIZE", "20")
+                ),
+                open_seconds=float(
+                    get_required_config("CIRCUIT_BREAKER_OPEN_SECONDS", "30")
+                ),
+            )
+        return _breakers[name]
+
+
+def get_breaker_metrics() -> Dict[str, Dict]:
+    """Report the state of every circuit breaker in the worker process."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.get_metrics() for breaker in breakers}
+
+
+def reset_breakers() -> None:
+    """Forget every circuit breaker, so they are created afresh."""
+    with _breakers_lock:
+        _breakers.clear()
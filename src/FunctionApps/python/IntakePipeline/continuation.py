@@ -0,0 +1,356 @@
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from config import get_required_config
+from typing import Iterable, Iterator, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from azure.data.tables import TableClient
+    from azure.storage.blob import BlobServiceClient
+    from azure.storage.queue import QueueClient
+
+CONTINUATION_QUEUE_NAME = "intake-continuation"
+CHECKPOINT_TABLE_NAME = "intakecheckpoints"
+CHECKPOINT_PARTITION_KEY = "blob"
+
+_blob_service_client = None
+_queue_client = None
+_table_client = None
+
+
+class Deadline:
+    """
+    A class tracking how much of an invocation's time budget remains, so a blob
+    can stop being processed cleanly before the function times out.
+
+    :param budget_seconds: The time budget, in seconds, from now.  A budget of 0
+        never expires.
+    """
+
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self._start = time.monotonic()
+
+    def remaining(self) -> float:
+        """The number of seconds left in the budget."""
+        if not self.budget_seconds:
+            return float("inf")
+        return self.budget_seconds - (time.monotonic() - self._start)
+
+    def expired(self) -> bool:
+        """Determine whether the budget has been used up."""
+        return self.remaining() <= 0
+
+
+def get_deadline() -> Deadline:
+    """
+    Start the time budget of an invocation.  `INTAKE_TIME_BUDGET_SECONDS` should
+    be the function timeout, less enough time for the messages in flight when it
+    expires to finish.
+    """
+    return Deadline(float(get_required_config("INTAKE_TIME_BUDGET_SECONDS", "240")))
+
+
+class BlobProgress:
+    """
+    A class tracking which messages of a blob have been processed, and
+    periodically checkpointing the number of messages at the start of the blob
+    that have all been processed.  Messages finish out of order when processed
+    concurrently, so the checkpoint only advances past a message once every
+    message before it has finished.
+
+    :param blob_name: The name of the blob
+    :param blob_length: The size of the blob, in bytes
+    :param start: The position of the first message being processed
+    :param interval: The number of messages to process between checkpoints
+    :param etag: The ETag of the blob, if known
+    """
+
+    def __init__(
+        self,
+        blob_name: str,
+        blob_length: int,
+        start: int,
+        interval: int,
+        etag: Optional[str] = None,
+    ):
+        self.blob_name = blob_name
+        self.blob_length = blob_length
+        self.etag = etag
+        self.offset = start
+        self.interval = interval
+        # Set when messages stop being processed before the end of the blob
+        self.stopped_at = None
+        # Whether a checkpoint of the blob exists that needs clearing at the end
+        self.checkpointed = start > 0
+        self._finished = set()
+        self._since_checkpoint = 0
+        self._lock = threading.Lock()
+
+    def complete(self, index: int) -> None:
+        """
+        Record that a message has been processed, whether it succeeded or not
+        (failed messages are retried or recorded as invalid by the pipeline).
+
+        :param index: The position of the message in the blob
+        """
+        with self._lock:
+            self._finished.add(index)
+            while self.offset in self._finished:
+                self._finished.remove(self.offset)
+                self.offset += 1
+            self._since_checkpoint += 1
+            if self._since_checkpoint < self.interval:
+                return
+            self._since_checkpoint = 0
+            self.checkpointed = True
+            offset = self.offset
+        store_checkpoint(self.blob_name, self.blob_length, offset, self.etag)
+
+    def until(
+        self, messages: Iterable[Tuple[int, str]], deadline: Deadline
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Pass messages on until the deadline expires, then stop and record where.
+
+        :param messages: The position in the blob and content of each message
+        :param deadline: The deadline of the invocation
+        """
+        for index, message in messages:
+            if deadline.expired():
+                self.stopped_at = index
+                return
+            yield index, message
+
+
+def get_checkpoint(blob_name: str, blob_length: int, etag: Optional[str] = None) -> int:
+    """
+    Get the number of messages at the start of a blob that an earlier
+    invocation processed before it stopped (eg: because it timed out).  A
+    checkpoint is ignored if the blob has since been replaced, as told by its
+    ETag or, when the ETag isn't known, its size.  If the checkpoint table
+    can't be reached, the blob is processed from the start.
+
+    :param blob_name: The name of the blob
+    :param blob_length: The size of the blob, in bytes
+    :param etag: The ETag of the blob, if known
+    """
+    try:
+        entity = _get_table_client().get_entity(
+            CHECKPOINT_PARTITION_KEY, _get_row_key(blob_name)
+        )
+    except ResourceNotFoundError:
+        return 0
+    except Exception:
+        logging.exception(f"Failed to look up the checkpoint of {blob_name}")
+        return 0
+    if entity.get("BlobLength") != blob_length:
+        return 0
+    if etag is not None and entity.get("BlobETag") != etag:
+        return 0
+    return int(entity.get("Offset", 0))
+
+
+def store_checkpoint(
+    blob_name: str, blob_length: int, offset: int, etag: Optional[str] = None
+) -> None:
+    """
+    Record the number of messages at the start of a blob that have been
+    processed.  Failures are logged rather than raised, since they only mean
+    more messages are processed again if the invocation is cut short.
+
+    :param blob_name: The name of the blob
+    :param blob_length: The size of the blob, in bytes
+    :param offset: The number of messages processed
+    :param etag: The ETag of the blob, if known
+    """
+    try:
+        _get_table_client().upsert_entity(
+            {
+                "PartitionKey": CHECKPOINT_PARTITION_KEY,
+                "RowKey": _get_row_key(blob_name),
+                "BlobName": blob_name,
+                "BlobLength": blob_length,
+                "BlobETag": etag or "",
+                "Offset": offset,
+            }
+        )
+    except Exception:
+        logging.exception(f"Failed to store the checkpoint of {blob_name}")
+
+
+def clear_checkpoint(blob_name: str) -> None:
+    """
+    Remove the checkpoint of a blob that has been processed to the end, so the
+    blob is processed from the start if it is ever written again.
+
+    :param blob_name: The name of the blob
+    """
+    try:
+        _get_table_client().delete_entity(
+            CHECKPOINT_PARTITION_KEY, _get_row_key(blob_name)
+        )
+    except Exception:
+        logging.exception(f"Failed to clear the checkpoint of {blob_name}")
+
+
+def schedule_continuation(blob_name: str, offset: int) -> bool:
+    """
+    Place a message on the continuation queue so the IntakeContinuation function
+    processes the rest of a blob, starting from the given message.
+
+    :param blob_name: The name of the blob, including its container
+    :param offset: The position of the first message left to process
+    :return: True if the continuation was queued
+    """
+    try:
+        _get_queue_client().send_message(
+            json.dumps({"blob_name": blob_name, "offset": offset})
+        )
+    except Exception:
+        logging.exception(f"Failed to queue the continuation of {blob_name}")
+        return False
+    logging.info(f"Queued the continuation of {blob_name} from message {offset}")
+    return True
+
+
+class BlobStream(io.RawIOBase):
+    """
+    A stand-in for the `InputStream` a blob trigger passes to the IntakePipeline,
+    reading the blob as it is downloaded.  It is a readable binary stream, so
+    it can be split while it is read in low-memory mode.
+
+    :param name: The name of the blob, including its container
+    :param length: The size of the blob, in bytes
+    :param downloader: The download of the blob
+    :param etag: The ETag of the version of the blob being downloaded, if known
+    """
+
+    def __init__(self, name: str, length: int, downloader, etag: Optional[str] = None):
+        super().__init__()
+        self.name = name
+        self.length = length
+        # As the blob trigger reports them
+        self.blob_properties = {"ETag": etag} if etag else None
+        self._downloader = downloader
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._downloader.read(size)
+
+    def readinto(self, buffer) -> int:
+        data = self._downloader.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        return size
+
+
+def open_blob(blob_name: str) -> BlobStream:
+    """
+    Start downloading a blob from the storage account the function app's
+    triggers use, accessed using the function app's managed identity.
+
+    :param blob_name: The name of the blob, including its container (eg:
+        `bronze/decrypted/VXU/some-file.hl7`), as passed to the blob trigger
+    """
+    container, name = blob_name.split("/", 1)
+    downloader = (
+        _get_blob_service_client().get_blob_client(container, name).download_blob()
+    )
+    return BlobStream(
+        blob_name, downloader.size, downloader, downloader.properties.etag
+    )
+
+
+def _get_blob_service_client() -> "BlobServiceClient":
+    """
+    Lazily build the client for the storage account the function app's triggers
+    use, so blobs opened by later invocations reuse its connections.
+    """
+    global _blob_service_client
+    if _blob_service_client is None:
+        from azure.identity import DefaultAzureCredential
+        from azure.storage.blob import BlobServiceClient
+
+        _blob_service_client = BlobServiceClient(
+            account_url=get_required_config("AzureWebJobsStorage__blobServiceUri"),
+            credential=DefaultAzureCredential(),
+        )
+    return _blob_service_client
+
+
+def get_etag(blob) -> Optional[str]:
+    """
+    Get the ETag of a blob passed to the IntakePipeline, from the properties the
+    blob trigger (or a `BlobStream`) reports, without the quotes some clients
+    wrap it in.
+
+    :param blob: The blob being processed
+    :return: The ETag, or None if the blob's properties aren't known
+    """
+    properties = getattr(blob, "blob_properties", None)
+    if not isinstance(properties, dict) or not properties.get("ETag"):
+        return None
+    return str(properties["ETag"]).strip('"')
+
+
+def _get_row_key(blob_name: str) -> str:
+    # Row keys can't contain "/"
+    return hashlib.sha256(blob_name.encode("utf-8")).hexdigest()
+
+
+def _get_table_client() -> "TableClient":
+    """
+    Lazily build the client for the checkpoint table, which lives in the same
+    storage account the function app uses for its triggers and is accessed
+    using the function app's managed identity.  The table is created on first
+    use.
+    """
+    global _table_client
+    if _table_client is None:
+        from azure.identity import DefaultAzureCredential
+        from azure.data.tables import TableClient
+
+        table_client = TableClient(
+            endpoint=get_required_config("AzureWebJobsStorage__tableServiceUri"),
+            table_name=CHECKPOINT_TABLE_NAME,
+            credential=DefaultAzureCredential(),
+        )
+        try:
+            table_client.create_table()
+        except ResourceExistsError:
+            pass
+        _table_client = table_client
+    return _table_client
+
+
+def _get_queue_client() -> "QueueClient":
+    """
+    Lazily build the client for the continuation queue, in the same way as the
+    retry queue.  The queue is created on first use since the
+    IntakeContinuation trigger only listens on it.
+    """
+    global _queue_client
+    if _queue_client is None:
+        from azure.identity import DefaultAzureCredential
+        from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+
+        queue_client = QueueClient(
+            account_url=get_required_config("AzureWebJobsStorage__queueServiceUri"),
+            queue_name=CONTINUATION_QUEUE_NAME,
+            credential=DefaultAzureCredential(),
+            message_encode_policy=TextBase64EncodePolicy(),
+        )
+        try:
+            queue_client.create_queue()
+        except ResourceExistsError:
+            pass
+        _queue_client = queue_client
+    return _queue_client
@@ -0,0 +1,250 @@
+import collections
+import datetime
+import hashlib
+import json
+import logging
+
+from azure.core.exceptions import ResourceExistsError
+from config import get_required_config
+from typing import Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from azure.data.tables import TableClient
+
+FINGERPRINT_TABLE_NAME = "intakefingerprints"
+
+# Table query filters may hold at most 15 comparisons, so each lookup compares
+# one partition key and up to 14 row keys
+LOOKUP_BATCH_SIZE = 14
+
+# The most operations a table transaction may hold
+TRANSACTION_SIZE = 100
+
+_table_client = None
+
+
+def is_delta_upload_enabled() -> bool:
+    """Determine whether unchanged resources should be left out of uploads."""
+    return get_required_config("INTAKE_DELTA_UPLOAD", "false").lower() == "true"
+
+
+def get_identity(entry: Dict) -> Optional[str]:
+    """
+    Get the identity of the resource a batch entry writes, ie: the url of an
+    update (eg: `Patient/some-id`).  Resources written any other way (eg: a
+    create without an id) have no stable identity, and are always uploaded.
+
+    :param entry: An entry of a batch bundle
+    """
+    request = entry.get("request", {})
+    if request.get("method") == "PUT" and request.get("url"):
+        return request["url"]
+    return None
+
+
+def get_fingerprint(resource: Dict) -> str:
+    """
+    Compute a content fingerprint for a resource.  Server-assigned metadata
+    (eg: the version id) is left out, so only changes to the content itself
+    produce a different fingerprint.
+
+    :param resource: The FHIR resource
+    """
+    content = {key: value for key, value in resource.items() if key != "meta"}
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+class DeltaUpload:
+    """
+    A class that plans an upload of only the entries in a bundle whose resources
+    have changed since they were last uploaded, and records the fingerprints of
+    the entries that were uploaded successfully.
+
+    With `conditional` set, changed entries that were previously uploaded are
+    sent with `If-Match` on the version that was last written, so the server
+    rejects the write (with a 412) rather than overwriting a change made
+    elsewhere, and creates that carry an identifier are sent with
+    `If-None-Exist` so the server doesn't create a duplicate.
+
+    :param bundle: The standardized batch bundle
+    :param conditional: Whether to add conditional request headers
+    """
+
+    def __init__(self, bundle: Dict, conditional: bool = False):
+        self.bundle = bundle
+        self.conditional = conditional
+        self.skipped = 0
+
+        entries = bundle.get("entry", [])
+        self._identities = [get_identity(entry) for entry in entries]
+        self._fingerprints = [
+            get_fingerprint(entry.get("resource", {})) if identity else None
+            for entry, identity in zip(entries, self._identities)
+        ]
+        known = lookup_fingerprints(
+            [identity for identity in self._identities if identity]
+        )
+
+        # The indexes in the original bundle of the entries being uploaded
+        self.indexes = []
+        upload_entries = []
+        for index, entry in enumerate(entries):
+            identity = self._identities[index]
+            previous = known.get(identity) if identity else None
+            if previous and previous["Fingerprint"] == self._fingerprints[index]:
+                self.skipped += 1
+                continue
+            if conditional:
+                entry = _add_condition(entry, previous)
+            self.indexes.append(index)
+            upload_entries.append(entry)
+
+        self.upload_bundle = {**bundle, "entry": upload_entries}
+
+    def record(self, upload_response_json: Dict) -> None:
+        """
+        Record the fingerprints of the entries that were uploaded successfully,
+        so later uploads of the same content can be skipped.
+
+        :param upload_response_json: The batch-response bundle returned by the
+            FHIR server for the upload bundle
+        """
+        records = []
+        for index, entry in zip(self.indexes, upload_response_json.get("entry", [])):
+            response = entry.get("response", {})
+            if self._identities[index] and response.get("status", "").startswith("2"):
+                records.append(
+                    (
+                        self._identities[index],
+                        self._fingerprints[index],
+                        response.get("etag"),
+                    )
+                )
+        store_fingerprints(records)
+
+
+def lookup_fingerprints(identities: Iterable[str]) -> Dict[str, Dict]:
+    """
+    Look up the stored fingerprints of resources.  Fingerprints older than
+    `INTAKE_DELTA_UPLOAD_MAX_AGE_HOURS` are ignored, so every resource is
+    rewritten periodically even if it never changes.  If the fingerprint table
+    can't be reached, every resource is treated as changed.
+
+    :param identities: The identities of the resources
+    :return: Dictionary mapping identities to their stored `Fingerprint` and
+        `ETag`, for those that have one
+    """
+    identities = list(dict.fromkeys(identities))
+    max_age = datetime.timedelta(
+        hours=float(get_required_config("INTAKE_DELTA_UPLOAD_MAX_AGE_HOURS", "168"))
+    )
+    oldest = datetime.datetime.now(datetime.timezone.utc) - max_age
+    by_key = {_get_keys(identity): identity for identity in identities}
+    by_partition = collections.defaultdict(list)
+    for partition_key, row_key in by_key:
+        by_partition[partition_key].append(row_key)
+
+    known = {}
+    try:
+        table_client = _get_table_client()
+        for partition_key, row_keys in by_partition.items():
+            for start in range(0, len(row_keys), LOOKUP_BATCH_SIZE):
+                end = start + LOOKUP_BATCH_SIZE
+                parameters = {"pk": partition_key}
+                conditions = []
+                for i, row_key in enumerate(row_keys[start:end]):
+                    parameters[f"rk{i}"] = row_key
+                    conditions.append(f"RowKey eq @rk{i}")
+                query_filter = f"PartitionKey eq @pk and ({' or '.join(conditions)})"
+                for entity in table_client.query_entities(
+                    query_filter, parameters=parameters
+                ):
+                    timestamp = entity.metadata.get("timestamp")
+                    if timestamp is not None and timestamp < oldest:
+                        continue
+                    known[by_key[(entity["PartitionKey"], entity["RowKey"])]] = entity
+    except Exception:
+        logging.exception("Failed to look up resource fingerprints")
+        return {}
+    return known
+
+
+def store_fingerprints(records: List[Tuple[str, str, Optional[str]]]) -> None:
+    """
+    Store the fingerprints of uploaded resources.  Failures are logged rather
+    than raised, since they only mean the resources will be uploaded again.
+
+    :param records: The identity, fingerprint and version etag of each resource
+    """
+    # Transactions may only hold entities from a single partition
+    by_partition = collections.defaultdict(list)
+    for identity, fingerprint, etag in records:
+        partition_key, row_key = _get_keys(identity)
+        by_partition[partition_key].append(
+            {
+                "PartitionKey": partition_key,
+                "RowKey": row_key,
+                "Fingerprint": fingerprint,
+                "ETag": etag or "",
+            }
+        )
+
+    try:
+        table_client = _get_table_client()
+        for entities in by_partition.values():
+            # A row may only appear once in a transaction
+            entities = list({entity["RowKey"]: entity for entity in entities}.values())
+            for start in range(0, len(entities), TRANSACTION_SIZE):
+                end = start + TRANSACTION_SIZE
+                table_client.submit_transaction(
+                    [("upsert", entity) for entity in entities[start:end]]
+                )
+    except Exception:
+        logging.exception("Failed to store resource fingerprints")
+
+
+def _add_condition(entry: Dict, previous: Optional[Dict]) -> Dict:
+    request = dict(entry.get("request", {}))
+    if previous and previous.get("ETag"):
+        request["ifMatch"] = previous["ETag"]
+    elif request.get("method") == "POST" and "ifNoneExist" not in request:
+        identifier = next(iter(entry.get("resource", {}).get("identifier", [])), {})
+        if identifier.get("system") and identifier.get("value"):
+            request["ifNoneExist"] = (
+                f"identifier={identifier['system']}|{identifier['value']}"
+            )
+    return {**entry, "request": request}
+
+
+def _get_keys(identity: str) -> Tuple[str, str]:
+    # Row keys can't contain "/", so resources are partitioned by type and keyed
+    # by a hash of their identity
+    resource_type = identity.split("/", 1)[0]
+    return resource_type, hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+def _get_table_client() -> "TableClient":
+    """
+    Lazily build the client for the fingerprint table, which lives in the same
+    storage account the function app uses for its triggers and is accessed
+    using the function app's managed identity.  The table is created on first
+    use.
+    """
+    global _table_client
+    if _table_client is None:
+        from azure.identity import DefaultAzureCredential
+        from azure.data.tables import TableClient
+
+        table_client = TableClient(
+            endpoint=get_required_config("AzureWebJobsStorage__tableServiceUri"),
+            table_name=FINGERPRINT_TABLE_NAME,
+            credential=DefaultAzureCredential(),
+        )
+        try:
+            table_client.create_table()
+        except ResourceExistsError:
+            pass
+        _table_client = table_client
+    return _table_client
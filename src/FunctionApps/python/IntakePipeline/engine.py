@@ -0,0 +1,172 @@
+import logging
+import queue
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional
+
+# Placed on a stage's queue once for each of its workers to stop them
+_STOP = object()
+
+
+class Stage:
+    """
+    A class describing one stage of a pipelined engine: the work it does on
+    each item, and how many items it works on at the same time.
+
+    :param name: The name of the stage, used in metrics
+    :param fn: The work to do on an item.  Returns True if the item should
+        continue to the next stage, or False if it is finished (eg: because it
+        failed and has been dealt with).
+    :param concurrency: The number of items the stage works on at the same time
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], bool], concurrency: int = 1):
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+
+
+class StagedEngine:
+    """
+    A class that runs items through a series of stages, each with its own
+    workers, connected by bounded queues.  While one stage works on an item,
+    earlier stages work on the items behind it, so a stage that waits on a
+    remote service (eg: conversion or geocoding) doesn't leave the others idle.
+
+    When a stage's queue is full, the stage before it waits until there is
+    room, and `submit` waits once the first queue is full, so at most
+    `queue_size` items wait in front of each stage and memory use is bounded
+    no matter how many items are submitted.
+
+    Items that raise an exception are logged and finish early, so one bad item
+    doesn't stop the rest.  Use as a context manager: on exit, every submitted
+    item is finished before the workers are stopped.
+
+    :param stages: The stages, in order
+    :param queue_size: The most items waiting in front of each stage
+    :param on_complete: Called with each item once it finishes, whether it
+        passed through every stage or not
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        queue_size: int,
+        on_complete: Optional[Callable[[Any], None]] = None,
+    ):
+        self.stages = stages
+        self.on_complete = on_complete
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._lock = threading.Lock()
+        self._metrics = {
+            stage.name: {
+                "max_queue_depth": 0,
+                "active": 0,
+                "processed": 0,
+                "failed": 0,
+                "busy_seconds": 0.0,
+            }
+            for stage in stages
+        }
+        self._workers = [
+            [
+                threading.Thread(
+                    target=self._work,
+                    args=(index,),
+                    name=f"{stage.name}-{n}",
+                    daemon=True,
+                )
+                for n in range(stage.concurrency)
+            ]
+            for index, stage in enumerate(stages)
+        ]
+
+    def __enter__(self) -> "StagedEngine":
+        for workers in self._workers:
+            for worker in workers:
+                worker.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def submit(self, item: Any) -> None:
+        """
+        Send an item into the first stage, waiting while its queue is full.
+
+        :param item: The item to process
+        """
+        self._put(0, item)
+
+    def close(self) -> None:
+        """Finish every submitted item, then stop the workers."""
+        # Queues are first in, first out, so each stage sees its stop markers
+        # only after every item in front of them
+        for index, workers in enumerate(self._workers):
+            for _ in workers:
+                self._queues[index].put(_STOP)
+            for worker in workers:
+                worker.join()
+
+    def get_metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Report, for every stage, the current and largest number of items
+        waiting in front of it, the items it is working on, the items it has
+        processed and failed, and the total time its workers spent busy.  The
+        stage with the deepest queue in front of it is the bottleneck.
+        """
+        with self._lock:
+            return {
+                stage.name: {
+                    "queue_depth": self._queues[index].qsize(),
+                    **self._metrics[stage.name],
+                    "busy_seconds": round(self._metrics[stage.name]["busy_seconds"], 3),
+                }
+                for index, stage in enumerate(self.stages)
+            }
+
+    def _put(self, index: int, item: Any) -> None:
+        self._queues[index].put(item)
+        with self._lock:
+            metrics = self._metrics[self.stages[index].name]
+            metrics["max_queue_depth"] = max(
+                metrics["max_queue_depth"], self._queues[index].qsize()
+            )
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        metrics = self._metrics[stage.name]
+        while True:
+            item = self._queues[index].get()
+            if item is _STOP:
+                return
+
+            with self._lock:
+                metrics["active"] += 1
+            start = time.perf_counter()
+            try:
+                proceed = stage.fn(item)
+            except Exception:
+                logging.exception(f"Exception occurred in the {stage.name} stage.")
+                proceed = False
+                with self._lock:
+                    metrics["failed"] += 1
+            finally:
+                with self._lock:
+                    metrics["active"] -= 1
+                    metrics["processed"] += 1
+                    metrics["busy_seconds"] += time.perf_counter() - start
+
+            if proceed and index + 1 < len(self.stages):
+                self._put(index + 1, item)
+            else:
+                self._complete(item)
+
+    def _complete(self, item: Any) -> None:
+        if self.on_complete is None:
+            return
+        try:
+            self.on_complete(item)
+        except Exception:
+            logging.exception("Exception occurred while completing an item.")
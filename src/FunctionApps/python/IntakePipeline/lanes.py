@@ -0,0 +1,247 @@
+import collections
+import contextlib
+import fnmatch
+import functools
+import json
+import statistics
+import threading
+import time
+
+from config import get_required_config
+from typing import Dict, Iterator, List, Optional
+
+# Large files and anything under a backfill directory are bulk loads; everything
+# else is treated as a real-time feed
+DEFAULT_LANES = [
+    {
+        "name": "bulk",
+        "weight": 1,
+        "max_concurrency": 2,
+        "min_size": 10 * 1024 * 1024,
+        "path_patterns": ["*/backfill/*"],
+    },
+    {"name": "realtime", "weight": 4, "max_concurrency": 8},
+]
+
+# Number of recent wait times kept per lane for reporting percentiles
+WAIT_TIME_WINDOW = 1000
+
+
+class Lane:
+    """
+    A class describing a priority lane, the blobs that belong to it, and its
+    share of the worker's processing capacity.
+
+    A blob belongs to the lane if it matches any of the lane's criteria: its
+    bundle type (from `get_file_type_mappings`) is one of `bundle_types`, its
+    name matches one of `path_patterns`, or it is at least `min_size` bytes.  A
+    lane with no criteria accepts every blob.
+
+    :param name: The name of the lane, used in metrics
+    :param weight: The lane's share of processing slots relative to other lanes
+        that also have messages waiting
+    :param max_concurrency: The most messages from this lane that may be
+        processed at the same time
+    :param bundle_types: Bundle types that belong to the lane
+    :param path_patterns: Glob patterns for blob names that belong to the lane
+    :param min_size: Blobs at least this many bytes belong to the lane
+    """
+
+    def __init__(
+        self,
+        name: str,
+        weight: float = 1,
+        max_concurrency: int = 1,
+        bundle_types: List[str] = (),
+        path_patterns: List[str] = (),
+        min_size: Optional[int] = None,
+    ):
+        self.name = name
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.bundle_types = list(bundle_types)
+        self.path_patterns = list(path_patterns)
+        self.min_size = min_size
+
+    def matches(
+        self, blob_name: str, blob_size: Optional[int], message_mappings: Dict[str, str]
+    ) -> bool:
+        if not (self.bundle_types or self.path_patterns or self.min_size is not None):
+            return True
+        return (
+            message_mappings.get("bundle_type") in self.bundle_types
+            or any(fnmatch.fnmatch(blob_name, p) for p in self.path_patterns)
+            or (
+                self.min_size is not None
+                and blob_size is not None
+                and blob_size >= self.min_size
+            )
+        )
+
+
+class LaneScheduler:
+    """
+    A class that shares a worker's processing slots between priority lanes, so
+    a bulk backfill cannot starve time-sensitive feeds.  Every message acquires
+    a slot from its lane before it is processed.  A lane never holds more than
+    its own `max_concurrency` slots, and when several lanes have messages
+    waiting, free slots go to the lane that has received the least service
+    relative to its weight.
+
+    :param lanes: The lanes, in the order they are matched against blobs; the
+        last lane also receives any blob that matches no other lane
+    :param max_concurrency: The total number of slots shared by all lanes
+    """
+
+    def __init__(self, lanes: List[Lane], max_concurrency: int):
+        self.lanes = lanes
+        self.max_concurrency = max_concurrency
+        self._condition = threading.Condition()
+        self._total_active = 0
+        self._active = {lane.name: 0 for lane in lanes}
+        self._waiting = {lane.name: collections.deque() for lane in lanes}
+        self._virtual_time = {lane.name: 0.0 for lane in lanes}
+        self._processed = {lane.name: 0 for lane in lanes}
+        self._wait_times = {
+            lane.name: collections.deque(maxlen=WAIT_TIME_WINDOW) for lane in lanes
+        }
+
+    def classify(
+        self, blob_name: str, blob_size: Optional[int], message_mappings: Dict[str, str]
+    ) -> Lane:
+        """
+        Find the lane that messages from a blob should be processed in.
+
+        :param blob_name: The name of the blob
+        :param blob_size: The size of the blob in bytes, if known
+        :param message_mappings: The template mappings for the blob
+        """
+        for lane in self.lanes:
+            if lane.matches(blob_name, blob_size, message_mappings):
+                return lane
+        return self.lanes[-1]
+
+    @contextlib.contextmanager
+    def slot(self, lane: Lane) -> Iterator[float]:
+        """
+        Wait for a processing slot in a lane and hold it for the duration of
+        the context.
+
+        :param lane: The lane to acquire a slot from
+        :return: The number of seconds spent waiting for the slot
+        """
+        wait_time = self.acquire(lane)
+        try:
+            yield wait_time
+        finally:
+            self.release(lane)
+
+    def get_metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Report the current queue depth, active messages, messages processed and
+        recent wait times (in seconds) for every lane.
+        """
+        with self._condition:
+            metrics = {}
+            for lane in self.lanes:
+                wait_times = sorted(self._wait_times[lane.name])
+                metrics[lane.name] = {
+                    "queue_depth": len(self._waiting[lane.name]),
+                    "active": self._active[lane.name],
+                    "processed": self._processed[lane.name],
+                    "wait_p50": (
+                        round(statistics.median(wait_times), 3) if wait_times else 0
+                    ),
+                    "wait_p95": (
+                        round(wait_times[int(0.95 * (len(wait_times) - 1))], 3)
+                        if wait_times
+                        else 0
+                    ),
+                    "wait_max": round(wait_times[-1], 3) if wait_times else 0,
+                }
+            return metrics
+
+    def acquire(self, lane: Lane) -> float:
+        """
+        Wait for a processing slot in a lane.  Prefer `slot`, unless the slot
+        is released by a different thread than the one that acquired it.
+
+        :param lane: The lane to acquire a slot from
+        :return: The number of seconds spent waiting for the slot
+        """
+        ticket = object()
+        enqueued = time.monotonic()
+        with self._condition:
+            waiting = self._waiting[lane.name]
+            if not waiting and self._active[lane.name] == 0:
+                # A lane that was idle doesn't get to bank credit for that time;
+                # it starts level with the lanes that have been busy
+                busy = [
+                    self._virtual_time[other.name]
+                    for other in self.lanes
+                    if self._waiting[other.name] or self._active[other.name]
+                ]
+                if busy:
+                    self._virtual_time[lane.name] = max(
+                        self._virtual_time[lane.name], min(busy)
+                    )
+            waiting.append(ticket)
+
+            while not self._can_start(lane, ticket):
+                self._condition.wait()
+
+            waiting.popleft()
+            self._active[lane.name] += 1
+            self._total_active += 1
+            self._virtual_time[lane.name] += 1 / lane.weight
+
+            wait_time = time.monotonic() - enqueued
+            self._wait_times[lane.name].append(wait_time)
+            # Another lane may now be next in line
+            self._condition.notify_all()
+            return wait_time
+
+    def release(self, lane: Lane) -> None:
+        """
+        Release a processing slot acquired with `acquire`.
+
+        :param lane: The lane the slot was acquired from
+        """
+        with self._condition:
+            self._active[lane.name] -= 1
+            self._total_active -= 1
+            self._processed[lane.name] += 1
+            self._condition.notify_all()
+
+    def _can_start(self, lane: Lane, ticket: object) -> bool:
+        if self._waiting[lane.name][0] is not ticket:
+            return False
+        if self._total_active >= self.max_concurrency:
+            return False
+        if self._active[lane.name] >= lane.max_concurrency:
+            return False
+
+        eligible = [
+            other
+            for other in self.lanes
+            if self._waiting[other.name]
+            and self._active[other.name] < other.max_concurrency
+        ]
+        next_lane = min(eligible, key=lambda other: self._virtual_time[other.name])
+        return self._virtual_time[lane.name] <= self._virtual_time[next_lane.name]
+
+
+@functools.lru_cache(maxsize=None)
+def get_scheduler() -> LaneScheduler:
+    """
+    Get the lane scheduler shared by every invocation in this worker process.
+    Lanes are read from the `INTAKE_LANES` setting, a JSON list of lane
+    definitions, and default to separate bulk and real-time lanes.
+    """
+    lane_config = json.loads(
+        get_required_config("INTAKE_LANES", json.dumps(DEFAULT_LANES))
+    )
+    return LaneScheduler(
+        lanes=[Lane(**lane) for lane in lane_config],
+        max_concurrency=int(get_required_config("INTAKE_MAX_CONCURRENCY", "8")),
+    )
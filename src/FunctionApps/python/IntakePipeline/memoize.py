@@ -0,0 +1,130 @@
+import collections
+import functools
+import threading
+
+from types import ModuleType
+from typing import Any, Callable, Dict, Hashable, Iterable
+
+# Longer string arguments (eg: free text) are rarely repeated, so they aren't
+# cached, which also bounds the memory each entry can use
+MAX_CACHED_LENGTH = 256
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class LRUCache:
+    """
+    A thread-safe cache holding the results of the `maxsize` most recently used
+    keys, and counting how often a key was found.
+
+    :param maxsize: The most results held; older results are evicted first
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Get the result held for a key, or compute and hold it.  The result is
+        computed outside the lock, so threads computing different keys don't
+        wait for each other.
+
+        :param key: The key of the result
+        :param compute: Computes the result when it isn't held
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        """Forget every held result, and reset the counts."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def get_metrics(self) -> Dict[str, int]:
+        """Report the number of results held, and the hit and miss counts."""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def memoize(fn: Callable, cache: LRUCache) -> Callable:
+    """
+    Wrap a pure function so its results are held in a cache, keyed on its
+    arguments, including keyword arguments (eg: options).  Calls with
+    arguments that can't be hashed, or with long strings, aren't cached.
+    Exceptions are never cached.
+
+    :param fn: The function to wrap
+    :param cache: The cache to hold its results in
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if any(
+            isinstance(arg, str) and len(arg) > MAX_CACHED_LENGTH
+            for arg in (*args, *kwargs.values())
+        ):
+            return fn(*args, **kwargs)
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return fn(*args, **kwargs)
+        return cache.get_or_compute(key, lambda: fn(*args, **kwargs))
+
+    wrapper.cache = cache
+    return wrapper
+
+
+def memoize_module_functions(
+    module: ModuleType, names: Iterable[str], maxsize: int
+) -> None:
+    """
+    Replace functions of a module with memoized versions, so other functions of
+    the module that call them by name use the cache too.  Each function gets its
+    own cache, named `<module>.<function>`.  Functions the module doesn't have,
+    or that are already memoized, are left alone.
+
+    :param module: The module holding the functions
+    :param names: The names of the functions to memoize
+    :param maxsize: The most results held for each function
+    """
+    for name in names:
+        fn = getattr(module, name, None)
+        if fn is None or hasattr(fn, "cache"):
+            continue
+        cache = LRUCache(maxsize)
+        setattr(module, name, memoize(fn, cache))
+        with _caches_lock:
+            _caches[f"{module.__name__}.{name}"] = cache
+
+
+def get_cache_metrics() -> Dict[str, Dict[str, int]]:
+    """Report the size and hit and miss counts of every memoized function."""
+    with _caches_lock:
+        caches = dict(_caches)
+    return {name: cache.get_metrics() for name, cache in caches.items()}
@@ -0,0 +1,188 @@
+import contextlib
+import io
+import os
+import random
+import resource
+import threading
+import tracemalloc
+
+from config import get_required_config
+from phdi.conversion import convert_batch_messages_to_list
+from typing import Dict, IO, Iterator, Optional
+
+# Delimiters some senders place around messages, which are removed when a batch
+# is split into messages
+MESSAGE_WRAPPER_CHARACTERS = "\u000b\u001c"
+
+_tracing_lock = threading.Lock()
+_tracing_invocations = 0
+_tracing_started = False
+
+
+def get_current_rss() -> Optional[int]:
+    """
+    Get the current resident set size of the worker process, in bytes, or None
+    if it can't be determined on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss() -> int:
+    """Get the peak resident set size of the worker process, in bytes."""
+    # Linux reports the peak in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def use_low_memory_mode(blob_size: Optional[int]) -> bool:
+    """
+    Determine whether a blob is large enough to be processed in low-memory mode,
+    as configured by `INTAKE_LOW_MEMORY_THRESHOLD_BYTES`.
+
+    :param blob_size: The size of the blob in bytes, if known
+    """
+    threshold = int(
+        get_required_config("INTAKE_LOW_MEMORY_THRESHOLD_BYTES", str(64 * 1024 * 1024))
+    )
+    return blob_size is not None and blob_size > threshold
+
+
+def iter_batch_messages(stream: IO[bytes]) -> Iterator[str]:
+    """
+    Split a batch file into individual messages while reading it, so that only
+    one message is held in memory at a time.  Each chunk of lines starting at
+    an MSH segment is split with `convert_batch_messages_to_list`, so messages
+    are normalized exactly as they would be if the whole batch was split at once.
+
+    :param stream: A binary stream holding the batch file
+    """
+    # Universal newlines mode turns CR and CR-LF segment delimiters into LF
+    lines = io.TextIOWrapper(stream, encoding="utf-8", errors="ignore")
+    chunk = []
+    chunk_has_message = False
+    for line in lines:
+        if line.lstrip(MESSAGE_WRAPPER_CHARACTERS).startswith("MSH"):
+            if chunk_has_message:
+                yield from convert_batch_messages_to_list("".join(chunk))
+                chunk = []
+            chunk_has_message = True
+        chunk.append(line)
+    if chunk:
+        yield from convert_batch_messages_to_list("".join(chunk))
+
+
+class MemoryTracker:
+    """
+    A class that records the memory used while processing a blob, so it can be
+    reported along with the blob's size and message count.  The worker's
+    resident set size is recorded for every stage.  A sampled fraction of
+    invocations (`INTAKE_TRACEMALLOC_SAMPLE_RATE`) also trace allocations with
+    tracemalloc to report each stage's peak traced memory and its largest
+    allocations.  Tracing covers the whole process, so figures for invocations
+    that overlap with other sampled invocations are approximate.
+
+    :param blob_name: The name of the blob being processed
+    :param blob_size: The size of the blob in bytes, if known
+    :param top_allocations: The number of largest allocations to report for
+        each stage of a traced invocation
+    """
+
+    def __init__(
+        self, blob_name: str, blob_size: Optional[int], top_allocations: int = 5
+    ):
+        self.blob_name = blob_name
+        self.blob_size = blob_size
+        self.top_allocations = top_allocations
+        self.message_count = 0
+        self.low_memory_mode = False
+        self.stages = {}
+        self.traced = random.random() < float(
+            get_required_config("INTAKE_TRACEMALLOC_SAMPLE_RATE", "0")
+        )
+        if self.traced:
+            _start_tracing()
+        self.rss_start = get_current_rss()
+        self.peak_rss_start = get_peak_rss()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Record the memory used by a stage of processing for the duration of
+        the context.
+
+        :param name: The name of the stage
+        """
+        rss_before = get_current_rss()
+        if self.traced:
+            tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            rss_after = get_current_rss()
+            stats = {
+                "rss_delta": (
+                    rss_after - rss_before
+                    if rss_after is not None and rss_before is not None
+                    else None
+                )
+            }
+            if self.traced:
+                stats["traced_peak"] = tracemalloc.get_traced_memory()[1]
+                stats["top_allocations"] = [
+                    {
+                        "location": f"{stat.traceback[0].filename}:"
+                        + f"{stat.traceback[0].lineno}",
+                        "size": stat.size,
+                        "count": stat.count,
+                    }
+                    for stat in tracemalloc.take_snapshot().statistics("lineno")[
+                        : self.top_allocations
+                    ]
+                ]
+            self.stages[name] = stats
+
+    def stop(self) -> None:
+        """Stop tracing allocations for this invocation, if it was sampled."""
+        if self.traced:
+            self.traced = False
+            _stop_tracing()
+
+    def report(self) -> Dict:
+        """Summarize the memory used while processing the blob."""
+        peak_rss = get_peak_rss()
+        return {
+            "blob_name": self.blob_name,
+            "blob_size": self.blob_size,
+            "message_count": self.message_count,
+            "low_memory_mode": self.low_memory_mode,
+            "rss_start": self.rss_start,
+            "rss_end": get_current_rss(),
+            "peak_rss": peak_rss,
+            # The peak covers the life of the worker; an increase means this
+            # blob set a new high-water mark
+            "peak_rss_increase": peak_rss - self.peak_rss_start,
+            "stages": self.stages,
+        }
+
+
+def _start_tracing() -> None:
+    global _tracing_invocations, _tracing_started
+    with _tracing_lock:
+        if _tracing_invocations == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_invocations += 1
+
+
+def _stop_tracing() -> None:
+    global _tracing_invocations, _tracing_started
+    with _tracing_lock:
+        _tracing_invocations -= 1
+        # Leave tracing alone if something other than a sampled invocation
+        # started it
+        if _tracing_invocations == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
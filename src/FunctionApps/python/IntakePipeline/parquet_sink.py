@@ -0,0 +1,395 @@
+import datetime
+import io
+import json
+import logging
+import threading
+import time
+import uuid
+
+from config import get_required_config
+from typing import Any, Callable, Dict, Iterable, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pyarrow
+    from azure.storage.blob import ContainerClient
+
+GEOLOCATION_URL = "http://hl7.org/fhir/StructureDefinition/geolocation"
+
+# Columns common to every resource type.  `resource` holds the whole resource
+# as JSON, so nothing is lost to the flattened columns.
+COMMON_COLUMNS = [
+    ("id", "string"),
+    ("source_filename", "string"),
+    ("ingested_at", "timestamp"),
+    ("resource", "string"),
+]
+
+# The flattened columns of each resource type written to Parquet
+COLUMNS = {
+    "Patient": [
+        ("identifier", "string"),
+        ("family", "string"),
+        ("given", "string"),
+        ("birth_date", "string"),
+        ("gender", "string"),
+        ("address_line", "string"),
+        ("city", "string"),
+        ("state", "string"),
+        ("postal_code", "string"),
+        ("latitude", "double"),
+        ("longitude", "double"),
+        ("phone", "string"),
+    ],
+    "Immunization": [
+        ("patient_reference", "string"),
+        ("status", "string"),
+        ("vaccine_system", "string"),
+        ("vaccine_code", "string"),
+        ("vaccine_display", "string"),
+        ("occurrence", "string"),
+        ("lot_number", "string"),
+    ],
+    "Observation": [
+        ("patient_reference", "string"),
+        ("status", "string"),
+        ("code_system", "string"),
+        ("code", "string"),
+        ("code_display", "string"),
+        ("effective", "string"),
+        ("value_quantity", "double"),
+        ("value_unit", "string"),
+        ("value_string", "string"),
+    ],
+}
+
+_container_client = None
+
+
+def is_parquet_output_enabled() -> bool:
+    """Determine whether standardized resources should be written to Parquet."""
+    return get_required_config("INTAKE_PARQUET_OUTPUT", "false").lower() == "true"
+
+
+def is_json_output_enabled() -> bool:
+    """Determine whether each standardized bundle should be stored as JSON."""
+    return get_required_config("INTAKE_JSON_OUTPUT", "true").lower() == "true"
+
+
+def get_sink() -> Optional["ParquetSink"]:
+    """
+    Build the Parquet sink for an invocation from the function app's settings,
+    or return None if Parquet output is disabled.
+    """
+    if not is_parquet_output_enabled():
+        return None
+    return ParquetSink(
+        output_path=get_required_config("PARQUET_OUTPUT_CONTAINER_PATH"),
+        max_rows=int(get_required_config("INTAKE_PARQUET_MAX_ROWS", "10000")),
+        max_age_seconds=float(
+            get_required_config("INTAKE_PARQUET_MAX_AGE_SECONDS", "60")
+        ),
+    )
+
+
+class ParquetSink:
+    """
+    A class collecting the Patient, Immunization and Observation resources of
+    standardized bundles, across messages, and writing them to Parquet in
+    micro-batches, so analytics jobs can scan a few large columnar files rather
+    than a JSON blob per message.
+
+    Each resource type is written to its own files, partitioned by the date the
+    resources were ingested, as
+    `<output_path>/<resource type>/ingest_date=<YYYY-MM-DD>/<time>-<id>.parquet`.
+    A resource type is written once `max_rows` of its resources are waiting, and
+    every type is written once the oldest waiting resource has waited
+    `max_age_seconds`, or when the sink is closed.
+
+    :param output_path: The path in the intake container to write files under
+    :param max_rows: The most resources of a type to collect before writing them
+    :param max_age_seconds: The longest a resource waits before being written
+    :param write: A function storing a file, given its name and content;
+        defaults to uploading it to the intake container
+    :param clock: A function returning the current time, in seconds
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        max_rows: int = 10000,
+        max_age_seconds: float = 60,
+        write: Optional[Callable[[str, bytes], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.output_path = output_path.rstrip("/")
+        self.max_rows = max_rows
+        self.max_age_seconds = max_age_seconds
+        self.files_written = 0
+        self.rows_written = 0
+        self._write = write or _upload
+        self._clock = clock
+        self._buffers = {resource_type: [] for resource_type in COLUMNS}
+        # When the oldest resource still waiting to be written was added
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def add(self, bundle: Dict, source_filename: str) -> None:
+        """
+        Collect the resources of a standardized bundle, writing any resource
+        types that are due.
+
+        :param bundle: The standardized bundle
+        :param source_filename: The name of the message the bundle came from
+        """
+        ingested_at = datetime.datetime.now(datetime.timezone.utc)
+        rows = extract_rows(bundle, source_filename, ingested_at)
+        with self._lock:
+            for resource_type, type_rows in rows.items():
+                self._buffers[resource_type].extend(type_rows)
+            if self._oldest is None and any(rows.values()):
+                self._oldest = self._clock()
+            expired = (
+                self._oldest is not None
+                and self._clock() - self._oldest >= self.max_age_seconds
+            )
+            full = [
+                resource_type
+                for resource_type, buffer in self._buffers.items()
+                if len(buffer) >= self.max_rows
+            ]
+
+        if expired:
+            self.flush()
+        elif full:
+            self.flush(full)
+
+    def flush(self, resource_types: Optional[Iterable[str]] = None) -> None:
+        """
+        Write the resources waiting to be written.  Resources that fail to be
+        written are kept, to be written with the next batch.
+
+        :param resource_types: The resource types to write, or every type
+        """
+        with self._lock:
+            batches = {}
+            for resource_type in resource_types or list(self._buffers):
+                batches[resource_type] = self._buffers[resource_type]
+                self._buffers[resource_type] = []
+            if not any(self._buffers.values()):
+                self._oldest = None
+
+        for resource_type, rows in batches.items():
+            by_date = {}
+            for row in rows:
+                ingest_date = row["ingested_at"].date().isoformat()
+                by_date.setdefault(ingest_date, []).append(row)
+
+            for ingest_date, date_rows in sorted(by_date.items()):
+                try:
+                    self._write_file(resource_type, ingest_date, date_rows)
+                except Exception:
+                    logging.exception(
+                        f"Failed to write {len(date_rows)} {resource_type} "
+                        + "resources to Parquet"
+                    )
+                    with self._lock:
+                        self._buffers[resource_type] = (
+                            date_rows + self._buffers[resource_type]
+                        )
+                        if self._oldest is None:
+                            self._oldest = self._clock()
+
+    def close(self) -> None:
+        """Write every resource still waiting to be written."""
+        self.flush()
+        with self._lock:
+            unwritten = sum(len(buffer) for buffer in self._buffers.values())
+        if unwritten:
+            logging.error(f"{unwritten} resources were never written to Parquet")
+
+    def _write_file(
+        self, resource_type: str, ingest_date: str, rows: List[Dict]
+    ) -> None:
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.Table.from_pylist(rows, schema=get_schema(resource_type))
+        buffer = io.BytesIO()
+        # The whole batch is a single row group
+        pyarrow.parquet.write_table(
+            table, buffer, compression="snappy", row_group_size=len(rows)
+        )
+        name = (
+            f"{self.output_path}/{resource_type}/ingest_date={ingest_date}/"
+            + f"{datetime.datetime.utcnow().strftime('%H%M%S')}-"
+            + f"{uuid.uuid4().hex}.parquet"
+        )
+        self._write(name, buffer.getvalue())
+        with self._lock:
+            self.files_written += 1
+            self.rows_written += len(rows)
+        logging.info(f"Wrote {len(rows)} {resource_type} resources to {name}")
+
+
+def get_schema(resource_type: str) -> "pyarrow.Schema":
+    """
+    Build the Parquet schema of a resource type, so every file of the type has
+    the same columns and types, even when a batch has no values for a column.
+
+    :param resource_type: One of the resource types in `COLUMNS`
+    """
+    import pyarrow
+
+    types = {
+        "string": pyarrow.string(),
+        "double": pyarrow.float64(),
+        "timestamp": pyarrow.timestamp("us", tz="UTC"),
+    }
+    return pyarrow.schema(
+        [
+            (name, types[column_type])
+            for name, column_type in COMMON_COLUMNS + COLUMNS[resource_type]
+        ]
+    )
+
+
+def extract_rows(
+    bundle: Dict, source_filename: str, ingested_at: datetime.datetime
+) -> Dict[str, List[Dict]]:
+    """
+    Flatten the Patient, Immunization and Observation resources of a bundle into
+    rows of their Parquet columns.
+
+    :param bundle: A standardized bundle
+    :param source_filename: The name of the message the bundle came from
+    :param ingested_at: When the bundle was ingested
+    :return: Dictionary mapping each resource type to its rows
+    """
+    extractors = {
+        "Patient": _patient_columns,
+        "Immunization": _immunization_columns,
+        "Observation": _observation_columns,
+    }
+    rows = {resource_type: [] for resource_type in COLUMNS}
+    for entry in bundle.get("entry", []):
+        resource = entry.get("resource", {})
+        resource_type = resource.get("resourceType")
+        if resource_type not in extractors:
+            continue
+        rows[resource_type].append(
+            {
+                "id": resource.get("id"),
+                "source_filename": source_filename,
+                "ingested_at": ingested_at,
+                "resource": json.dumps(resource, separators=(",", ":")),
+                **extractors[resource_type](resource),
+            }
+        )
+    return rows
+
+
+def _patient_columns(resource: Dict) -> Dict[str, Any]:
+    name = _first(resource, "name")
+    address = _first(resource, "address")
+    geolocation = next(
+        (
+            extension
+            for extension in address.get("extension", [])
+            if extension.get("url") == GEOLOCATION_URL
+        ),
+        {},
+    )
+    coordinates = {
+        extension.get("url"): extension.get("valueDecimal")
+        for extension in geolocation.get("extension", [])
+    }
+    phone = next(
+        (
+            telecom.get("value")
+            for telecom in resource.get("telecom", [])
+            if telecom.get("system") == "phone"
+        ),
+        None,
+    )
+    return {
+        "identifier": _first(resource, "identifier").get("value"),
+        "family": name.get("family"),
+        "given": " ".join(name.get("given", [])) or None,
+        "birth_date": resource.get("birthDate"),
+        "gender": resource.get("gender"),
+        "address_line": " ".join(address.get("line", [])) or None,
+        "city": address.get("city"),
+        "state": address.get("state"),
+        "postal_code": address.get("postalCode"),
+        "latitude": _to_float(coordinates.get("latitude")),
+        "longitude": _to_float(coordinates.get("longitude")),
+        "phone": phone,
+    }
+
+
+def _immunization_columns(resource: Dict) -> Dict[str, Any]:
+    coding = _first(resource.get("vaccineCode", {}), "coding")
+    return {
+        "patient_reference": resource.get("patient", {}).get("reference"),
+        "status": resource.get("status"),
+        "vaccine_system": coding.get("system"),
+        "vaccine_code": coding.get("code"),
+        "vaccine_display": coding.get("display"),
+        "occurrence": resource.get("occurrenceDateTime"),
+        "lot_number": resource.get("lotNumber"),
+    }
+
+
+def _observation_columns(resource: Dict) -> Dict[str, Any]:
+    coding = _first(resource.get("code", {}), "coding")
+    quantity = resource.get("valueQuantity", {})
+    value_string = resource.get("valueString")
+    if value_string is None:
+        value_string = _first(resource.get("valueCodeableConcept", {}), "coding").get(
+            "code"
+        )
+    return {
+        "patient_reference": resource.get("subject", {}).get("reference"),
+        "status": resource.get("status"),
+        "code_system": coding.get("system"),
+        "code": coding.get("code"),
+        "code_display": coding.get("display"),
+        "effective": resource.get("effectiveDateTime"),
+        "value_quantity": _to_float(quantity.get("value")),
+        "value_unit": quantity.get("unit"),
+        "value_string": value_string,
+    }
+
+
+def _first(element: Dict, key: str) -> Dict:
+    values = element.get(key) or [{}]
+    return values[0]
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _upload(name: str, data: bytes) -> None:
+    _get_container_client().upload_blob(name, data, overwrite=True)
+
+
+def _get_container_client() -> "ContainerClient":
+    """
+    Lazily build the client for the intake container, accessed using the
+    function app's managed identity.  Parquet files are binary, so they are
+    uploaded directly rather than with `store_data`.
+    """
+    global _container_client
+    if _container_client is None:
+        from azure.identity import DefaultAzureCredential
+        from azure.storage.blob import ContainerClient
+
+        _container_client = ContainerClient.from_container_url(
+            get_required_config("INTAKE_CONTAINER_URL"),
+            credential=DefaultAzureCredential(),
+        )
+    return _container_client
@@ -0,0 +1,260 @@
+import collections
+import contextlib
+import cProfile
+import datetime
+import logging
+import marshal
+import pstats
+import random
+import sys
+import threading
+
+from config import get_required_config
+from typing import Dict, Iterator, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from azure.storage.blob import ContainerClient
+
+PROFILERS = ("cprofile", "sampling")
+
+
+class SamplingProfiler:
+    """
+    A class that periodically samples the call stack of every thread in the
+    process from a background thread, and counts how often each stack is seen.
+    Sampling doesn't slow down the code being profiled the way tracing every
+    call does, and covers the threads messages are processed in.
+
+    :param interval_seconds: The time between samples
+    """
+
+    def __init__(self, interval_seconds: float = 0.01):
+        self.interval_seconds = interval_seconds
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Start sampling in a background thread."""
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling, and wait for the background thread to finish."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        """
+        Report the sampled stacks in the collapsed format read by flame graph
+        tools (eg: `flamegraph.pl` or speedscope): one line per distinct stack,
+        with its frames from the outermost in, separated by `;`, followed by the
+        number of samples it was seen in.
+        """
+        return "".join(
+            f"{';'.join(stack)} {count}\n"
+            for stack, count in sorted(self.stacks.items())
+        )
+
+    def sample(self) -> None:
+        """Record the current stack of every thread but the profiler's own."""
+        own_thread = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_describe_frame(frame))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval_seconds):
+            self.sample()
+
+
+class ThreadedProfile:
+    """
+    A class running `cProfile` in the invocation's thread and in every thread
+    started while it is enabled (eg: the threads messages are processed in), and
+    merging their statistics.  On Python 3.12 and later, a single profile
+    already covers every thread.
+    """
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start profiling the current thread, and any threads started later."""
+        self._enable()
+        threading.setprofile(self._start_thread)
+
+    def stop(self) -> pstats.Stats:
+        """Stop profiling, and merge the statistics of every profiled thread."""
+        threading.setprofile(None)
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = None
+        # The invocation's own profile is last, since stopping another thread's
+        # profile also stops profiling the current thread
+        for profile in reversed(profiles):
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def _start_thread(self, frame, event, arg) -> None:
+        # Replaces itself with a profile of the new thread on its first event
+        sys.setprofile(None)
+        try:
+            self._enable()
+        except ValueError:
+            # Another profile is already active, and covers this thread too
+            pass
+
+    def _enable(self) -> None:
+        profile = cProfile.Profile()
+        profile.enable()
+        with self._lock:
+            self._profiles.append(profile)
+
+
+def is_profiled() -> bool:
+    """
+    Decide whether to profile an invocation.  A fraction of invocations
+    (`INTAKE_PROFILE_SAMPLE_RATE`) are profiled, and only if there is somewhere
+    to store the profile.
+    """
+    if not get_required_config("DIAGNOSTICS_OUTPUT_CONTAINER_PATH", ""):
+        return False
+    return random.random() < float(
+        get_required_config("INTAKE_PROFILE_SAMPLE_RATE", "0")
+    )
+
+
+@contextlib.contextmanager
+def profile_invocation(blob_name: str) -> Iterator[None]:
+    """
+    Profile the processing of a blob, if this invocation is chosen to be
+    profiled, and store the profile under `DIAGNOSTICS_OUTPUT_CONTAINER_PATH`,
+    at the blob's own name.  `INTAKE_PROFILER` chooses between `cprofile`, which
+    stores a `.pstats` file of every function called, and `sampling`, which
+    stores the stacks seen every `INTAKE_PROFILE_INTERVAL_MS` as a `.collapsed`
+    file for flame graph tools.
+
+    Both profilers see every thread of the worker process, so a profile may
+    include other invocations running at the same time.  Profiles never
+    contain message contents.
+
+    :param blob_name: The name of the blob being processed, including its
+        container
+    """
+    if not is_profiled():
+        yield
+        return
+
+    profiler_name = get_required_config("INTAKE_PROFILER", "cprofile")
+    if profiler_name not in PROFILERS:
+        logging.warning(f"Unknown profiler {profiler_name}, using cprofile")
+        profiler_name = "cprofile"
+
+    if profiler_name == "sampling":
+        profiler = SamplingProfiler(
+            float(get_required_config("INTAKE_PROFILE_INTERVAL_MS", "10")) / 1000
+        )
+    else:
+        profiler = ThreadedProfile()
+
+    logging.info(f"Profiling {blob_name} with {profiler_name}")
+    profiler.start()
+    try:
+        yield
+    finally:
+        if profiler_name == "sampling":
+            profiler.stop()
+            store_profile(blob_name, "collapsed", profiler.collapsed().encode("utf-8"))
+        else:
+            stats = profiler.stop()
+            store_profile(blob_name, "pstats", marshal.dumps(stats.stats))
+            _log_hottest(blob_name, stats)
+
+
+def store_profile(blob_name: str, extension: str, data: bytes) -> Optional[str]:
+    """
+    Store a profile in the intake container, under
+    `DIAGNOSTICS_OUTPUT_CONTAINER_PATH/profiles`, named after the blob that was
+    processed and the time it was stored.  Failures are logged rather than
+    raised, since diagnostics must never fail the invocation.
+
+    :param blob_name: The name of the blob that was processed
+    :param extension: The file extension of the profile's format
+    :param data: The profile
+    :return: The name the profile was stored at, or None if it wasn't stored
+    """
+    diagnostics_path = get_required_config("DIAGNOSTICS_OUTPUT_CONTAINER_PATH")
+    timestamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    name = (
+        f"{diagnostics_path.rstrip('/')}/profiles/{blob_name}.{timestamp}.{extension}"
+    )
+    try:
+        _get_container_client().upload_blob(name, data, overwrite=True)
+    except Exception:
+        logging.exception(f"Failed to store the profile of {blob_name}")
+        return None
+    logging.info(f"Stored the profile of {blob_name} at {name}")
+    return name
+
+
+def _log_hottest(blob_name: str, stats: pstats.Stats, count: int = 10) -> None:
+    """Log the functions that took the most time, excluding the ones they called."""
+    hottest: List[Dict] = [
+        {
+            "function": _describe_function(function),
+            "calls": call_count,
+            "seconds": round(total_time, 3),
+        }
+        for function, (_, call_count, total_time, _, _) in sorted(
+            stats.stats.items(), key=lambda item: item[1][2], reverse=True
+        )[:count]
+    ]
+    logging.info(f"Hottest functions processing {blob_name}: {hottest}")
+
+
+def _describe_frame(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({_shorten(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _describe_function(function) -> str:
+    filename, line, name = function
+    return f"{name} ({_shorten(filename)}:{line})"
+
+
+def _shorten(filename: str) -> str:
+    """Drop the installation directory from the path of a library's file."""
+    for marker in ("site-packages/", "dist-packages/"):
+        if marker in filename:
+            return filename.rsplit(marker, 1)[1]
+    return filename
+
+
+def _get_container_client() -> "ContainerClient":
+    """
+    Build the client for the intake container, accessed using the function
+    app's managed identity.  Profiles are binary, so they are uploaded directly
+    rather than with `store_data`.
+    """
+    from azure.identity import DefaultAzureCredential
+    from azure.storage.blob import ContainerClient
+
+    return ContainerClient.from_container_url(
+        get_required_config("INTAKE_CONTAINER_URL"),
+        credential=DefaultAzureCredential(),
+    )
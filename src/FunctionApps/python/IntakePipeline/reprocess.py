@@ -0,0 +1,400 @@
+"""
+Reprocess every blob under a prefix of a container through the IntakePipeline,
+eg: to re-run a month of data after a template fix, or to replay the messages
+stored under the invalid output path.
+
+The prefix is listed in parallel, one listing per sub-directory (eg: per record
+type).  Blobs are assigned to shards by a hash of their name, so the work can be
+split across machines (`--shard-count`/`--shard-index`) and, on each machine,
+across worker processes (`--processes`), without any coordination between them.
+Each process sends its blobs through the pipeline a few at a time
+(`--concurrency`), exactly as if they had triggered the IntakePipeline function,
+and reports its progress and throughput as it goes.
+
+Every blob processed is recorded in a checkpoint manifest, so a run that is
+interrupted can be started again with the same options and picks up where it
+stopped.  Blobs that have changed since they were processed are processed again.
+
+Run from the function app root (src/FunctionApps/python), with the same settings
+as the function app in the environment, eg:
+
+    python -m IntakePipeline.reprocess decrypted/valid-messages/VXU/2022-07 \\
+        --shard-count 4 --shard-index 0 --processes 4
+"""
+
+import concurrent.futures
+import fnmatch
+import hashlib
+import json
+import logging
+import pathlib
+import threading
+import time
+import typer
+
+from azure.core import MatchConditions
+from config import get_required_config
+from typing import Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from IntakePipeline.continuation import BlobStream, Deadline
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobProperties, ContainerClient
+
+
+def get_shard(name: str, shard_count: int, processes: int = 1) -> Tuple[int, int]:
+    """
+    Assign a blob to a shard, and to a worker process within the shard, by a hash
+    of its name.  The shard doesn't depend on the number of processes, so
+    machines may run different numbers of processes.
+
+    :param name: The name of the blob
+    :param shard_count: The number of shards (eg: machines)
+    :param processes: The number of worker processes per shard
+    :return: The shard and process the blob belongs to
+    """
+    digest = int(hashlib.sha256(name.encode("utf-8")).hexdigest(), 16)
+    return digest % shard_count, digest // shard_count % processes
+
+
+def list_blobs(
+    container_client: "ContainerClient", prefix: str, concurrency: int
+) -> Iterator["BlobProperties"]:
+    """
+    List the blobs under a prefix.  Pages of a single listing can only be read
+    one after another, so each sub-directory directly under the prefix is listed
+    separately, several at a time.
+
+    :param container_client: The client of the container to list
+    :param prefix: The prefix to list
+    :param concurrency: The number of listings run at the same time
+    """
+    directories = []
+    for item in container_client.walk_blobs(name_starts_with=prefix, delimiter="/"):
+        if item.name.endswith("/"):
+            directories.append(item.name)
+        else:
+            yield item
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        listings = executor.map(
+            lambda directory: list(
+                container_client.list_blobs(name_starts_with=directory)
+            ),
+            directories,
+        )
+        for listing in listings:
+            yield from listing
+
+
+class Checkpoint:
+    """
+    A class recording the blobs a reprocessing run has finished, in a manifest of
+    one JSON line per blob.  Each process appends to its own manifest, and the
+    manifests of every process are read when a run starts again, so a run may
+    be resumed with a different number of processes.
+
+    :param directory: The directory holding the manifests
+    :param run: The options that determine which blobs a run covers.  Resuming
+        a run with different options is refused, since its manifests wouldn't
+        describe the same blobs.
+    :param name: The name of this process's manifest
+    """
+
+    def __init__(self, directory: pathlib.Path, run: Dict, name: str):
+        directory.mkdir(parents=True, exist_ok=True)
+        run_path = directory / "run.json"
+        if run_path.exists():
+            previous_run = json.loads(run_path.read_text())
+            if previous_run != run:
+                raise ValueError(
+                    f"Checkpoint {directory} belongs to a different run: "
+                    + json.dumps(previous_run)
+                )
+        else:
+            run_path.write_text(json.dumps(run))
+
+        # The etag of every blob finished by any process
+        self.done = {}
+        for path in sorted(directory.glob("*.jsonl")):
+            for line in path.read_text().splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line of an interrupted manifest may be incomplete
+                    continue
+                self.done[record["name"]] = record["etag"]
+
+        self._lock = threading.Lock()
+        self._file = open(directory / f"{name}.jsonl", "a")
+
+    def is_done(self, name: str, etag: str) -> bool:
+        """Determine whether a blob was finished, and hasn't changed since."""
+        return self.done.get(name) == etag
+
+    def record(self, name: str, etag: str) -> None:
+        """Record that a blob has been finished."""
+        with self._lock:
+            self._file.write(json.dumps({"name": name, "etag": etag}) + "\n")
+            self._file.flush()
+            self.done[name] = etag
+
+    def close(self) -> None:
+        """Close this process's manifest."""
+        self._file.close()
+
+
+class Progress:
+    """
+    A class reporting the progress and throughput of a process, at most once
+    every `interval` seconds.
+    """
+
+    def __init__(self, label: str, total: int, interval: float):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.counts = {"processed": 0, "skipped": 0, "failed": 0}
+        self.bytes_processed = 0
+        self._start = time.monotonic()
+        self._reported = self._start
+        self._lock = threading.Lock()
+
+    def add(self, outcome: str, size: int = 0) -> None:
+        """Count a finished blob, reporting progress if it's been a while."""
+        with self._lock:
+            self.counts[outcome] += 1
+            self.bytes_processed += size
+            now = time.monotonic()
+            if now - self._reported >= self.interval:
+                self._reported = now
+                typer.echo(self.describe())
+
+    def summary(self) -> Dict:
+        """Report the blobs and bytes processed, and the time taken."""
+        seconds = time.monotonic() - self._start
+        return {
+            **self.counts,
+            "bytes": self.bytes_processed,
+            "seconds": round(seconds, 3),
+        }
+
+    def describe(self) -> str:
+        """Describe the progress and throughput so far."""
+        seconds = max(time.monotonic() - self._start, 1e-9)
+        finished = sum(self.counts.values())
+        return (
+            f"[{self.label}] {finished}/{self.total} blobs "
+            + f"({self.counts['failed']} failed, {self.counts['skipped']} skipped), "
+            + f"{self.counts['processed'] / seconds:.2f} blobs/s, "
+            + f"{self.bytes_processed / seconds / 2**20:.2f} MiB/s"
+        )
+
+
+def reprocess(
+    container_client: "ContainerClient",
+    blobs: List["BlobProperties"],
+    checkpoint: Checkpoint,
+    concurrency: int,
+    progress: Progress,
+) -> Dict:
+    """
+    Send blobs through the IntakePipeline, a few at a time, skipping those the
+    checkpoint records as finished.  A blob that fails (eg: because it can't be
+    downloaded) is logged and left out of the checkpoint, so it is tried again
+    when the run is resumed.
+
+    :param container_client: The client of the container holding the blobs
+    :param blobs: The blobs to process
+    :param checkpoint: The checkpoint recording finished blobs
+    :param concurrency: The number of blobs processed at the same time
+    :param progress: Tracks and reports the blobs processed
+    :return: The number of blobs processed, skipped and failed, the bytes
+        processed and the time taken
+    """
+    from IntakePipeline import process_blob
+
+    def process(blob: "BlobProperties") -> None:
+        if checkpoint.is_done(blob.name, blob.etag):
+            progress.add("skipped")
+            return
+        try:
+            # Only process the version of the blob that was listed
+            downloader = container_client.download_blob(
+                blob.name, etag=blob.etag, match_condition=MatchConditions.IfNotModified
+            )
+            processed = process_blob(
+                BlobStream(
+                    f"{container_client.container_name}/{blob.name}",
+                    blob.size,
+                    downloader,
+                    blob.etag,
+                ),
+                deadline=Deadline(0),
+            )
+        except Exception:
+            logging.exception(f"Failed to reprocess {blob.name}")
+            processed = False
+        if not processed:
+            progress.add("failed")
+            return
+        checkpoint.record(blob.name, blob.etag)
+        progress.add("processed", blob.size)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Consume the results so every blob has finished before returning
+        list(executor.map(process, blobs))
+    return progress.summary()
+
+
+def run_process(options: Dict, process_index: int) -> Dict:
+    """
+    List the prefix and reprocess the blobs belonging to one process of this
+    machine's shard.  Runs in a worker process of its own when there is more
+    than one.
+
+    :param options: The options of the run
+    :param process_index: The process of the shard to run
+    """
+    logging.basicConfig(level=options["log_level"])
+    container_client = get_container_client(options["container_url"])
+    blobs = [
+        blob
+        for blob in list_blobs(
+            container_client, options["prefix"], options["listing_concurrency"]
+        )
+        if _matches(blob.name, options["include"], options["exclude"])
+        and get_shard(blob.name, options["shard_count"], options["processes"])
+        == (options["shard_index"], process_index)
+    ]
+
+    label = (
+        f"shard {options['shard_index']}/{options['shard_count']} "
+        + f"process {process_index}/{options['processes']}"
+    )
+    if options["dry_run"]:
+        size = sum(blob.size for blob in blobs)
+        typer.echo(f"[{label}] {len(blobs)} blobs, {size} bytes")
+        return {"processed": 0, "skipped": 0, "failed": 0, "bytes": 0, "seconds": 0}
+
+    checkpoint = Checkpoint(
+        pathlib.Path(options["checkpoint_dir"]),
+        {
+            key: options[key]
+            for key in ["container_url", "prefix", "include", "exclude"]
+            + ["shard_count", "shard_index"]
+        },
+        f"process-{process_index}-of-{options['processes']}",
+    )
+    progress = Progress(label, len(blobs), options["progress_interval"])
+    try:
+        summary = reprocess(
+            container_client, blobs, checkpoint, options["concurrency"], progress
+        )
+    finally:
+        checkpoint.close()
+    typer.echo(progress.describe())
+    return summary
+
+
+def get_container_client(container_url: str) -> "ContainerClient":
+    """
+    Build the client for a blob container, accessed using the signed-in Azure
+    identity (eg: from `az login`) or a managed identity.
+
+    :param container_url: The url of the container
+    """
+    from azure.identity import DefaultAzureCredential
+    from azure.storage.blob import ContainerClient
+
+    return ContainerClient.from_container_url(
+        container_url, credential=DefaultAzureCredential()
+    )
+
+
+def _matches(name: str, include: List[str], exclude: List[str]) -> bool:
+    filename = name.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(filename, pattern) for pattern in include) and not any(
+        fnmatch.fnmatch(filename, pattern) for pattern in exclude
+    )
+
+
+def main(
+    prefix: str = typer.Argument(..., help="The prefix of the blobs to reprocess"),
+    container_url: Optional[str] = typer.Option(
+        None, help="The container to reprocess (default = INTAKE_CONTAINER_URL)"
+    ),
+    include: List[str] = typer.Option(
+        ["*"], help="Only reprocess blobs whose file names match these patterns"
+    ),
+    exclude: List[str] = typer.Option(
+        ["*-resp", "*.entry-*", "*.fhir"],
+        help="Skip blobs whose file names match these patterns (by default, the "
+        + "responses, entries and bundles stored alongside messages)",
+    ),
+    shard_count: int = typer.Option(1, help="The number of machines sharing the run"),
+    shard_index: int = typer.Option(0, help="The shard this machine runs, from 0"),
+    processes: int = typer.Option(1, help="The number of worker processes to run"),
+    concurrency: int = typer.Option(
+        4, help="The number of blobs each process works on at the same time"
+    ),
+    listing_concurrency: int = typer.Option(
+        8, help="The number of sub-directories listed at the same time"
+    ),
+    checkpoint_dir: pathlib.Path = typer.Option(
+        pathlib.Path("reprocess-checkpoint"),
+        help="The directory holding the checkpoint manifests of the run",
+    ),
+    progress_interval: float = typer.Option(
+        10, help="The number of seconds between progress reports"
+    ),
+    dry_run: bool = typer.Option(
+        False, help="Only count the blobs that would be reprocessed"
+    ),
+    verbose: bool = typer.Option(False, help="Show the pipeline's logs"),
+) -> None:
+    if not 0 <= shard_index < shard_count:
+        typer.echo("--shard-index must be between 0 and --shard-count - 1", err=True)
+        raise typer.Exit(code=1)
+
+    options = {
+        "prefix": prefix,
+        "container_url": container_url or get_required_config("INTAKE_CONTAINER_URL"),
+        "include": list(include),
+        "exclude": list(exclude),
+        "shard_count": shard_count,
+        "shard_index": shard_index,
+        "processes": processes,
+        "concurrency": concurrency,
+        "listing_concurrency": listing_concurrency,
+        "checkpoint_dir": str(checkpoint_dir),
+        "progress_interval": progress_interval,
+        "dry_run": dry_run,
+        "log_level": logging.INFO if verbose else logging.WARNING,
+    }
+
+    try:
+        if processes == 1:
+            summaries = [run_process(options, 0)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes
+            ) as executor:
+                summaries = list(
+                    executor.map(run_process, [options] * processes, range(processes))
+                )
+    except ValueError as error:
+        typer.echo(str(error), err=True)
+        raise typer.Exit(code=1)
+
+    total = {
+        key: sum(summary[key] for summary in summaries)
+        for key in ["processed", "skipped", "failed", "bytes"]
+    }
+    typer.echo(f"Reprocessing summary: {json.dumps(total)}")
+    if total["failed"]:
+        raise typer.Exit(code=2)
+
+
+if __name__ == "__main__":
+    typer.run(main)
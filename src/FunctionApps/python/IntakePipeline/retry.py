@@ -0,0 +1,271 @@
+import json
+import logging
+import requests
+import time
+
+from azure.core.exceptions import ResourceExistsError
+from config import get_required_config
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING
+
+from IntakePipeline.continuation import Deadline
+
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient
+
+RETRY_QUEUE_NAME = "intake-retry"
+
+# Status codes that indicate the FHIR server (or something in front of it) was
+# temporarily unable to handle the request, rather than a problem with the message
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Statuses of individual batch entries that are worth resubmitting: conflicting
+# or stale concurrent writes, throttling, and server errors (any 5xx)
+RETRYABLE_ENTRY_STATUS_CODES = {409, 412, 429}
+
+# Storage queue messages are limited to 64 KiB, and base64 encoding the payload
+# inflates it by a third
+MAX_PAYLOAD_BYTES = 48 * 1024
+
+_queue_client = None
+
+
+def is_transient_failure(response: Optional[requests.Response]) -> bool:
+    """
+    Determine whether a failed convert or upload request is worth retrying.
+    A missing response means the request never completed (eg: a timeout or a
+    connection error), which is always considered transient.
+
+    :param response: The response from the FHIR server, if one was received
+    """
+    return response is None or response.status_code in RETRYABLE_STATUS_CODES
+
+
+def get_retry_delay(attempt: int) -> int:
+    """
+    Compute the number of seconds a retried message should stay invisible on
+    the retry queue.  The delay doubles with each attempt, up to a configured
+    maximum.
+
+    :param attempt: The number of attempts already made for the message
+    """
+    base_delay = float(get_required_config("RETRY_BASE_DELAY_SECONDS", "30"))
+    max_delay = float(get_required_config("RETRY_MAX_DELAY_SECONDS", "3600"))
+    return int(min(base_delay * 2 ** (attempt - 1), max_delay))
+
+
+def schedule_retry(
+    message: str, message_mappings: Dict[str, str], attempt: int
+) -> bool:
+    """
+    Place a message on the retry queue so it is redelivered to the IntakeRetry
+    function after an exponentially increasing delay.  Nothing is queued when
+    the message has used up its attempts, is too large to fit on the queue, or
+    the queue cannot be reached; the caller is expected to dead-letter the
+    message in that case.
+
+    :param message: The raw message that failed to process
+    :param message_mappings: Dictionary having the appropriate
+        template mapping for the type of file being processed
+    :param attempt: The number of attempts already made for the message
+    :return: True if the message was queued for another attempt
+    """
+    max_attempts = int(get_required_config("RETRY_MAX_ATTEMPTS", "5"))
+    if attempt >= max_attempts:
+        logging.warning(
+            f"Giving up on {message_mappings['filename']} after {attempt} attempts"
+        )
+        return False
+
+    delay = get_retry_delay(attempt)
+    if not _enqueue(message, message_mappings, attempt + 1, delay):
+        return False
+
+    logging.info(
+        f"Queued {message_mappings['filename']} for attempt {attempt + 1} "
+        + f"in {delay} seconds"
+    )
+    return True
+
+
+def park_message(
+    message: str, message_mappings: Dict[str, str], attempt: int, delay: int
+) -> bool:
+    """
+    Place a message on the retry queue without using up an attempt, so it is
+    processed again once a dependency whose circuit breaker is open has had time
+    to recover.
+
+    :param message: The raw message that couldn't be processed
+    :param message_mappings: Dictionary having the appropriate
+        template mapping for the type of file being processed
+    :param attempt: The number of the attempt that was deferred
+    :param delay: The number of seconds before the message is processed again
+    :return: True if the message was queued
+    """
+    if not _enqueue(message, message_mappings, attempt, delay):
+        return False
+
+    logging.info(f"Parked {message_mappings['filename']} for {delay} seconds")
+    return True
+
+
+def _enqueue(
+    message: str, message_mappings: Dict[str, str], attempt: int, delay: int
+) -> bool:
+    """Queue a message for the given attempt, unless it's too large to fit."""
+    payload = json.dumps(
+        {
+            "message": message,
+            "message_mappings": message_mappings,
+            "attempt": attempt,
+        }
+    )
+    if len(payload.encode("utf-8")) > MAX_PAYLOAD_BYTES:
+        logging.warning(
+            f"Message {message_mappings['filename']} is too large to retry via queue"
+        )
+        return False
+
+    try:
+        _get_queue_client().send_message(payload, visibility_timeout=delay)
+    except Exception:
+        logging.exception(
+            f"Failed to queue {message_mappings['filename']} for another attempt"
+        )
+        return False
+    return True
+
+
+def is_retryable_entry(entry: Dict) -> bool:
+    """
+    Determine whether a failed entry of a batch upload is worth resubmitting,
+    unless it is a conflict (see `is_conflict`).
+
+    :param entry: An entry of the batch-response bundle returned by the FHIR
+        server, whose `response.status` starts with the status code
+    """
+    status = entry.get("response", {}).get("status", "")
+    try:
+        status_code = int(status.split(" ", 1)[0])
+    except ValueError:
+        return False
+    return status_code in RETRYABLE_ENTRY_STATUS_CODES or 500 <= status_code < 600
+
+
+def is_conflict(entry: Dict, response_entry: Dict) -> bool:
+    """
+    Determine whether an entry was rejected because its resource changed since
+    the version it was conditioned on (a 412 on an `ifMatch` entry).  Sending it
+    again, with or without the condition, can't succeed without overwriting
+    that change, so it isn't resubmitted.
+
+    :param entry: An entry of the uploaded batch bundle
+    :param response_entry: The entry of the batch-response bundle for it
+    """
+    status = response_entry.get("response", {}).get("status", "")
+    return status.startswith("412") and "ifMatch" in entry.get("request", {})
+
+
+def resubmit_failed_entries(
+    bundle: Dict,
+    response_entries: List[Dict],
+    upload: Callable[[Dict], requests.Response],
+    filename: str,
+    deadline: Optional[Deadline] = None,
+) -> List[Dict]:
+    """
+    Resubmit the entries of a batch upload that failed for a retryable reason,
+    in a follow-up batch holding only those entries, until they succeed or
+    `ENTRY_RETRY_MAX_ATTEMPTS` uploads have been made.  Each resubmission waits
+    for an exponentially increasing delay (`ENTRY_RETRY_BASE_DELAY_SECONDS`,
+    doubling up to `ENTRY_RETRY_MAX_DELAY_SECONDS`) to give the server time to
+    recover, unless the invocation's time budget would run out first.  Entries
+    rejected because the resource changed since the version they were
+    conditioned on (a 412) are conflicts, and aren't resubmitted.
+
+    :param bundle: The batch bundle that was uploaded
+    :param response_entries: The entries of the batch-response bundle, in the
+        same order as the entries of `bundle`
+    :param upload: A function that uploads a batch bundle to the FHIR server
+    :param filename: The name of the message being uploaded, for logging
+    :param deadline: The time budget of the invocation, if any
+    :return: The latest response for every entry of `bundle`, in order
+    """
+    max_attempts = int(get_required_config("ENTRY_RETRY_MAX_ATTEMPTS", "3"))
+    base_delay = float(get_required_config("ENTRY_RETRY_BASE_DELAY_SECONDS", "1"))
+    max_delay = float(get_required_config("ENTRY_RETRY_MAX_DELAY_SECONDS", "10"))
+
+    response_entries = list(response_entries)
+    entries = bundle.get("entry", [])
+    conflicts = set()
+    for attempt in range(1, max_attempts):
+        indexes = []
+        for index, response_entry in enumerate(response_entries):
+            if not is_retryable_entry(response_entry):
+                continue
+            if is_conflict(entries[index], response_entry):
+                conflicts.add(index)
+            else:
+                indexes.append(index)
+        if not indexes:
+            break
+
+        delay = min(base_delay * 2 ** (attempt - 1), max_delay)
+        if deadline is not None and delay >= deadline.remaining():
+            logging.warning(
+                f"Not resubmitting {len(indexes)} failed entries of {filename}, "
+                + "the time budget has run out"
+            )
+            break
+        time.sleep(delay)
+        logging.info(
+            f"Resubmitting {len(indexes)} failed entries of {filename} "
+            + f"(upload {attempt + 1} of {max_attempts})"
+        )
+        retry_bundle = {**bundle, "entry": [entries[index] for index in indexes]}
+        try:
+            response = upload(retry_bundle)
+        except requests.exceptions.RequestException:
+            logging.exception(f"Resubmission of failed entries of {filename} failed")
+            continue
+        if response is None or response.status_code != 200:
+            continue
+
+        for index, entry in zip(indexes, response.json().get("entry", [])):
+            response_entries[index] = entry
+
+    if conflicts:
+        logging.warning(
+            f"{len(conflicts)} entries of {filename} conflict with changes made to "
+            + "their resources since they were last uploaded"
+        )
+    return response_entries
+
+
+def _get_queue_client() -> "QueueClient":
+    """
+    Lazily build the client for the retry queue.  The queue lives in the same
+    storage account the function app uses for its triggers, and is accessed
+    using the function app's managed identity.  The queue is created on first
+    use since the IntakeRetry trigger only listens on it.
+
+    The queue SDK is imported here rather than at module load, since most
+    invocations never need to retry anything.
+    """
+    global _queue_client
+    if _queue_client is None:
+        from azure.identity import DefaultAzureCredential
+        from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+
+        queue_client = QueueClient(
+            account_url=get_required_config("AzureWebJobsStorage__queueServiceUri"),
+            queue_name=RETRY_QUEUE_NAME,
+            credential=DefaultAzureCredential(),
+            message_encode_policy=TextBase64EncodePolicy(),
+        )
+        try:
+            queue_client.create_queue()
+        except ResourceExistsError:
+            pass
+        _queue_client = queue_client
+    return _queue_client
@@ -0,0 +1,173 @@
+import collections
+import contextlib
+import functools
+import logging
+import threading
+import time
+
+from config import get_required_config
+from phdi.azure import store_data
+from typing import Dict, Iterator, Optional
+
+# Number of recent message latencies used to compute the capture percentile
+LATENCY_WINDOW = 1000
+
+# Don't capture by percentile until enough latencies have been seen for the
+# percentile to mean something
+MIN_PERCENTILE_SAMPLES = 100
+
+CAPTURE_FORMAT_VERSION = 1
+
+
+class StageTimer:
+    """
+    A class that records how long each stage of processing a message takes, in
+    milliseconds.  A stage that runs more than once accumulates its time.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a stage of processing for the duration of the context.
+
+        :param name: The name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed_ms, 3)
+
+    def total_ms(self) -> float:
+        """The time since the timer was created, in milliseconds."""
+        return round((time.perf_counter() - self._start) * 1000, 3)
+
+
+class SlowMessageSampler:
+    """
+    A class that decides which messages are slow enough to capture for offline
+    replay.  A message is slow if it took at least `threshold_ms`, or if it was
+    at least as slow as the given percentile of recent messages.  Captures are
+    limited to `max_captures_per_hour` so that a general slowdown (eg: a FHIR
+    server outage) doesn't copy every message.
+
+    :param threshold_ms: Messages taking at least this many milliseconds are
+        always slow; 0 disables the absolute threshold
+    :param percentile: Messages at or above this percentile of recent latencies
+        are slow; 0 disables the percentile
+    :param max_captures_per_hour: The most messages captured by a worker in any
+        hour
+    """
+
+    def __init__(
+        self, threshold_ms: float, percentile: float, max_captures_per_hour: int
+    ):
+        self.threshold_ms = threshold_ms
+        self.percentile = percentile
+        self.max_captures_per_hour = max_captures_per_hour
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._captures = collections.deque()
+
+    def observe(self, latency_ms: float) -> bool:
+        """
+        Record a message's latency and determine whether it should be captured.
+
+        :param latency_ms: The time taken to process the message, in milliseconds
+        """
+        with self._lock:
+            cutoff = self._percentile_cutoff()
+            self._latencies.append(latency_ms)
+
+            slow = (self.threshold_ms and latency_ms >= self.threshold_ms) or (
+                cutoff is not None and latency_ms >= cutoff
+            )
+            if not slow:
+                return False
+
+            now = time.monotonic()
+            while self._captures and now - self._captures[0] > 3600:
+                self._captures.popleft()
+            if len(self._captures) >= self.max_captures_per_hour:
+                return False
+            self._captures.append(now)
+            return True
+
+    def _percentile_cutoff(self) -> Optional[float]:
+        if not self.percentile or len(self._latencies) < MIN_PERCENTILE_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_sampler() -> SlowMessageSampler:
+    """Get the slow-message sampler shared by every invocation in this worker."""
+    return SlowMessageSampler(
+        threshold_ms=float(get_required_config("SLOW_MESSAGE_THRESHOLD_MS", "30000")),
+        percentile=float(get_required_config("SLOW_MESSAGE_PERCENTILE", "99")),
+        max_captures_per_hour=int(
+            get_required_config("SLOW_MESSAGE_MAX_CAPTURES_PER_HOUR", "20")
+        ),
+    )
+
+
+def capture_slow_message(
+    message: str,
+    message_mappings: Dict[str, str],
+    timer: StageTimer,
+    attempt: int,
+) -> None:
+    """
+    Record a message's processing time and, if it was slow, store the raw
+    message, its template mappings and per-stage timings for offline replay.
+
+    Captured messages contain PHI, so they are only stored alongside the
+    pipeline's other message copies in the intake container, under
+    `DIAGNOSTICS_OUTPUT_CONTAINER_PATH`.  Capture is disabled when that setting
+    is empty, and message contents are never logged.
+
+    :param message: The raw message that was processed
+    :param message_mappings: Dictionary having the appropriate
+        template mapping for the type of file being processed
+    :param timer: The timings recorded while processing the message
+    :param attempt: The number of times this message has been attempted,
+        including this one
+    """
+    diagnostics_path = get_required_config("DIAGNOSTICS_OUTPUT_CONTAINER_PATH", "")
+    if not diagnostics_path:
+        return
+
+    total_ms = timer.total_ms()
+    if not get_sampler().observe(total_ms):
+        return
+
+    logging.warning(
+        f"Capturing slow message {message_mappings['filename']} "
+        + f"({total_ms:.0f} ms): {timer.timings}"
+    )
+    try:
+        store_data(
+            container_url=get_required_config("INTAKE_CONTAINER_URL"),
+            prefix=f"{diagnostics_path.rstrip('/')}/slow-messages",
+            filename=f"{message_mappings['filename']}.json",
+            bundle_type=message_mappings["bundle_type"],
+            message_json={
+                "version": CAPTURE_FORMAT_VERSION,
+                "message": message,
+                "message_mappings": message_mappings,
+                "attempt": attempt,
+                "total_ms": total_ms,
+                "timings": timer.timings,
+            },
+        )
+    except Exception:
+        # Diagnostics must never fail the message itself
+        logging.exception(
+            f"Failed to capture slow message {message_mappings['filename']}"
+        )
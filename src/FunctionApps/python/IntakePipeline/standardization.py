@@ -0,0 +1,114 @@
+import functools
+import logging
+
+from config import get_required_config
+from IntakePipeline.breakers import get_breaker
+from IntakePipeline.memoize import memoize_module_functions
+from IntakePipeline.slow_messages import StageTimer
+from typing import Dict, Optional, Sequence, TYPE_CHECKING
+
+import phdi.standardize
+
+from phdi.geo import geocode_patients
+from phdi.linkage import add_patient_identifier
+from phdi.standardize import (
+    standardize_patient_names,
+    standardize_all_phones,
+)
+
+if TYPE_CHECKING:
+    from smartystreets_python_sdk import us_street
+
+# The transforms applied to each patient, in order
+STEPS = ("standardize_names", "standardize_phones", "geocode", "add_identifier")
+
+# The value-level normalizers behind `standardize_patient_names` and
+# `standardize_all_phones`
+NORMALIZERS = ("standardize_name", "standardize_phone")
+
+
+def standardize_patients(
+    bundle: Dict,
+    geocoder: "us_street.Client",
+    salt: str,
+    timer: Optional[StageTimer] = None,
+    steps: Sequence[str] = STEPS,
+) -> Dict:
+    """
+    Standardize the names, phone numbers and addresses of every Patient in a
+    bundle, and add the linking identifier, in a single pass over the bundle.
+
+    The bundle's entries are visited once.  Each Patient entry is passed through
+    the same transforms as before, in the same order, but on a bundle holding
+    only that entry, so no transform walks or copies the rest of the bundle
+    (eg: a large ORU panel's Observations).  The standardized Patient replaces
+    the original entry, so the bundle is updated in place.
+
+    :param bundle: The FHIR bundle to standardize
+    :param geocoder: The SmartyStreets client used to geocode addresses
+    :param salt: The salt used when hashing the patient identifier
+    :param timer: A timer to accumulate the time taken by each transform in
+    :param steps: The transforms to apply, from `STEPS`; the pipelined engine
+        applies them in separate stages
+    :return: The standardized bundle
+    """
+    _memoize_normalizers()
+    timer = timer or StageTimer()
+    transforms = {
+        "standardize_names": standardize_patient_names,
+        "standardize_phones": standardize_all_phones,
+        "geocode": lambda patient_bundle: _geocode(patient_bundle, geocoder),
+        "add_identifier": lambda patient_bundle: add_patient_identifier(
+            patient_bundle, salt
+        ),
+    }
+    steps = [step for step in STEPS if step in steps]
+
+    entries = bundle.get("entry", [])
+    for index, entry in enumerate(entries):
+        if entry.get("resource", {}).get("resourceType") != "Patient":
+            continue
+
+        patient_bundle = {**bundle, "entry": [entry]}
+        for step in steps:
+            with timer.stage(step):
+                patient_bundle = transforms[step](patient_bundle)
+        entries[index] = patient_bundle["entry"][0]
+
+    return bundle
+
+
+def _geocode(patient_bundle: Dict, geocoder: "us_street.Client") -> Dict:
+    """
+    Geocode a patient's addresses.  Geocoding is an enrichment, so if the
+    geocoder fails, or its circuit breaker is open, the patient carries on
+    without coordinates rather than holding up or failing the message.
+    """
+    breaker = get_breaker("geocode")
+    if not breaker.allow():
+        return patient_bundle
+    try:
+        geocoded = geocode_patients(patient_bundle, geocoder)
+    except Exception:
+        breaker.record_failure()
+        logging.warning(
+            "Geocoding failed, continuing without coordinates", exc_info=True
+        )
+        return patient_bundle
+    breaker.record_success()
+    return geocoded
+
+
+@functools.lru_cache(maxsize=None)
+def _memoize_normalizers() -> None:
+    """
+    Cache the results of the name and phone normalizers, once per worker.  The
+    same raw values (eg: the names of family members, or a facility's phone
+    number) recur across the messages of a batch, and the bundle transforms look
+    the normalizers up by name each time they are called, so they find the
+    memoized versions.  Each normalizer holds at most
+    `INTAKE_NORMALIZER_CACHE_SIZE` results; 0 disables the caches.
+    """
+    maxsize = int(get_required_config("INTAKE_NORMALIZER_CACHE_SIZE", "10000"))
+    if maxsize > 0:
+        memoize_module_functions(phdi.standardize, NORMALIZERS, maxsize)
@@ -0,0 +1,205 @@
+import datetime
+import re
+
+from config import get_required_config
+from typing import Dict, List
+
+# Segments every message of a type must contain, by root template
+REQUIRED_SEGMENTS = {
+    "VXU_V04": ("MSH", "PID", "RXA"),
+    "ORU_R01": ("MSH", "OBR"),
+    "ADT_A01": ("MSH", "EVN", "PID", "PV1"),
+}
+
+# The least and most repetitions allowed of fields, as (segment, field, minimum,
+# maximum), where a maximum of None means the field may repeat any number of
+# times.  Fields of segments a message doesn't contain aren't checked.
+FIELD_CARDINALITY = [
+    ("MSH", 7, 1, 1),
+    ("MSH", 9, 1, 1),
+    ("MSH", 10, 1, 1),
+    ("MSH", 12, 1, 1),
+    ("PID", 3, 1, None),
+    ("PID", 5, 1, None),
+    ("PID", 7, 0, 1),
+    ("PID", 8, 0, 1),
+    ("RXA", 3, 1, 1),
+    ("RXA", 5, 1, 1),
+    ("OBR", 4, 1, 1),
+    ("OBX", 3, 1, 1),
+    ("EVN", 2, 0, 1),
+]
+
+# Fields holding timestamps (the TS and DTM data types)
+TIMESTAMP_FIELDS = [
+    ("MSH", 7),
+    ("EVN", 2),
+    ("PID", 7),
+    ("PID", 29),
+    ("RXA", 3),
+    ("RXA", 4),
+    ("OBR", 7),
+    ("OBR", 8),
+    ("OBR", 22),
+    ("OBX", 14),
+    ("OBX", 19),
+    ("PV1", 44),
+]
+
+SEGMENT_ID = re.compile(r"^[A-Z][A-Z0-9]{2}$")
+
+# YYYY[MM[DD[HH[MM[SS[.S[S[S[S]]]]]]]]][+/-ZZZZ]
+TIMESTAMP = re.compile(
+    r"^(?P<value>\d{4}(?:\d{2}){0,5})(?:\.\d{1,4})?(?:[+-](?P<offset>\d{4}))?$"
+)
+TIMESTAMP_FORMATS = {
+    4: "%Y",
+    6: "%Y%m",
+    8: "%Y%m%d",
+    10: "%Y%m%d%H",
+    12: "%Y%m%d%H%M",
+    14: "%Y%m%d%H%M%S",
+}
+
+
+def is_prevalidation_enabled() -> bool:
+    """Determine whether messages should be validated before conversion."""
+    return get_required_config("INTAKE_PREVALIDATION", "false").lower() == "true"
+
+
+def validate_message(message: str, message_mappings: Dict[str, str]) -> List[Dict]:
+    """
+    Check the structure of an HL7v2 message before it is sent for conversion,
+    to find messages the converter would reject (or convert incorrectly)
+    without the cost of a round trip.  The message must start with a well-formed
+    MSH segment and header, every segment must have a valid id, the segments
+    required for its root template must be present, required and
+    non-repeating fields must be used correctly, and timestamps must be valid
+    dates and times.  Messages of other input types (eg: CCDA) aren't checked;
+    the input type is matched regardless of case.
+
+    :param message: The raw message
+    :param message_mappings: Dictionary having the appropriate
+        template mapping for the type of file being processed
+    :return: The errors found, each with the segment, its line in the message
+        and the field (where relevant), or an empty list if the message is valid
+    """
+    if (message_mappings.get("input_data_type") or "").lower() != "hl7v2":
+        return []
+
+    segments = [line for line in re.split(r"\r\n|\r|\n", message) if line.strip()]
+    if not segments or not segments[0].startswith("MSH") or len(segments[0]) < 8:
+        return [_error("MSH", 1, None, "Message doesn't start with an MSH segment")]
+
+    header = segments[0]
+    field_separator = header[3]
+    encoding_characters = header[4:].split(field_separator, 1)[0]
+    if (
+        len(encoding_characters) not in (4, 5)
+        or len(set(encoding_characters + field_separator))
+        != len(encoding_characters) + 1
+        or any(char.isalnum() for char in encoding_characters + field_separator)
+    ):
+        return [
+            _error("MSH", 1, 2, f"Invalid encoding characters {encoding_characters!r}")
+        ]
+    component_separator, repetition_separator = encoding_characters[:2]
+
+    errors = []
+    parsed = []
+    for line, segment in enumerate(segments, start=1):
+        fields = segment.split(field_separator)
+        if not SEGMENT_ID.match(fields[0]):
+            errors.append(
+                _error(fields[0][:3], line, None, "Invalid or truncated segment id")
+            )
+            continue
+        if fields[0] == "MSH":
+            # MSH-1 is the field separator itself, so fields are offset by one
+            fields = ["MSH", field_separator] + fields[1:]
+        parsed.append((fields[0], line, fields))
+
+    present = {segment_id for segment_id, _, _ in parsed}
+    for segment_id in REQUIRED_SEGMENTS.get(message_mappings.get("root_template"), []):
+        if segment_id not in present:
+            errors.append(_error(segment_id, None, None, "Required segment is missing"))
+
+    for segment_id, line, fields in parsed:
+        errors.extend(
+            _check_cardinality(segment_id, line, fields, repetition_separator)
+        )
+        errors.extend(
+            _check_timestamps(
+                segment_id, line, fields, component_separator, repetition_separator
+            )
+        )
+    return errors
+
+
+def _check_cardinality(
+    segment_id: str, line: int, fields: List[str], repetition_separator: str
+) -> List[Dict]:
+    errors = []
+    for cardinality_segment, field, minimum, maximum in FIELD_CARDINALITY:
+        if cardinality_segment != segment_id:
+            continue
+        value = fields[field] if field < len(fields) else ""
+        repetitions = [
+            repetition
+            for repetition in value.split(repetition_separator)
+            if repetition.strip()
+        ]
+        if len(repetitions) < minimum:
+            errors.append(_error(segment_id, line, field, "Required field is empty"))
+        elif maximum is not None and len(repetitions) > maximum:
+            errors.append(
+                _error(
+                    segment_id,
+                    line,
+                    field,
+                    f"Field repeats {len(repetitions)} times, at most {maximum} "
+                    + "allowed",
+                )
+            )
+    return errors
+
+
+def _check_timestamps(
+    segment_id: str,
+    line: int,
+    fields: List[str],
+    component_separator: str,
+    repetition_separator: str,
+) -> List[Dict]:
+    errors = []
+    for timestamp_segment, field in TIMESTAMP_FIELDS:
+        if timestamp_segment != segment_id or field >= len(fields):
+            continue
+        for repetition in fields[field].split(repetition_separator):
+            # The time is the first component of a TS, the second being its
+            # degree of precision
+            value = repetition.split(component_separator, 1)[0].strip()
+            if value and not _is_valid_timestamp(value):
+                errors.append(
+                    _error(segment_id, line, field, f"Invalid timestamp {value!r}")
+                )
+    return errors
+
+
+def _is_valid_timestamp(value: str) -> bool:
+    match = TIMESTAMP.match(value)
+    if not match:
+        return False
+    offset = match.group("offset")
+    if offset and (int(offset[:2]) > 14 or int(offset[2:]) > 59):
+        return False
+    digits = match.group("value")
+    try:
+        datetime.datetime.strptime(digits, TIMESTAMP_FORMATS[len(digits)])
+    except ValueError:
+        return False
+    return True
+
+
+def _error(segment: str, line: int, field: int, error: str) -> Dict:
+    return {"segment": segment, "line": line, "field": field, "error": error}
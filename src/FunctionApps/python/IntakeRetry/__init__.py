@@ -0,0 +1,39 @@
+import azure.functions as func
+import json
+import logging
+
+from clients import get_cred_manager
+from config import get_required_config
+
+from IntakePipeline import run_pipeline
+from IntakePipeline.parquet_sink import get_sink
+
+
+def main(msg: func.QueueMessage) -> None:
+    """
+    This is the main entry point for the IntakeRetry function.  It receives
+    individual messages that the IntakePipeline function could not process
+    because of a transient failure, once their retry delay has passed, and
+    sends them down the processing pipeline again.
+
+    :param msg: The queued message, along with its template mappings and the
+        number of the attempt to make
+    """
+    logging.debug("Entering intake retry")
+    fhir_url = get_required_config("FHIR_URL")
+    cred_manager = get_cred_manager(fhir_url)
+
+    payload = json.loads(msg.get_body().decode("utf-8"))
+    sink = get_sink()
+    try:
+        run_pipeline(
+            payload["message"],
+            payload["message_mappings"],
+            fhir_url,
+            cred_manager,
+            attempt=payload["attempt"],
+            sink=sink,
+        )
+    finally:
+        if sink is not None:
+            sink.close()
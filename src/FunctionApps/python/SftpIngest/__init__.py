@@ -0,0 +1,195 @@
+import azure.functions as func
+import base64
+import concurrent.futures
+import json
+import logging
+import stat
+import threading
+import time
+
+from config import get_required_config
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from SftpIngest.transfer import TransferResult, transfer_file
+
+if TYPE_CHECKING:
+    from azure.storage.blob import ContainerClient
+    from paramiko import SFTPClient
+
+
+def main(timer: func.TimerRequest) -> None:
+    """
+    This is the main entry point for the SftpIngest function.  On a schedule,
+    it lists the files in the source directory of the SFTP server and copies
+    those that haven't been copied yet into blob storage, several at a time.
+
+    :param timer: The timer that triggered the function
+    """
+    if timer.past_due:
+        logging.warning("SFTP ingest is running late")
+
+    hostname = get_required_config("VDHSFTPHostname")
+    username = get_required_config("VDHSFTPUsername")
+    password = get_required_config("VDHSFTPPassword")
+    host_key = get_required_config("VDHSFTPHostKey", "")
+
+    summary = ingest(
+        connect=lambda: connect_sftp(hostname, username, password, host_key),
+        container_client=get_container_client(
+            get_required_config("INTAKE_CONTAINER_URL")
+        ),
+        source_path=get_required_config("SFTP_INGEST_SOURCE_PATH", "OtherFiles"),
+        output_path=get_required_config(
+            "SFTP_INGEST_OUTPUT_PATH", "additional-records/raw/VIIS"
+        ),
+        block_size=int(get_required_config("SFTP_INGEST_BLOCK_SIZE_BYTES", "4194304")),
+        concurrency=int(get_required_config("SFTP_INGEST_CONCURRENCY", "4")),
+    )
+    logging.info(f"Ingest summary: {json.dumps(summary)}")
+
+
+def ingest(
+    connect: Callable[[], "SFTPClient"],
+    container_client: "ContainerClient",
+    source_path: str,
+    output_path: str,
+    block_size: int,
+    concurrency: int,
+) -> Dict:
+    """
+    Copy every file in a directory of the SFTP server into blob storage.  Files
+    are copied in parallel, each by a worker with its own SFTP connection.  A
+    file that fails to copy is logged and doesn't stop the rest, and is tried
+    again, continuing from where it stopped, the next time the function runs.
+
+    :param connect: Opens a new connection to the SFTP server
+    :param container_client: The client of the container to copy files into
+    :param source_path: The directory of the SFTP server to copy files from
+    :param output_path: The path in the container to copy files to
+    :param block_size: The size of each block uploaded, in bytes
+    :param concurrency: The number of files copied at the same time
+    :return: The number of files with each outcome, the bytes transferred and
+        the time taken
+    """
+    start = time.monotonic()
+    connections = []
+    local = threading.local()
+    lock = threading.Lock()
+
+    def get_connection() -> "SFTPClient":
+        # SFTP clients can't be shared between threads
+        if not hasattr(local, "sftp"):
+            local.sftp = connect()
+            with lock:
+                connections.append(local.sftp)
+        return local.sftp
+
+    def transfer(path: str, size: int, mtime: int) -> Optional[TransferResult]:
+        blob_client = container_client.get_blob_client(
+            f"{output_path.rstrip('/')}/{path.rsplit('/', 1)[-1]}"
+        )
+        try:
+            return transfer_file(
+                get_connection(), blob_client, path, size, mtime, block_size
+            )
+        except Exception:
+            logging.exception(f"Failed to transfer {path}")
+            return None
+
+    summary = {"skipped": 0, "transferred": 0, "resumed": 0, "failed": 0}
+    bytes_transferred = 0
+    try:
+        files = list_files(get_connection(), source_path)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = executor.map(lambda file: transfer(*file), files)
+            for result in results:
+                if result is None:
+                    summary["failed"] += 1
+                    continue
+                summary[result.status] += 1
+                bytes_transferred += result.bytes_transferred
+    finally:
+        for connection in connections:
+            close_sftp(connection)
+
+    return {
+        **summary,
+        "bytes_transferred": bytes_transferred,
+        "seconds": round(time.monotonic() - start, 3),
+    }
+
+
+def list_files(sftp: "SFTPClient", source_path: str) -> List[Tuple[str, int, int]]:
+    """
+    List the regular files directly within a directory of the SFTP server.
+
+    :param sftp: An SFTP client
+    :param source_path: The directory to list
+    :return: The path, size and modification time of every file, in name order
+    """
+    return [
+        (
+            f"{source_path.rstrip('/')}/{attributes.filename}",
+            attributes.st_size,
+            int(attributes.st_mtime),
+        )
+        for attributes in sorted(
+            sftp.listdir_attr(source_path), key=lambda item: item.filename
+        )
+        if stat.S_ISREG(attributes.st_mode)
+    ]
+
+
+def connect_sftp(
+    hostname: str, username: str, password: str, host_key: str = ""
+) -> "SFTPClient":
+    """
+    Open a connection to an SFTP server on port 22.  If a host key (eg:
+    `ssh-ed25519 AAAA...`) is given, the server must present it.  Otherwise the
+    server's key isn't checked, as with the Data Factory linked service this
+    replaces.
+
+    :param hostname: The hostname of the SFTP server
+    :param username: The username to authenticate with
+    :param password: The corresponding password
+    :param host_key: The public key of the server, in `known_hosts` format
+    """
+    import paramiko
+
+    server_key = None
+    if host_key:
+        key_type, key_data = host_key.split()[:2]
+        server_key = paramiko.PKey.from_type_string(
+            key_type, base64.b64decode(key_data)
+        )
+
+    transport = paramiko.Transport((hostname, 22))
+    try:
+        transport.connect(hostkey=server_key, username=username, password=password)
+        return paramiko.SFTPClient.from_transport(transport)
+    except Exception:
+        transport.close()
+        raise
+
+
+def close_sftp(sftp: "SFTPClient") -> None:
+    """Close an SFTP connection along with the SSH transport it runs over."""
+    channel = sftp.get_channel()
+    sftp.close()
+    if channel is not None:
+        channel.get_transport().close()
+
+
+def get_container_client(container_url: str) -> "ContainerClient":
+    """
+    Build the client for a blob container, accessed using the function app's
+    managed identity.
+
+    :param container_url: The url of the container
+    """
+    from azure.identity import DefaultAzureCredential
+    from azure.storage.blob import ContainerClient
+
+    return ContainerClient.from_container_url(
+        container_url, credential=DefaultAzureCredential()
+    )
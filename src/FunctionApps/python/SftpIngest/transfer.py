@@ -0,0 +1,223 @@
+import hashlib
+import logging
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobBlock, BlobClient, ContentSettings
+from typing import Dict, List, Optional, Tuple
+
+# Block ids are `<version>-<index>-<md5>`, so every id of a blob has the same
+# length, as blob storage requires
+VERSION_LENGTH = 8
+INDEX_LENGTH = 6
+
+
+class SourceChangedError(Exception):
+    """Raised when a source file changes while it is being transferred."""
+
+
+class TransferResult:
+    """
+    A class describing the outcome of transferring one file.
+
+    :param path: The path of the file on the SFTP server
+    :param status: `skipped` if the file had already been transferred,
+        `transferred` if it was transferred from the start, or `resumed` if an
+        earlier, interrupted transfer was continued
+    :param bytes_transferred: The number of bytes read from the SFTP server and
+        uploaded during this transfer
+    :param checksum: The checksum recorded on the blob
+    """
+
+    def __init__(
+        self,
+        path: str,
+        status: str,
+        bytes_transferred: int = 0,
+        checksum: Optional[str] = None,
+    ):
+        self.path = path
+        self.status = status
+        self.bytes_transferred = bytes_transferred
+        self.checksum = checksum
+
+
+def get_version(path: str, size: int, mtime: int) -> str:
+    """
+    Identify a version of a source file by its path, size and modification time,
+    so blocks staged for an older version of a file are never reused for a newer
+    one.
+
+    :param path: The path of the file on the SFTP server
+    :param size: The size of the file, in bytes
+    :param mtime: The modification time of the file, as a unix timestamp
+    """
+    return hashlib.sha256(f"{path}:{size}:{mtime}".encode("utf-8")).hexdigest()[
+        :VERSION_LENGTH
+    ]
+
+
+def make_block_id(version: str, index: int, md5: str) -> str:
+    """
+    Build the id of a staged block from the version of the file it belongs to,
+    its position in the file and the MD5 of its content.
+
+    :param version: The version of the source file, from `get_version`
+    :param index: The position of the block in the file, from 0
+    :param md5: The hex MD5 digest of the block's content
+    """
+    return f"{version}-{index:0{INDEX_LENGTH}d}-{md5}"
+
+
+def parse_block_id(block_id: str) -> Optional[Tuple[str, int, str]]:
+    """
+    Split the id of a staged block into the version of the file it belongs to,
+    its position and its MD5.  Returns None for ids not made by `make_block_id`.
+
+    :param block_id: The id of a staged block
+    """
+    parts = block_id.split("-")
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    return parts[0], int(parts[1]), parts[2]
+
+
+def get_checksum(block_md5s: List[str]) -> str:
+    """
+    Combine the MD5s of a file's blocks into a checksum for the whole file: the
+    MD5 of the concatenated block digests, followed by the number of blocks.
+    Every block's MD5 is verified by blob storage as it is staged, so a blob
+    whose checksum matches was received intact.
+
+    :param block_md5s: The hex MD5 digests of the blocks, in order
+    """
+    combined = hashlib.md5(b"".join(bytes.fromhex(md5) for md5 in block_md5s))
+    return f"{combined.hexdigest()}-{len(block_md5s)}"
+
+
+def transfer_file(
+    sftp,
+    blob_client: BlobClient,
+    path: str,
+    size: int,
+    mtime: int,
+    block_size: int,
+) -> TransferResult:
+    """
+    Copy a file from the SFTP server to a block blob, one block at a time.
+
+    Blocks are staged with ids derived from the file's version, so if a transfer
+    is interrupted (eg: by a timeout or a dropped connection), the blocks staged
+    so far remain on the blob, uncommitted, and the next transfer of the same
+    version continues from the first block that is missing.  Each block is sent
+    with its MD5, which blob storage verifies, and the blob is only committed if
+    the source file didn't change during the transfer.
+
+    A file is skipped if its blob already holds the same version, or if the blob
+    was copied without version metadata (eg: by the Data Factory pipeline) and
+    has the same size.
+
+    :param sftp: An SFTP client (eg: a `paramiko.SFTPClient`)
+    :param blob_client: The client of the blob to copy the file to
+    :param path: The path of the file on the SFTP server
+    :param size: The size of the file, in bytes
+    :param mtime: The modification time of the file, as a unix timestamp
+    :param block_size: The size of each block, in bytes
+    """
+    version = get_version(path, size, mtime)
+    metadata = _get_metadata(blob_client)
+    if metadata is not None and (
+        metadata.get("source_version") == version
+        or ("source_version" not in metadata and metadata["size"] == size)
+    ):
+        return TransferResult(path, "skipped", checksum=metadata.get("checksum"))
+
+    # An empty file is committed with no blocks
+    block_count = (size + block_size - 1) // block_size
+    staged = _get_staged_blocks(blob_client, version, block_size, size)
+
+    bytes_transferred = 0
+    missing = [index for index in range(block_count) if index not in staged]
+    if missing:
+        with sftp.open(path, "rb") as source:
+            for index in missing:
+                expected_length = min(block_size, size - index * block_size)
+                # Only the block being staged is prefetched, so at most one
+                # block of the file is held in memory
+                try:
+                    (data,) = source.readv([(index * block_size, expected_length)])
+                except EOFError:
+                    data = b""
+                if len(data) != expected_length:
+                    raise SourceChangedError(f"{path} changed during transfer")
+
+                md5 = hashlib.md5(data).hexdigest()
+                blob_client.stage_block(
+                    make_block_id(version, index, md5), data, validate_content=True
+                )
+                staged[index] = md5
+                bytes_transferred += len(data)
+
+    # Only commit what was read if the file is still the version that was listed
+    attributes = sftp.stat(path)
+    if attributes.st_size != size or int(attributes.st_mtime) != mtime:
+        raise SourceChangedError(f"{path} changed during transfer")
+
+    block_md5s = [staged[index] for index in range(block_count)]
+    checksum = get_checksum(block_md5s)
+    blob_client.commit_block_list(
+        [
+            BlobBlock(block_id=make_block_id(version, index, md5))
+            for index, md5 in enumerate(block_md5s)
+        ],
+        content_settings=ContentSettings(content_type="application/octet-stream"),
+        metadata={
+            "source_path": path,
+            "source_version": version,
+            "source_size": str(size),
+            "checksum": checksum,
+        },
+    )
+
+    status = "transferred" if len(missing) == block_count else "resumed"
+    if status == "resumed":
+        logging.info(
+            f"Resumed transfer of {path} after {block_count - len(missing)} of "
+            + f"{block_count} blocks"
+        )
+    return TransferResult(path, status, bytes_transferred, checksum)
+
+
+def _get_metadata(blob_client: BlobClient) -> Optional[Dict[str, str]]:
+    """Get the metadata and size of a committed blob, or None if it's missing."""
+    try:
+        properties = blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+    return {**(properties.metadata or {}), "size": properties.size}
+
+
+def _get_staged_blocks(
+    blob_client: BlobClient, version: str, block_size: int, size: int
+) -> Dict[int, str]:
+    """
+    Find the blocks already staged for a version of a file by an earlier,
+    interrupted transfer.
+
+    :return: Dictionary mapping block positions to the MD5 of their content
+    """
+    try:
+        _, uncommitted = blob_client.get_block_list("uncommitted")
+    except ResourceNotFoundError:
+        return {}
+
+    staged = {}
+    for block in uncommitted:
+        parsed = parse_block_id(block.id)
+        if parsed is None or parsed[0] != version:
+            continue
+        _, index, md5 = parsed
+        if index * block_size < size and block.size == min(
+            block_size, size - index * block_size
+        ):
+            staged[index] = md5
+    return staged
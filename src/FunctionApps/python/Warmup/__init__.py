@@ -0,0 +1,22 @@
+import azure.functions as func
+import logging
+
+from IntakePipeline import warm_up
+
+
+def main(warmupContext: func.Context) -> None:
+    """
+    This is the main entry point for the Warmup function.  On plans that
+    support it, the platform invokes this function whenever a new instance is
+    added during scale-out, before the instance receives any triggers.  That
+    gives the worker a chance to load the pipeline modules, build its clients
+    and obtain an access token ahead of the first blob.
+
+    :param warmupContext: The invocation context
+    """
+    try:
+        warm_up()
+        logging.info("Function app instance warmed up")
+    except Exception:
+        # A failed warm-up only means the first invocation pays for setup
+        logging.exception("Exception occurred while warming up")
@@ -0,0 +1,251 @@
+"""
+Compare the size and duration of FHIR exports with and without server-side
+filtering (`_typeFilter`) and projection (`_elements`).
+
+A synthetic population of Patients, Immunizations and Observations is exported
+the way a bulk export writes it: one NDJSON file per resource type, holding the
+resources matching the export's parameters.  Each export's kick-off parameters
+are validated and composed by FhirServerExport, then applied to the population
+by a small in-process stand-in for the FHIR server, which understands the
+`date` and `vaccine-code` search parameters of Immunizations.  The median time
+to select and write the resources and the number of bytes written are reported
+for each export.
+
+Run from the function app root (src/FunctionApps/python), eg:
+
+    python benchmarks/fhir_export.py --patients 1000 --patients 10000
+"""
+
+import datetime
+import io
+import json
+import pathlib
+import re
+import statistics
+import sys
+import time
+import typer
+import urllib.parse
+
+from typing import Callable, Dict, List, Tuple
+
+APP_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# CVX codes of COVID-19 vaccines, and some others
+COVID_VACCINE_CODES = ["207", "208", "212", "213", "217"]
+OTHER_VACCINE_CODES = ["03", "08", "20", "62", "141"]
+
+# Elements every exported resource keeps, whatever `_elements` says
+MANDATORY_ELEMENTS = {"resourceType", "id", "meta"}
+
+EXPORTS = {
+    "everything": {},
+    "immunizations": {"type": "Immunization"},
+    "recent covid immunizations": {
+        "type": "Immunization",
+        "_typeFilter": "Immunization?date=ge2022-01-01&vaccine-code="
+        + ",".join(COVID_VACCINE_CODES),
+    },
+    "recent covid immunizations, 3 elements": {
+        "type": "Immunization",
+        "_typeFilter": "Immunization?date=ge2022-01-01&vaccine-code="
+        + ",".join(COVID_VACCINE_CODES),
+        "_elements": "Immunization.patient,Immunization.vaccineCode,"
+        + "Immunization.occurrenceDateTime",
+    },
+}
+
+
+def make_population(patients: int, immunizations: int, observations: int) -> Dict:
+    """
+    Build the resources of a FHIR server holding synthetic patients, each with
+    a history of immunizations spread over 2019 to 2022.
+
+    :param patients: The number of patients
+    :param immunizations: The number of immunizations of each patient
+    :param observations: The number of observations of each patient
+    :return: Dictionary mapping resource types to their resources
+    """
+    population = {"Patient": [], "Immunization": [], "Observation": []}
+    vaccine_codes = COVID_VACCINE_CODES + OTHER_VACCINE_CODES
+    start = datetime.date(2019, 1, 1)
+    for index in range(patients):
+        patient_id = f"patient-{index}"
+        population["Patient"].append(
+            {
+                "resourceType": "Patient",
+                "id": patient_id,
+                "identifier": [{"value": f"linking-id-{index}"}],
+                "name": [{"family": "DOE", "given": ["JOHN", "DANGER"]}],
+                "gender": "male",
+                "birthDate": "1983-02-01",
+                "telecom": [{"system": "phone", "value": "5555551234"}],
+                "address": [
+                    {
+                        "line": [f"{index} FAKE ST"],
+                        "city": "FAKETON",
+                        "state": "NY",
+                        "postalCode": "10001",
+                    }
+                ],
+            }
+        )
+        for i in range(immunizations):
+            code = vaccine_codes[(index + i) % len(vaccine_codes)]
+            occurred = start + datetime.timedelta(days=(index * 7 + i * 97) % 1460)
+            population["Immunization"].append(
+                {
+                    "resourceType": "Immunization",
+                    "id": f"immunization-{index}-{i}",
+                    "status": "completed",
+                    "patient": {"reference": f"Patient/{patient_id}"},
+                    "vaccineCode": {
+                        "coding": [
+                            {"system": "http://hl7.org/fhir/sid/cvx", "code": code}
+                        ]
+                    },
+                    "occurrenceDateTime": occurred.isoformat(),
+                    "lotNumber": f"LOT{index % 97:04d}",
+                    "performer": [
+                        {"actor": {"reference": "Practitioner/some-practitioner"}}
+                    ],
+                    "note": [{"text": "Administered at the county clinic"}],
+                }
+            )
+        for i in range(observations):
+            population["Observation"].append(
+                {
+                    "resourceType": "Observation",
+                    "id": f"observation-{index}-{i}",
+                    "status": "final",
+                    "subject": {"reference": f"Patient/{patient_id}"},
+                    "code": {
+                        "coding": [{"system": "http://loinc.org", "code": "30956-7"}]
+                    },
+                    "valueString": "Vaccine eligibility reviewed",
+                }
+            )
+    return population
+
+
+def occurred_since(date: str) -> Callable[[Dict], bool]:
+    return lambda resource: resource["occurrenceDateTime"] >= date
+
+
+def has_vaccine_code(codes: set) -> Callable[[Dict], bool]:
+    return lambda resource: resource["vaccineCode"]["coding"][0]["code"] in codes
+
+
+def make_search(query: str) -> Callable[[Dict], bool]:
+    """
+    Build a predicate for the search parameters of a `_typeFilter` query, for
+    the parameters this stand-in understands.
+
+    :param query: The search parameters, eg: `date=ge2022-01-01&vaccine-code=207`
+    """
+    checks = []
+    for name, value in urllib.parse.parse_qsl(query):
+        if name == "date" and value.startswith("ge"):
+            checks.append(occurred_since(value[2:]))
+        elif name == "vaccine-code":
+            checks.append(has_vaccine_code(set(value.split(","))))
+        else:
+            raise ValueError(f"The stand-in server can't search by {name}")
+    return lambda resource: all(check(resource) for check in checks)
+
+
+def export(population: Dict, parameters: Dict[str, str]) -> Dict[str, bytes]:
+    """
+    Write the resources matching an export's kick-off parameters as NDJSON, one
+    file per resource type.
+
+    :param population: The resources of the server, by type
+    :param parameters: The kick-off parameters, from `get_export_parameters`
+    :return: Dictionary mapping resource types to their exported file
+    """
+    types = parameters["_type"].split(",") if "_type" in parameters else population
+    searches = {}
+    if "_typeFilter" in parameters:
+        # Split only before the next query, as FhirServerExport does
+        for type_filter in re.split(
+            r",(?=[A-Z][A-Za-z]+\?)", parameters["_typeFilter"]
+        ):
+            resource_type, query = type_filter.split("?", 1)
+            searches.setdefault(resource_type, []).append(make_search(query))
+
+    elements = {}
+    for element in parameters.get("_elements", "").split(","):
+        if "." in element:
+            resource_type, name = element.split(".")
+            elements.setdefault(resource_type, set()).add(name)
+
+    files = {}
+    for resource_type in types:
+        output = io.StringIO()
+        type_searches = searches.get(resource_type)
+        kept = elements.get(resource_type)
+        for resource in population[resource_type]:
+            # A resource matching any of its type's filters is exported
+            if type_searches and not any(search(resource) for search in type_searches):
+                continue
+            if kept:
+                resource = {
+                    key: value
+                    for key, value in resource.items()
+                    if key in kept or key in MANDATORY_ELEMENTS
+                }
+                resource["meta"] = {"tag": [{"code": "SUBSETTED"}]}
+            output.write(json.dumps(resource, separators=(",", ":")))
+            output.write("\n")
+        files[resource_type] = output.getvalue().encode("utf-8")
+    return files
+
+
+def measure(
+    population: Dict, parameters: Dict[str, str], runs: int
+) -> Tuple[float, int, int]:
+    """
+    Export several times, and report the median time in milliseconds, with the
+    number of resources and bytes exported.
+    """
+    times_ms = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        files = export(population, parameters)
+        times_ms.append((time.perf_counter() - start) * 1000)
+    resources = sum(data.count(b"\n") for data in files.values())
+    return statistics.median(times_ms), resources, sum(map(len, files.values()))
+
+
+def main(
+    patients: List[int] = typer.Option(
+        [1000, 10000], help="Numbers of patients on the server"
+    ),
+    immunizations: int = typer.Option(8, help="Number of immunizations per patient"),
+    observations: int = typer.Option(4, help="Number of observations per patient"),
+    runs: int = typer.Option(3, help="Number of times each export is timed"),
+) -> None:
+    sys.path.insert(0, str(APP_ROOT))
+    from FhirServerExport.filters import compose_export_url, get_export_parameters
+
+    for count in patients:
+        population = make_population(count, immunizations, observations)
+        typer.echo(f"\n{count} patients")
+        typer.echo(
+            f"{'export':<42}{'resources':>10}{'MiB':>8}{'ms':>9}{'size':>8}{'time':>8}"
+        )
+        baseline = None
+        for name, params in EXPORTS.items():
+            parameters = get_export_parameters(params)
+            # Composing the URL also checks the parameters would be sent as is
+            compose_export_url("https://some-fhir-url", "", parameters)
+            duration_ms, resources, size = measure(population, parameters, runs)
+            baseline = baseline or (duration_ms, size)
+            typer.echo(
+                f"{name:<42}{resources:>10}{size / 2**20:>8.2f}{duration_ms:>9.1f}"
+                + f"{size / baseline[1]:>8.1%}{duration_ms / baseline[0]:>8.1%}"
+            )
+
+
+if __name__ == "__main__":
+    typer.run(main)
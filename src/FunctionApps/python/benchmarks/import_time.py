@@ -0,0 +1,94 @@
+"""
+Measure the cold-start import cost of a function app module.
+
+Each run imports the module in a fresh interpreter with `-X importtime`, the same
+way a newly started worker would, and the median over all runs is reported along
+with the most expensive imports.  When a budget is given, the script exits with a
+non-zero status if the median exceeds it, so it can be used as a CI check.
+
+Run from the function app root (src/FunctionApps/python), eg:
+
+    python benchmarks/import_time.py IntakePipeline --runs 5 --budget-ms 2500
+"""
+
+import pathlib
+import statistics
+import subprocess
+import sys
+import typer
+
+from typing import Dict, List, Optional, Tuple
+
+APP_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def parse_import_times(output: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parse the report written to stderr by `python -X importtime`.
+
+    :param output: The stderr output of the interpreter
+    :return: Dictionary mapping each imported module to its self and
+        cumulative import time, in microseconds
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line.split(":", 1)[1].split("|")
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Import a module in a fresh interpreter and return its import report.
+
+    :param module: The name of the module to import
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{result.stderr}")
+    return parse_import_times(result.stderr)
+
+
+def main(
+    module: str = typer.Argument("IntakePipeline", help="Module to import"),
+    runs: int = typer.Option(5, help="Number of fresh interpreters to measure"),
+    top: int = typer.Option(15, help="Number of slowest imports to list"),
+    budget_ms: Optional[float] = typer.Option(
+        None, help="Fail if the median import time exceeds this many milliseconds"
+    ),
+) -> None:
+    reports = [measure(module) for _ in range(runs)]
+    totals_ms: List[float] = [report[module][1] / 1000 for report in reports]
+    median_ms = statistics.median(totals_ms)
+
+    typer.echo(
+        f"{module}: median {median_ms:.1f} ms over {runs} runs "
+        + f"(min {min(totals_ms):.1f} ms, max {max(totals_ms):.1f} ms)"
+    )
+
+    # Attribute cost by the cumulative time of the top-level packages, which is
+    # what a lazy import of that package would save
+    typer.echo("\nSlowest top-level imports (median cumulative ms):")
+    packages = {name for name in reports[0] if "." not in name and name != module}
+    package_ms = {
+        name: statistics.median(report.get(name, (0, 0))[1] for report in reports)
+        / 1000
+        for name in packages
+    }
+    for name, ms in sorted(package_ms.items(), key=lambda item: -item[1])[:top]:
+        typer.echo(f"  {ms:8.1f}  {name}")
+
+    if budget_ms is not None and median_ms > budget_ms:
+        typer.echo(f"\nImport time exceeds budget of {budget_ms:.1f} ms", err=True)
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
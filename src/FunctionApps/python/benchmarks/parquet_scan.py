@@ -0,0 +1,194 @@
+"""
+Compare scanning the intake silver layer as a JSON blob per message against
+scanning the micro-batched Parquet files written by the Parquet sink.
+
+Synthetic standardized bundles, each with a Patient, an Immunization and a few
+Observations, are written both ways to a local directory.  The same analytics
+query, counting Immunizations by vaccine code, is then timed over each layout,
+along with the number of files and bytes it reads.
+
+Run from the function app root (src/FunctionApps/python), eg:
+
+    python benchmarks/parquet_scan.py --messages 1000 --messages 10000
+"""
+
+import collections
+import json
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+import typer
+
+from typing import Callable, Counter, Dict, List, Tuple
+
+APP_ROOT = pathlib.Path(__file__).resolve().parent.parent
+VACCINE_CODES = ["207", "208", "212", "213", "217"]
+
+
+def make_bundle(index: int, observations: int) -> Dict:
+    """
+    Build a bundle resembling the pipeline's standardized output for a VXU.
+
+    :param index: The position of the message, used to vary its content
+    :param observations: The number of Observations in the bundle
+    """
+    patient_reference = f"Patient/patient-{index}"
+    return {
+        "resourceType": "Bundle",
+        "type": "batch",
+        "entry": [
+            {
+                "resource": {
+                    "resourceType": "Patient",
+                    "id": f"patient-{index}",
+                    "identifier": [{"value": f"linking-id-{index}"}],
+                    "name": [{"family": "DOE", "given": ["JOHN"]}],
+                    "birthDate": "1983-02-01",
+                    "telecom": [{"system": "phone", "value": "+15555551234"}],
+                    "address": [
+                        {
+                            "line": [f"{index} FAKE ST"],
+                            "city": "FAKETON",
+                            "state": "NY",
+                            "postalCode": "10001",
+                        }
+                    ],
+                }
+            },
+            {
+                "resource": {
+                    "resourceType": "Immunization",
+                    "id": f"immunization-{index}",
+                    "status": "completed",
+                    "patient": {"reference": patient_reference},
+                    "vaccineCode": {
+                        "coding": [
+                            {
+                                "system": "http://hl7.org/fhir/sid/cvx",
+                                "code": VACCINE_CODES[index % len(VACCINE_CODES)],
+                            }
+                        ]
+                    },
+                    "occurrenceDateTime": "2022-06-01",
+                }
+            },
+        ]
+        + [
+            {
+                "resource": {
+                    "resourceType": "Observation",
+                    "id": f"observation-{index}-{i}",
+                    "status": "final",
+                    "subject": {"reference": patient_reference},
+                    "code": {
+                        "coding": [{"system": "http://loinc.org", "code": "30956-7"}]
+                    },
+                    "valueString": "Vaccine eligibility reviewed " * 4,
+                }
+            }
+            for i in range(observations)
+        ],
+    }
+
+
+def write_json(directory: pathlib.Path, bundles: List[Dict]) -> None:
+    """Write a `.fhir` JSON file per message, as the pipeline does today."""
+    for index, bundle in enumerate(bundles):
+        (directory / f"message-{index}.fhir").write_text(json.dumps(bundle))
+
+
+def write_parquet(directory: pathlib.Path, bundles: List[Dict]) -> None:
+    """Write the bundles through the Parquet sink, with its default batch size."""
+    from IntakePipeline.parquet_sink import ParquetSink
+
+    def write(name: str, data: bytes) -> None:
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    sink = ParquetSink("silver", write=write)
+    for index, bundle in enumerate(bundles):
+        sink.add(bundle, f"message-{index}")
+    sink.close()
+
+
+def scan_json(directory: pathlib.Path) -> Counter:
+    counts = collections.Counter()
+    for path in directory.glob("*.fhir"):
+        for entry in json.loads(path.read_text())["entry"]:
+            resource = entry["resource"]
+            if resource["resourceType"] == "Immunization":
+                counts[resource["vaccineCode"]["coding"][0]["code"]] += 1
+    return counts
+
+
+def scan_parquet(directory: pathlib.Path) -> Counter:
+    import pyarrow.parquet
+
+    counts = collections.Counter()
+    for path in (directory / "silver" / "Immunization").rglob("*.parquet"):
+        # Only the column the query needs is read
+        table = pyarrow.parquet.read_table(path, columns=["vaccine_code"])
+        counts.update(table.column("vaccine_code").to_pylist())
+    return counts
+
+
+def measure(
+    scan: Callable[[pathlib.Path], Counter], directory: pathlib.Path, runs: int
+) -> Tuple[float, Counter]:
+    """Run a scan several times and report its median time, in milliseconds."""
+    times_ms = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        counts = scan(directory)
+        times_ms.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times_ms), counts
+
+
+def describe(directory: pathlib.Path, pattern: str) -> Tuple[int, int]:
+    files = [path for path in directory.rglob(pattern) if path.is_file()]
+    return len(files), sum(path.stat().st_size for path in files)
+
+
+def main(
+    messages: List[int] = typer.Option(
+        [1000, 10000], help="Numbers of messages in the silver layer"
+    ),
+    observations: int = typer.Option(3, help="Number of Observations per message"),
+    runs: int = typer.Option(3, help="Number of times each scan is timed"),
+) -> None:
+    sys.path.insert(0, str(APP_ROOT))
+
+    typer.echo(
+        f"{'messages':>9}{'json files':>12}{'json MiB':>10}{'json ms':>10}"
+        + f"{'pq files':>10}{'pq MiB':>8}{'pq ms':>8}{'speedup':>9}"
+    )
+    for count in messages:
+        bundles = [make_bundle(index, observations) for index in range(count)]
+        with tempfile.TemporaryDirectory() as json_dir:
+            with tempfile.TemporaryDirectory() as parquet_dir:
+                json_path = pathlib.Path(json_dir)
+                parquet_path = pathlib.Path(parquet_dir)
+                write_json(json_path, bundles)
+                write_parquet(parquet_path, bundles)
+
+                json_ms, json_counts = measure(scan_json, json_path, runs)
+                parquet_ms, parquet_counts = measure(scan_parquet, parquet_path, runs)
+                if json_counts != parquet_counts:
+                    typer.echo(f"Results differ for {count} messages", err=True)
+                    raise typer.Exit(code=1)
+
+                json_files, json_bytes = describe(json_path, "*.fhir")
+                parquet_files, parquet_bytes = describe(parquet_path, "*.parquet")
+                typer.echo(
+                    f"{count:>9}{json_files:>12}{json_bytes / 2**20:>10.1f}"
+                    + f"{json_ms:>10.1f}{parquet_files:>10}"
+                    + f"{parquet_bytes / 2**20:>8.1f}{parquet_ms:>8.1f}"
+                    + f"{json_ms / parquet_ms:>8.0f}x"
+                )
+
+
+if __name__ == "__main__":
+    typer.run(main)
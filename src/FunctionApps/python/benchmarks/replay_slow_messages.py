@@ -0,0 +1,218 @@
+"""
+Replay slow messages captured by the IntakePipeline against local stand-in
+services, to reproduce and profile them.
+
+Download captures from the diagnostics path of the intake container (they
+contain PHI, so keep them on an approved machine), eg:
+
+    az storage blob download-batch --account-name <account> --source bronze \\
+        --pattern "blob-trigger-out/diagnostics/slow-messages/*" --destination captures
+
+Each captured message is run through `run_pipeline` with its original template
+mappings.  Conversion is sent to `--fhir-url`, which should be a locally running
+FHIR server or converter, since converter templates are a common cause of slow
+messages.  Blob storage, the retry queue and the geocoder are replaced with
+stand-ins that keep nothing, and uploads are acknowledged without being sent
+unless `--upload` is given.  Run from the function app root
+(src/FunctionApps/python), eg:
+
+    python benchmarks/replay_slow_messages.py captures --repeat 5 --profile profiles
+
+Per-stage timings are reported alongside those recorded when the message was
+captured, and with `--profile` a cProfile report is written for every message,
+which can be read with `python -m pstats` or snakeviz.
+"""
+
+import cProfile
+import json
+import os
+import pathlib
+import statistics
+import sys
+import time
+import typer
+
+from typing import Dict, List, Optional
+from unittest import mock
+
+APP_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Settings the pipeline requires, which don't matter when every service it
+# talks to other than the converter is a stand-in
+REPLAY_ENV = {
+    "INTAKE_CONTAINER_URL": "https://replay.invalid/bronze",
+    "VALID_OUTPUT_CONTAINER_PATH": "replay/valid",
+    "INVALID_OUTPUT_CONTAINER_PATH": "replay/invalid",
+    "HASH_SALT": "replay-salt",
+    "SMARTYSTREETS_AUTH_ID": "replay",
+    "SMARTYSTREETS_AUTH_TOKEN": "replay",
+    # Never capture replayed messages
+    "DIAGNOSTICS_OUTPUT_CONTAINER_PATH": "",
+}
+
+
+class StaticCredentialManager:
+    """A stand-in credential manager that always returns the same token."""
+
+    def __init__(self, token: str):
+        self.token = token
+
+    def get_access_token(self, *args, **kwargs):
+        return self
+
+
+class StandInGeocoder:
+    """
+    A stand-in SmartyStreets client that finds no candidates for any address,
+    after an optional delay to simulate the real service.
+    """
+
+    def __init__(self, latency_ms: float):
+        self.latency_ms = latency_ms
+
+    def send_lookup(self, lookup) -> None:
+        time.sleep(self.latency_ms / 1000)
+        lookup.result = []
+
+
+def acknowledge_upload(bundle: Dict, *args, **kwargs) -> mock.Mock:
+    """A stand-in upload that reports every entry in the bundle as created."""
+    response = mock.Mock(status_code=200)
+    response.json.return_value = {
+        "entry": [{"response": {"status": "200 OK"}} for _ in bundle.get("entry", [])]
+    }
+    return response
+
+
+def load_captures(paths: List[pathlib.Path]) -> List[Dict]:
+    """
+    Load captured messages from files, or from every JSON file under the given
+    directories.
+
+    :param paths: Capture files and directories holding them
+    """
+    files = []
+    for path in paths:
+        files.extend(sorted(path.rglob("*.json")) if path.is_dir() else [path])
+    return [json.loads(file.read_text()) for file in files]
+
+
+def replay(
+    capture: Dict,
+    fhir_url: str,
+    cred_manager: StaticCredentialManager,
+    profile_dir: Optional[pathlib.Path],
+) -> Dict[str, float]:
+    """
+    Run a captured message through the pipeline once.
+
+    :param capture: The captured message, mappings and timings
+    :param fhir_url: The url of the FHIR server or converter to convert with
+    :param cred_manager: The credential manager to authenticate with
+    :param profile_dir: Directory to write a cProfile report to, if any
+    :return: The time taken by each stage, and in total, in milliseconds
+    """
+    from IntakePipeline import run_pipeline
+    from IntakePipeline.slow_messages import StageTimer
+
+    timer = StageTimer()
+    profiler = cProfile.Profile() if profile_dir else None
+    if profiler:
+        profiler.enable()
+    run_pipeline(
+        capture["message"],
+        capture["message_mappings"],
+        fhir_url,
+        cred_manager,
+        capture.get("attempt", 1),
+        timer,
+    )
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(
+            profile_dir / f"{capture['message_mappings']['filename']}.pstats"
+        )
+    return {**timer.timings, "total": timer.total_ms()}
+
+
+def main(
+    paths: List[pathlib.Path] = typer.Argument(
+        ..., help="Capture files, or directories holding them"
+    ),
+    fhir_url: str = typer.Option(
+        "http://localhost:8080", help="Local FHIR server or converter to convert with"
+    ),
+    token: str = typer.Option("replay", help="Access token to send to the FHIR url"),
+    repeat: int = typer.Option(3, help="Number of times to replay each message"),
+    upload: bool = typer.Option(
+        False, help="Upload bundles to the FHIR url rather than acknowledging them"
+    ),
+    geocode_latency_ms: float = typer.Option(
+        0, help="Delay added to every stand-in geocoder lookup"
+    ),
+    profile: Optional[pathlib.Path] = typer.Option(
+        None, help="Directory to write a cProfile report per message to"
+    ),
+) -> None:
+    captures = load_captures(paths)
+    if not captures:
+        typer.echo("No captured messages found", err=True)
+        raise typer.Exit(code=1)
+    if profile:
+        profile.mkdir(parents=True, exist_ok=True)
+
+    sys.path.insert(0, str(APP_ROOT))
+    os.environ.update({**REPLAY_ENV, "FHIR_URL": fhir_url})
+    cred_manager = StaticCredentialManager(token)
+    stand_ins = [
+        mock.patch("IntakePipeline.store_data"),
+        mock.patch("IntakePipeline.store_message_and_response"),
+        mock.patch("IntakePipeline.schedule_retry", return_value=False),
+        mock.patch(
+            "IntakePipeline.get_geocoder",
+            return_value=StandInGeocoder(geocode_latency_ms),
+        ),
+    ]
+    if not upload:
+        stand_ins.append(
+            mock.patch(
+                "IntakePipeline.upload_bundle_to_fhir_server",
+                side_effect=acknowledge_upload,
+            )
+        )
+
+    for stand_in in stand_ins:
+        stand_in.start()
+    try:
+        for capture in captures:
+            runs = [
+                replay(capture, fhir_url, cred_manager, profile if i == 0 else None)
+                for i in range(repeat)
+            ]
+            report(capture, runs)
+    finally:
+        for stand_in in stand_ins:
+            stand_in.stop()
+
+
+def report(capture: Dict, runs: List[Dict[str, float]]) -> None:
+    """Print the median replayed time per stage next to the captured time."""
+    captured = {**capture["timings"], "total": capture["total_ms"]}
+    typer.echo(
+        f"\n{capture['message_mappings']['filename']} "
+        + f"({len(capture['message'])} characters)"
+    )
+    typer.echo(f"  {'stage':<20}{'captured ms':>14}{'replayed ms':>14}")
+    stages = dict.fromkeys([*capture["timings"], *runs[0]])
+    # Keep the total last
+    stages.pop("total")
+    for stage in [*stages, "total"]:
+        replayed = [run[stage] for run in runs if stage in run]
+        typer.echo(
+            f"  {stage:<20}{captured.get(stage, float('nan')):>14.1f}"
+            + f"{statistics.median(replayed) if replayed else float('nan'):>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,152 @@
+"""
+Compare the cost per message of standardizing patients with the chain of bundle
+transforms against the single-pass `standardize_patients` stage.
+
+Synthetic bundles are built with a given number of patients and other entries
+(eg: the Observations of an ORU panel), and each is standardized both ways.  The
+median time and the peak memory allocated while standardizing are reported for
+each bundle size.  Geocoding uses a stand-in client that returns no candidates,
+so only the time spent in the pipeline itself is measured.
+
+Run from the function app root (src/FunctionApps/python), eg:
+
+    python benchmarks/standardization.py --entries 10 --entries 100 --entries 1000
+"""
+
+import copy
+import pathlib
+import statistics
+import sys
+import time
+import tracemalloc
+import typer
+
+from typing import Callable, Dict, List, Tuple
+
+APP_ROOT = pathlib.Path(__file__).resolve().parent.parent
+SALT = "benchmark-salt"
+
+
+class StandInGeocoder:
+    """A stand-in SmartyStreets client that finds no candidates for any address."""
+
+    def send_lookup(self, lookup) -> None:
+        lookup.result = []
+
+
+def make_bundle(patients: int, entries: int) -> Dict:
+    """
+    Build a bundle resembling converter output, with patients spread among the
+    other entries.
+
+    :param patients: The number of Patient resources
+    :param entries: The number of other resources
+    """
+    others = [
+        {
+            "fullUrl": f"urn:uuid:obs-{i}",
+            "resource": {
+                "resourceType": "Observation",
+                "id": f"obs-{i}",
+                "status": "final",
+                "code": {"coding": [{"system": "http://loinc.org", "code": "94500-6"}]},
+                "valueString": "Not detected " * 4,
+                "subject": {"reference": "Patient/patient-0"},
+            },
+        }
+        for i in range(entries)
+    ]
+    bundle = {"resourceType": "Bundle", "type": "batch", "entry": others}
+    for i in range(patients):
+        bundle["entry"].insert(
+            i * (len(bundle["entry"]) // patients),
+            {
+                "fullUrl": f"urn:uuid:patient-{i}",
+                "resource": {
+                    "resourceType": "Patient",
+                    "id": f"patient-{i}",
+                    "name": [{"family": " doe ", "given": ["John", "d4nger"]}],
+                    "birthDate": "1983-02-01",
+                    "telecom": [{"system": "phone", "value": "(555) 555-1234"}],
+                    "address": [
+                        {
+                            "line": ["123 Fake St"],
+                            "city": "Faketon",
+                            "state": "NY",
+                            "postalCode": "10001",
+                            "country": "USA",
+                        }
+                    ],
+                },
+            },
+        )
+    return bundle
+
+
+def measure(
+    standardize: Callable[[Dict], Dict], bundle: Dict, runs: int
+) -> Tuple[float, int]:
+    """
+    Standardize copies of a bundle and report the median time taken, in
+    milliseconds, and the peak memory allocated, in bytes.
+    """
+    times_ms = []
+    for _ in range(runs):
+        run_bundle = copy.deepcopy(bundle)
+        start = time.perf_counter()
+        standardize(run_bundle)
+        times_ms.append((time.perf_counter() - start) * 1000)
+
+    run_bundle = copy.deepcopy(bundle)
+    tracemalloc.start()
+    standardize(run_bundle)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times_ms), peak
+
+
+def main(
+    entries: List[int] = typer.Option(
+        [10, 100, 1000], help="Numbers of non-patient entries per bundle"
+    ),
+    patients: int = typer.Option(1, help="Number of patients per bundle"),
+    runs: int = typer.Option(20, help="Number of messages timed per bundle size"),
+) -> None:
+    sys.path.insert(0, str(APP_ROOT))
+    from IntakePipeline.standardization import standardize_patients
+    from phdi.geo import geocode_patients
+    from phdi.linkage import add_patient_identifier
+    from phdi.standardize import standardize_all_phones, standardize_patient_names
+
+    geocoder = StandInGeocoder()
+
+    def chain(bundle: Dict) -> Dict:
+        bundle = standardize_patient_names(bundle)
+        bundle = standardize_all_phones(bundle)
+        bundle = geocode_patients(bundle, geocoder)
+        return add_patient_identifier(bundle, SALT)
+
+    def fused(bundle: Dict) -> Dict:
+        return standardize_patients(bundle, geocoder, SALT)
+
+    typer.echo(
+        f"{'entries':>8}{'chain ms':>12}{'fused ms':>12}{'saved ms':>12}"
+        + f"{'chain KiB':>12}{'fused KiB':>12}"
+    )
+    for count in entries:
+        bundle = make_bundle(patients, count)
+        if fused(copy.deepcopy(bundle)) != chain(copy.deepcopy(bundle)):
+            typer.echo(f"Results differ for {count} entries", err=True)
+            raise typer.Exit(code=1)
+
+        chain_ms, chain_peak = measure(chain, bundle, runs)
+        fused_ms, fused_peak = measure(fused, bundle, runs)
+        typer.echo(
+            f"{count:>8}{chain_ms:>12.3f}{fused_ms:>12.3f}"
+            + f"{chain_ms - fused_ms:>12.3f}"
+            + f"{chain_peak / 1024:>12.1f}{fused_peak / 1024:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,32 @@
+import functools
+
+from phdi.azure import AzureFhirServerCredentialManager
+from phdi.geo import get_smartystreets_client
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from smartystreets_python_sdk import us_street
+
+
+@functools.lru_cache(maxsize=None)
+def get_cred_manager(fhir_url: str) -> AzureFhirServerCredentialManager:
+    """
+    Get the credential manager for a FHIR server.  The manager is created once
+    per worker process, so an access token obtained by one invocation is reused
+    by later invocations until it nears expiry.
+
+    :param fhir_url: The url of the FHIR server to authenticate with
+    """
+    return AzureFhirServerCredentialManager(fhir_url)
+
+
+@functools.lru_cache(maxsize=None)
+def get_geocoder(auth_id: str, auth_token: str) -> "us_street.Client":
+    """
+    Get a SmartyStreets client for geocoding.  The client is created once per
+    worker process and reused by later invocations.
+
+    :param auth_id: The SmartyStreets auth id
+    :param auth_token: The corresponding auth token
+    """
+    return get_smartystreets_client(auth_id, auth_token)
@@ -0,0 +1,99 @@
+import threading
+
+from FhirLookup.cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cache_freshness():
+    clock = FakeClock()
+    cache = ResponseCache(max_bytes=100, ttl_seconds=10, clock=clock)
+    cache.put("Patient/1", b"patient", "application/fhir+json", 'W/"1"')
+
+    response = cache.get("Patient/1")
+    assert response.body == b"patient"
+    assert response.etag == 'W/"1"'
+    assert cache.is_fresh(response)
+
+    clock.now = 10
+    assert not cache.is_fresh(response)
+    # Stale responses are kept for revalidation
+    assert cache.get("Patient/1") is response
+
+    cache.touch(response)
+    assert cache.is_fresh(response)
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_bytes=10, ttl_seconds=10)
+    cache.put("Patient/1", b"aaaa", "application/fhir+json", None)
+    cache.put("Patient/2", b"bbbb", "application/fhir+json", None)
+    cache.get("Patient/1")
+    cache.put("Patient/3", b"cccc", "application/fhir+json", None)
+
+    assert cache.get("Patient/2") is None
+    assert cache.get("Patient/1") is not None
+    assert cache.get("Patient/3") is not None
+    assert cache.size_bytes == 8
+    assert cache.get_metrics()["evictions"] == 1
+
+
+def test_cache_replaces_and_discards():
+    cache = ResponseCache(max_bytes=10, ttl_seconds=10)
+    cache.put("Patient/1", b"aaaa", "application/fhir+json", None)
+    cache.put("Patient/1", b"bb", "application/fhir+json", None)
+    assert cache.size_bytes == 2
+
+    cache.discard("Patient/1")
+    assert cache.get("Patient/1") is None
+    assert cache.size_bytes == 0
+
+
+def test_cache_skips_responses_larger_than_cache():
+    cache = ResponseCache(max_bytes=4, ttl_seconds=10)
+    cache.put("Patient/1", b"aaaaa", "application/fhir+json", None)
+
+    assert cache.get("Patient/1") is None
+    assert cache.size_bytes == 0
+
+
+def test_cache_metrics():
+    cache = ResponseCache(max_bytes=100, ttl_seconds=10)
+    cache.put("Patient/1", b"aaaa", "application/fhir+json", None)
+    for outcome in ["hit", "hit", "revalidated", "miss"]:
+        cache.record(outcome)
+
+    assert cache.get_metrics() == {
+        "hit": 2,
+        "revalidated": 1,
+        "miss": 1,
+        "requests": 4,
+        "hit_rate": 0.75,
+        "entries": 1,
+        "size_bytes": 4,
+    }
+
+
+def test_cache_is_thread_safe():
+    cache = ResponseCache(max_bytes=500, ttl_seconds=10)
+
+    def work(thread: int):
+        for i in range(500):
+            key = f"Patient/{(thread + i) % 200}"
+            if cache.get(key) is None:
+                cache.put(key, b"patient", "application/fhir+json", None)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.size_bytes <= 500
+    assert cache.size_bytes == 7 * cache.get_metrics()["entries"]
@@ -0,0 +1,198 @@
+import json
+import pytest
+import requests
+
+from unittest import mock
+
+from FhirLookup import compose_lookup_url, main, reset_cache
+
+ENVIRONMENT = {
+    "FHIR_URL": "https://some-fhir-url",
+    "FHIR_LOOKUP_CACHE_TTL_SECONDS": "60",
+}
+
+
+@pytest.fixture(autouse=True)
+def cache():
+    reset_cache()
+    yield
+    reset_cache()
+
+
+@pytest.fixture()
+def cred_manager():
+    with mock.patch("FhirLookup.get_cred_manager") as get_cred_manager:
+        access_token = get_cred_manager.return_value.get_access_token.return_value
+        access_token.token = "some-token"
+        yield get_cred_manager.return_value
+
+
+def make_request(path: str, query: str = "") -> mock.Mock:
+    req = mock.Mock()
+    req.route_params = {"path": path}
+    req.url = f"https://some-function-app/api/FhirLookup/{path}" + (
+        f"?{query}" if query else ""
+    )
+    return req
+
+
+def make_response(status_code: int, body: bytes = b"", etag: str = None):
+    response = mock.Mock(status_code=status_code, content=body)
+    response.headers = {"Content-Type": "application/fhir+json"}
+    if etag:
+        response.headers["ETag"] = etag
+    return response
+
+
+def test_compose_lookup_url():
+    types = ["Patient", "Immunization"]
+
+    assert compose_lookup_url("https://some-fhir-url/", "Patient/1", "", types) == (
+        "https://some-fhir-url/Patient/1"
+    )
+    assert compose_lookup_url(
+        "https://some-fhir-url",
+        "Immunization",
+        "patient=Patient/1&date=ge2022-01-01",
+        types,
+    ) == ("https://some-fhir-url/Immunization?date=ge2022-01-01&patient=Patient%2F1")
+    # Repeated parameters are all kept, in a consistent order
+    assert compose_lookup_url(
+        "https://some-fhir-url",
+        "Immunization",
+        "date=lt2023-01-01&patient=Patient%2F1&date=ge2022-01-01",
+        types,
+    ) == (
+        "https://some-fhir-url/Immunization"
+        + "?date=ge2022-01-01&date=lt2023-01-01&patient=Patient%2F1"
+    )
+    assert compose_lookup_url(
+        "https://some-fhir-url", "Patient/1/_history/2", "", types
+    ) == ("https://some-fhir-url/Patient/1/_history/2")
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "",
+        "Practitioner/1",
+        "Patient/1/$everything",
+        "Patient/1/_history",
+        "Patient/a b",
+    ],
+)
+def test_compose_lookup_url_rejects(path):
+    with pytest.raises(ValueError):
+        compose_lookup_url("https://some-fhir-url", path, "", ["Patient"])
+
+
+@mock.patch("FhirLookup.requests.get")
+@mock.patch.dict("os.environ", ENVIRONMENT)
+def test_main_caches_reads(mock_get, cred_manager):
+    mock_get.return_value = make_response(200, b'{"id": "1"}', 'W/"1"')
+
+    first = main(make_request("Patient/1"))
+    second = main(make_request("Patient/1"))
+
+    assert first.get_body() == second.get_body() == b'{"id": "1"}'
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.headers["ETag"] == 'W/"1"'
+    mock_get.assert_called_once_with(
+        "https://some-fhir-url/Patient/1",
+        headers={
+            "Authorization": "Bearer some-token",
+            "Accept": "application/fhir+json",
+        },
+        timeout=30,
+    )
+
+
+@mock.patch("FhirLookup.requests.get")
+@mock.patch.dict("os.environ", {**ENVIRONMENT, "FHIR_LOOKUP_CACHE_TTL_SECONDS": "0"})
+def test_main_revalidates_stale_responses(mock_get, cred_manager):
+    mock_get.side_effect = [
+        make_response(200, b'{"id": "1"}', 'W/"1"'),
+        make_response(304),
+        make_response(200, b'{"id": "1", "active": true}', 'W/"2"'),
+    ]
+
+    main(make_request("Patient/1"))
+    revalidated = main(make_request("Patient/1"))
+    changed = main(make_request("Patient/1"))
+
+    assert mock_get.call_args_list[1][1]["headers"]["If-None-Match"] == 'W/"1"'
+    assert revalidated.headers["X-Cache"] == "REVALIDATED"
+    assert revalidated.get_body() == b'{"id": "1"}'
+    assert changed.headers["X-Cache"] == "MISS"
+    assert changed.get_body() == b'{"id": "1", "active": true}'
+
+    metrics = json.loads(main(make_request("_metrics")).get_body())
+    assert metrics["miss"] == 1
+    assert metrics["revalidated"] == 1
+    assert metrics["refreshed"] == 1
+    assert metrics["hit_rate"] == pytest.approx(1 / 3, abs=0.001)
+
+
+@mock.patch("FhirLookup.requests.get")
+@mock.patch.dict("os.environ", {**ENVIRONMENT, "FHIR_LOOKUP_CACHE_TTL_SECONDS": "0"})
+def test_main_forgets_deleted_resources(mock_get, cred_manager):
+    mock_get.side_effect = [
+        make_response(200, b'{"id": "1"}', 'W/"1"'),
+        make_response(410, b'{"resourceType": "OperationOutcome"}'),
+        make_response(200, b'{"id": "1"}'),
+    ]
+
+    main(make_request("Patient/1"))
+    gone = main(make_request("Patient/1"))
+    main(make_request("Patient/1"))
+
+    assert gone.status_code == 410
+    assert "If-None-Match" not in mock_get.call_args_list[2][1]["headers"]
+
+
+@mock.patch("FhirLookup.requests.get")
+@mock.patch.dict("os.environ", ENVIRONMENT)
+def test_main_rejects_other_types(mock_get, cred_manager):
+    response = main(make_request("Practitioner/1"))
+
+    assert response.status_code == 400
+    mock_get.assert_not_called()
+
+
+@mock.patch("FhirLookup.requests.get")
+@mock.patch.dict("os.environ", ENVIRONMENT)
+def test_main_server_unreachable(mock_get, cred_manager):
+    mock_get.side_effect = requests.ConnectionError()
+
+    response = main(make_request("Immunization", "patient=Patient/1"))
+
+    assert response.status_code == 502
+
+
+@mock.patch("FhirLookup.requests.get")
+@mock.patch.dict("os.environ", {**ENVIRONMENT, "FHIR_LOOKUP_CACHE_TTL_SECONDS": "0"})
+def test_main_serves_stale_responses(mock_get, cred_manager):
+    mock_get.side_effect = [
+        make_response(200, b'{"id": "1"}', 'W/"1"'),
+        make_response(503),
+        make_response(429),
+        requests.ConnectionError(),
+        make_response(304),
+    ]
+
+    main(make_request("Patient/1"))
+    stale = [main(make_request("Patient/1")) for _ in range(3)]
+    revalidated = main(make_request("Patient/1"))
+
+    # The cached response is served while the FHIR server can't answer, and
+    # kept for when it can
+    assert [response.status_code for response in stale] == [200, 200, 200]
+    assert [response.headers["X-Cache"] for response in stale] == ["STALE"] * 3
+    assert stale[0].get_body() == b'{"id": "1"}'
+    assert mock_get.call_args_list[4][1]["headers"]["If-None-Match"] == 'W/"1"'
+    assert revalidated.headers["X-Cache"] == "REVALIDATED"
+
+    metrics = json.loads(main(make_request("_metrics")).get_body())
+    assert metrics["stale"] == 3
+    assert metrics["requests"] == 5
@@ -0,0 +1,74 @@
+import pytest
+
+from FhirServerExport.filters import (
+    ExportParameterError,
+    compose_export_url,
+    get_export_parameters,
+)
+
+
+def test_get_export_parameters():
+    params = {
+        "since": "2022-01-01T00:00:00Z",
+        "type": "Patient,Immunization",
+        "_typeFilter": "Immunization?date=ge2022-01-01&vaccine-code=207,208,"
+        + "Patient?address-state=NY",
+        "_elements": "id, Immunization.vaccineCode,Patient.birthDate",
+        "_container": "covid-exports",
+    }
+
+    assert get_export_parameters(params, "fhir-exports") == {
+        "_since": "2022-01-01T00:00:00Z",
+        "_type": "Patient,Immunization",
+        "_typeFilter": "Immunization?date=ge2022-01-01&vaccine-code=207,208,"
+        + "Patient?address-state=NY",
+        "_elements": "id,Immunization.vaccineCode,Patient.birthDate",
+        "_container": "covid-exports",
+    }
+
+
+def test_get_export_parameters_defaults():
+    assert get_export_parameters({}, "fhir-exports") == {"_container": "fhir-exports"}
+    assert get_export_parameters({"type": ""}, "") == {}
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"_typeFilter": "Immunization"},
+        {"_typeFilter": "immunization?date=ge2022-01-01"},
+        {"_typeFilter": "Immunization?date"},
+        {"type": "Patient", "_typeFilter": "Immunization?date=ge2022-01-01"},
+        {"_elements": "Immunization."},
+        {"_elements": "vaccine-code"},
+        {"_container": "Fhir_Exports"},
+        {"_container": "ab"},
+        {"_container": "fhir--exports"},
+    ],
+)
+def test_get_export_parameters_rejects_malformed(params):
+    with pytest.raises(ExportParameterError):
+        get_export_parameters(params)
+
+
+def test_compose_export_url():
+    parameters = {
+        "_type": "Immunization",
+        "_typeFilter": "Immunization?date=ge2022-01-01",
+        "_elements": "id,Immunization.vaccineCode",
+        "_since": "2022-01-01T00:00:00Z",
+    }
+
+    assert compose_export_url("https://some-fhir-url/", "Group/1", parameters) == (
+        "https://some-fhir-url/Group/1/$export?_since=2022-01-01T00%3A00%3A00Z"
+        + "&_type=Immunization&_typeFilter=Immunization%3Fdate%3Dge2022-01-01"
+        + "&_elements=id,Immunization.vaccineCode"
+    )
+    assert compose_export_url("https://some-fhir-url", "", {}) == (
+        "https://some-fhir-url/$export"
+    )
+
+
+def test_compose_export_url_rejects_scope():
+    with pytest.raises(ExportParameterError):
+        compose_export_url("https://some-fhir-url", "Encounter", {})
@@ -71,3 +71,74 @@ def test_main(mock_cred_manager_constructor, mock_export):
         poll_step=0.1,
         poll_timeout=1.0,
     )
+
+
+@mock.patch("FhirServerExport.time.sleep")
+@mock.patch("FhirServerExport.requests.get")
+@mock.patch("FhirServerExport.fhir.export_from_fhir_server")
+@mock.patch("FhirServerExport.AzureFhirServerCredentialManager")
+@mock.patch.dict("os.environ", ENVIRONMENT)
+def test_main_with_filters(
+    mock_cred_manager_constructor, mock_export, mock_get, mock_sleep
+):
+    mock_cred_manager = mock_cred_manager_constructor.return_value
+    mock_cred_manager.get_access_token.return_value.token = "some-token"
+    req = mock.Mock()
+    req.params = {
+        "type": "Immunization",
+        "_typeFilter": "Immunization?date=ge2022-01-01",
+        "_elements": "id,Immunization.vaccineCode",
+    }
+
+    kickoff_response = mock.Mock(status_code=202)
+    kickoff_response.headers = {"Content-Location": "https://some-poll-url"}
+    in_progress_response = mock.Mock(status_code=202)
+    complete_response = mock.Mock(status_code=200)
+    complete_response.json.return_value = {"output": []}
+    mock_get.side_effect = [kickoff_response, in_progress_response, complete_response]
+
+    response = main(req)
+
+    assert response.status_code == 202
+    mock_export.assert_not_called()
+    kickoff_url = mock_get.call_args_list[0][0][0]
+    assert kickoff_url == (
+        "https://some-fhir-url/$export?_type=Immunization"
+        + "&_typeFilter=Immunization%3Fdate%3Dge2022-01-01"
+        + "&_elements=id,Immunization.vaccineCode&_container=fhir-exports"
+    )
+    assert mock_get.call_args_list[0][1]["headers"]["Prefer"] == "respond-async"
+    assert mock_get.call_args_list[1][0][0] == "https://some-poll-url"
+    assert mock_get.call_count == 3
+    mock_sleep.assert_called_once_with(0.1)
+
+
+@mock.patch("FhirServerExport.requests.get")
+@mock.patch("FhirServerExport.fhir.export_from_fhir_server")
+@mock.patch("FhirServerExport.AzureFhirServerCredentialManager")
+@mock.patch.dict("os.environ", ENVIRONMENT)
+def test_main_rejects_malformed_parameters(
+    mock_cred_manager_constructor, mock_export, mock_get
+):
+    req = mock.Mock()
+    req.params = {"_elements": "vaccine-code"}
+
+    response = main(req)
+
+    assert response.status_code == 400
+    assert b"vaccine-code" in response.get_body()
+    mock_export.assert_not_called()
+    mock_get.assert_not_called()
+
+
+@mock.patch("FhirServerExport.fhir.export_from_fhir_server")
+@mock.patch("FhirServerExport.AzureFhirServerCredentialManager")
+@mock.patch.dict("os.environ", ENVIRONMENT)
+def test_main_overrides_container(mock_cred_manager_constructor, mock_export):
+    req = mock.Mock()
+    req.params = {"_container": "covid-exports"}
+    mock_export.return_value = {"output": []}
+
+    main(req)
+
+    assert mock_export.call_args[1]["container"] == "covid-exports"
@@ -0,0 +1,138 @@
+import json
+import pytest
+
+from unittest import mock
+
+from IntakeBatch import main
+from IntakePipeline.blob_events import BlobEvent
+
+
+def make_event(name: str, length: int = 100) -> str:
+    return json.dumps(
+        {
+            "eventType": "Microsoft.Storage.BlobCreated",
+            "subject": "/blobServices/default/containers/bronze/blobs/decrypted/"
+            + name,
+            "data": {"contentLength": length},
+        }
+    )
+
+
+def make_msg(body: str) -> mock.Mock:
+    msg = mock.Mock()
+    msg.get_body.return_value = body.encode("utf-8")
+    return msg
+
+
+@mock.patch("IntakeBatch.schedule_continuation")
+@mock.patch("IntakeBatch.release_event")
+@mock.patch("IntakeBatch.delete_event")
+@mock.patch("IntakeBatch.process_blobs")
+@mock.patch("IntakeBatch.open_blob")
+@mock.patch("IntakeBatch.receive_events")
+@mock.patch.dict("os.environ", {"INTAKE_BATCH_MAX_BLOBS": "4"})
+def test_main(
+    patched_receive_events,
+    patched_open_blob,
+    patched_process_blobs,
+    patched_delete_event,
+    patched_release_event,
+    patched_schedule_continuation,
+):
+    received = [
+        BlobEvent("bronze/decrypted/VXU/b.hl7", 100, mock.Mock()),
+        BlobEvent("bronze/decrypted/VXU/c.hl7", 100, mock.Mock()),
+        BlobEvent("bronze/decrypted/VXU/large.hl7", 10 * 2**20, mock.Mock()),
+    ]
+    patched_receive_events.return_value = received
+    patched_open_blob.side_effect = lambda name: mock.Mock(name=name)
+    patched_process_blobs.return_value = {
+        "bronze/decrypted/VXU/a.hl7": True,
+        "bronze/decrypted/VXU/b.hl7": True,
+        "bronze/decrypted/VXU/c.hl7": False,
+    }
+    patched_schedule_continuation.return_value = True
+
+    main(make_msg(make_event("VXU/a.hl7")))
+
+    assert patched_receive_events.call_args[0][0] == 3
+    # The small blobs are processed together, and the large one on its own
+    assert [call.args[0] for call in patched_open_blob.call_args_list] == [
+        "bronze/decrypted/VXU/a.hl7",
+        "bronze/decrypted/VXU/b.hl7",
+        "bronze/decrypted/VXU/c.hl7",
+    ]
+    assert len(patched_process_blobs.call_args[0][0]) == 3
+    patched_schedule_continuation.assert_called_once_with(
+        "bronze/decrypted/VXU/large.hl7", 0
+    )
+
+    deleted = [call.args[0].blob_name for call in patched_delete_event.call_args_list]
+    assert sorted(deleted) == [
+        "bronze/decrypted/VXU/a.hl7",
+        "bronze/decrypted/VXU/b.hl7",
+        "bronze/decrypted/VXU/large.hl7",
+    ]
+    patched_release_event.assert_called_once_with(received[1])
+
+
+@mock.patch("IntakeBatch.release_event")
+@mock.patch("IntakeBatch.delete_event")
+@mock.patch("IntakeBatch.process_blobs")
+@mock.patch("IntakeBatch.open_blob")
+@mock.patch("IntakeBatch.receive_events")
+def test_main_trigger_fails(
+    patched_receive_events,
+    patched_open_blob,
+    patched_process_blobs,
+    patched_delete_event,
+    patched_release_event,
+):
+    other = BlobEvent("bronze/decrypted/VXU/b.hl7", 100, mock.Mock())
+    patched_receive_events.return_value = [other]
+    patched_open_blob.side_effect = [Exception("not found"), mock.Mock()]
+    patched_process_blobs.return_value = {"bronze/decrypted/VXU/b.hl7": True}
+
+    with pytest.raises(RuntimeError):
+        main(make_msg(make_event("VXU/a.hl7")))
+
+    # The other blob still counts as processed
+    patched_delete_event.assert_called_once_with(other)
+
+
+@mock.patch("IntakeBatch.release_event")
+@mock.patch("IntakeBatch.delete_event")
+@mock.patch("IntakeBatch.process_blobs")
+@mock.patch("IntakeBatch.open_blob")
+@mock.patch("IntakeBatch.receive_events")
+@mock.patch.dict("os.environ", {"INTAKE_TIME_BUDGET_SECONDS": "120"})
+def test_main_deadline(
+    patched_receive_events,
+    patched_open_blob,
+    patched_process_blobs,
+    patched_delete_event,
+    patched_release_event,
+):
+    unreached = BlobEvent("bronze/decrypted/VXU/b.hl7", 100, mock.Mock())
+    patched_receive_events.return_value = [unreached]
+    # The time budget ran out before the second blob was reached
+    patched_process_blobs.return_value = {"bronze/decrypted/VXU/a.hl7": True}
+
+    main(make_msg(make_event("VXU/a.hl7")))
+
+    deadline = patched_process_blobs.call_args.args[1]
+    assert 0 < deadline.remaining() <= 120
+    # Its notification is returned to the queue for another invocation
+    patched_release_event.assert_called_once_with(unreached)
+    assert patched_delete_event.call_args.args[0].blob_name == (
+        "bronze/decrypted/VXU/a.hl7"
+    )
+
+
+@mock.patch("IntakeBatch.process_blobs")
+@mock.patch("IntakeBatch.receive_events")
+def test_main_ignores_other_events(patched_receive_events, patched_process_blobs):
+    main(make_msg(json.dumps({"eventType": "Microsoft.Storage.BlobDeleted"})))
+
+    patched_receive_events.assert_not_called()
+    patched_process_blobs.assert_not_called()
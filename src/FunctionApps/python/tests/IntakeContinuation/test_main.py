@@ -0,0 +1,19 @@
+import json
+
+from IntakeContinuation import main
+
+from unittest import mock
+
+
+@mock.patch("IntakeContinuation.process_blob")
+@mock.patch("IntakeContinuation.open_blob")
+def test_main(patched_open_blob, patched_process_blob):
+    msg = mock.Mock()
+    msg.get_body.return_value = json.dumps(
+        {"blob_name": "bronze/decrypted/VXU/some-file.hl7", "offset": 120}
+    ).encode("utf-8")
+
+    main(msg)
+
+    patched_open_blob.assert_called_with("bronze/decrypted/VXU/some-file.hl7")
+    patched_process_blob.assert_called_with(patched_open_blob.return_value, start=120)
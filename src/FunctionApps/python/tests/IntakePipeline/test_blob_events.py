@@ -0,0 +1,115 @@
+import json
+import pytest
+
+from unittest import mock
+
+from IntakePipeline import blob_events
+from IntakePipeline.blob_events import (
+    BlobEvent,
+    delete_event,
+    parse_event,
+    receive_events,
+    release_event,
+)
+
+
+def make_event(container: str = "bronze", path: str = "decrypted/VXU/a.hl7") -> str:
+    return json.dumps(
+        {
+            "eventType": "Microsoft.Storage.BlobCreated",
+            "subject": f"/blobServices/default/containers/{container}/blobs/{path}",
+            "data": {"contentLength": 1234},
+        }
+    )
+
+
+@pytest.fixture()
+def queue_clients():
+    clients = {
+        blob_events.BLOB_EVENTS_QUEUE_NAME: mock.Mock(),
+        blob_events.POISON_QUEUE_NAME: mock.Mock(),
+    }
+    with mock.patch.object(blob_events, "_queue_clients", clients):
+        yield clients
+
+
+def test_parse_event():
+    event = parse_event(make_event())
+
+    assert event.blob_name == "bronze/decrypted/VXU/a.hl7"
+    assert event.length == 1234
+    assert event.message is None
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        make_event(container="silver"),
+        make_event(path="other/VXU/a.hl7"),
+        json.dumps({"eventType": "Microsoft.Storage.BlobDeleted"}),
+        json.dumps({"eventType": "Microsoft.Storage.BlobCreated"}),
+        "not json",
+    ],
+)
+def test_parse_event_ignores(body):
+    assert parse_event(body) is None
+
+
+def test_receive_events(queue_clients):
+    queue_client = queue_clients[blob_events.BLOB_EVENTS_QUEUE_NAME]
+    messages = [
+        mock.Mock(content=make_event()),
+        mock.Mock(content=make_event(container="silver")),
+    ]
+    queue_client.receive_messages.return_value = iter(messages)
+
+    events = receive_events(10, 300)
+
+    assert [event.blob_name for event in events] == ["bronze/decrypted/VXU/a.hl7"]
+    assert events[0].message is messages[0]
+    queue_client.receive_messages.assert_called_with(
+        messages_per_page=10, max_messages=10, visibility_timeout=300
+    )
+    queue_client.delete_message.assert_called_once_with(messages[1])
+
+
+def test_receive_events_failure(queue_clients):
+    queue_client = queue_clients[blob_events.BLOB_EVENTS_QUEUE_NAME]
+    queue_client.receive_messages.side_effect = Exception("unreachable")
+
+    assert receive_events(10, 300) == []
+    assert receive_events(0, 300) == []
+
+
+def test_delete_event(queue_clients):
+    queue_client = queue_clients[blob_events.BLOB_EVENTS_QUEUE_NAME]
+    message = mock.Mock()
+
+    delete_event(BlobEvent("bronze/decrypted/VXU/a.hl7", 1, message))
+    # The triggering notification is left to the runtime
+    delete_event(BlobEvent("bronze/decrypted/VXU/b.hl7", 1))
+
+    queue_client.delete_message.assert_called_once_with(message)
+
+
+def test_release_event(queue_clients):
+    queue_client = queue_clients[blob_events.BLOB_EVENTS_QUEUE_NAME]
+    poison_client = queue_clients[blob_events.POISON_QUEUE_NAME]
+    message = mock.Mock(dequeue_count=1)
+
+    release_event(BlobEvent("bronze/decrypted/VXU/a.hl7", 1, message))
+
+    queue_client.update_message.assert_called_with(message, visibility_timeout=0)
+    poison_client.send_message.assert_not_called()
+
+
+def test_release_event_poisons(queue_clients):
+    queue_client = queue_clients[blob_events.BLOB_EVENTS_QUEUE_NAME]
+    poison_client = queue_clients[blob_events.POISON_QUEUE_NAME]
+    message = mock.Mock(dequeue_count=blob_events.MAX_DEQUEUE_COUNT, content="event")
+
+    release_event(BlobEvent("bronze/decrypted/VXU/a.hl7", 1, message))
+
+    poison_client.send_message.assert_called_with("event")
+    queue_client.delete_message.assert_called_with(message)
+    queue_client.update_message.assert_not_called()
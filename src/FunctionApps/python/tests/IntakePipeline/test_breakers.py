@@ -0,0 +1,114 @@
+from IntakePipeline.breakers import (
+    CircuitBreaker,
+    get_breaker,
+    get_breaker_metrics,
+    reset_breakers,
+)
+
+from unittest import mock
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock):
+    return CircuitBreaker(
+        "some-dependency",
+        error_rate=0.5,
+        min_calls=4,
+        window_size=10,
+        open_seconds=30,
+        clock=clock,
+    )
+
+
+def test_breaker_opens_at_error_rate():
+    breaker = make_breaker(Clock())
+
+    # Too few calls to judge
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_success()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.get_metrics()["opened"] == 1
+    assert breaker.get_metrics()["rejected"] == 1
+
+
+def test_breaker_half_open_probe_closes():
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record_failure()
+
+    clock.now = 10
+    assert breaker.retry_after() == 20
+    assert not breaker.allow()
+
+    clock.now = 30
+    # Only a single probe is let through
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    assert breaker.get_metrics()["recent_failures"] == 0
+
+
+def test_breaker_half_open_probe_reopens():
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record_failure()
+
+    clock.now = 30
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert breaker.retry_after() == 30
+    assert breaker.get_metrics()["opened"] == 2
+
+
+def test_breaker_abandoned_probe():
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record_failure()
+
+    clock.now = 30
+    assert breaker.allow()
+    # The probe's outcome was never recorded
+    clock.now = 60
+    assert breaker.allow()
+
+
+@mock.patch.dict(
+    "os.environ",
+    {"CIRCUIT_BREAKER_MIN_CALLS": "2", "CIRCUIT_BREAKER_OPEN_SECONDS": "5"},
+)
+def test_get_breaker():
+    reset_breakers()
+
+    breaker = get_breaker("convert")
+
+    assert get_breaker("convert") is breaker
+    assert breaker.min_calls == 2
+    assert breaker.open_seconds == 5
+    assert breaker.error_rate == 0.5
+    assert list(get_breaker_metrics()) == ["convert"]
+
+    reset_breakers()
+    assert get_breaker_metrics() == {}
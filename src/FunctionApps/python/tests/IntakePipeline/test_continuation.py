@@ -0,0 +1,123 @@
+import json
+
+from azure.core.exceptions import ResourceNotFoundError
+from IntakePipeline.continuation import (
+    BlobProgress,
+    BlobStream,
+    Deadline,
+    clear_checkpoint,
+    get_checkpoint,
+    get_etag,
+    schedule_continuation,
+    store_checkpoint,
+)
+
+from unittest import mock
+
+
+def test_deadline():
+    assert not Deadline(60).expired()
+    assert Deadline(-1).expired()
+    assert Deadline(0).remaining() == float("inf")
+
+
+@mock.patch("IntakePipeline.continuation.store_checkpoint")
+def test_blob_progress_watermark(patched_store_checkpoint):
+    progress = BlobProgress("some-blob", 100, 10, interval=2, etag="0x1")
+
+    # Messages finish out of order, so the checkpoint waits for message 10
+    progress.complete(11)
+    patched_store_checkpoint.assert_not_called()
+    progress.complete(12)
+    patched_store_checkpoint.assert_called_once_with("some-blob", 100, 10, "0x1")
+
+    progress.complete(10)
+    assert progress.offset == 13
+    progress.complete(13)
+    patched_store_checkpoint.assert_called_with("some-blob", 100, 14, "0x1")
+    assert progress.checkpointed
+
+
+def test_blob_progress_until():
+    progress = BlobProgress("some-blob", 100, 0, interval=50)
+    deadline = mock.Mock()
+    deadline.expired.side_effect = [False, False, True]
+
+    messages = list(progress.until(enumerate(["a", "b", "c", "d"]), deadline))
+
+    assert messages == [(0, "a"), (1, "b")]
+    assert progress.stopped_at == 2
+
+
+def test_blob_progress_until_end():
+    progress = BlobProgress("some-blob", 100, 0, interval=50)
+
+    messages = list(progress.until(enumerate(["a", "b"]), Deadline(0)))
+
+    assert messages == [(0, "a"), (1, "b")]
+    assert progress.stopped_at is None
+    assert not progress.checkpointed
+
+
+@mock.patch("IntakePipeline.continuation._get_table_client")
+def test_get_checkpoint(patched_get_table_client):
+    table_client = patched_get_table_client.return_value
+    table_client.get_entity.return_value = {
+        "BlobLength": 100,
+        "BlobETag": "0x1",
+        "Offset": 40,
+    }
+
+    assert get_checkpoint("some-blob", 100, "0x1") == 40
+    assert get_checkpoint("some-blob", 100) == 40
+    # The blob was replaced by one of a different size, or of the same size
+    assert get_checkpoint("some-blob", 200, "0x1") == 0
+    assert get_checkpoint("some-blob", 100, "0x2") == 0
+
+    table_client.get_entity.side_effect = ResourceNotFoundError()
+    assert get_checkpoint("some-blob", 100) == 0
+
+    table_client.get_entity.side_effect = Exception("some-error")
+    assert get_checkpoint("some-blob", 100) == 0
+
+
+@mock.patch("IntakePipeline.continuation._get_table_client")
+def test_store_and_clear_checkpoint(patched_get_table_client):
+    table_client = patched_get_table_client.return_value
+
+    store_checkpoint("bronze/some-blob", 100, 40, "0x1")
+    entity = table_client.upsert_entity.call_args.args[0]
+    assert entity["BlobName"] == "bronze/some-blob"
+    assert entity["BlobLength"] == 100
+    assert entity["BlobETag"] == "0x1"
+    assert entity["Offset"] == 40
+    assert "/" not in entity["RowKey"]
+
+    clear_checkpoint("bronze/some-blob")
+    table_client.delete_entity.assert_called_with("blob", entity["RowKey"])
+
+    # Storage failures are logged rather than raised
+    table_client.upsert_entity.side_effect = Exception("some-error")
+    store_checkpoint("bronze/some-blob", 100, 40)
+
+
+@mock.patch("IntakePipeline.continuation._get_queue_client")
+def test_schedule_continuation(patched_get_queue_client):
+    queue_client = patched_get_queue_client.return_value
+
+    assert schedule_continuation("bronze/some-blob", 40)
+    assert json.loads(queue_client.send_message.call_args.args[0]) == {
+        "blob_name": "bronze/some-blob",
+        "offset": 40,
+    }
+
+    queue_client.send_message.side_effect = Exception("some-error")
+    assert not schedule_continuation("bronze/some-blob", 40)
+
+
+def test_get_etag():
+    blob = mock.Mock(blob_properties={"ETag": '"0x8DA0000000000A"'})
+    assert get_etag(blob) == "0x8DA0000000000A"
+    assert get_etag(BlobStream("bronze/some-blob", 0, None, "0x1")) == "0x1"
+    assert get_etag(BlobStream("bronze/some-blob", 0, None)) is None
+    assert get_etag(mock.Mock(blob_properties=None)) is None
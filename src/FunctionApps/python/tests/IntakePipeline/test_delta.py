@@ -0,0 +1,196 @@
+import datetime
+
+from unittest import mock
+
+from IntakePipeline.delta import (
+    DeltaUpload,
+    get_fingerprint,
+    get_identity,
+    lookup_fingerprints,
+    store_fingerprints,
+    _get_keys,
+)
+
+
+def make_entry(resource_id, family="DOE", method="PUT"):
+    return {
+        "fullUrl": f"urn:uuid:{resource_id}",
+        "resource": {
+            "resourceType": "Patient",
+            "id": resource_id,
+            "identifier": [{"system": "urn:some-system", "value": resource_id}],
+            "name": [{"family": family}],
+        },
+        "request": {"method": method, "url": f"Patient/{resource_id}"},
+    }
+
+
+class TableEntity(dict):
+    """Mimics the table SDK's entities, which are dicts with metadata."""
+
+    metadata = {}
+
+
+def make_entity(identity, fingerprint, etag="", age_hours=0):
+    partition_key, row_key = _get_keys(identity)
+    entity = TableEntity(
+        PartitionKey=partition_key,
+        RowKey=row_key,
+        Fingerprint=fingerprint,
+        ETag=etag,
+    )
+    entity.metadata = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc)
+        - datetime.timedelta(hours=age_hours)
+    }
+    return entity
+
+
+def test_get_identity():
+    assert get_identity(make_entry("some-id")) == "Patient/some-id"
+    assert get_identity(make_entry("some-id", method="POST")) is None
+    assert get_identity({"resource": {}}) is None
+
+
+def test_get_fingerprint():
+    resource = make_entry("some-id")["resource"]
+    reordered = dict(reversed(list(resource.items())))
+
+    assert get_fingerprint(resource) == get_fingerprint(reordered)
+    assert get_fingerprint(resource) == get_fingerprint(
+        {**resource, "meta": {"versionId": "2"}}
+    )
+    assert get_fingerprint(resource) != get_fingerprint(
+        make_entry("some-id", family="SMITH")["resource"]
+    )
+
+
+@mock.patch("IntakePipeline.delta._get_table_client")
+def test_lookup_fingerprints(patched_get_table_client):
+    identities = [f"Patient/{i}" for i in range(20)]
+    patched_get_table_client.return_value.query_entities.side_effect = [
+        [make_entity("Patient/1", "fresh"), make_entity("Patient/2", "stale", "", 500)],
+        [make_entity("Patient/16", "fresh")],
+    ]
+
+    known = lookup_fingerprints(identities)
+
+    # Lookups are batched, and fingerprints past their maximum age are ignored
+    assert patched_get_table_client.return_value.query_entities.call_count == 2
+    assert sorted(known) == ["Patient/1", "Patient/16"]
+
+
+@mock.patch("IntakePipeline.delta._get_table_client")
+def test_lookup_fingerprints_unavailable(patched_get_table_client):
+    patched_get_table_client.return_value.query_entities.side_effect = Exception()
+
+    assert lookup_fingerprints(["Patient/1"]) == {}
+
+
+@mock.patch("IntakePipeline.delta._get_table_client")
+def test_lookup_fingerprints_filter_size(patched_get_table_client):
+    identities = [f"Patient/{i}" for i in range(30)] + ["Observation/1"]
+    patched_get_table_client.return_value.query_entities.return_value = []
+
+    lookup_fingerprints(identities)
+
+    # Each query stays within the 15 comparisons a table filter may hold, and
+    # only compares row keys within a single partition
+    calls = patched_get_table_client.return_value.query_entities.call_args_list
+    assert len(calls) == 4
+    for call in calls:
+        query_filter = call.args[0]
+        assert query_filter.count(" eq ") <= 15
+        assert query_filter.count("PartitionKey eq ") == 1
+    looked_up = [
+        value
+        for call in calls
+        for name, value in call.kwargs["parameters"].items()
+        if name.startswith("rk")
+    ]
+    assert sorted(looked_up) == sorted(_get_keys(i)[1] for i in identities)
+
+
+@mock.patch("IntakePipeline.delta._get_table_client")
+def test_store_fingerprints(patched_get_table_client):
+    store_fingerprints(
+        [
+            ("Patient/1", "a", 'W/"1"'),
+            ("Observation/1", "b", None),
+            ("Patient/1", "c", 'W/"2"'),
+        ]
+    )
+
+    transactions = [
+        call.args[0]
+        for call in patched_get_table_client.return_value.submit_transaction.mock_calls
+    ]
+    # One transaction per partition, holding each row once
+    assert len(transactions) == 2
+    patient_operations = next(
+        t for t in transactions if t[0][1]["PartitionKey"] == "Patient"
+    )
+    assert [(op, e["Fingerprint"], e["ETag"]) for op, e in patient_operations] == [
+        ("upsert", "c", 'W/"2"')
+    ]
+
+
+@mock.patch("IntakePipeline.delta.store_fingerprints")
+@mock.patch("IntakePipeline.delta.lookup_fingerprints")
+def test_delta_upload(patched_lookup, patched_store):
+    unchanged = make_entry("unchanged")
+    changed = make_entry("changed", family="SMITH")
+    new = make_entry("new")
+    created = make_entry("created", method="POST")
+    patched_lookup.return_value = {
+        "Patient/unchanged": {
+            "Fingerprint": get_fingerprint(unchanged["resource"]),
+            "ETag": 'W/"1"',
+        },
+        "Patient/changed": {
+            "Fingerprint": get_fingerprint(make_entry("changed")["resource"]),
+            "ETag": 'W/"3"',
+        },
+    }
+    bundle = {"resourceType": "Bundle", "entry": [unchanged, changed, new, created]}
+
+    delta_upload = DeltaUpload(bundle)
+
+    assert delta_upload.skipped == 1
+    assert delta_upload.indexes == [1, 2, 3]
+    assert delta_upload.upload_bundle == {
+        "resourceType": "Bundle",
+        "entry": [changed, new, created],
+    }
+
+    delta_upload.record(
+        {
+            "entry": [
+                {"response": {"status": "200 OK", "etag": 'W/"4"'}},
+                {"response": {"status": "400 Bad Request"}},
+                {"response": {"status": "201 Created", "etag": 'W/"1"'}},
+            ]
+        }
+    )
+
+    # Only successful writes of resources with an identity are recorded
+    patched_store.assert_called_with(
+        [("Patient/changed", get_fingerprint(changed["resource"]), 'W/"4"')]
+    )
+
+
+@mock.patch("IntakePipeline.delta.lookup_fingerprints")
+def test_delta_upload_conditional(patched_lookup):
+    changed = make_entry("changed", family="SMITH")
+    created = make_entry("created", method="POST")
+    patched_lookup.return_value = {
+        "Patient/changed": {"Fingerprint": "old", "ETag": 'W/"3"'}
+    }
+
+    delta_upload = DeltaUpload({"entry": [changed, created]}, conditional=True)
+
+    requests = [e["request"] for e in delta_upload.upload_bundle["entry"]]
+    assert requests[0]["ifMatch"] == 'W/"3"'
+    assert requests[1]["ifNoneExist"] == "identifier=urn:some-system|created"
+    # The original bundle is left alone
+    assert "ifMatch" not in changed["request"]
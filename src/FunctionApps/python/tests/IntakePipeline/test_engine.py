@@ -0,0 +1,94 @@
+import threading
+import time
+
+from IntakePipeline.engine import Stage, StagedEngine
+
+
+def test_engine_runs_every_stage():
+    completed = []
+    stages = [
+        Stage("double", lambda item: item.append(item[0] * 2) or True),
+        Stage("square", lambda item: item.append(item[1] ** 2) or True, 3),
+    ]
+
+    with StagedEngine(stages, queue_size=2, on_complete=completed.append) as engine:
+        for i in range(10):
+            engine.submit([i])
+
+    assert sorted(completed) == [[i, i * 2, (i * 2) ** 2] for i in range(10)]
+    metrics = engine.get_metrics()
+    assert metrics["double"]["processed"] == 10
+    assert metrics["square"]["processed"] == 10
+    assert metrics["square"]["queue_depth"] == 0
+    assert metrics["square"]["active"] == 0
+
+
+def test_engine_finishes_items_early():
+    later = []
+
+    def fail(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item % 2 == 0
+
+    completed = []
+    stages = [Stage("filter", fail), Stage("later", lambda item: later.append(item))]
+    with StagedEngine(stages, queue_size=4, on_complete=completed.append) as engine:
+        for i in range(6):
+            engine.submit(i)
+
+    # Odd items stop after the first stage and the failing item doesn't stop
+    # the rest, but every item completes
+    assert sorted(later) == [0, 2, 4]
+    assert sorted(completed) == list(range(6))
+    assert engine.get_metrics()["filter"]["failed"] == 1
+
+
+def test_engine_stage_concurrency():
+    barrier = threading.Barrier(3, timeout=5)
+
+    with StagedEngine([Stage("wait", lambda item: barrier.wait(), 3)], 3) as engine:
+        for i in range(3):
+            engine.submit(i)
+
+    # All three items must have been in the stage at once to pass the barrier
+    assert not barrier.broken
+    assert engine.get_metrics()["wait"]["processed"] == 3
+
+
+def test_engine_backpressure():
+    release = threading.Event()
+    submitted = []
+
+    def slow(item):
+        release.wait(5)
+        return True
+
+    engine = StagedEngine(
+        [Stage("fast", lambda item: True), Stage("slow", slow)], queue_size=2
+    )
+    with engine:
+
+        def submit_all():
+            for i in range(10):
+                engine.submit(i)
+                submitted.append(i)
+
+        feeder = threading.Thread(target=submit_all)
+        feeder.start()
+        time.sleep(0.2)
+
+        # One item in the slow stage, two waiting in front of it, one blocked in
+        # the fast stage and two waiting in front of that
+        assert len(submitted) < 10
+        metrics = engine.get_metrics()
+        assert metrics["slow"]["queue_depth"] == 2
+        assert metrics["slow"]["active"] == 1
+
+        release.set()
+        feeder.join()
+
+    metrics = engine.get_metrics()
+    assert metrics["slow"]["processed"] == 10
+    assert metrics["slow"]["max_queue_depth"] <= 2
+    assert metrics["fast"]["max_queue_depth"] <= 2
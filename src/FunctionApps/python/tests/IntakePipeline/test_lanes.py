@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+
+from unittest import mock
+
+from IntakePipeline.lanes import Lane, LaneScheduler, get_scheduler
+
+
+def test_lane_matches():
+    bulk = Lane("bulk", path_patterns=["*/backfill/*"], min_size=100)
+    elr = Lane("elr", bundle_types=["ELR"])
+    default = Lane("realtime")
+
+    assert bulk.matches("bronze/decrypted/backfill/VXU_1.hl7", 10, {})
+    assert bulk.matches("bronze/decrypted/VXU_1.hl7", 1000, {})
+    assert not bulk.matches("bronze/decrypted/VXU_1.hl7", 10, {})
+    assert not bulk.matches("bronze/decrypted/VXU_1.hl7", None, {})
+    assert elr.matches("bronze/decrypted/ELR_1.hl7", 10, {"bundle_type": "ELR"})
+    assert not elr.matches("bronze/decrypted/VXU_1.hl7", 10, {"bundle_type": "VXU"})
+    assert default.matches("anything", None, {})
+
+
+def test_classify():
+    bulk = Lane("bulk", min_size=100)
+    elr = Lane("elr", bundle_types=["ELR"])
+    scheduler = LaneScheduler([bulk, elr], max_concurrency=2)
+
+    assert scheduler.classify("big.hl7", 1000, {"bundle_type": "ELR"}) is bulk
+    assert scheduler.classify("small.hl7", 10, {"bundle_type": "ELR"}) is elr
+    # Blobs matching no lane fall through to the last lane
+    assert scheduler.classify("small.hl7", 10, {"bundle_type": "VXU"}) is elr
+
+
+def test_lane_concurrency_budget():
+    bulk = Lane("bulk", max_concurrency=1)
+    scheduler = LaneScheduler([bulk], max_concurrency=4)
+    started = threading.Event()
+
+    with scheduler.slot(bulk):
+
+        def second_message():
+            with scheduler.slot(bulk):
+                started.set()
+
+        thread = threading.Thread(target=second_message)
+        thread.start()
+
+        # The lane's budget is used up, so the second message has to wait
+        assert not started.wait(0.2)
+        assert scheduler.get_metrics()["bulk"]["queue_depth"] == 1
+
+    thread.join(1)
+    assert started.is_set()
+    assert scheduler.get_metrics()["bulk"]["processed"] == 2
+
+
+def test_weighted_fair_sharing():
+    bulk = Lane("bulk", weight=1, max_concurrency=4)
+    realtime = Lane("realtime", weight=3, max_concurrency=4)
+    scheduler = LaneScheduler([bulk, realtime], max_concurrency=1)
+    order = []
+    order_lock = threading.Lock()
+
+    def process(lane):
+        with scheduler.slot(lane):
+            with order_lock:
+                order.append(lane.name)
+            time.sleep(0.01)
+
+    # Hold the only slot while both lanes queue up messages
+    threads = []
+    with scheduler.slot(bulk):
+        for lane in [bulk] * 4 + [realtime] * 6:
+            thread = threading.Thread(target=process, args=(lane,))
+            thread.start()
+            threads.append(thread)
+        while sum(m["queue_depth"] for m in scheduler.get_metrics().values()) < 10:
+            time.sleep(0.01)
+
+    for thread in threads:
+        thread.join(5)
+
+    # Real-time messages get three slots for every one given to bulk messages
+    # while both lanes have work waiting
+    assert order[:8].count("realtime") == 6
+    assert sorted(order) == ["bulk"] * 4 + ["realtime"] * 6
+
+
+@mock.patch.dict(
+    "os.environ",
+    {
+        "INTAKE_LANES": json.dumps(
+            [{"name": "elr", "bundle_types": ["ELR"]}, {"name": "other"}]
+        ),
+        "INTAKE_MAX_CONCURRENCY": "3",
+    },
+)
+def test_get_scheduler():
+    get_scheduler.cache_clear()
+
+    scheduler = get_scheduler()
+
+    assert [lane.name for lane in scheduler.lanes] == ["elr", "other"]
+    assert scheduler.max_concurrency == 3
+    assert get_scheduler() is scheduler
+    get_scheduler.cache_clear()
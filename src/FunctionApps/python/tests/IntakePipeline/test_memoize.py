@@ -0,0 +1,120 @@
+import threading
+import types
+
+from unittest import mock
+
+from IntakePipeline.memoize import (
+    LRUCache,
+    MAX_CACHED_LENGTH,
+    get_cache_metrics,
+    memoize,
+    memoize_module_functions,
+)
+
+
+def test_cache_counts_hits_and_misses():
+    cache = LRUCache(2)
+    compute = mock.Mock(return_value="JOHN")
+
+    assert cache.get_or_compute("john", compute) == "JOHN"
+    assert cache.get_or_compute("john", compute) == "JOHN"
+
+    compute.assert_called_once()
+    assert cache.get_metrics() == {"size": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("b", lambda: 2)
+    # Using "a" again makes "b" the least recently used
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("c", lambda: 3)
+
+    assert cache.get_or_compute("a", lambda: "recomputed") == 1
+    assert cache.get_or_compute("b", lambda: "recomputed") == "recomputed"
+    assert cache.get_metrics()["size"] == 2
+    assert cache.get_metrics()["evictions"] == 2
+
+
+def test_cache_clear():
+    cache = LRUCache(2)
+    cache.get_or_compute("a", lambda: 1)
+    cache.clear()
+
+    assert cache.get_metrics() == {"size": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+
+def test_cache_is_thread_safe():
+    cache = LRUCache(50)
+
+    def work():
+        for i in range(1000):
+            key = i % 100
+            assert cache.get_or_compute(key, lambda: key * 2) == key * 2
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    metrics = cache.get_metrics()
+    assert metrics["hits"] + metrics["misses"] == 8000
+    assert metrics["size"] <= 50
+
+
+def test_memoize_keys_on_options():
+    fn = mock.Mock(side_effect=lambda raw, case="upper": f"{raw}-{case}")
+    memoized = memoize(fn, LRUCache(10))
+
+    assert memoized("john") == "john-upper"
+    assert memoized("john", case="lower") == "john-lower"
+    assert memoized("john", case="lower") == "john-lower"
+    assert fn.call_count == 2
+
+
+def test_memoize_skips_unhashable_and_long_arguments():
+    cache = LRUCache(10)
+    fn = mock.Mock(side_effect=lambda raw: raw)
+    memoized = memoize(fn, cache)
+
+    memoized(["555", "1234"])
+    memoized(["555", "1234"])
+    memoized("x" * (MAX_CACHED_LENGTH + 1))
+    memoized("x" * (MAX_CACHED_LENGTH + 1))
+
+    assert fn.call_count == 4
+    assert cache.get_metrics()["size"] == 0
+
+
+def test_memoize_does_not_cache_exceptions():
+    fn = mock.Mock(side_effect=[ValueError("bad"), "ok"])
+    memoized = memoize(fn, LRUCache(10))
+
+    try:
+        memoized("raw")
+    except ValueError:
+        pass
+    assert memoized("raw") == "ok"
+
+
+def test_memoize_module_functions():
+    module = types.ModuleType("normalizers")
+    module.upper = lambda value: value.upper()
+    module.normalize_all = lambda values: [module.upper(value) for value in values]
+
+    memoize_module_functions(module, ["upper", "missing"], 10)
+    memoized = module.upper
+    # Memoizing again leaves the existing cache alone
+    memoize_module_functions(module, ["upper"], 10)
+
+    assert module.upper is memoized
+    assert module.normalize_all(["a", "b", "a"]) == ["A", "B", "A"]
+    assert get_cache_metrics()["normalizers.upper"] == {
+        "size": 2,
+        "hits": 1,
+        "misses": 2,
+        "evictions": 0,
+    }
+    assert "normalizers.missing" not in get_cache_metrics()
@@ -0,0 +1,84 @@
+import io
+import pathlib
+import pytest
+import tracemalloc
+
+from unittest import mock
+
+from phdi.conversion import convert_batch_messages_to_list
+
+from IntakePipeline.memory import (
+    MemoryTracker,
+    iter_batch_messages,
+    use_low_memory_mode,
+)
+
+ASSETS = pathlib.Path(__file__).parent / "assets"
+
+
+@pytest.mark.parametrize(
+    "filename",
+    [
+        "batchFileSingleMessage.hl7",
+        "batchFileMultipleMessages.hl7",
+        "batchFileMultipleMessagesOneBad.hl7",
+    ],
+)
+def test_iter_batch_messages(filename):
+    data = (ASSETS / filename).read_bytes()
+
+    assert list(iter_batch_messages(io.BytesIO(data))) == (
+        convert_batch_messages_to_list(data.decode("utf-8", errors="ignore"))
+    )
+
+
+def test_iter_batch_messages_wrapped():
+    data = (
+        "\u000bMSH|^~\\&|first\nPID|1\n\u001c\n"
+        + "\u000bMSH|^~\\&|second\nPID|2\n\u001c\n"
+    ).encode("utf-8")
+
+    assert list(iter_batch_messages(io.BytesIO(data))) == (
+        convert_batch_messages_to_list(data.decode("utf-8"))
+    )
+
+
+@mock.patch.dict("os.environ", {"INTAKE_LOW_MEMORY_THRESHOLD_BYTES": "1000"})
+def test_use_low_memory_mode():
+    assert use_low_memory_mode(1001)
+    assert not use_low_memory_mode(1000)
+    assert not use_low_memory_mode(None)
+
+
+@mock.patch.dict("os.environ", {"INTAKE_TRACEMALLOC_SAMPLE_RATE": "0"})
+def test_memory_tracker():
+    tracker = MemoryTracker("some-blob.hl7", 1234)
+    with tracker.stage("split"):
+        pass
+    tracker.message_count = 3
+    tracker.stop()
+
+    report = tracker.report()
+    assert report["blob_name"] == "some-blob.hl7"
+    assert report["blob_size"] == 1234
+    assert report["message_count"] == 3
+    assert report["low_memory_mode"] is False
+    assert report["peak_rss"] > 0
+    assert report["peak_rss_increase"] >= 0
+    assert list(report["stages"]) == ["split"]
+    assert "traced_peak" not in report["stages"]["split"]
+
+
+@mock.patch.dict("os.environ", {"INTAKE_TRACEMALLOC_SAMPLE_RATE": "1"})
+def test_memory_tracker_traced():
+    tracker = MemoryTracker("some-blob.hl7", 1234, top_allocations=2)
+    assert tracemalloc.is_tracing()
+    with tracker.stage("process"):
+        data = [bytearray(1024 * 1024)]
+    tracker.stop()
+
+    assert not tracemalloc.is_tracing()
+    stats = tracker.report()["stages"]["process"]
+    assert stats["traced_peak"] >= len(data[0])
+    assert len(stats["top_allocations"]) == 2
+    assert stats["top_allocations"][0]["size"] >= len(data[0])
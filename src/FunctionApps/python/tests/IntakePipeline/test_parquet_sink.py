@@ -0,0 +1,218 @@
+import datetime
+import io
+import json
+import pyarrow.parquet
+
+from IntakePipeline.parquet_sink import ParquetSink, extract_rows, get_sink
+
+from unittest import mock
+
+INGESTED_AT = datetime.datetime(2022, 10, 19, 12, tzinfo=datetime.timezone.utc)
+
+
+def make_bundle(index=0):
+    return {
+        "resourceType": "Bundle",
+        "entry": [
+            {
+                "resource": {
+                    "resourceType": "Patient",
+                    "id": f"patient-{index}",
+                    "identifier": [{"value": "some-linking-id"}],
+                    "name": [{"family": "DOE", "given": ["JOHN", "DANGER"]}],
+                    "birthDate": "1983-02-01",
+                    "gender": "male",
+                    "telecom": [
+                        {"system": "email", "value": "john@example.com"},
+                        {"system": "phone", "value": "+15555551234"},
+                    ],
+                    "address": [
+                        {
+                            "line": ["123 FAKE ST", "APT 2"],
+                            "city": "FAKETON",
+                            "state": "NY",
+                            "postalCode": "10001",
+                            "extension": [
+                                {
+                                    "url": "http://hl7.org/fhir/StructureDefinition/"
+                                    + "geolocation",
+                                    "extension": [
+                                        {"url": "latitude", "valueDecimal": 40.75},
+                                        {"url": "longitude", "valueDecimal": -73.99},
+                                    ],
+                                }
+                            ],
+                        }
+                    ],
+                }
+            },
+            {
+                "resource": {
+                    "resourceType": "Immunization",
+                    "id": f"immunization-{index}",
+                    "status": "completed",
+                    "patient": {"reference": f"Patient/patient-{index}"},
+                    "vaccineCode": {
+                        "coding": [
+                            {
+                                "system": "http://hl7.org/fhir/sid/cvx",
+                                "code": "208",
+                                "display": "COVID-19, mRNA",
+                            }
+                        ]
+                    },
+                    "occurrenceDateTime": "2021-06-01",
+                    "lotNumber": "EW0182",
+                }
+            },
+            {
+                "resource": {
+                    "resourceType": "Observation",
+                    "id": f"observation-{index}",
+                    "status": "final",
+                    "subject": {"reference": f"Patient/patient-{index}"},
+                    "code": {
+                        "coding": [{"system": "http://loinc.org", "code": "8310-5"}]
+                    },
+                    "effectiveDateTime": "2021-06-01T10:00:00Z",
+                    "valueQuantity": {"value": 37.2, "unit": "Cel"},
+                }
+            },
+            {"resource": {"resourceType": "Provenance", "id": "provenance"}},
+        ],
+    }
+
+
+def read(data):
+    return pyarrow.parquet.read_table(io.BytesIO(data)).to_pylist()
+
+
+def test_extract_rows():
+    rows = extract_rows(make_bundle(), "some-file-0", INGESTED_AT)
+
+    assert list(rows) == ["Patient", "Immunization", "Observation"]
+    patient = rows["Patient"][0]
+    assert patient["id"] == "patient-0"
+    assert patient["source_filename"] == "some-file-0"
+    assert patient["given"] == "JOHN DANGER"
+    assert patient["address_line"] == "123 FAKE ST APT 2"
+    assert (patient["latitude"], patient["longitude"]) == (40.75, -73.99)
+    assert patient["phone"] == "+15555551234"
+    assert json.loads(patient["resource"])["birthDate"] == "1983-02-01"
+
+    immunization = rows["Immunization"][0]
+    assert immunization["patient_reference"] == "Patient/patient-0"
+    assert immunization["vaccine_code"] == "208"
+    assert immunization["lot_number"] == "EW0182"
+
+    observation = rows["Observation"][0]
+    assert observation["code"] == "8310-5"
+    assert observation["value_quantity"] == 37.2
+    assert observation["value_string"] is None
+
+
+def test_extract_rows_sparse_resources():
+    bundle = {
+        "entry": [
+            {"resource": {"resourceType": "Patient", "id": "patient-0"}},
+            {
+                "resource": {
+                    "resourceType": "Observation",
+                    "valueCodeableConcept": {"coding": [{"code": "260385009"}]},
+                }
+            },
+        ]
+    }
+
+    rows = extract_rows(bundle, "some-file-0", INGESTED_AT)
+
+    assert rows["Patient"][0]["family"] is None
+    assert rows["Patient"][0]["latitude"] is None
+    assert rows["Immunization"] == []
+    assert rows["Observation"][0]["value_string"] == "260385009"
+
+
+def test_sink_flushes_on_size():
+    written = {}
+    sink = ParquetSink(
+        "silver/", max_rows=3, write=lambda name, data: written.update({name: data})
+    )
+
+    for index in range(2):
+        sink.add(make_bundle(index), f"some-file-{index}")
+    assert written == {}
+
+    sink.add(make_bundle(2), "some-file-2")
+    # Every type reached 3 resources, so each is written as one file
+    assert len(written) == 3
+    for name, data in written.items():
+        resource_type = name.split("/")[1]
+        assert name.startswith(f"silver/{resource_type}/ingest_date=")
+        assert name.endswith(".parquet")
+        rows = read(data)
+        assert len(rows) == 3
+        assert [row["source_filename"] for row in rows] == [
+            "some-file-0",
+            "some-file-1",
+            "some-file-2",
+        ]
+    assert sink.rows_written == 9
+    assert sink.files_written == 3
+
+    sink.close()
+    assert len(written) == 3
+
+
+def test_sink_flushes_on_age():
+    written = {}
+    clock = mock.Mock(return_value=0)
+    sink = ParquetSink(
+        "silver",
+        max_age_seconds=60,
+        write=lambda name, data: written.update({name: data}),
+        clock=clock,
+    )
+
+    sink.add(make_bundle(0), "some-file-0")
+    clock.return_value = 59
+    sink.add(make_bundle(1), "some-file-1")
+    assert written == {}
+
+    clock.return_value = 60
+    sink.add({"entry": []}, "some-file-2")
+    assert len(written) == 3
+    assert all(len(read(data)) == 2 for data in written.values())
+
+
+def test_sink_keeps_rows_that_fail_to_write():
+    written = {}
+    write = mock.Mock(side_effect=Exception("some-error"))
+    sink = ParquetSink("silver", write=write)
+
+    sink.add(make_bundle(0), "some-file-0")
+    sink.flush()
+    assert sink.rows_written == 0
+
+    write.side_effect = lambda name, data: written.update({name: data})
+    sink.close()
+    assert sink.rows_written == 3
+    assert len(written) == 3
+
+
+@mock.patch.dict(
+    "os.environ",
+    {
+        "INTAKE_PARQUET_OUTPUT": "true",
+        "PARQUET_OUTPUT_CONTAINER_PATH": "silver",
+        "INTAKE_PARQUET_MAX_ROWS": "500",
+    },
+)
+def test_get_sink():
+    sink = get_sink()
+
+    assert sink.output_path == "silver"
+    assert sink.max_rows == 500
+    assert sink.max_age_seconds == 60
+
+    with mock.patch.dict("os.environ", {"INTAKE_PARQUET_OUTPUT": "false"}):
+        assert get_sink() is None
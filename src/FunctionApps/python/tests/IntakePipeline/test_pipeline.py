@@ -1,11 +1,34 @@
+import io
 import json
+import logging
 import pathlib
 import pytest
+import requests
+import time
 from unittest import mock
 
 from phdi.conversion import convert_batch_messages_to_list
 
-from IntakePipeline import run_pipeline, _default_fields
+from IntakePipeline import (
+    main,
+    process_blob,
+    process_blobs,
+    run_pipeline,
+    warm_up,
+    _default_fields,
+)
+from IntakePipeline.breakers import get_breaker, reset_breakers
+from IntakePipeline.continuation import BlobStream
+from IntakePipeline.delta import get_fingerprint
+from IntakePipeline.lanes import Lane, LaneScheduler
+from IntakePipeline.slow_messages import StageTimer
+
+
+@pytest.fixture(autouse=True)
+def breakers():
+    reset_breakers()
+    yield
+    reset_breakers()
 
 
 @pytest.fixture()
@@ -36,13 +59,10 @@ MESSAGE_MAPPINGS = {
 }
 
 
-@mock.patch("IntakePipeline.standardize_patient_names")
-@mock.patch("IntakePipeline.standardize_all_phones")
-@mock.patch("IntakePipeline.geocode_patients")
-@mock.patch("IntakePipeline.add_patient_identifier")
+@mock.patch("IntakePipeline.standardize_patients")
 @mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
 @mock.patch("IntakePipeline.store_data")
-@mock.patch("IntakePipeline.get_smartystreets_client")
+@mock.patch("IntakePipeline.get_geocoder")
 @mock.patch("IntakePipeline.convert_message_to_fhir")
 @mock.patch.dict("os.environ", TEST_ENV)
 def test_pipeline_valid_message(
@@ -50,10 +70,7 @@ def test_pipeline_valid_message(
     patched_get_geocoder,
     patched_store,
     patched_upload,
-    patched_patient_id,
-    patched_address_standardization,
-    patched_phone_standardization,
-    patched_name_standardization,
+    patched_standardize_patients,
 ):
 
     patched_converter.return_value = mock.Mock(
@@ -67,14 +84,8 @@ def test_pipeline_valid_message(
     patched_geocoder = mock.Mock()
     patched_get_geocoder.return_value = patched_geocoder
 
-    patched_standardized_name_data = mock.Mock()
-    patched_name_standardization.return_value = patched_standardized_name_data
-    patched_standardized_phone_data = mock.Mock()
-    patched_phone_standardization.return_value = patched_standardized_phone_data
-    patched_standardized_address_data = mock.Mock()
-    patched_address_standardization.return_value = patched_standardized_address_data
     patched_linked_id_data = mock.Mock()
-    patched_patient_id.return_value = patched_linked_id_data
+    patched_standardize_patients.return_value = patched_linked_id_data
 
     patched_upload.return_value = mock.Mock(
         status_code=200,
@@ -104,16 +115,11 @@ def test_pipeline_valid_message(
         fhir_url="some-fhir-url",
     )
 
-    patched_name_standardization.assert_called_with(
-        {"resourceType": "Bundle", "entry": [{"hello": "world"}]}
-    )
-    patched_phone_standardization.assert_called_with(patched_standardized_name_data)
-    patched_address_standardization.assert_called_with(
-        patched_standardized_phone_data, patched_geocoder
-    )
-
-    patched_patient_id.assert_called_with(
-        patched_standardized_address_data, TEST_ENV["HASH_SALT"]
+    patched_standardize_patients.assert_called_with(
+        {"resourceType": "Bundle", "entry": [{"hello": "world"}]},
+        patched_geocoder,
+        TEST_ENV["HASH_SALT"],
+        mock.ANY,
     )
     patched_upload.assert_called_with(
         patched_linked_id_data,
@@ -129,13 +135,44 @@ def test_pipeline_valid_message(
     )
 
 
-@mock.patch("IntakePipeline.standardize_patient_names")
-@mock.patch("IntakePipeline.standardize_all_phones")
-@mock.patch("IntakePipeline.geocode_patients")
-@mock.patch("IntakePipeline.add_patient_identifier")
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_JSON_OUTPUT": "false"})
+def test_pipeline_parquet_output(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize_patients,
+):
+    patched_converter.return_value = mock.Mock(
+        status_code=200,
+        json=lambda: {"resourceType": "Bundle", "entry": [{"hello": "world"}]},
+    )
+    patched_upload.return_value = mock.Mock(
+        status_code=200, json=lambda: {"resourceType": "Bundle", "entry": []}
+    )
+    sink = mock.Mock()
+
+    run_pipeline(
+        "MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock(), sink=sink
+    )
+
+    sink.add.assert_called_with(
+        patched_standardize_patients.return_value, "some-filename-1"
+    )
+    # The per-message JSON is turned off
+    patched_store.assert_not_called()
+    patched_upload.assert_called_once()
+
+
+@mock.patch("IntakePipeline.standardize_patients")
 @mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
 @mock.patch("IntakePipeline.store_message_and_response")
-@mock.patch("IntakePipeline.get_smartystreets_client")
+@mock.patch("IntakePipeline.get_geocoder")
 @mock.patch("IntakePipeline.convert_message_to_fhir")
 @mock.patch.dict("os.environ", TEST_ENV)
 def test_pipeline_invalid_message(
@@ -143,10 +180,7 @@ def test_pipeline_invalid_message(
     patched_get_geocoder,
     patched_store_msg_resp,
     patched_upload,
-    patched_patient_id,
-    patched_address_standardization,
-    patched_phone_standardization,
-    patched_name_standardization,
+    patched_standardize_patients,
 ):
     patched_converter.return_value = mock.Mock(
         status_code=400,
@@ -172,10 +206,7 @@ def test_pipeline_invalid_message(
         cred_manager=patched_cred_manager,
         fhir_url="some-fhir-url",
     )
-    patched_address_standardization.assert_not_called()
-    patched_phone_standardization.assert_not_called()
-    patched_name_standardization.assert_not_called()
-    patched_patient_id.assert_not_called()
+    patched_standardize_patients.assert_not_called()
     patched_upload.assert_not_called()
     patched_store_msg_resp.assert_called_with(
         container_url="some-url",
@@ -188,15 +219,79 @@ def test_pipeline_invalid_message(
     )
 
 
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_PREVALIDATION": "true"})
+def test_pipeline_prevalidation(
+    patched_converter, patched_get_geocoder, patched_store, partial_failure_message
+):
+    messages = convert_batch_messages_to_list(partial_failure_message)
+    # Messages are defaulted before they are validated
+    defaulted_message = _default_fields(messages[2], MESSAGE_MAPPINGS)
+
+    run_pipeline(messages[2], MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+
+    # The message's birth date can't be parsed, so it is never converted
+    patched_converter.assert_not_called()
+    patched_store.assert_has_calls(
+        [
+            mock.call(
+                container_url="some-url",
+                prefix="output/invalid/path",
+                filename="some-filename-1.hl7",
+                bundle_type=MESSAGE_MAPPINGS["bundle_type"],
+                message=defaulted_message,
+            ),
+            mock.call(
+                container_url="some-url",
+                prefix="output/invalid/path",
+                filename="some-filename-1.hl7.validation-resp",
+                bundle_type=MESSAGE_MAPPINGS["bundle_type"],
+                message_json={
+                    "errors": [
+                        {
+                            "segment": "PID",
+                            "line": 2,
+                            "field": 7,
+                            "error": "Invalid timestamp '20180808678923411'",
+                        }
+                    ]
+                },
+            ),
+        ]
+    )
+
+
+@mock.patch("IntakePipeline.store_message_and_response")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_PREVALIDATION": "true"})
+def test_pipeline_prevalidation_valid_message(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_store_msg_resp,
+    partial_failure_message,
+):
+    patched_converter.return_value = mock.Mock(status_code=400)
+    message = convert_batch_messages_to_list(partial_failure_message)[0]
+
+    run_pipeline(message, MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+
+    # Valid messages are converted as before
+    patched_converter.assert_called_once()
+    patched_store.assert_not_called()
+    patched_store_msg_resp.assert_called_once()
+
+
 @mock.patch("IntakePipeline._default_fields")
-@mock.patch("IntakePipeline.standardize_patient_names")
-@mock.patch("IntakePipeline.standardize_all_phones")
-@mock.patch("IntakePipeline.geocode_patients")
-@mock.patch("IntakePipeline.add_patient_identifier")
+@mock.patch("IntakePipeline.standardize_patients")
 @mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
 @mock.patch("IntakePipeline.store_message_and_response")
 @mock.patch("IntakePipeline.store_data")
-@mock.patch("IntakePipeline.get_smartystreets_client")
+@mock.patch("IntakePipeline.get_geocoder")
 @mock.patch("IntakePipeline.convert_message_to_fhir")
 @mock.patch.dict("os.environ", TEST_ENV)
 def test_pipeline_partial_invalid_message(
@@ -205,10 +300,7 @@ def test_pipeline_partial_invalid_message(
     patched_store,
     patched_store_msg_resp,
     patched_upload,
-    patched_patient_id,
-    patched_address_standardization,
-    patched_phone_standardization,
-    patched_name_standardization,
+    patched_standardize_patients,
     patched_default_fields,
     partial_failure_message,
 ):
@@ -237,14 +329,8 @@ def test_pipeline_partial_invalid_message(
     patched_geocoder = mock.Mock()
     patched_get_geocoder.return_value = patched_geocoder
 
-    patched_standardized_name_data = mock.Mock()
-    patched_name_standardization.return_value = patched_standardized_name_data
-    patched_standardized_phone_data = mock.Mock()
-    patched_phone_standardization.return_value = patched_standardized_phone_data
-    patched_standardized_address_data = mock.Mock()
-    patched_address_standardization.return_value = patched_standardized_address_data
     patched_linked_id_data = mock.Mock()
-    patched_patient_id.return_value = patched_linked_id_data
+    patched_standardize_patients.return_value = patched_linked_id_data
     upload_response_dict = {
         "resourceType": "Bundle",
         "entry": [{"resource": {"hello": "world"}, "response": {"status": "200 OK"}}],
@@ -338,10 +424,7 @@ def test_pipeline_partial_invalid_message(
         ]
     )
 
-    patched_address_standardization.call_count = 4
-    patched_phone_standardization.call_count = 4
-    patched_name_standardization.call_count = 4
-    patched_patient_id.call_count = 4
+    patched_standardize_patients.call_count = 4
     patched_upload.call_count = 4
 
     patched_store.assert_has_calls(
@@ -388,13 +471,10 @@ def test_pipeline_partial_invalid_message(
     )
 
 
-@mock.patch("IntakePipeline.standardize_patient_names")
-@mock.patch("IntakePipeline.standardize_all_phones")
-@mock.patch("IntakePipeline.geocode_patients")
-@mock.patch("IntakePipeline.add_patient_identifier")
+@mock.patch("IntakePipeline.standardize_patients")
 @mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
 @mock.patch("IntakePipeline.store_data")
-@mock.patch("IntakePipeline.get_smartystreets_client")
+@mock.patch("IntakePipeline.get_geocoder")
 @mock.patch("IntakePipeline.convert_message_to_fhir")
 @mock.patch.dict("os.environ", TEST_ENV)
 def test_pipeline_partial_failed_upload(
@@ -402,10 +482,7 @@ def test_pipeline_partial_failed_upload(
     patched_get_geocoder,
     patched_store,
     patched_upload,
-    patched_patient_id,
-    patched_address_standardization,
-    patched_phone_standardization,
-    patched_name_standardization,
+    patched_standardize_patients,
 ):
 
     patched_converter.return_value = mock.Mock(
@@ -419,14 +496,8 @@ def test_pipeline_partial_failed_upload(
     patched_geocoder = mock.Mock()
     patched_get_geocoder.return_value = patched_geocoder
 
-    patched_standardized_name_data = mock.Mock()
-    patched_name_standardization.return_value = patched_standardized_name_data
-    patched_standardized_phone_data = mock.Mock()
-    patched_phone_standardization.return_value = patched_standardized_phone_data
-    patched_standardized_address_data = mock.Mock()
-    patched_address_standardization.return_value = patched_standardized_address_data
     patched_linked_id_data = mock.Mock()
-    patched_patient_id.return_value = patched_linked_id_data
+    patched_standardize_patients.return_value = patched_linked_id_data
 
     patched_upload.return_value = mock.Mock(
         status_code=200,
@@ -469,16 +540,11 @@ def test_pipeline_partial_failed_upload(
         fhir_url="some-fhir-url",
     )
 
-    patched_name_standardization.assert_called_with(
-        {"resourceType": "Bundle", "entry": [{"hello": "world"}]}
-    )
-    patched_phone_standardization.assert_called_with(patched_standardized_name_data)
-    patched_address_standardization.assert_called_with(
-        patched_standardized_phone_data, patched_geocoder
-    )
-
-    patched_patient_id.assert_called_with(
-        patched_standardized_address_data, TEST_ENV["HASH_SALT"]
+    patched_standardize_patients.assert_called_with(
+        {"resourceType": "Bundle", "entry": [{"hello": "world"}]},
+        patched_geocoder,
+        TEST_ENV["HASH_SALT"],
+        mock.ANY,
     )
     patched_upload.assert_called_with(
         patched_linked_id_data,
@@ -514,6 +580,714 @@ def test_pipeline_partial_failed_upload(
     )
 
 
+@mock.patch("IntakePipeline.schedule_retry")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_message_and_response")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_pipeline_transient_convert_failure(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store_msg_resp,
+    patched_upload,
+    patched_schedule_retry,
+):
+    patched_converter.return_value = mock.Mock(status_code=503)
+    patched_schedule_retry.return_value = True
+
+    run_pipeline("MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+
+    patched_schedule_retry.assert_called_with("MSH|Hello World", MESSAGE_MAPPINGS, 1)
+    patched_upload.assert_not_called()
+    patched_store_msg_resp.assert_not_called()
+
+
+@mock.patch("IntakePipeline.park_message")
+@mock.patch("IntakePipeline.schedule_retry")
+@mock.patch("IntakePipeline.store_message_and_response")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", {**TEST_ENV, "CIRCUIT_BREAKER_OPEN_SECONDS": "60"})
+def test_pipeline_convert_breaker(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store_msg_resp,
+    patched_schedule_retry,
+    patched_park_message,
+):
+    patched_converter.return_value = mock.Mock(status_code=503)
+    patched_schedule_retry.return_value = True
+    patched_park_message.return_value = True
+    breaker = get_breaker("convert")
+
+    for _ in range(breaker.min_calls):
+        run_pipeline("MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+    assert breaker.state == "open"
+    assert patched_converter.call_count == breaker.min_calls
+
+    # Once open, messages are parked without waiting on the converter
+    run_pipeline(
+        "MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock(), attempt=2
+    )
+    assert patched_converter.call_count == breaker.min_calls
+    patched_park_message.assert_called_once_with(
+        "MSH|Hello World", MESSAGE_MAPPINGS, 2, mock.ANY
+    )
+    assert 60 <= patched_park_message.call_args.args[3] <= 120
+    patched_store_msg_resp.assert_not_called()
+
+    # If the message can't be parked, it's processed anyway
+    patched_park_message.return_value = False
+    run_pipeline("MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+    assert patched_converter.call_count == breaker.min_calls + 1
+
+
+@mock.patch("IntakePipeline.park_message")
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_pipeline_upload_breaker(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize_patients,
+    patched_park_message,
+):
+    patched_converter.return_value = mock.Mock(
+        status_code=200,
+        json=lambda: {"resourceType": "Bundle", "entry": [{"hello": "world"}]},
+    )
+    patched_park_message.return_value = True
+    breaker = get_breaker("upload")
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+
+    run_pipeline("MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+
+    patched_upload.assert_not_called()
+    patched_park_message.assert_called_once_with(
+        "MSH|Hello World", MESSAGE_MAPPINGS, 1, mock.ANY
+    )
+    # The convert breaker recorded the successful conversion
+    assert get_breaker("convert").get_metrics()["recent_calls"] == 1
+
+
+@mock.patch("IntakePipeline.capture_slow_message")
+@mock.patch("IntakePipeline.schedule_retry")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_pipeline_records_stage_timings(
+    patched_converter,
+    patched_get_geocoder,
+    patched_schedule_retry,
+    patched_capture,
+):
+    patched_converter.return_value = mock.Mock(status_code=503)
+    patched_schedule_retry.return_value = True
+    timer = StageTimer()
+
+    run_pipeline(
+        "MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock(), 2, timer
+    )
+
+    assert list(timer.timings) == ["convert"]
+    patched_capture.assert_called_with("MSH|Hello World", MESSAGE_MAPPINGS, timer, 2)
+
+
+@mock.patch("IntakePipeline.schedule_retry")
+@mock.patch("IntakePipeline.store_message_and_response")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_pipeline_transient_convert_failure_exhausted(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store_msg_resp,
+    patched_schedule_retry,
+):
+    patched_converter.return_value = mock.Mock(status_code=503)
+    patched_schedule_retry.return_value = False
+
+    run_pipeline(
+        "MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock(), attempt=5
+    )
+
+    patched_schedule_retry.assert_called_with("MSH|Hello World", MESSAGE_MAPPINGS, 5)
+    patched_store_msg_resp.assert_called_with(
+        container_url="some-url",
+        prefix="output/invalid/path",
+        message_filename="some-filename-1.hl7",
+        response_filename="some-filename-1.hl7.convert-resp",
+        bundle_type=MESSAGE_MAPPINGS["bundle_type"],
+        message="MSH|Hello World",
+        response=patched_converter.return_value,
+    )
+
+
+@mock.patch("IntakePipeline.schedule_retry")
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_pipeline_upload_timeout(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize_patients,
+    patched_schedule_retry,
+):
+    patched_converter.return_value = mock.Mock(
+        status_code=200,
+        json=lambda: {"resourceType": "Bundle", "entry": [{"hello": "world"}]},
+    )
+    patched_upload.side_effect = requests.exceptions.Timeout()
+    patched_schedule_retry.return_value = False
+
+    run_pipeline("MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+
+    patched_schedule_retry.assert_called_with("MSH|Hello World", MESSAGE_MAPPINGS, 1)
+    patched_store.assert_has_calls(
+        [
+            mock.call(
+                container_url="some-url",
+                prefix="output/invalid/path",
+                filename="some-filename-1.hl7",
+                bundle_type=MESSAGE_MAPPINGS["bundle_type"],
+                message="MSH|Hello World",
+            ),
+            mock.call(
+                container_url="some-url",
+                prefix="output/invalid/path",
+                filename="some-filename-1.hl7.upload-resp",
+                bundle_type=MESSAGE_MAPPINGS["bundle_type"],
+                message_json={"error": "No response received from the FHIR server"},
+            ),
+        ]
+    )
+
+
+@mock.patch("IntakePipeline.retry.time.sleep")
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_pipeline_resubmits_failed_entries(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize_patients,
+    patched_sleep,
+):
+    entries = [{"resource": {"id": f"resource-{i}"}} for i in range(3)]
+    bundle = {"resourceType": "Bundle", "entry": entries}
+    patched_converter.return_value = mock.Mock(status_code=200, json=lambda: bundle)
+    patched_standardize_patients.return_value = bundle
+    statuses = [
+        ["200 OK", "429 Too Many Requests", "409 Conflict"],
+        ["200 OK", "409 Conflict"],
+        ["200 OK"],
+    ]
+    patched_upload.side_effect = [
+        mock.Mock(
+            status_code=200,
+            json=lambda s=s: {"entry": [{"response": {"status": x}} for x in s]},
+        )
+        for s in statuses
+    ]
+
+    run_pipeline("MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+
+    assert [len(call.args[0]["entry"]) for call in patched_upload.call_args_list] == [
+        3,
+        2,
+        1,
+    ]
+    # Only the valid bundle is stored; no entry is recorded as a failure
+    patched_store.assert_called_once()
+
+
+@mock.patch("IntakePipeline.delta.store_fingerprints")
+@mock.patch("IntakePipeline.delta.lookup_fingerprints")
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_DELTA_UPLOAD": "true"})
+def test_pipeline_delta_upload(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize_patients,
+    patched_lookup_fingerprints,
+    patched_store_fingerprints,
+):
+    entries = [
+        {
+            "resource": {"resourceType": "Patient", "id": f"patient-{i}"},
+            "request": {"method": "PUT", "url": f"Patient/patient-{i}"},
+        }
+        for i in range(3)
+    ]
+    bundle = {"resourceType": "Bundle", "entry": entries}
+    patched_converter.return_value = mock.Mock(status_code=200, json=lambda: bundle)
+    patched_standardize_patients.return_value = bundle
+    patched_lookup_fingerprints.return_value = {
+        "Patient/patient-0": {
+            "Fingerprint": get_fingerprint(entries[0]["resource"]),
+            "ETag": "",
+        }
+    }
+    patched_upload.return_value = mock.Mock(
+        status_code=200,
+        json=lambda: {
+            "resourceType": "Bundle",
+            "entry": [
+                {"response": {"status": "200 OK"}},
+                {"response": {"status": "400 Bad Request"}},
+            ],
+        },
+    )
+
+    run_pipeline("MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+
+    # The unchanged patient is left out of the upload
+    assert patched_upload.call_args.args[0]["entry"] == entries[1:]
+    # Failures are recorded against their index in the full bundle
+    patched_store.assert_called_with(
+        container_url="some-url",
+        prefix="output/invalid/path",
+        filename=f"{MESSAGE_MAPPINGS['filename']}.entry-2"
+        + f".{MESSAGE_MAPPINGS['file_suffix']}",
+        bundle_type=MESSAGE_MAPPINGS["bundle_type"],
+        message_json={
+            "entry_index": 2,
+            "entry": {"response": {"status": "400 Bad Request"}},
+        },
+    )
+    patched_store_fingerprints.assert_called_with(
+        [
+            (
+                "Patient/patient-1",
+                get_fingerprint(entries[1]["resource"]),
+                None,
+            )
+        ]
+    )
+
+
+@mock.patch("IntakePipeline.delta.lookup_fingerprints")
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_DELTA_UPLOAD": "true"})
+def test_pipeline_delta_upload_unchanged(
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize_patients,
+    patched_lookup_fingerprints,
+):
+    entry = {
+        "resource": {"resourceType": "Patient", "id": "patient-0"},
+        "request": {"method": "PUT", "url": "Patient/patient-0"},
+    }
+    bundle = {"resourceType": "Bundle", "entry": [entry]}
+    patched_converter.return_value = mock.Mock(status_code=200, json=lambda: bundle)
+    patched_standardize_patients.return_value = bundle
+    patched_lookup_fingerprints.return_value = {
+        "Patient/patient-0": {"Fingerprint": get_fingerprint(entry["resource"])}
+    }
+
+    run_pipeline("MSH|Hello World", MESSAGE_MAPPINGS, "some-fhir-url", mock.Mock())
+
+    patched_upload.assert_not_called()
+
+
+@mock.patch("IntakePipeline.run_pipeline")
+@mock.patch("IntakePipeline.get_scheduler")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_main(
+    patched_get_cred_manager,
+    patched_get_scheduler,
+    patched_run_pipeline,
+    partial_failure_message,
+):
+    scheduler = LaneScheduler(
+        [Lane("bulk", min_size=1000000), Lane("realtime", max_concurrency=3)],
+        max_concurrency=3,
+    )
+    patched_get_scheduler.return_value = scheduler
+    # One failing message doesn't stop the rest of the blob
+    patched_run_pipeline.side_effect = lambda message, message_mappings, *args: (
+        1 / 0 if message_mappings["filename"].endswith("-2") else None
+    )
+    blob = mock.Mock()
+    blob.name = "bronze/decrypted/VXU/some-file.hl7"
+    blob.length = len(partial_failure_message)
+    blob.read.return_value = partial_failure_message.encode("utf-8")
+
+    main(blob)
+
+    messages = convert_batch_messages_to_list(partial_failure_message)
+    assert patched_run_pipeline.call_count == len(messages)
+    filenames = sorted(
+        call.args[1]["filename"] for call in patched_run_pipeline.call_args_list
+    )
+    assert filenames == [f"some-file-{i}" for i in range(len(messages))]
+    metrics = scheduler.get_metrics()
+    assert metrics["realtime"]["processed"] == len(messages)
+    assert metrics["bulk"]["processed"] == 0
+
+
+@mock.patch("IntakePipeline.run_pipeline")
+@mock.patch("IntakePipeline.get_scheduler")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_LOW_MEMORY_THRESHOLD_BYTES": "100"})
+def test_main_low_memory(
+    patched_get_cred_manager,
+    patched_get_scheduler,
+    patched_run_pipeline,
+    partial_failure_message,
+    caplog,
+):
+    patched_get_scheduler.return_value = LaneScheduler(
+        [Lane("realtime", max_concurrency=3)], max_concurrency=3
+    )
+    blob = io.BytesIO(partial_failure_message.encode("utf-8"))
+    blob.name = "bronze/decrypted/VXU/some-file.hl7"
+    blob.length = len(partial_failure_message)
+
+    with caplog.at_level(logging.INFO):
+        main(blob)
+
+    # Messages are processed one at a time, in order, as the blob is read
+    messages = convert_batch_messages_to_list(partial_failure_message)
+    assert [call.args[0] for call in patched_run_pipeline.call_args_list] == messages
+    assert [
+        call.args[1]["filename"] for call in patched_run_pipeline.call_args_list
+    ] == [f"some-file-{i}" for i in range(len(messages))]
+
+    report = json.loads(
+        next(
+            record.getMessage().split(": ", 1)[1]
+            for record in caplog.records
+            if record.getMessage().startswith("Memory usage: ")
+        )
+    )
+    assert report["blob_name"] == blob.name
+    assert report["message_count"] == len(messages)
+    assert report["low_memory_mode"] is True
+    assert list(report["stages"]) == ["process"]
+
+
+@mock.patch("IntakePipeline.run_pipeline")
+@mock.patch("IntakePipeline.get_scheduler")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_LOW_MEMORY_THRESHOLD_BYTES": "100"})
+def test_process_blob_stream_low_memory(
+    patched_get_cred_manager,
+    patched_get_scheduler,
+    patched_run_pipeline,
+    partial_failure_message,
+):
+    patched_get_scheduler.return_value = LaneScheduler(
+        [Lane("realtime", max_concurrency=3)], max_concurrency=3
+    )
+    content = partial_failure_message.encode("utf-8")
+    # An opened blob is split as it is downloaded, as continuations,
+    # reprocessing and micro-batches do
+    blob = BlobStream(
+        "bronze/decrypted/VXU/some-file.hl7", len(content), io.BytesIO(content)
+    )
+
+    assert process_blob(blob) is True
+
+    messages = convert_batch_messages_to_list(partial_failure_message)
+    assert [call.args[0] for call in patched_run_pipeline.call_args_list] == messages
+
+
+@mock.patch("IntakePipeline.store_checkpoint")
+@mock.patch("IntakePipeline.run_pipeline")
+@mock.patch("IntakePipeline.get_scheduler")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_LOW_MEMORY_THRESHOLD_BYTES": "100"})
+def test_process_blob_failed(
+    patched_get_cred_manager,
+    patched_get_scheduler,
+    patched_run_pipeline,
+    patched_store_checkpoint,
+    partial_failure_message,
+):
+    patched_get_scheduler.return_value = LaneScheduler(
+        [Lane("realtime", max_concurrency=3)], max_concurrency=3
+    )
+    content = partial_failure_message.encode("utf-8")
+    downloader = mock.Mock()
+    downloader.read.side_effect = [content[:150], Exception("connection reset")]
+    blob = BlobStream("bronze/decrypted/VXU/some-file.hl7", len(content), downloader)
+
+    # The error is logged, as for the blob trigger, and reported to the caller
+    assert process_blob(blob) is False
+    patched_store_checkpoint.assert_not_called()
+
+
+@mock.patch("IntakePipeline.get_sink")
+@mock.patch("IntakePipeline.clear_checkpoint")
+@mock.patch("IntakePipeline.get_checkpoint")
+@mock.patch("IntakePipeline.run_pipeline")
+@mock.patch("IntakePipeline.get_scheduler")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_main_resumes_from_checkpoint(
+    patched_get_cred_manager,
+    patched_get_scheduler,
+    patched_run_pipeline,
+    patched_get_checkpoint,
+    patched_clear_checkpoint,
+    patched_get_sink,
+    partial_failure_message,
+):
+    sink = patched_get_sink.return_value
+    sink.close.side_effect = lambda: patched_clear_checkpoint.assert_not_called()
+    patched_get_scheduler.return_value = LaneScheduler(
+        [Lane("realtime", max_concurrency=3)], max_concurrency=3
+    )
+    patched_get_checkpoint.return_value = 2
+    blob = mock.Mock()
+    blob.name = "bronze/decrypted/VXU/some-file.hl7"
+    blob.length = len(partial_failure_message)
+    blob.read.return_value = partial_failure_message.encode("utf-8")
+
+    main(blob)
+
+    messages = convert_batch_messages_to_list(partial_failure_message)
+    patched_get_checkpoint.assert_called_with(blob.name, blob.length, None)
+    filenames = sorted(
+        call.args[1]["filename"] for call in patched_run_pipeline.call_args_list
+    )
+    assert filenames == [f"some-file-{i}" for i in range(2, len(messages))]
+    # The blob was finished, and its resources written, so its checkpoint is
+    # no longer needed
+    patched_clear_checkpoint.assert_called_with(blob.name)
+    sink.close.assert_called_once()
+
+
+@mock.patch("IntakePipeline.schedule_continuation")
+@mock.patch("IntakePipeline.store_checkpoint")
+@mock.patch("IntakePipeline.clear_checkpoint")
+@mock.patch("IntakePipeline.get_checkpoint")
+@mock.patch("IntakePipeline.get_deadline")
+@mock.patch("IntakePipeline.run_pipeline")
+@mock.patch("IntakePipeline.get_scheduler")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_LOW_MEMORY_THRESHOLD_BYTES": "100"})
+def test_main_continues_after_deadline(
+    patched_get_cred_manager,
+    patched_get_scheduler,
+    patched_run_pipeline,
+    patched_get_deadline,
+    patched_get_checkpoint,
+    patched_clear_checkpoint,
+    patched_store_checkpoint,
+    patched_schedule_continuation,
+    partial_failure_message,
+):
+    patched_get_scheduler.return_value = LaneScheduler(
+        [Lane("realtime", max_concurrency=3)], max_concurrency=3
+    )
+    patched_get_checkpoint.return_value = 0
+    # The time budget runs out after three messages have been started
+    patched_get_deadline.return_value.expired.side_effect = [False] * 3 + [True]
+    patched_schedule_continuation.return_value = True
+    blob = io.BytesIO(partial_failure_message.encode("utf-8"))
+    blob.name = "bronze/decrypted/VXU/some-file.hl7"
+    blob.length = len(partial_failure_message)
+    blob.blob_properties = {"ETag": '"0x8DA0000000000A"'}
+
+    main(blob)
+
+    assert [
+        call.args[1]["filename"] for call in patched_run_pipeline.call_args_list
+    ] == ["some-file-0", "some-file-1", "some-file-2"]
+    # The checkpoint only applies to this version of the blob
+    patched_get_checkpoint.assert_called_with(
+        blob.name, blob.length, "0x8DA0000000000A"
+    )
+    patched_store_checkpoint.assert_called_with(
+        blob.name, blob.length, 3, "0x8DA0000000000A"
+    )
+    patched_schedule_continuation.assert_called_with(blob.name, 3)
+    patched_clear_checkpoint.assert_not_called()
+
+    # If the rest of the blob can't be handed over, the invocation fails so the
+    # trigger retries it from the checkpoint
+    patched_get_deadline.return_value.expired.side_effect = [False] * 3 + [True]
+    patched_schedule_continuation.return_value = False
+    blob = io.BytesIO(partial_failure_message.encode("utf-8"))
+    blob.name = "bronze/decrypted/VXU/some-file.hl7"
+    blob.length = len(partial_failure_message)
+    with pytest.raises(RuntimeError):
+        main(blob)
+
+
+@mock.patch("IntakePipeline.schedule_continuation")
+@mock.patch("IntakePipeline.store_checkpoint")
+@mock.patch("IntakePipeline.clear_checkpoint")
+@mock.patch("IntakePipeline.get_checkpoint")
+@mock.patch("IntakePipeline.run_pipeline")
+@mock.patch("IntakePipeline.get_scheduler")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", {**TEST_ENV, "INTAKE_TIME_BUDGET_SECONDS": "0.3"})
+def test_main_concurrent_continues_after_deadline(
+    patched_get_cred_manager,
+    patched_get_scheduler,
+    patched_run_pipeline,
+    patched_get_checkpoint,
+    patched_clear_checkpoint,
+    patched_store_checkpoint,
+    patched_schedule_continuation,
+):
+    patched_get_scheduler.return_value = LaneScheduler(
+        [Lane("realtime", max_concurrency=2)], max_concurrency=2
+    )
+    patched_get_checkpoint.return_value = 0
+    patched_run_pipeline.side_effect = lambda *args, **kwargs: time.sleep(0.2)
+    patched_schedule_continuation.return_value = True
+    content = "".join(
+        f"MSH|^~\\&|WIR|WIR|||20200514||VXU^V04|{i}|P|2.4\nPID|||{i}\n"
+        for i in range(20)
+    )
+    blob = io.BytesIO(content.encode("utf-8"))
+    blob.name = "bronze/decrypted/VXU/some-file.hl7"
+    blob.length = len(content)
+
+    main(blob)
+
+    # Messages are started only as others finish, so the time budget stops the
+    # blob part way through and the rest is handed over
+    started = patched_run_pipeline.call_count
+    assert 2 <= started < 20
+    patched_store_checkpoint.assert_called_with(blob.name, blob.length, started, None)
+    patched_schedule_continuation.assert_called_once_with(blob.name, started)
+    patched_clear_checkpoint.assert_not_called()
+
+
+@mock.patch("IntakePipeline.capture_slow_message")
+@mock.patch("IntakePipeline.store_message_and_response")
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch("IntakePipeline.get_scheduler")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict(
+    "os.environ",
+    {
+        **TEST_ENV,
+        "INTAKE_PIPELINED": "true",
+        "INTAKE_STAGE_CONCURRENCY": '{"upload": 2}',
+        "INTAKE_STAGE_QUEUE_SIZE": "1",
+    },
+)
+def test_main_pipelined(
+    patched_get_cred_manager,
+    patched_get_scheduler,
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize,
+    patched_store_message_and_response,
+    patched_capture_slow_message,
+    partial_failure_message,
+    caplog,
+):
+    scheduler = LaneScheduler([Lane("realtime", max_concurrency=2)], max_concurrency=2)
+    patched_get_scheduler.return_value = scheduler
+    # The third message fails to convert, and stops there
+    patched_converter.side_effect = lambda message, filename, **kwargs: mock.Mock(
+        status_code=400 if filename.endswith("-2") else 200
+    )
+    patched_standardize.side_effect = lambda bundle, *args, **kwargs: bundle
+    patched_upload.return_value = mock.Mock(status_code=200)
+    patched_upload.return_value.json.return_value = {"entry": []}
+    blob = mock.Mock()
+    blob.name = "bronze/decrypted/VXU/some-file.hl7"
+    blob.length = len(partial_failure_message)
+    blob.read.return_value = partial_failure_message.encode("utf-8")
+
+    with caplog.at_level(logging.INFO):
+        main(blob)
+
+    messages = convert_batch_messages_to_list(partial_failure_message)
+    assert patched_converter.call_count == len(messages)
+    # Standardization is split across the standardize, geocode and link stages
+    assert sorted(
+        call.kwargs["steps"] for call in patched_standardize.call_args_list
+    ) == sorted(
+        [("standardize_names", "standardize_phones"), ("geocode",), ("add_identifier",)]
+        * (len(messages) - 1)
+    )
+    assert patched_store.call_count == len(messages) - 1
+    assert patched_upload.call_count == len(messages) - 1
+    patched_store_message_and_response.assert_called_once()
+
+    # Every message finishes and gives its lane slot back
+    assert patched_capture_slow_message.call_count == len(messages)
+    metrics = scheduler.get_metrics()
+    assert metrics["realtime"]["processed"] == len(messages)
+    assert metrics["realtime"]["active"] == 0
+
+    stage_metrics = json.loads(
+        next(
+            record.getMessage().split(": ", 1)[1]
+            for record in caplog.records
+            if record.getMessage().startswith("Stage metrics: ")
+        )
+    )
+    assert list(stage_metrics) == [
+        "convert",
+        "standardize",
+        "geocode",
+        "link",
+        "store",
+        "upload",
+    ]
+    assert stage_metrics["convert"]["processed"] == len(messages)
+    assert stage_metrics["upload"]["processed"] == len(messages) - 1
+    assert all(stage["max_queue_depth"] <= 1 for stage in stage_metrics.values())
+
+
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_warm_up(patched_get_cred_manager, patched_get_geocoder):
+    warm_up()
+
+    patched_get_cred_manager.assert_called_with("fhir-url")
+    patched_get_cred_manager.return_value.get_access_token.assert_called_once()
+    patched_get_geocoder.assert_called_with("smarty-auth-id", "smarty-auth-token")
+
+
 def test_default_fields():
     message = (
         "MSH|^~\\&|Hello World\n"
@@ -528,3 +1302,168 @@ def test_default_fields():
     )
 
     assert _default_fields(message, MESSAGE_MAPPINGS) == defaulted_message
+
+
+def make_blob(name: str, content: str) -> mock.Mock:
+    blob = mock.Mock()
+    blob.name = f"bronze/decrypted/VXU/{name}"
+    blob.length = len(content)
+    blob.read.return_value = content.encode("utf-8")
+    return blob
+
+
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_process_blobs(
+    patched_get_cred_manager,
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize_patients,
+):
+    # Each message converts to a bundle with an entry per segment
+    patched_converter.side_effect = lambda message, **kwargs: mock.Mock(
+        status_code=200,
+        json=lambda: {
+            "resourceType": "Bundle",
+            "type": "batch",
+            "entry": [{"segment": segment} for segment in message.split("\n")],
+        },
+    )
+    patched_standardize_patients.side_effect = lambda bundle, *args: bundle
+    # The only entry of the second blob's message fails
+    patched_upload.side_effect = lambda bundle, *args: mock.Mock(
+        status_code=200,
+        json=lambda: {
+            "entry": [
+                {
+                    "response": {
+                        "status": (
+                            "400 Bad Request"
+                            if entry["segment"] == "MSH|b"
+                            else "200 OK"
+                        )
+                    }
+                }
+                for entry in bundle["entry"]
+            ]
+        },
+    )
+    unreadable = make_blob("unreadable.hl7", "")
+    unreadable.read.side_effect = Exception("gone")
+
+    results = process_blobs(
+        [
+            make_blob("a.hl7", "MSH|a\nPID|a"),
+            unreadable,
+            make_blob("b.hl7", "MSH|b"),
+        ]
+    )
+
+    assert results == {
+        "bronze/decrypted/VXU/a.hl7": True,
+        "bronze/decrypted/VXU/unreadable.hl7": False,
+        "bronze/decrypted/VXU/b.hl7": True,
+    }
+    # Both messages are uploaded together
+    patched_upload.assert_called_once()
+    upload_bundle = patched_upload.call_args[0][0]
+    assert sorted(entry["segment"] for entry in upload_bundle["entry"]) == [
+        "MSH|a",
+        "MSH|b",
+        "PID|a",
+    ]
+    # The failed entry is recorded against its own message
+    patched_store.assert_any_call(
+        container_url="some-url",
+        prefix="output/invalid/path",
+        filename="b-0.entry-0.hl7",
+        bundle_type="VXU",
+        message_json={
+            "entry_index": 0,
+            "entry": {"response": {"status": "400 Bad Request"}},
+        },
+    )
+    invalid_entries = [
+        call.kwargs["filename"]
+        for call in patched_store.call_args_list
+        if call.kwargs.get("prefix") == "output/invalid/path"
+    ]
+    assert invalid_entries == ["b-0.entry-0.hl7"]
+
+
+@mock.patch("IntakePipeline.schedule_retry")
+@mock.patch("IntakePipeline.store_message_and_response")
+@mock.patch("IntakePipeline.standardize_patients")
+@mock.patch("IntakePipeline.upload_bundle_to_fhir_server")
+@mock.patch("IntakePipeline.store_data")
+@mock.patch("IntakePipeline.get_geocoder")
+@mock.patch("IntakePipeline.convert_message_to_fhir")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict(
+    "os.environ",
+    {**TEST_ENV, "INTAKE_BATCH_MAX_ENTRIES": "2", "RETRY_MAX_ATTEMPTS": "5"},
+)
+def test_process_blobs_failed_upload(
+    patched_get_cred_manager,
+    patched_converter,
+    patched_get_geocoder,
+    patched_store,
+    patched_upload,
+    patched_standardize_patients,
+    patched_store_message_and_response,
+    patched_schedule_retry,
+):
+    patched_converter.return_value = mock.Mock(
+        status_code=200,
+        json=lambda: {"resourceType": "Bundle", "type": "batch", "entry": [{}]},
+    )
+    patched_standardize_patients.side_effect = lambda bundle, *args: bundle
+    patched_upload.return_value = mock.Mock(status_code=503)
+    patched_schedule_retry.return_value = True
+
+    process_blobs([make_blob(f"{name}.hl7", f"MSH|{name}") for name in "abc"])
+
+    # At most two entries are uploaded together
+    assert sorted(
+        len(call.args[0]["entry"]) for call in patched_upload.call_args_list
+    ) == [1, 2]
+    # Every message of a failed upload is retried on its own
+    assert sorted(
+        call.args[1]["filename"] for call in patched_schedule_retry.call_args_list
+    ) == ["a-0", "b-0", "c-0"]
+
+
+@mock.patch("IntakePipeline.get_sink")
+@mock.patch("IntakePipeline._finish")
+@mock.patch("IntakePipeline._upload_together")
+@mock.patch("IntakePipeline._prepare_in_lane")
+@mock.patch("IntakePipeline.get_cred_manager")
+@mock.patch.dict("os.environ", TEST_ENV)
+def test_process_blobs_deadline(
+    patched_get_cred_manager,
+    patched_prepare_in_lane,
+    patched_upload_together,
+    patched_finish,
+    patched_get_sink,
+):
+    patched_prepare_in_lane.side_effect = lambda *args: (mock.Mock(), True)
+    deadline = mock.Mock()
+    deadline.expired.side_effect = [False, True]
+    blobs = [make_blob(f"{name}.hl7", f"MSH|{name}") for name in "abc"]
+
+    results = process_blobs(blobs, deadline)
+
+    # Blobs aren't read once the time budget has run out, and are left out of
+    # the results
+    assert results == {"bronze/decrypted/VXU/a.hl7": True}
+    blobs[1].read.assert_not_called()
+    assert patched_prepare_in_lane.call_count == 1
+    assert patched_upload_together.call_args.args[2] is deadline
+    patched_get_sink.return_value.close.assert_called_once()
@@ -0,0 +1,138 @@
+import marshal
+import pstats
+import threading
+
+from IntakePipeline.profiling import (
+    SamplingProfiler,
+    ThreadedProfile,
+    profile_invocation,
+    store_profile,
+)
+
+from unittest import mock
+
+BLOB_NAME = "bronze/decrypted/VXU/some-file.hl7"
+
+
+def busy_work():
+    return sum(i * i for i in range(10000))
+
+
+def other_work():
+    return sorted(range(1000), reverse=True)
+
+
+def test_sampling_profiler():
+    waiting = threading.Event()
+    finished = threading.Event()
+
+    def wait_in_thread():
+        waiting.set()
+        finished.wait()
+
+    thread = threading.Thread(target=wait_in_thread)
+    thread.start()
+    waiting.wait()
+    profiler = SamplingProfiler()
+    profiler.sample()
+    profiler.sample()
+    finished.set()
+    thread.join()
+
+    assert profiler.samples == 2
+    lines = profiler.collapsed().splitlines()
+    stack, count = next(line for line in lines if "wait_in_thread" in line).rsplit(
+        " ", 1
+    )
+    assert count == "2"
+    # Frames run from the outermost in
+    frames = stack.split(";")
+    assert frames[0].startswith("_bootstrap ")
+    assert "wait_in_thread (" in frames[-3]
+
+
+def test_threaded_profile():
+    profile = ThreadedProfile()
+    profile.start()
+    thread = threading.Thread(target=busy_work)
+    thread.start()
+    other_work()
+    thread.join()
+    stats = profile.stop()
+
+    # Both the current thread and the one it started are profiled
+    functions = {name for _, _, name in stats.stats}
+    assert "busy_work" in functions
+    assert "other_work" in functions
+
+
+@mock.patch("IntakePipeline.profiling.store_profile")
+@mock.patch.dict(
+    "os.environ",
+    {"DIAGNOSTICS_OUTPUT_CONTAINER_PATH": "diagnostics/path"},
+)
+def test_profile_invocation_disabled(patched_store_profile):
+    with profile_invocation(BLOB_NAME):
+        busy_work()
+
+    patched_store_profile.assert_not_called()
+
+
+@mock.patch("IntakePipeline.profiling.store_profile")
+@mock.patch.dict(
+    "os.environ",
+    {
+        "DIAGNOSTICS_OUTPUT_CONTAINER_PATH": "diagnostics/path",
+        "INTAKE_PROFILE_SAMPLE_RATE": "1",
+    },
+)
+def test_profile_invocation_cprofile(patched_store_profile):
+    with profile_invocation(BLOB_NAME):
+        busy_work()
+
+    blob_name, extension, data = patched_store_profile.call_args.args
+    assert (blob_name, extension) == (BLOB_NAME, "pstats")
+    stats = pstats.Stats()
+    stats.stats = marshal.loads(data)
+    assert "busy_work" in {name for _, _, name in stats.stats}
+
+
+@mock.patch("IntakePipeline.profiling.store_profile")
+@mock.patch.dict(
+    "os.environ",
+    {
+        "DIAGNOSTICS_OUTPUT_CONTAINER_PATH": "diagnostics/path",
+        "INTAKE_PROFILE_SAMPLE_RATE": "1",
+        "INTAKE_PROFILER": "sampling",
+        "INTAKE_PROFILE_INTERVAL_MS": "1",
+    },
+)
+def test_profile_invocation_sampling(patched_store_profile):
+    with profile_invocation(BLOB_NAME):
+        for _ in range(50):
+            busy_work()
+
+    blob_name, extension, data = patched_store_profile.call_args.args
+    assert (blob_name, extension) == (BLOB_NAME, "collapsed")
+    assert "busy_work" in data.decode("utf-8")
+
+
+@mock.patch("IntakePipeline.profiling._get_container_client")
+@mock.patch.dict(
+    "os.environ",
+    {"DIAGNOSTICS_OUTPUT_CONTAINER_PATH": "diagnostics/path/"},
+)
+def test_store_profile(patched_get_container_client):
+    container_client = patched_get_container_client.return_value
+
+    name = store_profile(BLOB_NAME, "pstats", b"some-profile")
+
+    assert name.startswith(f"diagnostics/path/profiles/{BLOB_NAME}.")
+    assert name.endswith("Z.pstats")
+    container_client.upload_blob.assert_called_with(
+        name, b"some-profile", overwrite=True
+    )
+
+    # Diagnostics never fail the invocation
+    container_client.upload_blob.side_effect = Exception("some-error")
+    assert store_profile(BLOB_NAME, "pstats", b"some-profile") is None
@@ -0,0 +1,226 @@
+import io
+import pathlib
+import pytest
+import typer
+
+from typer.testing import CliRunner
+from unittest import mock
+
+from IntakePipeline.reprocess import (
+    Checkpoint,
+    Progress,
+    get_shard,
+    list_blobs,
+    main,
+    reprocess,
+    run_process,
+)
+
+BLOB_NAMES = [
+    "decrypted/valid-messages/summary.txt",
+    *[f"decrypted/valid-messages/VXU/file-{i}.hl7" for i in range(6)],
+    *[f"decrypted/valid-messages/ELR/file-{i}.hl7" for i in range(4)],
+    "decrypted/valid-messages/ELR/file-0.hl7.convert-resp",
+]
+
+
+class MemoryContainerClient:
+    """A stand-in for a `ContainerClient`, holding blobs in memory."""
+
+    container_name = "bronze"
+
+    def __init__(self, names):
+        self.blobs = {
+            name: mock.Mock(etag=f"etag-{name}", size=len(name.encode("utf-8")))
+            for name in names
+        }
+        for name, blob in self.blobs.items():
+            blob.name = name
+
+    def walk_blobs(self, name_starts_with, delimiter):
+        items = []
+        directories = set()
+        for name, blob in self.blobs.items():
+            rest = name.split(name_starts_with, 1)[1]
+            if delimiter in rest:
+                directories.add(name_starts_with + rest.split(delimiter)[0] + "/")
+            else:
+                items.append(blob)
+        for directory in sorted(directories):
+            items.append(mock.Mock())
+            items[-1].name = directory
+        return items
+
+    def list_blobs(self, name_starts_with):
+        return [
+            blob
+            for name, blob in self.blobs.items()
+            if name.startswith(name_starts_with)
+        ]
+
+    def download_blob(self, name, etag, match_condition):
+        assert etag == self.blobs[name].etag
+        return io.BytesIO(name.encode("utf-8"))
+
+
+def make_options(tmp_path, **options):
+    return {
+        "prefix": "decrypted/valid-messages/",
+        "container_url": "https://some-account/bronze",
+        "include": ["*"],
+        "exclude": ["*-resp"],
+        "shard_count": 1,
+        "shard_index": 0,
+        "processes": 1,
+        "concurrency": 3,
+        "listing_concurrency": 2,
+        "checkpoint_dir": str(tmp_path / "checkpoint"),
+        "progress_interval": 0,
+        "dry_run": False,
+        "log_level": "WARNING",
+        **options,
+    }
+
+
+def test_get_shard():
+    names = [f"decrypted/VXU/file-{i}.hl7" for i in range(200)]
+
+    shards = [get_shard(name, 4, 3) for name in names]
+
+    # Every shard and process gets a share, and a blob's shard doesn't depend on
+    # the number of processes
+    assert set(shards) == {
+        (shard, process) for shard in range(4) for process in range(3)
+    }
+    assert [shard for shard, _ in shards] == [get_shard(name, 4)[0] for name in names]
+    assert shards == [get_shard(name, 4, 3) for name in names]
+
+
+def test_list_blobs():
+    container_client = MemoryContainerClient(BLOB_NAMES)
+
+    blobs = list(list_blobs(container_client, "decrypted/valid-messages/", 2))
+
+    assert sorted(blob.name for blob in blobs) == sorted(BLOB_NAMES)
+
+
+def test_checkpoint(tmp_path):
+    run = {"prefix": "decrypted/"}
+    checkpoint = Checkpoint(tmp_path, run, "process-0-of-2")
+    checkpoint.record("decrypted/a.hl7", "etag-1")
+    checkpoint.close()
+    with open(tmp_path / "process-1-of-2.jsonl", "w") as manifest:
+        # Interrupted part way through writing a record
+        manifest.write('{"name": "decrypted/b.hl7", "etag": "etag-2"}\n{"name": "d')
+
+    checkpoint = Checkpoint(tmp_path, run, "process-0-of-1")
+
+    assert checkpoint.is_done("decrypted/a.hl7", "etag-1")
+    assert checkpoint.is_done("decrypted/b.hl7", "etag-2")
+    # The blob has changed since it was processed
+    assert not checkpoint.is_done("decrypted/a.hl7", "etag-3")
+
+    with pytest.raises(ValueError):
+        Checkpoint(tmp_path, {"prefix": "invalid/"}, "process-0-of-1")
+
+
+@mock.patch("IntakePipeline.process_blob")
+def test_reprocess(patched_process_blob, tmp_path):
+    container_client = MemoryContainerClient(BLOB_NAMES[:5])
+    blobs = list(container_client.blobs.values())
+    checkpoint = Checkpoint(tmp_path, {}, "process-0-of-1")
+    checkpoint.record(blobs[0].name, blobs[0].etag)
+    # One blob fails to be downloaded, and the pipeline stops part way through
+    # another
+    patched_process_blob.side_effect = lambda blob, deadline: (
+        1 / 0
+        if blob.name.endswith("file-2.hl7")
+        else not blob.name.endswith("file-0.hl7") and bool(blob.read())
+    )
+
+    summary = reprocess(container_client, blobs, checkpoint, 2, Progress("", 5, 0))
+
+    assert summary["processed"] == 2
+    assert summary["skipped"] == 1
+    assert summary["failed"] == 2
+    assert summary["bytes"] == blobs[2].size + blobs[4].size
+    # Blobs are passed to the pipeline as if from the blob trigger, without a
+    # time budget, so none of a blob is left to a continuation
+    streams = [call.args[0] for call in patched_process_blob.call_args_list]
+    assert sorted(stream.name for stream in streams) == sorted(
+        f"bronze/{blob.name}" for blob in blobs[1:]
+    )
+    # Checkpoints within a blob only apply to the version that was listed
+    assert all(
+        stream.blob_properties == {"ETag": f"etag-{stream.name[len('bronze/'):]}"}
+        for stream in streams
+    )
+    assert all(
+        call.kwargs["deadline"].remaining() == float("inf")
+        for call in patched_process_blob.call_args_list
+    )
+    assert not checkpoint.is_done(blobs[1].name, blobs[1].etag)
+    assert not checkpoint.is_done(blobs[3].name, blobs[3].etag)
+    assert all(
+        checkpoint.is_done(blob.name, blob.etag)
+        for blob in blobs
+        if blob not in (blobs[1], blobs[3])
+    )
+
+
+@mock.patch("IntakePipeline.process_blob")
+@mock.patch("IntakePipeline.reprocess.get_container_client")
+def test_run_process_resumes(
+    patched_get_container_client, patched_process_blob, tmp_path
+):
+    container_client = MemoryContainerClient(BLOB_NAMES)
+    patched_get_container_client.return_value = container_client
+    options = make_options(tmp_path, shard_count=2, shard_index=1)
+    in_shard = [
+        name
+        for name in BLOB_NAMES
+        if not name.endswith("-resp") and get_shard(name, 2)[0] == 1
+    ]
+
+    summary = run_process(options, 0)
+
+    assert summary["processed"] == len(in_shard)
+    assert sorted(
+        call.args[0].name for call in patched_process_blob.call_args_list
+    ) == sorted(f"bronze/{name}" for name in in_shard)
+
+    # Starting the run again skips the blobs already processed
+    patched_process_blob.reset_mock()
+    summary = run_process(options, 0)
+
+    assert summary["skipped"] == len(in_shard)
+    patched_process_blob.assert_not_called()
+
+
+@mock.patch("IntakePipeline.process_blob")
+@mock.patch("IntakePipeline.reprocess.get_container_client")
+def test_main(patched_get_container_client, patched_process_blob, tmp_path):
+    patched_get_container_client.return_value = MemoryContainerClient(BLOB_NAMES)
+    app = typer.Typer()
+    app.command()(main)
+
+    result = CliRunner().invoke(
+        app,
+        [
+            "decrypted/valid-messages/",
+            "--container-url",
+            "https://some-account/bronze",
+            "--checkpoint-dir",
+            str(tmp_path / "checkpoint"),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert '"processed": 11' in result.output
+    assert patched_process_blob.call_count == 11
+    assert (pathlib.Path(tmp_path) / "checkpoint" / "run.json").exists()
+
+    result = CliRunner().invoke(
+        app, ["decrypted/valid-messages/", "--shard-count", "2", "--shard-index", "2"]
+    )
+    assert result.exit_code == 1
@@ -0,0 +1,242 @@
+import json
+import requests
+
+from unittest import mock
+
+from IntakePipeline.retry import (
+    get_retry_delay,
+    is_conflict,
+    is_retryable_entry,
+    is_transient_failure,
+    park_message,
+    resubmit_failed_entries,
+    schedule_retry,
+    MAX_PAYLOAD_BYTES,
+)
+
+MESSAGE_MAPPINGS = {
+    "file_suffix": "hl7",
+    "bundle_type": "VXU",
+    "root_template": "VXU_V04",
+    "input_data_type": "Hl7v2",
+    "template_collection": "microsofthealth/fhirconverter:default",
+    "filename": "some-filename-1",
+}
+
+
+def test_is_transient_failure():
+    assert is_transient_failure(None)
+    assert is_transient_failure(mock.Mock(status_code=429))
+    assert is_transient_failure(mock.Mock(status_code=503))
+    assert not is_transient_failure(mock.Mock(status_code=400))
+    assert not is_transient_failure(mock.Mock(status_code=401))
+
+
+@mock.patch.dict(
+    "os.environ", {"RETRY_BASE_DELAY_SECONDS": "10", "RETRY_MAX_DELAY_SECONDS": "60"}
+)
+def test_get_retry_delay():
+    assert get_retry_delay(1) == 10
+    assert get_retry_delay(2) == 20
+    assert get_retry_delay(3) == 40
+    assert get_retry_delay(4) == 60
+
+
+@mock.patch("IntakePipeline.retry._get_queue_client")
+@mock.patch.dict("os.environ", {"RETRY_MAX_ATTEMPTS": "3"})
+def test_schedule_retry(patched_get_queue_client):
+    patched_queue_client = patched_get_queue_client.return_value
+
+    assert schedule_retry("MSH|Hello World", MESSAGE_MAPPINGS, 2)
+
+    patched_queue_client.send_message.assert_called_with(
+        json.dumps(
+            {
+                "message": "MSH|Hello World",
+                "message_mappings": MESSAGE_MAPPINGS,
+                "attempt": 3,
+            }
+        ),
+        visibility_timeout=60,
+    )
+
+
+@mock.patch("IntakePipeline.retry._get_queue_client")
+@mock.patch.dict("os.environ", {"RETRY_MAX_ATTEMPTS": "3"})
+def test_schedule_retry_exhausted(patched_get_queue_client):
+    assert not schedule_retry("MSH|Hello World", MESSAGE_MAPPINGS, 3)
+    patched_get_queue_client.return_value.send_message.assert_not_called()
+
+
+@mock.patch("IntakePipeline.retry._get_queue_client")
+def test_schedule_retry_oversized_message(patched_get_queue_client):
+    message = "MSH|" + "x" * MAX_PAYLOAD_BYTES
+    assert not schedule_retry(message, MESSAGE_MAPPINGS, 1)
+    patched_get_queue_client.return_value.send_message.assert_not_called()
+
+
+@mock.patch("IntakePipeline.retry._get_queue_client")
+def test_schedule_retry_queue_unavailable(patched_get_queue_client):
+    patched_get_queue_client.return_value.send_message.side_effect = Exception()
+    assert not schedule_retry("MSH|Hello World", MESSAGE_MAPPINGS, 1)
+
+
+@mock.patch("IntakePipeline.retry._get_queue_client")
+@mock.patch.dict("os.environ", {"RETRY_MAX_ATTEMPTS": "3"})
+def test_park_message(patched_get_queue_client):
+    patched_queue_client = patched_get_queue_client.return_value
+
+    # Parking doesn't use up an attempt, even the last one
+    assert park_message("MSH|Hello World", MESSAGE_MAPPINGS, 3, 45)
+
+    patched_queue_client.send_message.assert_called_with(
+        json.dumps(
+            {
+                "message": "MSH|Hello World",
+                "message_mappings": MESSAGE_MAPPINGS,
+                "attempt": 3,
+            }
+        ),
+        visibility_timeout=45,
+    )
+
+
+def make_response(*statuses):
+    return mock.Mock(
+        status_code=200,
+        json=lambda: {
+            "resourceType": "Bundle",
+            "entry": [{"response": {"status": status}} for status in statuses],
+        },
+    )
+
+
+def test_is_retryable_entry():
+    assert is_retryable_entry({"response": {"status": "409 Conflict"}})
+    assert is_retryable_entry({"response": {"status": "412"}})
+    assert is_retryable_entry({"response": {"status": "429 Too Many Requests"}})
+    assert is_retryable_entry({"response": {"status": "503 Service Unavailable"}})
+    assert not is_retryable_entry({"response": {"status": "200 OK"}})
+    assert not is_retryable_entry({"response": {"status": "400 Bad Request"}})
+    assert not is_retryable_entry({"response": {}})
+
+
+def test_is_conflict():
+    conditional = {"request": {"method": "PUT", "ifMatch": 'W/"1"'}}
+    assert is_conflict(conditional, {"response": {"status": "412"}})
+    assert not is_conflict(conditional, {"response": {"status": "409 Conflict"}})
+    assert not is_conflict(
+        {"request": {"method": "PUT"}}, {"response": {"status": "412"}}
+    )
+
+
+@mock.patch("IntakePipeline.retry.time.sleep")
+@mock.patch.dict(
+    "os.environ",
+    {"ENTRY_RETRY_MAX_ATTEMPTS": "3", "ENTRY_RETRY_BASE_DELAY_SECONDS": "2"},
+)
+def test_resubmit_failed_entries(patched_sleep):
+    entries = [
+        {"resource": {"id": "ok"}, "request": {"method": "PUT"}},
+        {"resource": {"id": "bad"}, "request": {"method": "PUT"}},
+        {"resource": {"id": "busy"}, "request": {"method": "PUT"}},
+        {"resource": {"id": "stale"}, "request": {"method": "PUT", "ifMatch": "1"}},
+    ]
+    bundle = {"resourceType": "Bundle", "type": "batch", "entry": entries}
+    upload = mock.Mock(
+        side_effect=[
+            make_response("429 Too Many Requests"),
+            make_response("200 OK"),
+        ]
+    )
+
+    response_entries = resubmit_failed_entries(
+        bundle,
+        make_response("200 OK", "400 Bad Request", "503", "412").json()["entry"],
+        upload,
+        "some-filename-1",
+    )
+
+    assert [e["response"]["status"] for e in response_entries] == [
+        "200 OK",
+        "400 Bad Request",
+        "200 OK",
+        "412",
+    ]
+    # Only retryable entries are resubmitted, and conflicts with changes made
+    # elsewhere aren't
+    first_retry, second_retry = [call.args[0] for call in upload.call_args_list]
+    assert first_retry["type"] == "batch"
+    assert first_retry["entry"] == [entries[2]]
+    assert second_retry["entry"] == [entries[2]]
+    assert patched_sleep.call_args_list == [mock.call(2), mock.call(4)]
+
+
+@mock.patch("IntakePipeline.retry.time.sleep")
+@mock.patch.dict("os.environ", {"ENTRY_RETRY_MAX_ATTEMPTS": "3"})
+def test_resubmit_failed_entries_unconditional_412(patched_sleep):
+    bundle = {"entry": [{"resource": {"id": "busy"}, "request": {"method": "PUT"}}]}
+    upload = mock.Mock(return_value=make_response("200 OK"))
+
+    response_entries = resubmit_failed_entries(
+        bundle, make_response("412").json()["entry"], upload, "some-filename-1"
+    )
+
+    assert upload.call_args.args[0] == bundle
+    assert response_entries == [{"response": {"status": "200 OK"}}]
+
+
+@mock.patch("IntakePipeline.retry.time.sleep")
+@mock.patch.dict(
+    "os.environ",
+    {"ENTRY_RETRY_MAX_ATTEMPTS": "3", "ENTRY_RETRY_BASE_DELAY_SECONDS": "2"},
+)
+def test_resubmit_failed_entries_deadline(patched_sleep):
+    bundle = {"entry": [{"resource": {"id": "busy"}}]}
+    upload = mock.Mock(return_value=make_response("503"))
+    deadline = mock.Mock()
+    # Enough time is left to wait for the first resubmission, but not the second
+    deadline.remaining.side_effect = [3, 3]
+
+    response_entries = resubmit_failed_entries(
+        bundle,
+        make_response("503").json()["entry"],
+        upload,
+        "some-filename-1",
+        deadline,
+    )
+
+    assert upload.call_count == 1
+    assert patched_sleep.call_args_list == [mock.call(2)]
+    assert response_entries == [{"response": {"status": "503"}}]
+
+
+@mock.patch("IntakePipeline.retry.time.sleep")
+@mock.patch.dict("os.environ", {"ENTRY_RETRY_MAX_ATTEMPTS": "3"})
+def test_resubmit_failed_entries_exhausted(patched_sleep):
+    bundle = {"entry": [{"resource": {"id": "busy"}}]}
+    upload = mock.Mock(
+        side_effect=[requests.exceptions.Timeout(), make_response("503")]
+    )
+
+    response_entries = resubmit_failed_entries(
+        bundle, make_response("503").json()["entry"], upload, "some-filename-1"
+    )
+
+    assert upload.call_count == 2
+    assert response_entries == [{"response": {"status": "503"}}]
+
+
+@mock.patch("IntakePipeline.retry.time.sleep")
+def test_resubmit_failed_entries_nothing_to_retry(patched_sleep):
+    upload = mock.Mock()
+
+    resubmit_failed_entries(
+        {"entry": [{}]},
+        make_response("400 Bad Request").json()["entry"],
+        upload,
+        "some-filename-1",
+    )
+
+    upload.assert_not_called()
+    patched_sleep.assert_not_called()
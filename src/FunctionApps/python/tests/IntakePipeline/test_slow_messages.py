@@ -0,0 +1,130 @@
+from unittest import mock
+
+from IntakePipeline.slow_messages import (
+    SlowMessageSampler,
+    StageTimer,
+    capture_slow_message,
+    MIN_PERCENTILE_SAMPLES,
+)
+
+MESSAGE_MAPPINGS = {
+    "file_suffix": "hl7",
+    "bundle_type": "VXU",
+    "root_template": "VXU_V04",
+    "input_data_type": "Hl7v2",
+    "template_collection": "microsofthealth/fhirconverter:default",
+    "filename": "some-filename-1",
+}
+
+
+def test_stage_timer():
+    timer = StageTimer()
+    with timer.stage("convert"):
+        pass
+    with timer.stage("geocode"):
+        pass
+    with timer.stage("geocode"):
+        pass
+
+    assert list(timer.timings) == ["convert", "geocode"]
+    assert timer.total_ms() >= sum(timer.timings.values())
+
+
+def test_sampler_threshold():
+    sampler = SlowMessageSampler(
+        threshold_ms=1000, percentile=0, max_captures_per_hour=10
+    )
+
+    assert not sampler.observe(999)
+    assert sampler.observe(1000)
+
+
+def test_sampler_percentile():
+    sampler = SlowMessageSampler(
+        threshold_ms=0, percentile=99, max_captures_per_hour=10
+    )
+
+    # Nothing is slow until enough latencies have been seen
+    assert not any(sampler.observe(i) for i in range(MIN_PERCENTILE_SAMPLES))
+    assert not sampler.observe(50)
+    assert sampler.observe(500)
+
+
+def test_sampler_rate_limit():
+    sampler = SlowMessageSampler(
+        threshold_ms=1000, percentile=0, max_captures_per_hour=2
+    )
+
+    assert [sampler.observe(5000) for _ in range(3)] == [True, True, False]
+    with mock.patch("IntakePipeline.slow_messages.time.monotonic", return_value=10**9):
+        assert sampler.observe(5000)
+
+
+@mock.patch("IntakePipeline.slow_messages.get_sampler")
+@mock.patch("IntakePipeline.slow_messages.store_data")
+@mock.patch.dict(
+    "os.environ",
+    {
+        "INTAKE_CONTAINER_URL": "some-url",
+        "DIAGNOSTICS_OUTPUT_CONTAINER_PATH": "output/diagnostics/",
+    },
+)
+def test_capture_slow_message(patched_store, patched_get_sampler):
+    patched_get_sampler.return_value.observe.return_value = True
+    timer = StageTimer()
+    timer.timings = {"convert": 12.5}
+
+    capture_slow_message("MSH|Hello World", MESSAGE_MAPPINGS, timer, 2)
+
+    kwargs = patched_store.call_args.kwargs
+    assert kwargs["container_url"] == "some-url"
+    assert kwargs["prefix"] == "output/diagnostics/slow-messages"
+    assert kwargs["filename"] == "some-filename-1.json"
+    assert kwargs["bundle_type"] == "VXU"
+    assert kwargs["message_json"]["message"] == "MSH|Hello World"
+    assert kwargs["message_json"]["message_mappings"] == MESSAGE_MAPPINGS
+    assert kwargs["message_json"]["attempt"] == 2
+    assert kwargs["message_json"]["timings"] == {"convert": 12.5}
+
+
+@mock.patch("IntakePipeline.slow_messages.get_sampler")
+@mock.patch("IntakePipeline.slow_messages.store_data")
+@mock.patch.dict(
+    "os.environ",
+    {
+        "INTAKE_CONTAINER_URL": "some-url",
+        "DIAGNOSTICS_OUTPUT_CONTAINER_PATH": "output/diagnostics",
+    },
+)
+def test_capture_fast_message(patched_store, patched_get_sampler):
+    patched_get_sampler.return_value.observe.return_value = False
+
+    capture_slow_message("MSH|Hello World", MESSAGE_MAPPINGS, StageTimer(), 1)
+
+    patched_store.assert_not_called()
+
+
+@mock.patch("IntakePipeline.slow_messages.get_sampler")
+@mock.patch("IntakePipeline.slow_messages.store_data")
+@mock.patch.dict("os.environ", {"DIAGNOSTICS_OUTPUT_CONTAINER_PATH": ""})
+def test_capture_disabled(patched_store, patched_get_sampler):
+    capture_slow_message("MSH|Hello World", MESSAGE_MAPPINGS, StageTimer(), 1)
+
+    patched_get_sampler.assert_not_called()
+    patched_store.assert_not_called()
+
+
+@mock.patch("IntakePipeline.slow_messages.get_sampler")
+@mock.patch("IntakePipeline.slow_messages.store_data")
+@mock.patch.dict(
+    "os.environ",
+    {
+        "INTAKE_CONTAINER_URL": "some-url",
+        "DIAGNOSTICS_OUTPUT_CONTAINER_PATH": "output/diagnostics",
+    },
+)
+def test_capture_failure_ignored(patched_store, patched_get_sampler):
+    patched_get_sampler.return_value.observe.return_value = True
+    patched_store.side_effect = Exception("storage unavailable")
+
+    capture_slow_message("MSH|Hello World", MESSAGE_MAPPINGS, StageTimer(), 1)
@@ -0,0 +1,130 @@
+import copy
+import json
+import pathlib
+import pytest
+
+from unittest import mock
+
+from phdi.geo import geocode_patients
+from phdi.linkage import add_patient_identifier
+from phdi.standardize import (
+    standardize_patient_names,
+    standardize_all_phones,
+)
+
+from IntakePipeline.breakers import get_breaker, reset_breakers
+from IntakePipeline.slow_messages import StageTimer
+from IntakePipeline.standardization import standardize_patients
+
+SALT = "super-secret-definitely-legit-passphrase"
+
+
+@pytest.fixture(autouse=True)
+def breakers():
+    reset_breakers()
+    yield
+    reset_breakers()
+
+
+@pytest.fixture()
+def bundle():
+    bundle = json.load(
+        open(pathlib.Path(__file__).parent / "assets" / "patient_bundle.json")
+    )
+    # A second patient, separated from the first by other resources
+    patient = copy.deepcopy(bundle["entry"][1])
+    patient["resource"]["id"] = "some-other-uuid"
+    patient["resource"]["name"][0]["given"] = ["jane 2"]
+    patient["resource"]["telecom"][0]["value"] = "(555) 555-1234"
+    observations = [
+        {"resource": {"resourceType": "Observation", "id": f"obs-{i}"}}
+        for i in range(3)
+    ]
+    bundle["entry"].extend(observations + [patient])
+    return bundle
+
+
+def test_standardize_patients_matches_chain(bundle):
+    geocoder = mock.Mock()
+    expected = standardize_patient_names(copy.deepcopy(bundle))
+    expected = standardize_all_phones(expected)
+    expected = geocode_patients(expected, geocoder)
+    expected = add_patient_identifier(expected, SALT)
+
+    assert standardize_patients(bundle, geocoder, SALT) == expected
+
+
+def test_standardize_patients_in_place(bundle):
+    observation = bundle["entry"][2]
+
+    standardized = standardize_patients(bundle, mock.Mock(), SALT)
+
+    assert standardized is bundle
+    assert standardized["entry"][2] is observation
+
+
+@mock.patch("IntakePipeline.standardization.add_patient_identifier")
+@mock.patch("IntakePipeline.standardization.geocode_patients")
+@mock.patch("IntakePipeline.standardization.standardize_all_phones")
+@mock.patch("IntakePipeline.standardization.standardize_patient_names")
+def test_standardize_patients_visits_patients_only(
+    patched_names, patched_phones, patched_geocode, patched_identifier, bundle
+):
+    for patched in (patched_names, patched_phones, patched_geocode):
+        patched.side_effect = lambda patient_bundle, *args: patient_bundle
+    patched_identifier.side_effect = lambda patient_bundle, salt: patient_bundle
+    timer = StageTimer()
+
+    standardize_patients(bundle, mock.Mock(), SALT, timer)
+
+    # Each transform sees one patient at a time, and nothing else
+    assert patched_names.call_count == 2
+    for call in patched_names.call_args_list:
+        entries = call.args[0]["entry"]
+        assert [e["resource"]["resourceType"] for e in entries] == ["Patient"]
+    assert list(timer.timings) == [
+        "standardize_names",
+        "standardize_phones",
+        "geocode",
+        "add_identifier",
+    ]
+
+
+@mock.patch("IntakePipeline.standardization.geocode_patients")
+def test_standardize_patients_geocoder_failure(patched_geocode, bundle):
+    patched_geocode.side_effect = Exception("some-error")
+    expected = standardize_patient_names(copy.deepcopy(bundle))
+    expected = standardize_all_phones(expected)
+    expected = add_patient_identifier(expected, SALT)
+
+    # Patients continue without coordinates
+    assert standardize_patients(bundle, mock.Mock(), SALT) == expected
+    assert get_breaker("geocode").get_metrics()["recent_failures"] == 2
+
+
+@mock.patch("IntakePipeline.standardization.geocode_patients")
+def test_standardize_patients_geocoder_breaker_open(patched_geocode, bundle):
+    breaker = get_breaker("geocode")
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+
+    standardize_patients(bundle, mock.Mock(), SALT)
+
+    patched_geocode.assert_not_called()
+
+
+def test_standardize_patients_memoizes_normalizers(bundle):
+    import phdi.standardize
+
+    from IntakePipeline.memoize import get_cache_metrics
+
+    standardize_patients(copy.deepcopy(bundle), mock.Mock(), SALT)
+    before = get_cache_metrics()["phdi.standardize.standardize_name"]
+    standardize_patients(copy.deepcopy(bundle), mock.Mock(), SALT)
+    after = get_cache_metrics()["phdi.standardize.standardize_name"]
+
+    assert hasattr(phdi.standardize.standardize_name, "cache")
+    assert hasattr(phdi.standardize.standardize_phone, "cache")
+    # Every name was seen by the first call
+    assert after["hits"] > before["hits"]
+    assert after["misses"] == before["misses"]
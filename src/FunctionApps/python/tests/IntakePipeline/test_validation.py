@@ -0,0 +1,141 @@
+import pathlib
+import pytest
+
+from phdi.conversion import convert_batch_messages_to_list
+
+from IntakePipeline.validation import validate_message
+
+VXU_MAPPINGS = {"input_data_type": "Hl7v2", "root_template": "VXU_V04"}
+
+VXU_MESSAGE = (
+    "MSH|^~\\&|WIR11.3.2^^|WIR^^||WIRPH^^|20200514||VXU^V04|2020051411020600|P^|"
+    + "2.4^^|||ER\r"
+    + "PID|||3054790^^^^SR^~^^^^PI^||ZTEST^PEDIARIX^^^^^^|HEPB^DTAP^^^^^^|20180808|M\r"
+    + "RXA|0|999|20180809|20180809|08^HepB pediatric^CVX^90744^HepB pediatric^CPT|1.0"
+)
+
+
+def read_messages(name):
+    return convert_batch_messages_to_list(
+        open(pathlib.Path(__file__).parent / "assets" / name).read()
+    )
+
+
+def describe(errors):
+    return [(error["segment"], error["field"], error["error"]) for error in errors]
+
+
+def test_validate_valid_messages():
+    for name in ["batchFileSingleMessage.hl7", "batchFileMultipleMessages.hl7"]:
+        for message in read_messages(name):
+            assert validate_message(message, VXU_MAPPINGS) == []
+    assert validate_message(VXU_MESSAGE, VXU_MAPPINGS) == []
+
+
+def test_validate_unparseable_timestamp():
+    messages = read_messages("batchFileMultipleMessagesOneBad.hl7")
+
+    errors = [validate_message(message, VXU_MAPPINGS) for message in messages]
+
+    # Only the third message is broken
+    assert errors[:2] + errors[3:] == [[]] * (len(messages) - 1)
+    assert errors[2] == [
+        {
+            "segment": "PID",
+            "line": 2,
+            "field": 7,
+            "error": "Invalid timestamp '20180808678923411'",
+        }
+    ]
+
+
+@pytest.mark.parametrize(
+    "timestamp,valid",
+    [
+        ("2018", True),
+        ("201808", True),
+        ("20180808", True),
+        ("201808081230", True),
+        ("20180808123045.1234-0500", True),
+        ("20180808123045+0000^S", True),
+        ("2018080", False),
+        ("20181308", False),
+        ("20180230", False),
+        ("20180808250000", False),
+        ("20180808-2500", False),
+        ("08/08/2018", False),
+    ],
+)
+def test_validate_timestamps(timestamp, valid):
+    message = VXU_MESSAGE.replace("|20180808|", f"|{timestamp}|")
+
+    errors = validate_message(message, VXU_MAPPINGS)
+
+    assert errors == ([] if valid else [errors[0]])
+    if not valid:
+        assert describe(errors) == [
+            ("PID", 7, f"Invalid timestamp {timestamp.split('^')[0]!r}")
+        ]
+
+
+def test_validate_header():
+    assert describe(validate_message("PID|||3054790", VXU_MAPPINGS)) == [
+        ("MSH", None, "Message doesn't start with an MSH segment")
+    ]
+    assert describe(
+        validate_message(VXU_MESSAGE.replace("^~\\&", "^~"), VXU_MAPPINGS)
+    ) == [("MSH", 2, "Invalid encoding characters '^~'")]
+    assert describe(
+        validate_message(VXU_MESSAGE.replace("^~\\&", "^^\\&"), VXU_MAPPINGS)
+    ) == [("MSH", 2, "Invalid encoding characters '^^\\\\&'")]
+
+
+def test_validate_truncated_message():
+    # The message was cut off part way through the PID segment
+    message = VXU_MESSAGE[: VXU_MESSAGE.index("PID") + 2]
+
+    assert describe(validate_message(message, VXU_MAPPINGS)) == [
+        ("PI", None, "Invalid or truncated segment id"),
+        ("PID", None, "Required segment is missing"),
+        ("RXA", None, "Required segment is missing"),
+    ]
+
+
+def test_validate_required_segments():
+    oru_message = VXU_MESSAGE.replace("VXU^V04", "ORU^R01").replace(
+        "\rRXA", "\rOBX|1|ST|94500-6^SARS-CoV-2 RNA^LN||Not detected\rXXX"
+    )
+
+    assert describe(
+        validate_message(
+            oru_message, {"input_data_type": "Hl7v2", "root_template": "ORU_R01"}
+        )
+    ) == [("OBR", None, "Required segment is missing")]
+
+
+def test_validate_field_cardinality():
+    message = (
+        VXU_MESSAGE.replace("|2020051411020600|", "||")
+        .replace("|20180808|", "|20180808~20180809|")
+        .replace("|20180809|20180809|", "||20180809|")
+    )
+
+    assert describe(validate_message(message, VXU_MAPPINGS)) == [
+        ("MSH", 10, "Required field is empty"),
+        ("PID", 7, "Field repeats 2 times, at most 1 allowed"),
+        ("RXA", 3, "Required field is empty"),
+    ]
+
+
+def test_validate_other_input_types():
+    assert validate_message("<ClinicalDocument/>", {"input_data_type": "Ccda"}) == []
+
+
+def test_validate_input_type_case():
+    # The input type is set by hand in the template mappings, so "HL7v2" and
+    # "hl7v2" are checked too
+    for input_data_type in ("HL7v2", "hl7v2"):
+        errors = validate_message(
+            "<ClinicalDocument/>", {**VXU_MAPPINGS, "input_data_type": input_data_type}
+        )
+        assert [error["segment"] for error in errors] == ["MSH"]
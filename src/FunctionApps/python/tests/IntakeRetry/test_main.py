@@ -0,0 +1,40 @@
+import json
+
+from IntakeRetry import main
+
+from unittest import mock
+
+MESSAGE_MAPPINGS = {
+    "file_suffix": "hl7",
+    "bundle_type": "VXU",
+    "root_template": "VXU_V04",
+    "input_data_type": "Hl7v2",
+    "template_collection": "microsofthealth/fhirconverter:default",
+    "filename": "some-filename-1",
+}
+
+
+@mock.patch("IntakeRetry.run_pipeline")
+@mock.patch("IntakeRetry.get_cred_manager")
+@mock.patch.dict("os.environ", {"FHIR_URL": "some-fhir-url"})
+def test_main(patched_get_cred_manager, patched_run_pipeline):
+    msg = mock.Mock()
+    msg.get_body.return_value = json.dumps(
+        {
+            "message": "MSH|Hello World",
+            "message_mappings": MESSAGE_MAPPINGS,
+            "attempt": 3,
+        }
+    ).encode("utf-8")
+
+    main(msg)
+
+    patched_get_cred_manager.assert_called_with("some-fhir-url")
+    patched_run_pipeline.assert_called_with(
+        "MSH|Hello World",
+        MESSAGE_MAPPINGS,
+        "some-fhir-url",
+        patched_get_cred_manager.return_value,
+        attempt=3,
+        sink=None,
+    )
@@ -0,0 +1,151 @@
+"""
+Local stand-ins for the SFTP server and blob storage, so transfers can be tested
+end to end without either service.
+"""
+
+import base64
+import hashlib
+import os
+import pathlib
+import threading
+
+from azure.core.exceptions import ResourceNotFoundError
+from unittest import mock
+
+
+class LocalSftpFile:
+    """A file opened on the local SFTP stand-in."""
+
+    def __init__(self, path: pathlib.Path, reads: list):
+        self._file = open(path, "rb")
+        self._reads = reads
+
+    def __enter__(self) -> "LocalSftpFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._file.close()
+
+    def readv(self, chunks):
+        self._reads.append(list(chunks))
+        for offset, size in chunks:
+            self._file.seek(offset)
+            yield self._file.read(size)
+
+
+class LocalSftp:
+    """
+    A stand-in for a `paramiko.SFTPClient`, serving the files of a local
+    directory.  Paths on the server are relative to the directory.
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+        self.closed = False
+        self.opened = []
+        self.reads = []
+
+    def _resolve(self, path: str) -> pathlib.Path:
+        return self.root / path.lstrip("/")
+
+    def listdir_attr(self, path: str):
+        entries = []
+        for child in self._resolve(path).iterdir():
+            stat_result = child.stat()
+            entries.append(
+                mock.Mock(
+                    filename=child.name,
+                    st_size=stat_result.st_size,
+                    st_mtime=int(stat_result.st_mtime),
+                    st_mode=stat_result.st_mode,
+                )
+            )
+        return entries
+
+    def stat(self, path: str):
+        stat_result = self._resolve(path).stat()
+        return mock.Mock(
+            st_size=stat_result.st_size, st_mtime=int(stat_result.st_mtime)
+        )
+
+    def open(self, path: str, mode: str) -> LocalSftpFile:
+        self.opened.append(path)
+        return LocalSftpFile(self._resolve(path), self.reads)
+
+    def get_channel(self):
+        return None
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class MemoryBlobClient:
+    """
+    A stand-in for a block blob's `BlobClient`, keeping staged and committed
+    blocks in memory.  Staging fails once, after `fail_after_blocks` more
+    blocks have been staged, to simulate an interrupted transfer.
+    """
+
+    def __init__(self, container: "MemoryContainerClient", name: str):
+        self.container = container
+        self.name = name
+
+    def get_blob_properties(self):
+        blob = self.container.blobs.get(self.name)
+        if blob is None:
+            raise ResourceNotFoundError("The specified blob does not exist.")
+        return mock.Mock(size=len(blob["content"]), metadata=blob["metadata"])
+
+    def get_block_list(self, block_list_type: str):
+        blocks = self.container.uncommitted.get(self.name)
+        if blocks is None and self.name not in self.container.blobs:
+            raise ResourceNotFoundError("The specified blob does not exist.")
+        return [], [
+            mock.Mock(id=block_id, size=len(data))
+            for block_id, data in (blocks or {}).items()
+        ]
+
+    def stage_block(self, block_id: str, data: bytes, validate_content: bool):
+        with self.container.lock:
+            if self.container.fail_after_blocks is not None:
+                if self.container.fail_after_blocks == 0:
+                    self.container.fail_after_blocks = None
+                    raise ConnectionError("Connection reset")
+                self.container.fail_after_blocks -= 1
+            # Block ids are sent base64 encoded, and must be at most 64 bytes
+            assert len(base64.b64decode(base64.b64encode(block_id.encode()))) <= 64
+            md5 = block_id.rsplit("-", 1)[-1]
+            assert not validate_content or hashlib.md5(data).hexdigest() == md5
+            self.container.uncommitted.setdefault(self.name, {})[block_id] = data
+            self.container.staged.append((self.name, block_id))
+
+    def commit_block_list(self, block_list, content_settings, metadata):
+        with self.container.lock:
+            blocks = self.container.uncommitted.pop(self.name, {})
+            self.container.blobs[self.name] = {
+                "content": b"".join(blocks[block.id] for block in block_list),
+                "metadata": metadata,
+            }
+
+
+class MemoryContainerClient:
+    """A stand-in for a `ContainerClient`, keeping blobs in memory."""
+
+    def __init__(self, fail_after_blocks: int = None):
+        self.blobs = {}
+        self.uncommitted = {}
+        self.staged = []
+        self.fail_after_blocks = fail_after_blocks
+        self.lock = threading.Lock()
+
+    def get_blob_client(self, name: str) -> MemoryBlobClient:
+        return MemoryBlobClient(self, name)
+
+
+def write_file(root: pathlib.Path, path: str, size: int) -> bytes:
+    """Write a file of random content to the local SFTP stand-in."""
+    content = os.urandom(size)
+    file_path = root / path
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(content)
+    return content
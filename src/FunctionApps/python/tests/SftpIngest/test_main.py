@@ -0,0 +1,148 @@
+import json
+import logging
+import paramiko
+import pytest
+
+from SftpIngest import connect_sftp, ingest, list_files, main
+from tests.SftpIngest.stand_ins import LocalSftp, MemoryContainerClient, write_file
+
+from unittest import mock
+
+BLOCK_SIZE = 1024
+
+
+def test_list_files(tmp_path):
+    write_file(tmp_path, "OtherFiles/b.txt", 10)
+    write_file(tmp_path, "OtherFiles/a.txt", 20)
+    write_file(tmp_path, "OtherFiles/nested/c.txt", 30)
+
+    files = list_files(LocalSftp(tmp_path), "OtherFiles")
+
+    assert [(path, size) for path, size, _ in files] == [
+        ("OtherFiles/a.txt", 20),
+        ("OtherFiles/b.txt", 10),
+    ]
+
+
+def test_ingest(tmp_path):
+    contents = {
+        f"file-{i}.txt": write_file(tmp_path, f"OtherFiles/file-{i}.txt", i * 700)
+        for i in range(6)
+    }
+    container = MemoryContainerClient()
+    connections = []
+
+    def connect():
+        connections.append(LocalSftp(tmp_path))
+        return connections[-1]
+
+    summary = ingest(connect, container, "OtherFiles", "raw/VIIS", BLOCK_SIZE, 3)
+
+    assert summary["transferred"] == 6
+    assert summary["bytes_transferred"] == sum(map(len, contents.values()))
+    assert {name: blob["content"] for name, blob in container.blobs.items()} == {
+        f"raw/VIIS/{name}": content for name, content in contents.items()
+    }
+    # Each worker has its own connection, and every connection is closed
+    assert len(connections) <= 4
+    assert all(connection.closed for connection in connections)
+
+    summary = ingest(connect, container, "OtherFiles", "raw/VIIS", BLOCK_SIZE, 3)
+
+    assert summary["skipped"] == 6
+    assert summary["bytes_transferred"] == 0
+
+
+def test_ingest_resumes_failed_transfer(tmp_path):
+    contents = {
+        f"file-{i}.txt": write_file(tmp_path, f"OtherFiles/file-{i}.txt", 3000)
+        for i in range(3)
+    }
+    container = MemoryContainerClient(fail_after_blocks=1)
+
+    def connect():
+        return LocalSftp(tmp_path)
+
+    # The first file fails part way through, and the rest are still transferred
+    summary = ingest(connect, container, "OtherFiles", "raw", BLOCK_SIZE, 1)
+
+    assert summary["failed"] == 1
+    assert summary["transferred"] == 2
+    assert "raw/file-0.txt" not in container.blobs
+
+    summary = ingest(connect, container, "OtherFiles", "raw", BLOCK_SIZE, 1)
+
+    assert summary["resumed"] == 1
+    assert summary["skipped"] == 2
+    assert summary["bytes_transferred"] == 3000 - BLOCK_SIZE
+    assert container.blobs["raw/file-0.txt"]["content"] == contents["file-0.txt"]
+
+
+@mock.patch("SftpIngest.ingest")
+@mock.patch("SftpIngest.connect_sftp")
+@mock.patch("SftpIngest.get_container_client")
+@mock.patch.dict(
+    "os.environ",
+    {
+        "VDHSFTPHostname": "some-sftp-host",
+        "VDHSFTPUsername": "some-username",
+        "VDHSFTPPassword": "some-password",
+        "INTAKE_CONTAINER_URL": "some-url",
+        "SFTP_INGEST_CONCURRENCY": "8",
+    },
+)
+def test_main(
+    patched_get_container_client, patched_connect_sftp, patched_ingest, caplog
+):
+    patched_ingest.return_value = {"transferred": 2}
+
+    with caplog.at_level(logging.INFO):
+        main(mock.Mock(past_due=False))
+
+    patched_get_container_client.assert_called_with("some-url")
+    kwargs = patched_ingest.call_args.kwargs
+    assert kwargs["container_client"] == patched_get_container_client.return_value
+    assert kwargs["source_path"] == "OtherFiles"
+    assert kwargs["output_path"] == "additional-records/raw/VIIS"
+    assert kwargs["block_size"] == 4194304
+    assert kwargs["concurrency"] == 8
+
+    kwargs["connect"]()
+    patched_connect_sftp.assert_called_with(
+        "some-sftp-host", "some-username", "some-password", ""
+    )
+    assert f"Ingest summary: {json.dumps({'transferred': 2})}" in caplog.messages
+
+
+@mock.patch("paramiko.SFTPClient.from_transport")
+@mock.patch("paramiko.Transport")
+def test_connect_sftp(patched_transport, patched_from_transport):
+    server_key = paramiko.RSAKey.generate(1024)
+
+    sftp = connect_sftp(
+        "some-sftp-host",
+        "some-username",
+        "some-password",
+        f"{server_key.get_name()} {server_key.get_base64()} some-comment",
+    )
+
+    assert sftp == patched_from_transport.return_value
+    patched_transport.assert_called_with(("some-sftp-host", 22))
+    # The server must present the configured host key
+    patched_transport.return_value.connect.assert_called_with(
+        hostkey=server_key, username="some-username", password="some-password"
+    )
+
+
+@mock.patch("paramiko.SFTPClient.from_transport")
+@mock.patch("paramiko.Transport")
+def test_connect_sftp_fails(patched_transport, patched_from_transport):
+    patched_transport.return_value.connect.side_effect = paramiko.SSHException
+
+    with pytest.raises(paramiko.SSHException):
+        connect_sftp("some-sftp-host", "some-username", "some-password")
+
+    patched_transport.return_value.connect.assert_called_with(
+        hostkey=None, username="some-username", password="some-password"
+    )
+    patched_transport.return_value.close.assert_called_once()
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import pytest
+
+from SftpIngest.transfer import (
+    SourceChangedError,
+    get_checksum,
+    get_version,
+    make_block_id,
+    parse_block_id,
+    transfer_file,
+)
+from tests.SftpIngest.stand_ins import LocalSftp, MemoryContainerClient, write_file
+
+BLOCK_SIZE = 1024
+
+
+def transfer(tmp_path, container, path):
+    stat_result = (tmp_path / path).stat()
+    return transfer_file(
+        LocalSftp(tmp_path),
+        container.get_blob_client(f"raw/{path}"),
+        path,
+        stat_result.st_size,
+        int(stat_result.st_mtime),
+        BLOCK_SIZE,
+    )
+
+
+def test_block_ids():
+    version = get_version("OtherFiles/some-file.txt", 100, 1660000000)
+    md5 = hashlib.md5(b"some content").hexdigest()
+
+    block_id = make_block_id(version, 12, md5)
+    assert parse_block_id(block_id) == (version, 12, md5)
+    assert len(make_block_id(version, 0, md5)) == len(block_id)
+    assert parse_block_id("some-other-block-id") is None
+    assert version != get_version("OtherFiles/some-file.txt", 100, 1660000001)
+
+
+def test_transfer_file(tmp_path):
+    content = write_file(tmp_path, "some-file.txt", 3 * BLOCK_SIZE + 10)
+    container = MemoryContainerClient()
+
+    result = transfer(tmp_path, container, "some-file.txt")
+
+    assert result.status == "transferred"
+    assert result.bytes_transferred == len(content)
+    blob = container.blobs["raw/some-file.txt"]
+    assert blob["content"] == content
+    assert len(container.staged) == 4
+    assert blob["metadata"]["source_size"] == str(len(content))
+    blocks = [
+        content[start:][:BLOCK_SIZE] for start in range(0, 4 * BLOCK_SIZE, BLOCK_SIZE)
+    ]
+    block_md5s = [hashlib.md5(block).hexdigest() for block in blocks]
+    assert blob["metadata"]["checksum"] == get_checksum(block_md5s)
+    assert result.checksum == get_checksum(block_md5s)
+
+
+def test_transfer_file_empty(tmp_path):
+    write_file(tmp_path, "empty.txt", 0)
+    container = MemoryContainerClient()
+
+    result = transfer(tmp_path, container, "empty.txt")
+
+    assert result.status == "transferred"
+    assert container.blobs["raw/empty.txt"]["content"] == b""
+    assert container.staged == []
+
+
+def test_transfer_file_skips_transferred(tmp_path):
+    write_file(tmp_path, "some-file.txt", 2 * BLOCK_SIZE)
+    container = MemoryContainerClient()
+    checksum = transfer(tmp_path, container, "some-file.txt").checksum
+
+    result = transfer(tmp_path, container, "some-file.txt")
+
+    assert result.status == "skipped"
+    assert result.checksum == checksum
+    assert len(container.staged) == 2
+
+
+def test_transfer_file_skips_copied_without_metadata(tmp_path):
+    content = write_file(tmp_path, "some-file.txt", 2 * BLOCK_SIZE)
+    container = MemoryContainerClient()
+    # Copied by the Data Factory pipeline
+    container.blobs["raw/some-file.txt"] = {"content": content, "metadata": {}}
+
+    assert transfer(tmp_path, container, "some-file.txt").status == "skipped"
+    assert container.staged == []
+
+
+def test_transfer_file_resumes(tmp_path):
+    content = write_file(tmp_path, "some-file.txt", 5 * BLOCK_SIZE + 1)
+    container = MemoryContainerClient(fail_after_blocks=3)
+
+    with pytest.raises(ConnectionError):
+        transfer(tmp_path, container, "some-file.txt")
+    assert "raw/some-file.txt" not in container.blobs
+
+    result = transfer(tmp_path, container, "some-file.txt")
+
+    # Only the blocks that weren't staged before the interruption are sent
+    assert result.status == "resumed"
+    assert result.bytes_transferred == 2 * BLOCK_SIZE + 1
+    assert len(container.staged) == 6
+    assert container.blobs["raw/some-file.txt"]["content"] == content
+
+
+def test_transfer_file_reads_one_block_at_a_time(tmp_path):
+    write_file(tmp_path, "some-file.txt", 3 * BLOCK_SIZE + 10)
+    container = MemoryContainerClient(fail_after_blocks=1)
+    with pytest.raises(ConnectionError):
+        transfer(tmp_path, container, "some-file.txt")
+    sftp = LocalSftp(tmp_path)
+    stat_result = (tmp_path / "some-file.txt").stat()
+
+    transfer_file(
+        sftp,
+        container.get_blob_client("raw/some-file.txt"),
+        "some-file.txt",
+        stat_result.st_size,
+        int(stat_result.st_mtime),
+        BLOCK_SIZE,
+    )
+
+    # Each read covers only the block being staged, and staged blocks are skipped
+    assert sftp.reads == [
+        [(BLOCK_SIZE, BLOCK_SIZE)],
+        [(2 * BLOCK_SIZE, BLOCK_SIZE)],
+        [(3 * BLOCK_SIZE, 10)],
+    ]
+
+
+def test_transfer_file_restarts_changed_file(tmp_path):
+    write_file(tmp_path, "some-file.txt", 4 * BLOCK_SIZE)
+    container = MemoryContainerClient(fail_after_blocks=2)
+    with pytest.raises(ConnectionError):
+        transfer(tmp_path, container, "some-file.txt")
+
+    # The file is replaced before the transfer is continued
+    content = write_file(tmp_path, "some-file.txt", 4 * BLOCK_SIZE)
+    stat_result = (tmp_path / "some-file.txt").stat()
+    os.utime(tmp_path / "some-file.txt", (stat_result.st_atime, 1660000000))
+
+    result = transfer(tmp_path, container, "some-file.txt")
+
+    assert result.status == "transferred"
+    assert result.bytes_transferred == len(content)
+    assert container.blobs["raw/some-file.txt"]["content"] == content
+
+
+def test_transfer_file_source_changed(tmp_path):
+    write_file(tmp_path, "some-file.txt", 2 * BLOCK_SIZE)
+    container = MemoryContainerClient()
+    stat_result = (tmp_path / "some-file.txt").stat()
+
+    # The file grows after it was listed
+    with open(tmp_path / "some-file.txt", "ab") as file:
+        file.write(b"more content")
+
+    with pytest.raises(SourceChangedError):
+        transfer_file(
+            LocalSftp(tmp_path),
+            container.get_blob_client("raw/some-file.txt"),
+            "some-file.txt",
+            stat_result.st_size,
+            int(stat_result.st_mtime),
+            BLOCK_SIZE,
+        )
+    assert "raw/some-file.txt" not in container.blobs
@@ -0,0 +1,17 @@
+from Warmup import main
+
+from unittest import mock
+
+
+@mock.patch("Warmup.warm_up")
+def test_main(patched_warm_up):
+    main(mock.Mock())
+    patched_warm_up.assert_called_once()
+
+
+@mock.patch("Warmup.warm_up")
+def test_main_failure(patched_warm_up):
+    patched_warm_up.side_effect = Exception("no network yet")
+
+    # Warm-up failures are logged rather than raised
+    main(mock.Mock())
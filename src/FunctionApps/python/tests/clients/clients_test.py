@@ -0,0 +1,28 @@
+from unittest import mock
+
+from clients import get_cred_manager, get_geocoder
+
+
+@mock.patch("clients.AzureFhirServerCredentialManager")
+def test_get_cred_manager(patched_cred_manager_constructor):
+    get_cred_manager.cache_clear()
+
+    cred_manager = get_cred_manager("some-fhir-url")
+
+    # The same manager is handed out on every call for the same server
+    assert get_cred_manager("some-fhir-url") is cred_manager
+    patched_cred_manager_constructor.assert_called_once_with("some-fhir-url")
+    get_cred_manager.cache_clear()
+
+
+@mock.patch("clients.get_smartystreets_client")
+def test_get_geocoder(patched_get_smartystreets_client):
+    get_geocoder.cache_clear()
+
+    geocoder = get_geocoder("smarty-auth-id", "smarty-auth-token")
+
+    assert get_geocoder("smarty-auth-id", "smarty-auth-token") is geocoder
+    patched_get_smartystreets_client.assert_called_once_with(
+        "smarty-auth-id", "smarty-auth-token"
+    )
+    get_geocoder.cache_clear()